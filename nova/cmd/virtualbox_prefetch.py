@@ -0,0 +1,77 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Warm the image cache of a VirtualBox compute host.
+
+The images received with --image are fetched in the image cache of the
+host. If no image is received, the images selected by the prefetch
+options from the [virtualbox] section are fetched.
+"""
+
+from __future__ import print_function
+
+import sys
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from nova.conductor import rpcapi as conductor_rpcapi
+from nova import config
+from nova import context as nova_context
+from nova import objects
+from nova.objects import base as objects_base
+from nova import utils
+from nova.virt.virtualbox import prefetch
+
+CONF = cfg.CONF
+CONF.import_opt('use_local', 'nova.conductor.api', group='conductor')
+
+cli_opts = [
+    cfg.MultiStrOpt('image',
+                    default=[],
+                    help='The ID of an image which is fetched in the image '
+                         'cache. Can be used multiple times.'),
+]
+CONF.register_cli_opts(cli_opts)
+
+
+def main():
+    config.parse_args(sys.argv)
+    logging.setup(CONF, 'nova')
+    utils.monkey_patch()
+    objects.register_all()
+
+    if not CONF.conductor.use_local:
+        objects_base.NovaObject.indirection_api = \
+            conductor_rpcapi.ConductorAPI()
+
+    context = nova_context.get_admin_context()
+    prefetcher = prefetch.ImagePrefetcher()
+    image_ids = CONF.image or prefetcher.select_images(context)
+    if not image_ids:
+        print("No image was selected for prefetching.")
+        return 0
+
+    failed = False
+    results = prefetcher.prefetch(context, image_ids)
+    for image_id in image_ids:
+        result = results[image_id]
+        if isinstance(result, Exception):
+            failed = True
+            print("%s: failed: %s" % (image_id, result))
+        else:
+            print("%s: %s" % (image_id, result))
+
+    return 1 if failed else 0
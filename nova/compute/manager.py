@@ -5820,13 +5820,28 @@ class ComputeManager(manager.Manager):
                         {'num_db_instances': num_db_instances,
                          'num_vm_instances': num_vm_instances})
 
+        try:
+            vm_power_states = self.driver.get_power_states(db_instances)
+        except NotImplementedError:
+            vm_power_states = None
+        except Exception:
+            LOG.exception(_LE("Failed to get the power states for all the "
+                              "instances, querying them one by one."))
+            vm_power_states = None
+
         def _sync(db_instance):
+            vm_power_state = None
+            if vm_power_states is not None:
+                vm_power_state = vm_power_states.get(db_instance.uuid,
+                                                     power_state.NOSTATE)
+
             # NOTE(melwitt): This must be synchronized as we query state from
             #                two separate sources, the driver and the database.
             #                They are set (in stop_instance) and read, in sync.
             @utils.synchronized(db_instance.uuid)
             def query_driver_power_state_and_sync():
-                self._query_driver_power_state_and_sync(context, db_instance)
+                self._query_driver_power_state_and_sync(
+                    context, db_instance, vm_power_state=vm_power_state)
 
             try:
                 query_driver_power_state_and_sync()
@@ -5848,18 +5863,23 @@ class ComputeManager(manager.Manager):
                 self._syncs_in_progress[uuid] = True
                 self._sync_power_pool.spawn_n(_sync, db_instance)
 
-    def _query_driver_power_state_and_sync(self, context, db_instance):
+    def _query_driver_power_state_and_sync(self, context, db_instance,
+                                           vm_power_state=None):
         if db_instance.task_state is not None:
             LOG.info(_LI("During sync_power_state the instance has a "
                          "pending task (%(task)s). Skip."),
                      {'task': db_instance.task_state}, instance=db_instance)
             return
         # No pending tasks. Now try to figure out the real vm_power_state.
-        try:
-            vm_instance = self.driver.get_info(db_instance)
-            vm_power_state = vm_instance.state
-        except exception.InstanceNotFound:
-            vm_power_state = power_state.NOSTATE
+        # NOTE: The power state obtained in bulk by the caller can be
+        #       outdated, so it is trusted only if it matches the database.
+        if (vm_power_state is None or
+                vm_power_state != db_instance.power_state):
+            try:
+                vm_instance = self.driver.get_info(db_instance)
+                vm_power_state = vm_instance.state
+            except exception.InstanceNotFound:
+                vm_power_state = power_state.NOSTATE
         # Note(maoy): the above get_info call might take a long time,
         # for example, because of a broken libvirt driver.
         try:
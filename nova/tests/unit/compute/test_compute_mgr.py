@@ -1093,6 +1093,48 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
                                         use_slave=True)
             mock_spawn.assert_called_once_with(mock.ANY, instance)
 
+    @mock.patch.object(objects.InstanceList, 'get_by_host')
+    def test_sync_power_states_bulk(self, mock_get):
+        instances = [mock.Mock(uuid='fake-uuid-1'),
+                     mock.Mock(uuid='fake-uuid-2')]
+        mock_get.return_value = instances
+
+        with contextlib.nested(
+            mock.patch.object(self.compute.driver, 'get_power_states',
+                              return_value={'fake-uuid-1':
+                                            power_state.RUNNING}),
+            mock.patch.object(self.compute,
+                              '_query_driver_power_state_and_sync'),
+            mock.patch.object(self.compute._sync_power_pool, 'spawn_n',
+                              side_effect=lambda func, *args: func(*args)),
+        ) as (mock_power_states, mock_query, mock_spawn):
+            self.compute._sync_power_states(mock.sentinel.context)
+
+            mock_power_states.assert_called_once_with(instances)
+            mock_query.assert_has_calls([
+                mock.call(mock.sentinel.context, instances[0],
+                          vm_power_state=power_state.RUNNING),
+                mock.call(mock.sentinel.context, instances[1],
+                          vm_power_state=power_state.NOSTATE)])
+
+    @mock.patch.object(objects.InstanceList, 'get_by_host')
+    def test_sync_power_states_bulk_not_implemented(self, mock_get):
+        instance = mock.Mock(uuid='fake-uuid')
+        mock_get.return_value = [instance]
+
+        with contextlib.nested(
+            mock.patch.object(self.compute.driver, 'get_power_states',
+                              side_effect=NotImplementedError),
+            mock.patch.object(self.compute,
+                              '_query_driver_power_state_and_sync'),
+            mock.patch.object(self.compute._sync_power_pool, 'spawn_n',
+                              side_effect=lambda func, *args: func(*args)),
+        ) as (mock_power_states, mock_query, mock_spawn):
+            self.compute._sync_power_states(mock.sentinel.context)
+
+            mock_query.assert_called_once_with(mock.sentinel.context,
+                                               instance, vm_power_state=None)
+
     def _get_sync_instance(self, power_state, vm_state, task_state=None,
                            shutdown_terminate=False):
         instance = objects.Instance()
@@ -1201,6 +1243,39 @@ class ComputeManagerUnitTestCase(test.NoDBTestCase):
                                                           power_state.NOSTATE,
                                                           use_slave=True)
 
+    @mock.patch('nova.compute.manager.ComputeManager.'
+                '_sync_instance_power_state')
+    def test_query_driver_power_state_and_sync_bulk_match(
+            self, mock_sync_power_state):
+        with mock.patch.object(self.compute.driver,
+                               'get_info') as mock_get_info:
+            db_instance = objects.Instance(uuid='fake-uuid', task_state=None,
+                                           power_state=power_state.RUNNING)
+            self.compute._query_driver_power_state_and_sync(
+                self.context, db_instance, vm_power_state=power_state.RUNNING)
+            self.assertFalse(mock_get_info.called)
+            mock_sync_power_state.assert_called_once_with(self.context,
+                                                          db_instance,
+                                                          power_state.RUNNING,
+                                                          use_slave=True)
+
+    @mock.patch('nova.compute.manager.ComputeManager.'
+                '_sync_instance_power_state')
+    def test_query_driver_power_state_and_sync_bulk_mismatch(
+            self, mock_sync_power_state):
+        vm_instance = hardware.InstanceInfo(state=power_state.RUNNING)
+        with mock.patch.object(self.compute.driver, 'get_info',
+                               return_value=vm_instance) as mock_get_info:
+            db_instance = objects.Instance(uuid='fake-uuid', task_state=None,
+                                           power_state=power_state.RUNNING)
+            self.compute._query_driver_power_state_and_sync(
+                self.context, db_instance, vm_power_state=power_state.SHUTDOWN)
+            mock_get_info.assert_called_once_with(db_instance)
+            mock_sync_power_state.assert_called_once_with(self.context,
+                                                          db_instance,
+                                                          power_state.RUNNING,
+                                                          use_slave=True)
+
     def test_run_pending_deletes(self):
         self.flags(instance_delete_interval=10)
 
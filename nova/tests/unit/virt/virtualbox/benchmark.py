@@ -0,0 +1,227 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark for the VirtualBox driver running against the VBoxManage
+simulator.
+
+Every build spawns an instance, takes a snapshot of it and destroys it.
+The builds are executed concurrently and the throughput and the latency
+percentiles are reported for each operation:
+
+    python -m nova.tests.unit.virt.virtualbox.benchmark \\
+        --builds 32 --concurrency 8 --latency 0.05 --lock-error-rate 0.05
+"""
+
+import argparse
+import contextlib
+import logging
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import eventlet
+import mock
+from oslo_config import cfg
+
+from nova import context as nova_context
+from nova.tests.unit import fake_instance
+from nova.tests.unit.virt.virtualbox import simulator
+from nova.virt.virtualbox import driver
+from nova.virt.virtualbox import manage
+from nova.virt.virtualbox import snapshotops
+
+CONF = cfg.CONF
+CONF.import_opt('instances_path', 'nova.compute.manager')
+
+IMAGE_REF = "benchmark-image"
+OPERATIONS = ("spawn", "snapshot", "destroy")
+
+
+def percentile(values, fraction):
+    """Return the value below which the received fraction of the values
+    fall, using the nearest-rank method.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(int(math.ceil(fraction * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(durations, errors, elapsed):
+    """Return the statistics for a single operation."""
+    return {
+        "count": len(durations),
+        "errors": errors,
+        "ops_per_sec": len(durations) / elapsed if elapsed else 0.0,
+        "p50": percentile(durations, 0.50),
+        "p99": percentile(durations, 0.99),
+        "max": max(durations) if durations else 0.0,
+    }
+
+
+@contextlib.contextmanager
+def _environment(backend, instances_path):
+    overrides = {
+        "instances_path": (instances_path, None),
+        "use_cow_images": (True, None),
+        "power_state_event_polling_interval": (0, "virtualbox"),
+        "retry_interval": (0, "virtualbox"),
+    }
+    for name, (value, group) in overrides.items():
+        CONF.set_override(name, value, group)
+
+    patchers = [
+        mock.patch.object(manage.VBoxManage, "_backend", backend),
+        mock.patch.object(manage.VBoxManage, "_deferred", {}),
+        mock.patch.object(manage.VBoxManage, "_started_vms", set()),
+        mock.patch.object(snapshotops.SnapshotOperations,
+                          "_save_glance_image"),
+    ]
+    for attribute in ("_vm_info_cache", "_vm_registry", "_medium_registry",
+                      "_governor", "_metrics"):
+        patchers.append(mock.patch.object(manage.VBoxManage, attribute,
+                                          None))
+    for patcher in patchers:
+        patcher.start()
+
+    try:
+        yield
+    finally:
+        for patcher in reversed(patchers):
+            patcher.stop()
+        for name, (_, group) in overrides.items():
+            CONF.clear_override(name, group)
+
+
+def _build(compute_driver, context, index, results):
+    instance = fake_instance.fake_instance_obj(
+        context, id=index + 1, uuid=str(uuid.uuid4()),
+        image_ref=IMAGE_REF, root_gb=2, ephemeral_gb=1, memory_mb=256,
+        vcpus=1)
+    steps = (
+        ("spawn", lambda: compute_driver.spawn(
+            context, instance, image_meta={}, injected_files=[],
+            admin_password=None, network_info=[])),
+        ("snapshot", lambda: compute_driver.snapshot(
+            context, instance, str(uuid.uuid4()),
+            update_task_state=lambda **kwargs: None)),
+        ("destroy", lambda: compute_driver.destroy(
+            context, instance, network_info=[])),
+    )
+    for operation, step in steps:
+        start = time.time()
+        try:
+            step()
+        except Exception:
+            results[operation]["errors"] += 1
+            return
+        results[operation]["durations"].append(time.time() - start)
+
+
+def run_benchmark(builds=8, concurrency=4, backend=None):
+    """Execute the builds against the simulator and return the
+    statistics for each operation and for the VBoxManage commands.
+    """
+    backend = backend or simulator.SimulatedVBoxManage()
+    instances_path = tempfile.mkdtemp(prefix="vbox-benchmark-")
+    results = {operation: {"durations": [], "errors": 0}
+               for operation in OPERATIONS}
+    try:
+        base_dir = os.path.join(instances_path, "_base")
+        os.makedirs(base_dir)
+        image_path = os.path.join(base_dir, IMAGE_REF + ".vdi")
+        open(image_path, "w").close()
+        backend.register_medium(image_path, capacity=1024)
+
+        with _environment(backend, instances_path):
+            compute_driver = driver.VirtualBoxDriver(virtapi=None)
+            compute_driver.init_host(host=None)
+            context = nova_context.get_admin_context()
+
+            pool = eventlet.GreenPool(concurrency)
+            start = time.time()
+            for index in range(builds):
+                pool.spawn_n(_build, compute_driver, context, index,
+                             results)
+            pool.waitall()
+            elapsed = time.time() - start
+
+            compute_driver.cleanup_host(host=None)
+            commands = manage.VBoxManage.get_metrics().stats()
+    finally:
+        shutil.rmtree(instances_path, ignore_errors=True)
+
+    report = {operation: summarize(results[operation]["durations"],
+                                   results[operation]["errors"], elapsed)
+              for operation in OPERATIONS}
+    report["elapsed"] = elapsed
+    report["commands"] = commands
+    return report
+
+
+def format_report(report):
+    """Return the report as a table."""
+    lines = ["%-10s %6s %6s %10s %10s %10s" % (
+        "operation", "count", "errors", "ops/sec", "p50 (s)", "p99 (s)")]
+    for operation in OPERATIONS:
+        stats = report[operation]
+        lines.append("%-10s %6d %6d %10.2f %10.3f %10.3f" % (
+            operation, stats["count"], stats["errors"],
+            stats["ops_per_sec"], stats["p50"], stats["p99"]))
+
+    lines.append("")
+    lines.append("%-18s %6s %8s %10s %10s" % (
+        "command", "calls", "retries", "avg (s)", "max (s)"))
+    for command, stats in sorted(report["commands"].items()):
+        lines.append("%-18s %6d %8d %10.3f %10.3f" % (
+            command, stats["count"], stats["retries"],
+            stats["average_time"], stats["max_time"]))
+    lines.append("")
+    lines.append("Elapsed: %.2f seconds" % report["elapsed"])
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--builds", type=int, default=16,
+                        help="The number of instances built.")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="The number of builds executed at once.")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="The latency of every VBoxManage command, "
+                             "in seconds.")
+    parser.add_argument("--lock-error-rate", type=float, default=0.0,
+                        help="The probability for a command which locks "
+                             "the virtual machine to fail.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for the injected errors.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.ERROR)
+
+    backend = simulator.SimulatedVBoxManage(
+        default_latency=args.latency, lock_error_rate=args.lock_error_rate,
+        seed=args.seed)
+    report = run_benchmark(args.builds, args.concurrency, backend)
+    sys.stdout.write(format_report(report) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -31,6 +31,7 @@ FAKE_DISK_PATH = 'sata-fake-disk.vdi'
 
 FAKE_HOST_PROCESSOR_COUNT = 8
 FAKE_HOST_PROCESSOR_CORE_COUNT = 4
+FAKE_HOST_PROCESSOR_DESCRIPTION = 'FakeVendor FakeCPU @ 2.60GHz'
 FAKE_HOST_MEMORY_AVAILABLE = 13213
 FAKE_HOST_MEMORY_SIZE = 15926
 
@@ -41,6 +42,7 @@ FAKE_SYSTEM_BUS_SCSI = 'fake-scsi'
 FAKE_TOTAL = 3
 FAKE_USED = 2
 FAKE_FREE = 1
+FAKE_VCPUS_USED = 3
 
 
 class FakeVBoxManage(object):
@@ -78,6 +80,7 @@ class FakeVBoxManage(object):
             Processor count: {processor_count}
             Processor online core count: {processor_core_count}
             Processor core count: {processor_core_count}
+            Processor#0 description: {processor_description}
 
             Memory size: {memory_size} MByte
             Memory available: {memory_available} MByte
@@ -87,6 +90,7 @@ class FakeVBoxManage(object):
             return template.format(
                 processor_count=FAKE_HOST_PROCESSOR_COUNT,
                 processor_core_count=FAKE_HOST_PROCESSOR_CORE_COUNT,
+                processor_description=FAKE_HOST_PROCESSOR_DESCRIPTION,
                 memory_size=FAKE_HOST_MEMORY_SIZE,
                 memory_available=FAKE_HOST_MEMORY_AVAILABLE
             )
@@ -94,6 +98,7 @@ class FakeVBoxManage(object):
             return template.format(
                 processor_count='f',
                 processor_core_count='a',
+                processor_description='',
                 memory_size='f',
                 memory_available='e'
             )
@@ -154,6 +159,39 @@ class FakeVBoxManage(object):
             nic8="none"
         """)
 
+    @staticmethod
+    def list_vms_long():
+        template = textwrap.dedent(
+            """
+            Name:            {vm_name}
+            Groups:          /
+            Guest OS:        Ubuntu (64 bit)
+            UUID:            {vm_uuid}
+            Memory size:     512MB
+            State:           running (since 2015-05-12T10:15:22.123000000)
+            Storage Controller Name (0):            SATA
+
+            Shared folders:
+
+            Name: 'shared', Host path: '/tmp/shared' (machine mapping)
+
+            Name:            <inaccessible!>
+            UUID:            fake-inaccessible-uuid
+            Config file:     /tmp/inaccessible.vbox
+            Access error details:
+
+            Name:            fake-paused-vm
+            Guest OS:        Ubuntu (64 bit)
+            UUID:            fake-paused-uuid
+            State:           paused (since 2015-05-12T10:15:22.123000000)
+
+            Name:            fake-stuck-vm
+            State:           guru meditation (since 2015-05-12T10:15:22)
+            """
+        )
+
+        return template.format(vm_name=FAKE_VM_NAME, vm_uuid=FAKE_VM_UUID)
+
 
 def fake_disk_usage():
     ntuple_diskusage = collections.namedtuple('usage', 'total used free')
@@ -179,6 +217,7 @@ def fake_available_resources():
         'memory_mb_used': FAKE_HOST_MEMORY_SIZE - FAKE_HOST_MEMORY_AVAILABLE,
         'local_gb': FAKE_TOTAL,
         'local_gb_used': FAKE_USED,
+        'vcpus_used': FAKE_VCPUS_USED,
     }
 
 
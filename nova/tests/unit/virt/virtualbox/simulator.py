@@ -0,0 +1,701 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Stateful VBoxManage simulator.
+
+The simulator can be used as backend for VBoxManage in order to run the
+driver operations end to end without VirtualBox. It keeps the registries
+for the virtual machines, the virtual hard disks and the snapshots and it
+produces the same output as VBoxManage for the commands used by the driver.
+
+Optionally, it can delay the commands and it can fail the commands which
+lock the virtual machine in order to simulate a busy VBoxSVC.
+"""
+
+import collections
+import os
+import random
+import threading
+import time
+import uuid
+
+from nova.virt.virtualbox import backend
+from nova.virt.virtualbox import constants
+
+DONE = "0%...10%...20%...30%...40%...50%...60%...70%...80%...90%...100%"
+VERSION = "5.0.0r101573"
+VBOX_E_OBJECT_IN_USE = "VBOX_E_OBJECT_IN_USE"
+
+# The commands which need a session lock on the virtual machine.
+LOCKING_COMMANDS = ("controlvm", "modifyvm", "snapshot", "startvm",
+                    "storageattach", "storagectl", "unregistervm")
+
+_LONG_STATE = {
+    constants.STATE_POWER_OFF: "powered off",
+    constants.STATE_SAVED: "saved",
+}
+
+_OS_TYPES = (("Other", "Other/Unknown", "false"),
+             ("Other_64", "Other/Unknown (64-bit)", "true"),
+             ("Ubuntu_64", "Ubuntu (64-bit)", "true"))
+
+
+class SimulatorError(Exception):
+
+    def __init__(self, message, code=constants.NS_ERROR_FAILURE):
+        super(SimulatorError, self).__init__(message)
+        self.code = code
+
+    @property
+    def stderr(self):
+        return ("VBoxManage: error: %(message)s\n"
+                "VBoxManage: error: Details: code %(code)s (0x80004005)\n" %
+                {"message": self.args[0], "code": self.code})
+
+
+class Medium(object):
+
+    def __init__(self, path, capacity, disk_format=constants.DISK_FORMAT_VDI,
+                 parent=None, medium_uuid=None):
+        self.uuid = medium_uuid or str(uuid.uuid4())
+        self.path = path
+        self.capacity = capacity
+        self.disk_format = disk_format
+        self.parent = parent
+        self.type = constants.VHD_TYPE_NORMAL
+        self.auto_reset = constants.OFF
+
+
+class Machine(object):
+
+    def __init__(self, name, machine_uuid, basefolder=None):
+        self.name = name
+        self.uuid = machine_uuid
+        self.basefolder = basefolder or "/"
+        self.state = constants.STATE_POWER_OFF
+        self.settings = collections.OrderedDict([
+            ("ostype", constants.DEFAULT_OS_TYPE),
+            ("memory", "128"),
+            ("cpus", "1"),
+            ("vrde", constants.OFF),
+        ])
+        self.controllers = collections.OrderedDict()
+        self.attachments = {}
+        self.snapshots = collections.OrderedDict()
+
+
+class SimulatedVBoxManage(backend.BaseBackend):
+
+    """Backend which simulates a VirtualBox installation.
+
+    :param latency:         dictionary with the number of seconds each
+                            command should take, by command name
+    :param default_latency: the number of seconds taken by the commands
+                            missing from `latency`
+    :param lock_error_rate: the probability for a command which locks the
+                            virtual machine to fail with
+                            VBOX_E_INVALID_OBJECT_STATE
+    :param seed:            seed for the random generator used in order
+                            to inject the errors
+    """
+
+    def __init__(self, latency=None, default_latency=0, lock_error_rate=0,
+                 seed=None):
+        self.latency = latency or {}
+        self.default_latency = default_latency
+        self.lock_error_rate = lock_error_rate
+        self.calls = collections.defaultdict(int)
+        self.properties = {}
+        self.host_info = {
+            constants.HOST_PROCESSOR_COUNT: 8,
+            constants.HOST_PROCESSOR_CORE_COUNT: 4,
+            constants.HOST_MEMORY_SIZE: 16384,
+            constants.HOST_MEMORY_AVAILABLE: 12288,
+        }
+        self._machines = collections.OrderedDict()
+        self._media = collections.OrderedDict()
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._handlers = {
+            "--version": self._version,
+            "clonehd": self._clone_hd,
+            "closemedium": self._close_medium,
+            "convertfromraw": self._convert_from_raw,
+            "controlvm": self._control_vm,
+            "createhd": self._create_hd,
+            "createvm": self._create_vm,
+            "internalcommands": self._internal_commands,
+            "list": self._list,
+            "metrics": self._metrics,
+            "modifyhd": self._modify_hd,
+            "modifyvm": self._modify_vm,
+            "setproperty": self._set_property,
+            "showhdinfo": self._show_hd_info,
+            "showvminfo": self._show_vm_info,
+            "snapshot": self._snapshot,
+            "startvm": self._start_vm,
+            "storageattach": self._storage_attach,
+            "storagectl": self._storage_ctl,
+            "unregistervm": self._unregister_vm,
+        }
+
+    def execute(self, command, *args):
+        args = [str(argument) for argument in args]
+        self.calls[command] += 1
+
+        delay = self.latency.get(command, self.default_latency)
+        if delay:
+            time.sleep(delay)
+
+        if (command in LOCKING_COMMANDS and self.lock_error_rate and
+                self._random.random() < self.lock_error_rate):
+            return "", SimulatorError(
+                "The machine is already locked for a session (or being "
+                "unlocked)", constants.VBOX_E_INVALID_OBJECT_STATE).stderr
+
+        handler = self._handlers.get(command)
+        if handler is None:
+            return "", SimulatorError("Unknown command %s" % command,
+                                      constants.NS_ERROR_INVALID_ARG).stderr
+
+        with self._lock:
+            try:
+                output = handler(*args)
+            except SimulatorError as exc:
+                return "", exc.stderr
+
+        if isinstance(output, tuple):
+            return output
+        return output or "", ""
+
+    def execute_stream(self, source, command, *args):
+        if command != "convertfromraw":
+            return "", SimulatorError("Unknown command %s" % command,
+                                      constants.NS_ERROR_INVALID_ARG).stderr
+
+        size = sum(len(chunk) for chunk in source)
+        return self.execute(command, size, *args)
+
+    # Helpers
+
+    @staticmethod
+    def _options(args):
+        """Split the arguments in positional arguments and options."""
+        positional, options = [], collections.OrderedDict()
+        index = 0
+        while index < len(args):
+            argument = args[index]
+            if not argument.startswith("--"):
+                positional.append(argument)
+            elif (index + 1 < len(args) and
+                    not args[index + 1].startswith("--")):
+                options[argument] = args[index + 1]
+                index += 1
+            else:
+                options[argument] = None
+            index += 1
+        return positional, options
+
+    def _machine(self, name, lock=False):
+        for machine in self._machines.values():
+            if name in (machine.name, machine.uuid):
+                break
+        else:
+            raise SimulatorError("%s '%s'" % (
+                constants.VBOX_E_INSTANCE_NOT_FOUND, name),
+                constants.VBOX_E_OBJECT_NOT_FOUND)
+
+        if lock and machine.state not in (constants.STATE_POWER_OFF,
+                                          constants.STATE_SAVED, "aborted"):
+            raise SimulatorError("The machine '%s' is already locked for a "
+                                 "session" % machine.name,
+                                 constants.VBOX_E_INVALID_OBJECT_STATE)
+        return machine
+
+    def _find_medium(self, name):
+        if name in self._media:
+            return self._media[name]
+        for medium in self._media.values():
+            if medium.path == name:
+                return medium
+        return None
+
+    def _medium(self, name):
+        medium = self._find_medium(name)
+        if medium is None:
+            if not os.path.isfile(name):
+                raise SimulatorError(
+                    "Could not find file for the medium '%s'" % name,
+                    constants.VBOX_E_FILE_ERROR)
+            # Note: VirtualBox registers the existing files when they
+            # are used for the first time.
+            disk_format = os.path.splitext(name)[1].lstrip(".").upper()
+            medium = self.register_medium(name, disk_format=disk_format)
+        return medium
+
+    def _users(self, medium):
+        return [machine for machine in self._machines.values()
+                if medium.uuid in machine.attachments.values()]
+
+    def _children(self, medium):
+        return [child for child in self._media.values()
+                if child.parent == medium.uuid]
+
+    def register_medium(self, path, capacity=1024,
+                        disk_format=constants.DISK_FORMAT_VDI, parent=None):
+        """Register a new virtual hard disk and return it."""
+        with self._lock:
+            medium = Medium(path, capacity, disk_format or
+                            constants.DEFAULT_DISK_FORMAT, parent)
+            self._media[medium.uuid] = medium
+            return medium
+
+    def machines(self):
+        """Return the names of the virtual machines registered."""
+        with self._lock:
+            return [machine.name for machine in self._machines.values()]
+
+    def media(self):
+        """Return the paths of the virtual hard disks registered."""
+        with self._lock:
+            return [medium.path for medium in self._media.values()]
+
+    # Commands
+
+    def _version(self):
+        return VERSION + "\n"
+
+    def _set_property(self, name, value):
+        self.properties[name] = value
+
+    def _metrics(self, subcommand, *args):
+        positional, _ = self._options(args)
+        if subcommand == "setup":
+            return ""
+        if subcommand != "query":
+            raise SimulatorError("Invalid parameter '%s'" % subcommand,
+                                 constants.NS_ERROR_INVALID_ARG)
+
+        samples = [
+            (constants.METRICS_HOST, constants.METRIC_CPU_LOAD_USER,
+             "10.00%"),
+            (constants.METRICS_HOST, constants.METRIC_CPU_LOAD_KERNEL,
+             "5.00%"),
+            (constants.METRICS_HOST, constants.METRIC_CPU_LOAD_IDLE,
+             "85.00%"),
+            (constants.METRICS_HOST, constants.METRIC_CPU_MHZ, "2600 MHz"),
+        ]
+        for machine in self._machines.values():
+            if machine.state != "running":
+                continue
+            samples.extend([
+                (machine.name, constants.METRIC_CPU_LOAD_USER, "1.00%"),
+                (machine.name, constants.METRIC_CPU_LOAD_KERNEL, "0.50%"),
+                (machine.name, constants.METRIC_RAM_USED,
+                 "%d kB" % (int(machine.settings["memory"]) * 512)),
+                (machine.name, constants.METRIC_NET_RATE_RX, "1000 B/s"),
+                (machine.name, constants.METRIC_NET_RATE_TX, "500 B/s"),
+            ])
+
+        objects = positional[0] if positional else "*"
+        output = ["Object          Metric               Values",
+                  "--------------- -------------------- ----------"]
+        for name, metric, value in samples:
+            if objects in ("*", name):
+                output.append("%-15s %-20s %s" % (name, metric, value))
+        return "\n".join(output) + "\n"
+
+    def _list(self, *args):
+        long_format = "--long" in args
+        information = args[-1] if args else None
+
+        if information == constants.VMS_INFO:
+            machines = list(self._machines.values())
+        elif information == constants.RUNNINGVMS_INFO:
+            machines = [machine for machine in self._machines.values()
+                        if machine.state == "running"]
+        elif information == constants.HDDS_INFO:
+            return "\n".join(self._medium_info(medium, listing=True)
+                             for medium in self._media.values())
+        elif information == constants.OSTYPES_INFO:
+            return "\n".join(
+                "ID:          %s\nDescription: %s\nFamily ID:   Other\n"
+                "Family Desc: Other\n64 bit:      %s\n" % os_type
+                for os_type in _OS_TYPES)
+        elif information == constants.HOST_INFO:
+            return "Host Information:\n\n" + "\n".join(
+                "%s: %s%s" % (key, value, " MByte" if "Memory" in key else "")
+                for key, value in sorted(self.host_info.items())) + "\n"
+        elif information == constants.EXTPACKS:
+            return "Extension Packs: 0\n"
+        else:
+            raise SimulatorError("Invalid parameter '%s'" % information,
+                                 constants.NS_ERROR_INVALID_ARG)
+
+        if not long_format:
+            return "".join('"%s" {%s}\n' % (machine.name, machine.uuid)
+                           for machine in machines)
+
+        output = []
+        for machine in machines:
+            state = _LONG_STATE.get(machine.state, machine.state)
+            output.append(
+                "Name:            %(name)s\n"
+                "Groups:          /\n"
+                "Guest OS:        %(ostype)s\n"
+                "UUID:            %(uuid)s\n"
+                "Memory size:     %(memory)sMB\n"
+                "State:           %(state)s (since 2015-05-12T10:15:22.1)\n" %
+                {"name": machine.name, "uuid": machine.uuid,
+                 "ostype": machine.settings["ostype"],
+                 "memory": machine.settings["memory"], "state": state})
+        return "\n".join(output)
+
+    def _medium_info(self, medium, listing=False):
+        parent = self._media.get(medium.parent)
+        kind = "differencing" if parent else "base"
+        lines = [
+            "UUID:           %s" % medium.uuid,
+            "Parent UUID:    %s" % (parent.uuid if parent else "base"),
+            "State:          created",
+            "Type:           %s (%s)" % (medium.type, kind),
+            "Location:       %s" % medium.path,
+            "Storage format: %s" % medium.disk_format,
+            "Capacity:       %s MBytes" % medium.capacity,
+        ]
+        if listing:
+            return "\n".join(lines) + "\n"
+
+        lines.extend([
+            "Format variant: dynamic default",
+            "Size on disk:   0 MBytes",
+            "Auto-Reset:     %s" % medium.auto_reset,
+        ])
+        users = self._users(medium)
+        if users:
+            lines.append("In use by VMs:  %s" % ", ".join(
+                "%s (UUID: %s)" % (machine.name, machine.uuid)
+                for machine in users))
+        children = self._children(medium)
+        for index, child in enumerate(children):
+            prefix = "Child UUIDs:    " if not index else " " * 16
+            lines.append(prefix + child.uuid)
+        return "\n".join(lines) + "\n"
+
+    def _show_hd_info(self, name):
+        medium = self._find_medium(name)
+        if medium is None:
+            if not os.path.isfile(name):
+                raise SimulatorError(
+                    "Could not find file for the medium '%s'" % name,
+                    constants.NS_ERROR_INVALID_ARG)
+            medium = self._medium(name)
+        return self._medium_info(medium)
+
+    def _show_vm_info(self, name, *args):
+        machine = self._machine(name)
+        lines = [
+            'name="%s"' % machine.name,
+            'UUID="%s"' % machine.uuid,
+            'CfgFile="%s"' % os.path.join(machine.basefolder, machine.name,
+                                          machine.name + ".vbox"),
+        ]
+        for key, value in machine.settings.items():
+            lines.append('%s="%s"' % (key, value))
+        lines.append('%s="%s"' % (constants.VM_POWER_STATE, machine.state))
+
+        for index, (name, controller) in enumerate(
+                machine.controllers.items()):
+            lines.append('storagecontrollername%d="%s"' % (index, name))
+            lines.append('storagecontrollertype%d="%s"' % (index, controller))
+
+        for (controller, port, device), medium_uuid in sorted(
+                machine.attachments.items()):
+            medium = self._media[medium_uuid]
+            lines.append('"%s-%s-%s"="%s"' % (controller, port, device,
+                                             medium.path))
+            lines.append('"%s-ImageUUID-%s-%s"="%s"' % (controller, port,
+                                                       device, medium.uuid))
+        return "\n".join(lines) + "\n"
+
+    def _create_vm(self, *args):
+        _, options = self._options(args)
+        name = options.get("--name")
+        for machine in self._machines.values():
+            if machine.name == name:
+                raise SimulatorError(
+                    "Machine settings file '%s.vbox' already exists" % name,
+                    constants.VBOX_E_FILE_ERROR)
+
+        machine = Machine(name, options.get("--uuid") or str(uuid.uuid4()),
+                          options.get("--basefolder"))
+        if "--register" in options:
+            self._machines[machine.uuid] = machine
+
+        return ("Virtual machine '%(name)s' is created and registered.\n"
+                "UUID: %(uuid)s\n" % {"name": name, "uuid": machine.uuid})
+
+    def _modify_vm(self, name, *args):
+        machine = self._machine(name, lock=True)
+        index = 0
+        while index < len(args):
+            field = args[index]
+            values = []
+            index += 1
+            while index < len(args) and not args[index].startswith("--"):
+                values.append(args[index])
+                index += 1
+            if field == constants.FIELD_NAME:
+                self._rename(machine, values[0])
+                continue
+            machine.settings[field.lstrip("-")] = ",".join(values)
+
+    def _rename(self, machine, name):
+        for other in self._machines.values():
+            if other is not machine and other.name == name:
+                raise SimulatorError("A machine named '%s' already exists" %
+                                     name, constants.VBOX_E_FILE_ERROR)
+        machine.name = name
+
+    def _storage_ctl(self, name, *args):
+        machine = self._machine(name, lock=True)
+        _, options = self._options(args)
+        controller = options.get("--name")
+        if controller in machine.controllers:
+            raise SimulatorError("Storage controller named '%s' already "
+                                 "exists" % controller,
+                                 VBOX_E_OBJECT_IN_USE)
+        machine.controllers[controller] = options.get("--controller")
+
+    def _storage_attach(self, name, *args):
+        machine = self._machine(name, lock=True)
+        _, options = self._options(args)
+        controller = options.get("--storagectl")
+        if controller not in machine.controllers:
+            raise SimulatorError("Could not find a storage controller named "
+                                 "'%s'" % controller,
+                                 constants.VBOX_E_OBJECT_NOT_FOUND)
+
+        attach_point = (controller, options.get("--port"),
+                        options.get("--device"))
+        medium_name = options.get("--medium")
+        if medium_name in (constants.MEDIUM_NONE, "emptydrive"):
+            machine.attachments.pop(attach_point, None)
+            return
+
+        if medium_name == constants.MEDIUM_ISCSI:
+            medium = self.register_medium(
+                "iscsi://%s/%s" % (options.get("--server"),
+                                   options.get("--target")),
+                disk_format=constants.VHD_TYPE_ISCASI)
+        else:
+            medium = self._medium(medium_name)
+        machine.attachments[attach_point] = medium.uuid
+
+    def _start_vm(self, name, *args):
+        machine = self._machine(name, lock=True)
+        machine.state = "running"
+        return ('Waiting for VM "%s" to power on...\n'
+                'VM "%s" has been successfully started.\n' %
+                (machine.name, machine.name))
+
+    def _control_vm(self, name, state, *args):
+        machine = self._machine(name)
+        transitions = {
+            constants.STATE_PAUSE: ("running", "paused"),
+            constants.STATE_RESUME: ("paused", "running"),
+            constants.STATE_RESET: ("running", "running"),
+            constants.STATE_SUSPEND: (("running", "paused"),
+                                      constants.STATE_SAVED),
+            constants.STATE_POWER_OFF: (("running", "paused"),
+                                        constants.STATE_POWER_OFF),
+            constants.ACPI_POWER_BUTTON: ("running",
+                                          constants.STATE_POWER_OFF),
+            constants.ACPI_SLEEP_BUTTON: ("running", "running"),
+        }
+        if state not in transitions:
+            raise SimulatorError("Invalid parameter '%s'" % state,
+                                 constants.NS_ERROR_INVALID_ARG)
+
+        current_states, new_state = transitions[state]
+        if machine.state not in current_states:
+            raise SimulatorError("Machine '%s' is not currently running" %
+                                 machine.name,
+                                 constants.VBOX_E_INVALID_VM_STATE)
+        machine.state = new_state
+        return "", DONE
+
+    def _unregister_vm(self, name, *args):
+        machine = self._machine(name, lock=True)
+        del self._machines[machine.uuid]
+        if "--delete" in args:
+            # Remove the media which are not used by other machines,
+            # starting with the differencing disks.
+            media = [self._media[medium_uuid]
+                     for medium_uuid in machine.attachments.values()]
+            while media:
+                medium = media.pop()
+                if self._users(medium) or self._children(medium):
+                    continue
+                self._media.pop(medium.uuid, None)
+                parent = self._media.get(medium.parent)
+                if parent and parent.path.startswith(
+                        os.path.join(machine.basefolder, machine.name)):
+                    media.append(parent)
+        return "", DONE
+
+    def _create_hd(self, *args):
+        _, options = self._options(args)
+        path = options.get("--filename")
+        if self._find_medium(path) or os.path.exists(path):
+            raise SimulatorError("Could not create the medium storage unit "
+                                 "'%s'" % path, constants.VBOX_E_FILE_ERROR)
+
+        parent = None
+        capacity = options.get("--size")
+        if options.get("--diffparent"):
+            parent = self._medium(options["--diffparent"])
+            capacity = parent.capacity
+        if capacity is None:
+            raise SimulatorError("Parameter --size is required",
+                                 constants.NS_ERROR_INVALID_ARG)
+
+        medium = self.register_medium(
+            path, int(capacity), options.get("--format"),
+            parent.uuid if parent else None)
+        if os.path.isdir(os.path.dirname(path)):
+            # Note: The folders of the virtual machines are not created
+            # by the simulator, so only their media are kept in memory.
+            open(path, "w").close()
+        return "Medium created. UUID: %s\n" % medium.uuid, DONE
+
+    def _convert_from_raw(self, received, source, filename, size, *args):
+        # Note: The disk created by convertfromraw is not registered.
+        if int(received) != int(size):
+            raise SimulatorError("Received %s bytes instead of %s" %
+                                 (received, size),
+                                 constants.VBOX_E_FILE_ERROR)
+        if self._find_medium(filename) or os.path.exists(filename):
+            raise SimulatorError("Cannot create the disk image '%s'" %
+                                 filename, constants.VBOX_E_FILE_ERROR)
+        return ('Converting from raw image file="%s" to file="%s"...\n' %
+                (source, filename))
+
+    def _clone_hd(self, source, destination, *args):
+        _, options = self._options(args)
+        source = self._medium(source)
+        target = self._find_medium(destination)
+        if "--existing" in options:
+            if target is None:
+                raise SimulatorError("Could not find the medium '%s'" %
+                                     destination,
+                                     constants.VBOX_E_OBJECT_NOT_FOUND)
+            target.capacity = max(target.capacity, source.capacity)
+        else:
+            if target is not None:
+                raise SimulatorError("Cannot register the hard disk '%s' "
+                                     "because a hard disk with the same "
+                                     "location already exists" % destination,
+                                     constants.VBOX_E_FILE_ERROR)
+            target = self.register_medium(
+                destination, source.capacity,
+                options.get("--format") or source.disk_format)
+
+        return ("Clone medium created in format '%s'. UUID: %s\n" %
+                (target.disk_format, target.uuid), DONE)
+
+    def _modify_hd(self, name, *args):
+        medium = self._medium(name)
+        _, options = self._options(args)
+        if constants.FIELD_HD_TYPE in options:
+            medium.type = options[constants.FIELD_HD_TYPE]
+        if constants.FIELD_HD_RESIZE_MB in options:
+            capacity = int(options[constants.FIELD_HD_RESIZE_MB])
+            if capacity < medium.capacity:
+                raise SimulatorError("Shrinking is not yet supported",
+                                     constants.VERR_NOT_SUPPORTED)
+            medium.capacity = capacity
+        if constants.FIELD_HD_AUTORESET in options:
+            medium.auto_reset = options[constants.FIELD_HD_AUTORESET]
+        return "", DONE
+
+    def _close_medium(self, medium_type, name, *args):
+        medium = self._find_medium(name)
+        if medium is None:
+            raise SimulatorError("Could not find the medium '%s'" % name,
+                                 constants.VBOX_E_OBJECT_NOT_FOUND)
+        if self._users(medium) or self._children(medium):
+            raise SimulatorError("Medium '%s' is in use" % medium.path,
+                                 VBOX_E_OBJECT_IN_USE)
+        del self._media[medium.uuid]
+        if "--delete" in args and os.path.isfile(medium.path):
+            os.remove(medium.path)
+        return "", DONE
+
+    def _snapshot(self, name, action, *args):
+        machine = self._machine(name)
+        positional, _ = self._options(args)
+        snapshot_name = positional[0] if positional else None
+
+        if action == "take":
+            changes = {}
+            for attach_point, medium_uuid in machine.attachments.items():
+                medium = self._media[medium_uuid]
+                if medium.disk_format == constants.VHD_TYPE_ISCASI:
+                    continue
+                difference = self.register_medium(
+                    os.path.join(machine.basefolder, machine.name,
+                                 "Snapshots", "{%s}.vdi" % uuid.uuid4()),
+                    medium.capacity, parent=medium.uuid)
+                machine.attachments[attach_point] = difference.uuid
+                changes[attach_point] = (medium.uuid, difference.uuid)
+            snapshot_uuid = str(uuid.uuid4())
+            machine.snapshots[snapshot_name] = changes
+            return ("Snapshot taken. UUID: %s\n" % snapshot_uuid, DONE)
+
+        if action == "delete":
+            changes = machine.snapshots.pop(snapshot_name, None)
+            if changes is None:
+                raise SimulatorError("Could not find a snapshot named '%s'" %
+                                     snapshot_name,
+                                     constants.VBOX_E_OBJECT_NOT_FOUND)
+            # Merge the differencing disks created by the snapshot into
+            # their parents.
+            for attach_point, (original, difference) in changes.items():
+                if machine.attachments.get(attach_point) == difference:
+                    machine.attachments[attach_point] = original
+                    self._media.pop(difference, None)
+            return "", DONE
+
+        raise SimulatorError("Invalid parameter '%s'" % action,
+                             constants.NS_ERROR_INVALID_ARG)
+
+    def _internal_commands(self, command, name, *args):
+        medium = self._find_medium(name)
+        if command == "sethduuid":
+            if medium is not None:
+                del self._media[medium.uuid]
+                medium.uuid = str(uuid.uuid4())
+                self._media[medium.uuid] = medium
+            return "UUID changed to: %s\n" % uuid.uuid4()
+
+        if command == "sethdparentuuid":
+            if medium is not None:
+                medium.parent = args[0]
+            return "UUID changed to: %s\n" % args[0]
+
+        raise SimulatorError("Invalid parameter '%s'" % command,
+                             constants.NS_ERROR_INVALID_ARG)
@@ -0,0 +1,440 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import socket
+
+import mock
+from oslo_concurrency import processutils
+
+from nova import test
+from nova.virt.virtualbox import backend
+from nova.virt.virtualbox import constants
+
+
+_RESPONSE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<SOAP-ENV:Envelope '
+    'xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:vbox="http://www.virtualbox.org/">'
+    '<SOAP-ENV:Body>%s</SOAP-ENV:Body></SOAP-ENV:Envelope>')
+
+
+def _soap_response(method, *values):
+    content = "".join("<returnval>%s</returnval>" % value
+                      for value in values)
+    return _RESPONSE % ("<vbox:%(method)sResponse>%(content)s"
+                        "</vbox:%(method)sResponse>" %
+                        {"method": method, "content": content})
+
+
+def _soap_fault(message, result_code):
+    return _RESPONSE % (
+        "<SOAP-ENV:Fault><faultcode>SOAP-ENV:Client</faultcode>"
+        "<faultstring>%(message)s</faultstring><detail>"
+        "<vbox:RuntimeFault><resultCode>%(code)s</resultCode>"
+        "</vbox:RuntimeFault></detail></SOAP-ENV:Fault>" %
+        {"message": message, "code": result_code})
+
+
+class FakeWebService(object):
+
+    """Local stand-in for the VirtualBox web service."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def connection(self, *args, **kwargs):
+        connection = mock.Mock()
+        connection.request.side_effect = self._request
+        connection.getresponse.side_effect = self._response
+        return connection
+
+    def _request(self, verb, path, body, headers):
+        method = body.split('<vbox:')[1].split('>')[0]
+        self.requests.append((method, body))
+
+    def _response(self):
+        method, _ = self.requests[-1]
+        response = mock.Mock(will_close=False)
+        value = self.responses[method]
+        if isinstance(value, list):
+            value = value.pop(0)
+        response.read.return_value = value
+        return response
+
+
+class CLIBackendTestCase(test.NoDBTestCase):
+
+    @mock.patch('nova.utils.execute')
+    def test_execute(self, mock_execute):
+        mock_execute.side_effect = [
+            (mock.sentinel.stdout, mock.sentinel.stderr),
+            processutils.ProcessExecutionError(stdout=mock.sentinel.stdout,
+                                               stderr=mock.sentinel.error)]
+        cli_backend = backend.CLIBackend()
+
+        self.assertEqual((mock.sentinel.stdout, mock.sentinel.stderr),
+                         cli_backend.execute('LIST', 'vms'))
+        self.assertEqual((mock.sentinel.stdout, mock.sentinel.error),
+                         cli_backend.execute('LIST', 'vms'))
+        mock_execute.assert_called_with('VBoxManage', '--nologo',
+                                        'list', 'vms')
+
+    @mock.patch('subprocess.Popen')
+    def test_execute_stream(self, mock_popen):
+        process = mock_popen.return_value
+        process.communicate.return_value = (mock.sentinel.stdout, "")
+        process.returncode = 0
+        cli_backend = backend.CLIBackend()
+
+        response = cli_backend.execute_stream(iter(["abc", "def"]),
+                                              'convertfromraw', 'stdin',
+                                              'fake-path', 6)
+
+        self.assertEqual((mock.sentinel.stdout, ""), response)
+        self.assertEqual(['VBoxManage', '--nologo', 'convertfromraw',
+                          'stdin', 'fake-path', '6'],
+                         mock_popen.call_args[0][0])
+        process.stdin.write.assert_has_calls([mock.call("abc"),
+                                              mock.call("def")])
+
+    @mock.patch('subprocess.Popen')
+    def test_execute_stream_fail(self, mock_popen):
+        process = mock_popen.return_value
+        process.stdin.write.side_effect = IOError
+        process.communicate.return_value = ("", "")
+        process.returncode = 1
+        cli_backend = backend.CLIBackend()
+
+        _, stderr = cli_backend.execute_stream(iter(["abc", "def"]),
+                                               'convertfromraw')
+
+        self.assertEqual(1, process.stdin.write.call_count)
+        self.assertIn("exited with code 1", stderr)
+
+    @mock.patch('os.read')
+    @mock.patch('subprocess.Popen')
+    def test_execute_progress(self, mock_popen, mock_read):
+        process = mock_popen.return_value
+        process.stdout.read.return_value = b""
+        process.returncode = 0
+        mock_read.side_effect = [b"0%...10%", b"...", b"20%...100%\n", b""]
+        progress = []
+        cli_backend = backend.CLIBackend()
+
+        response = cli_backend.execute_progress(
+            progress.append, 'controlvm', 'fake-vm', 'teleport')
+
+        self.assertEqual(("", "0%...10%...20%...100%\n"), response)
+        self.assertEqual([10, 100], progress)
+        process.stdout.read.assert_called_once_with()
+        self.assertEqual(['VBoxManage', '--nologo', 'controlvm', 'fake-vm',
+                          'teleport'], mock_popen.call_args[0][0])
+
+    @mock.patch('os.read')
+    @mock.patch('subprocess.Popen')
+    def test_execute_progress_fail(self, mock_popen, mock_read):
+        process = mock_popen.return_value
+        process.stdout.read.return_value = b""
+        process.returncode = 1
+        mock_read.side_effect = [b"0%...10%...", b""]
+        cli_backend = backend.CLIBackend()
+
+        _, stderr = cli_backend.execute_progress(
+            mock.Mock(), 'controlvm', 'fake-vm', 'teleport')
+
+        self.assertIn("exited with code 1", stderr)
+
+
+class WebServiceBackendTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(WebServiceBackendTestCase, self).setUp()
+        self._fallback = mock.Mock()
+        self._service = FakeWebService({
+            'IWebsessionManager_logon': _soap_response(
+                'IWebsessionManager_logon', 'fake-session'),
+        })
+        patcher = mock.patch('six.moves.http_client.HTTPConnection',
+                             side_effect=self._service.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._backend = backend.WebServiceBackend(fallback=self._fallback)
+
+    def _methods(self):
+        return [method for method, _ in self._service.requests]
+
+    def test_version(self):
+        self._service.responses.update({
+            'IVirtualBox_getVersion': _soap_response(
+                'IVirtualBox_getVersion', '4.3.18'),
+            'IVirtualBox_getRevision': _soap_response(
+                'IVirtualBox_getRevision', '96516'),
+        })
+
+        for _ in range(2):
+            self.assertEqual(('4.3.18r96516\n', ''),
+                             self._backend.execute('--version'))
+
+        # The session is created only once
+        self.assertEqual(1, self._methods().count('IWebsessionManager_logon'))
+        self.assertFalse(self._fallback.execute.called)
+
+    def test_connection_pool(self):
+        self.flags(websrv_pool_size=1, group='virtualbox')
+        web_backend = backend.WebServiceBackend(fallback=self._fallback)
+
+        connection = web_backend._get_connection()
+        web_backend._put_connection(connection)
+        self.assertIs(connection, web_backend._get_connection())
+
+        # A broken connection releases its slot, so the next caller
+        # opens a new connection instead of waiting forever.
+        web_backend._put_connection(connection, broken=True)
+        connection.close.assert_called_once_with()
+        new_connection = web_backend._get_connection()
+        self.assertIsNot(connection, new_connection)
+
+        web_backend._put_connection(new_connection)
+        web_backend.close()
+        new_connection.close.assert_called_once_with()
+
+    def test_parse_response_invalid(self):
+        for body in ('', '<html><body>Bad Gateway</body></html>'):
+            self.assertRaises(backend.WebServiceFault,
+                              self._backend._parse_response, body)
+
+    def test_execute_invalid_response(self):
+        self._service.responses['IVirtualBox_getVersion'] = (
+            '<html><body>Bad Gateway</body></html>')
+
+        stdout, stderr = self._backend.execute('--version')
+        self.assertEqual('', stdout)
+        self.assertIn('Invalid response from the web service', stderr)
+
+    def test_control_vm(self):
+        self._service.responses.update({
+            'IVirtualBox_findMachine': _soap_response(
+                'IVirtualBox_findMachine', 'machine'),
+            'IWebsessionManager_getSessionObject': _soap_response(
+                'IWebsessionManager_getSessionObject', 'session'),
+            'IMachine_lockMachine': _soap_response('IMachine_lockMachine'),
+            'ISession_getConsole': _soap_response('ISession_getConsole',
+                                                  'console'),
+            'IConsole_pause': _soap_response('IConsole_pause'),
+            'ISession_unlockMachine': _soap_response(
+                'ISession_unlockMachine'),
+        })
+
+        self.assertEqual(('', ''), self._backend.execute(
+            'controlvm', 'fake-vm', constants.STATE_PAUSE))
+        self.assertEqual(['IWebsessionManager_logon',
+                          'IVirtualBox_findMachine',
+                          'IWebsessionManager_getSessionObject',
+                          'IMachine_lockMachine', 'ISession_getConsole',
+                          'IConsole_pause', 'ISession_unlockMachine'],
+                         self._methods())
+
+    def test_control_vm_not_found(self):
+        self._service.responses.update({
+            'IVirtualBox_findMachine': _soap_fault('Could not find',
+                                                   -2135228415),
+        })
+
+        _, stderr = self._backend.execute('controlvm', 'fake-vm',
+                                          constants.STATE_PAUSE)
+        self.assertIn(constants.VBOX_E_INSTANCE_NOT_FOUND, stderr)
+        self.assertIn(constants.VBOX_E_OBJECT_NOT_FOUND, stderr)
+
+    def _session_responses(self, *methods):
+        self._service.responses.update({
+            'IVirtualBox_findMachine': _soap_response(
+                'IVirtualBox_findMachine', 'machine'),
+            'IWebsessionManager_getSessionObject': _soap_response(
+                'IWebsessionManager_getSessionObject', 'session'),
+            'IMachine_lockMachine': _soap_response('IMachine_lockMachine'),
+            'ISession_getMachine': _soap_response('ISession_getMachine',
+                                                  'mutable'),
+            'IMachine_saveSettings': _soap_response('IMachine_saveSettings'),
+            'ISession_unlockMachine': _soap_response(
+                'ISession_unlockMachine'),
+        })
+        for method in methods:
+            self._service.responses[method] = _soap_response(method)
+
+    def _params(self, method):
+        return [body for name, body in self._service.requests
+                if name == method]
+
+    def test_modify_vm(self):
+        self._session_responses(
+            'IMachine_setDescription', 'IMachine_setMemorySize',
+            'IVRDEServer_setVRDEProperty', 'INetworkAdapter_setEnabled',
+            'INetworkAdapter_setAttachmentType',
+            'INetworkAdapter_setAdapterType',
+            'INetworkAdapter_setMACAddress')
+        self._service.responses.update({
+            'IMachine_getVRDEServer': _soap_response(
+                'IMachine_getVRDEServer', 'vrde'),
+            'IMachine_getNetworkAdapter': _soap_response(
+                'IMachine_getNetworkAdapter', 'adapter'),
+        })
+
+        self.assertEqual(('', ''), self._backend.execute(
+            'modifyvm', 'fake-vm', constants.FIELD_DESCRIPTION, 'fake',
+            constants.FIELD_MEMORY, 512, constants.FIELD_VRDE_PORT, 3389,
+            '--nic4', constants.NIC_MODE_NULL,
+            '--nictype4', constants.NIC_TYPE_82540EM,
+            '--macaddress4', 'AABBCCDDEEFF'))
+
+        self.assertFalse(self._fallback.execute.called)
+        methods = self._methods()
+        self.assertEqual(['IMachine_lockMachine', 'ISession_getMachine',
+                          'IMachine_setDescription',
+                          'IMachine_setMemorySize',
+                          'IMachine_getVRDEServer',
+                          'IVRDEServer_setVRDEProperty',
+                          'IMachine_getNetworkAdapter',
+                          'INetworkAdapter_setEnabled',
+                          'INetworkAdapter_setAttachmentType',
+                          'INetworkAdapter_setAdapterType',
+                          'INetworkAdapter_setMACAddress',
+                          'IMachine_saveSettings',
+                          'ISession_unlockMachine'],
+                         methods[methods.index('IMachine_lockMachine'):])
+        self.assertIn('<lockType>Write</lockType>',
+                      self._params('IMachine_lockMachine')[0])
+        self.assertIn('<slot>3</slot>',
+                      self._params('IMachine_getNetworkAdapter')[0])
+        self.assertIn('<key>TCP/Ports</key><value>3389</value>',
+                      self._params('IVRDEServer_setVRDEProperty')[0])
+        self.assertIn('<adapterType>I82540EM</adapterType>',
+                      self._params('INetworkAdapter_setAdapterType')[0])
+
+    def test_modify_vm_unsupported(self):
+        self._fallback.execute.return_value = mock.sentinel.output
+
+        for args in ((constants.FIELD_MEMORY, 512, '--boot1', 'disk'),
+                     (constants.FIELD_MEMORY, 'fake-size'),
+                     ('--nic1', 'fake-mode'),
+                     (constants.FIELD_MEMORY,)):
+            self.assertEqual(mock.sentinel.output, self._backend.execute(
+                'modifyvm', 'fake-vm', *args))
+            self._fallback.execute.assert_called_with(
+                'modifyvm', 'fake-vm', *args)
+        self.assertEqual([], self._service.requests)
+
+    def test_storage_attach(self):
+        self._session_responses('IMachine_attachDevice',
+                                'IMachine_detachDevice')
+        self._service.responses['IVirtualBox_openMedium'] = _soap_response(
+            'IVirtualBox_openMedium', 'medium')
+        disk_path = os.path.abspath('fake-disk.vdi')
+
+        self.assertEqual(('', ''), self._backend.execute(
+            'storageattach', 'fake-vm', '--storagectl', 'SATA',
+            '--port', 1, '--device', 0, '--type', constants.STORAGE_HDD,
+            '--medium', disk_path))
+
+        methods = self._methods()
+        self.assertEqual(['IMachine_lockMachine', 'ISession_getMachine',
+                          'IVirtualBox_openMedium', 'IMachine_detachDevice',
+                          'IMachine_attachDevice', 'IMachine_saveSettings',
+                          'ISession_unlockMachine'],
+                         methods[methods.index('IMachine_lockMachine'):])
+        request = self._params('IMachine_attachDevice')[0]
+        for value in ('<name>SATA</name>', '<controllerPort>1',
+                      '<device>0</device>', '<type>HardDisk</type>',
+                      '<medium>medium</medium>'):
+            self.assertIn(value, request)
+        self.assertFalse(self._fallback.execute.called)
+
+    def test_storage_attach_detach(self):
+        self._session_responses('IMachine_detachDevice')
+
+        self.assertEqual(('', ''), self._backend.execute(
+            'storageattach', 'fake-vm', '--storagectl', 'SATA',
+            '--port', 1, '--device', 0, '--type', constants.STORAGE_HDD,
+            '--medium', constants.MEDIUM_NONE))
+
+        self.assertNotIn('IVirtualBox_openMedium', self._methods())
+        self.assertEqual(1, len(self._params('IMachine_detachDevice')))
+
+    def test_storage_attach_unsupported(self):
+        self._fallback.execute.return_value = mock.sentinel.output
+        arguments = ['--storagectl', 'SATA', '--port', 1, '--device', 0,
+                     '--type', constants.STORAGE_HDD]
+
+        for args in (arguments + ['--medium', 'iscsi', '--server', 'fake'],
+                     arguments + ['--medium', 'emptydrive'],
+                     arguments):
+            self.assertEqual(mock.sentinel.output, self._backend.execute(
+                'storageattach', 'fake-vm', *args))
+        self.assertEqual([], self._service.requests)
+
+    def test_execute_unsupported_command(self):
+        self._fallback.execute.return_value = mock.sentinel.output
+
+        self.assertEqual(mock.sentinel.output, self._backend.execute(
+            'showvminfo', 'fake-vm', '--machinereadable'))
+        self.assertEqual(mock.sentinel.output, self._backend.execute(
+            'list', constants.HDDS_INFO))
+        self.assertEqual(mock.sentinel.output, self._backend.execute(
+            'list', constants.VMS_INFO))
+        self.assertEqual([], self._service.requests)
+
+    def test_execute_stream(self):
+        self._fallback.execute_stream.return_value = mock.sentinel.output
+
+        self.assertEqual(mock.sentinel.output, self._backend.execute_stream(
+            mock.sentinel.source, 'convertfromraw', 'stdin'))
+        self._fallback.execute_stream.assert_called_once_with(
+            mock.sentinel.source, 'convertfromraw', 'stdin')
+
+    def test_execute_progress(self):
+        self._fallback.execute_progress.return_value = mock.sentinel.output
+
+        self.assertEqual(mock.sentinel.output, self._backend.execute_progress(
+            mock.sentinel.callback, 'controlvm', 'fake-vm', 'teleport'))
+        self._fallback.execute_progress.assert_called_once_with(
+            mock.sentinel.callback, 'controlvm', 'fake-vm', 'teleport')
+
+    def test_execute_service_unavailable(self):
+        self._fallback.execute.return_value = mock.sentinel.output
+        self._service.responses['IWebsessionManager_logon'] = None
+
+        with mock.patch.object(self._backend, '_request') as mock_request:
+            mock_request.side_effect = socket.error
+            self.assertEqual(mock.sentinel.output,
+                             self._backend.execute('--version'))
+        self._fallback.execute.assert_called_once_with('--version')
+
+
+class GetBackendTestCase(test.NoDBTestCase):
+
+    def test_get_backend(self):
+        for name, backend_class in backend.BACKENDS.items():
+            self.flags(backend=name, group='virtualbox')
+            self.assertIsInstance(backend.get_backend(), backend_class)
+
+    def test_backend_choices(self):
+        opt = [opt for opt in backend.VIRTUAL_BOX if opt.name == 'backend']
+        self.assertRaises(ValueError, opt[0].type, 'fake-backend')
+
+    def test_get_backend_unknown(self):
+        self.flags(backend='fake-backend', group='virtualbox')
+        self.assertIsInstance(backend.get_backend(), backend.CLIBackend)
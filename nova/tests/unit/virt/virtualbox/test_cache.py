@@ -0,0 +1,213 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from nova import test
+from nova.tests.unit import fake_instance
+from nova.virt.virtualbox import cache
+from nova.virt.virtualbox import constants
+
+
+class VMInfoCacheTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(VMInfoCacheTestCase, self).setUp()
+        self._instance = fake_instance.fake_instance_obj(
+            'fake-context', name='fake_name', uuid='fake_uuid')
+        self._cache = cache.VMInfoCache()
+
+    def test_lookup(self):
+        information, token = self._cache.lookup(self._instance)
+        self.assertIsNone(information)
+
+        self._cache.store(self._instance, {'a': 'b'}, token)
+        information, _ = self._cache.lookup(self._instance)
+
+        self.assertEqual({'a': 'b'}, information)
+        self.assertEqual({'hits': 1, 'misses': 1, 'invalidations': 0,
+                          'size': 1}, self._cache.stats())
+
+    @mock.patch('time.time')
+    def test_lookup_expired(self, mock_time):
+        mock_time.side_effect = [0, 10]
+        self._cache.ttl = 5
+        self._cache.store(self._instance, {'a': 'b'},
+                          self._cache.token(self._instance))
+
+        information, _ = self._cache.lookup(self._instance)
+        self.assertIsNone(information)
+
+    def test_invalidate(self):
+        for name in (self._instance.name, self._instance.uuid):
+            self._cache.store(self._instance, {'a': 'b'},
+                              self._cache.token(self._instance))
+            self._cache.invalidate(name)
+
+            information, _ = self._cache.lookup(self._instance)
+            self.assertIsNone(information)
+
+    def test_store_after_invalidate(self):
+        token = self._cache.token(self._instance)
+        self._cache.invalidate(self._instance.name)
+        self._cache.store(self._instance, {'a': 'b'}, token)
+
+        information, _ = self._cache.lookup(self._instance)
+        self.assertIsNone(information)
+
+    def test_clear(self):
+        self._cache.store(self._instance, {'a': 'b'},
+                          self._cache.token(self._instance))
+        self._cache.clear()
+
+        self.assertEqual(0, self._cache.stats()['size'])
+
+
+class VMRegistryTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(VMRegistryTestCase, self).setUp()
+        self._get_virtual_machines = mock.Mock(return_value=[
+            ('fake-vm', 'fake-uuid'),
+            (cache.VMRegistry.INACCESSIBLE, 'fake-inaccessible-uuid')])
+        self._registry = cache.VMRegistry()
+
+    def test_reconcile(self):
+        for _ in range(2):
+            self._registry.reconcile(self._get_virtual_machines)
+
+        self._get_virtual_machines.assert_called_once_with()
+        self.assertEqual('fake-uuid', self._registry.get('fake-vm').uuid)
+        self.assertEqual('fake-vm', self._registry.get('fake-uuid').name)
+        self.assertEqual(['fake-inaccessible-uuid'],
+                         [virtual_machine.uuid for virtual_machine in
+                          self._registry.virtual_machines(inaccessible=True)])
+
+        self._registry.reconcile(self._get_virtual_machines, force=True)
+        self.assertEqual(2, self._get_virtual_machines.call_count)
+
+    @mock.patch('time.time')
+    def test_outdated(self, mock_time):
+        mock_time.side_effect = [0, 10, 20]
+        self._registry.ttl = 15
+
+        self.assertTrue(self._registry.outdated)
+        self._registry.reconcile(self._get_virtual_machines)
+        self.assertFalse(self._registry.outdated)
+        self.assertTrue(self._registry.outdated)
+
+    def test_add_remove(self):
+        self._registry.add('fake-vm', 'fake-uuid')
+        self.assertEqual(['fake-vm'], [virtual_machine.name for
+                                       virtual_machine in
+                                       self._registry.virtual_machines()])
+
+        self._registry.remove('fake-uuid')
+        self.assertIsNone(self._registry.get('fake-vm'))
+        self.assertEqual([], self._registry.virtual_machines())
+
+    def test_instance_uuid(self):
+        self._registry.reconcile(self._get_virtual_machines)
+        self._registry.set_instance_uuid('fake-uuid', 'fake-instance-uuid')
+        self.assertEqual('fake-instance-uuid',
+                         self._registry.instance_uuid('fake-uuid'))
+        self.assertEqual('fake-other-uuid',
+                         self._registry.instance_uuid('fake-other-uuid'))
+
+        self._get_virtual_machines.return_value = []
+        self._registry.reconcile(self._get_virtual_machines, force=True)
+        self.assertEqual('fake-uuid',
+                         self._registry.instance_uuid('fake-uuid'))
+
+    def test_cpus(self):
+        self._registry.reconcile(self._get_virtual_machines)
+        self._registry.set_cpus('fake-uuid', 2)
+        self.assertEqual(2, self._registry.cpus('fake-uuid'))
+        self.assertIsNone(self._registry.cpus('fake-other-uuid'))
+
+        self._registry.remove('fake-vm')
+        self.assertIsNone(self._registry.cpus('fake-uuid'))
+
+        self._registry.add('fake-vm', 'fake-uuid')
+        self._registry.set_cpus('fake-uuid', 4)
+        self._get_virtual_machines.return_value = []
+        self._registry.reconcile(self._get_virtual_machines, force=True)
+        self.assertIsNone(self._registry.cpus('fake-uuid'))
+
+
+class MediumRegistryTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(MediumRegistryTestCase, self).setUp()
+        self._list_media = mock.Mock(return_value={
+            'fake-base-uuid': {constants.VHD_PATH: 'fake-base-path'},
+            'fake-root-uuid': {
+                constants.VHD_PATH: 'fake-root-path',
+                constants.VHD_PARENT_UUID: 'fake-base-uuid'},
+        })
+        self._show_medium = mock.Mock(return_value={
+            constants.VHD_UUID: 'fake-diff-uuid',
+            constants.VHD_PATH: 'fake-diff-path',
+            constants.VHD_PARENT_UUID: 'fake-root-uuid',
+        })
+        self._registry = cache.MediumRegistry()
+        self._registry.reconcile(self._list_media)
+
+    def test_get(self):
+        information = self._registry.get('fake-root-path', self._show_medium)
+
+        self.assertEqual('fake-root-uuid', information[constants.VHD_UUID])
+        self.assertFalse(self._show_medium.called)
+
+        for _ in range(2):
+            information = self._registry.get('fake-diff-path',
+                                              self._show_medium)
+        self.assertEqual('fake-diff-uuid', information[constants.VHD_UUID])
+        self._show_medium.assert_called_once_with('fake-diff-path')
+
+    def test_chain(self):
+        chain = self._registry.chain('fake-diff-path', self._show_medium)
+
+        self.assertEqual(['fake-diff-uuid', 'fake-root-uuid',
+                          'fake-base-uuid'],
+                         [item[constants.VHD_UUID] for item in chain])
+
+    def test_invalidate(self):
+        self._registry.get('fake-diff-path', self._show_medium)
+        self._registry.invalidate('fake-diff-uuid')
+        self._registry.get('fake-diff-path', self._show_medium)
+        self.assertEqual(2, self._show_medium.call_count)
+
+        self._registry.invalidate()
+        self.assertTrue(self._registry.outdated)
+
+    def test_registered(self):
+        self.assertTrue(self._registry.registered('fake-base-path',
+                                                  self._list_media))
+        self.assertFalse(self._registry.registered('fake-diff-uuid',
+                                                   self._list_media))
+        self.assertEqual(1, self._list_media.call_count)
+
+        self._registry.invalidate('fake-new-path', created=True)
+        self._registry.registered('fake-base-uuid', self._list_media)
+        self.assertEqual(2, self._list_media.call_count)
+
+    def test_children(self):
+        children = self._registry.children('fake-base-path',
+                                           self._list_media,
+                                           self._show_medium)
+
+        self.assertEqual(['fake-root-path'],
+                         [item[constants.VHD_PATH] for item in children])
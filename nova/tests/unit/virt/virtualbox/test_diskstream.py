@@ -0,0 +1,210 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import struct
+import zlib
+
+import fixtures
+
+from nova import test
+from nova.virt.virtualbox import diskstream
+from nova.virt.virtualbox import exception as vbox_exc
+
+
+class DiskStreamTestCase(test.NoDBTestCase):
+
+    _BLOCK_SIZE = 1024
+
+    def setUp(self):
+        super(DiskStreamTestCase, self).setUp()
+        self._path = self.useFixture(fixtures.TempDir()).path
+
+    def _write_vdi(self, name, blocks, block_count=4):
+        """Write a VDI image which contains the received blocks.
+
+        The value None marks the blocks which contain only zeros.
+        """
+        header, blocks_offset, data_offset = diskstream.vdi_header(
+            block_count * self._BLOCK_SIZE, self._BLOCK_SIZE, block_count,
+            len(blocks))
+        block_map = [diskstream.VDI_BLOCK_FREE] * block_count
+        data = b""
+        for index in sorted(blocks):
+            if blocks[index] is None:
+                block_map[index] = diskstream.VDI_BLOCK_ZERO
+            else:
+                block_map[index] = len(data) // self._BLOCK_SIZE
+                data += blocks[index]
+
+        path = os.path.join(self._path, name)
+        with open(path, "wb") as disk_file:
+            disk_file.write(header)
+            disk_file.seek(blocks_offset)
+            disk_file.write(struct.pack("<%dI" % block_count, *block_map))
+            disk_file.seek(data_offset)
+            disk_file.write(data)
+        return path
+
+    @staticmethod
+    def _vhd_footer(size, disk_type, data_offset):
+        return diskstream._VHD_FOOTER.pack(
+            diskstream.VHD_COOKIE, 2, 0x00010000, data_offset, 0, b"vbox",
+            0, b"Wi2k", size, size, 0, disk_type, 0, b"\x00" * 16, 0, b"")
+
+    def _write_vhd_fixed(self, name, data):
+        path = os.path.join(self._path, name)
+        with open(path, "wb") as disk_file:
+            disk_file.write(data)
+            disk_file.write(self._vhd_footer(
+                len(data), diskstream.VHD_TYPE_FIXED, 0xffffffffffffffff))
+        return path
+
+    def _write_vhd_differencing(self, name, size, blocks):
+        """Write a differencing VHD image which contains the received
+        blocks, as tuples of sector bitmaps and data.
+        """
+        block_count = size // self._BLOCK_SIZE
+        footer = self._vhd_footer(size, diskstream.VHD_TYPE_DIFFERENCING,
+                                  512)
+        path = os.path.join(self._path, name)
+        with open(path, "wb") as disk_file:
+            disk_file.write(footer)
+            disk_file.write(diskstream._VHD_DYNAMIC_HEADER.pack(
+                b"cxsparse", 0xffffffffffffffff, 1536, 0x00010000,
+                block_count, self._BLOCK_SIZE))
+
+            bat = [diskstream.VHD_BLOCK_FREE] * block_count
+            sector = 4
+            for index in sorted(blocks):
+                bitmap, data = blocks[index]
+                bat[index] = sector
+                disk_file.seek(sector * diskstream.SECTOR_SIZE)
+                disk_file.write(bitmap + b"\x00" * (512 - len(bitmap)))
+                disk_file.write(data)
+                sector += 1 + len(data) // diskstream.SECTOR_SIZE
+
+            disk_file.seek(1536)
+            disk_file.write(struct.pack(">%dI" % block_count, *bat))
+            disk_file.seek(sector * diskstream.SECTOR_SIZE)
+            disk_file.write(footer)
+        return path
+
+    def test_vdi_chain(self):
+        base = self._write_vdi("base.vdi", {0: b"a" * 1024, 1: b"b" * 1024,
+                                            3: b"d" * 1024})
+        child = self._write_vdi("child.vdi", {1: b"B" * 1024, 3: None})
+
+        with diskstream.FlatDisk([child, base]) as flat_disk:
+            self.assertEqual(4096, flat_disk.size)
+            self.assertFalse(flat_disk.is_allocated(2048, 1024))
+            self.assertTrue(flat_disk.is_allocated(1536, 1024))
+            self.assertEqual(b"a" * 1024 + b"B" * 1024 + b"\x00" * 2048,
+                             flat_disk.read(0, 4096))
+            self.assertEqual(b"a" * 2 + b"B" * 2, flat_disk.read(1022, 4))
+
+    def test_vhd_chain(self):
+        base_data = b"".join(chr(ord("a") + index).encode() * 512
+                             for index in range(4))
+        base = self._write_vhd_fixed("base.vhd", base_data)
+        # Only the second sector of the first block is marked in the
+        # bitmap of the differencing image.
+        child = self._write_vhd_differencing(
+            "child.vhd", 2048, {0: (b"\x40", b"Y" * 512 + b"X" * 512)})
+
+        with diskstream.FlatDisk([child, base]) as flat_disk:
+            self.assertTrue(flat_disk.is_allocated(0, 512))
+            self.assertFalse(flat_disk._images[0].is_allocated(1024, 1024))
+            self.assertEqual(b"a" * 512 + b"X" * 512 + b"c" * 512 +
+                             b"d" * 512,
+                             flat_disk.read(0, 2048))
+            self.assertEqual(b"a" + b"X" * 2, flat_disk.read(511, 3))
+
+    def test_vdi_stream(self):
+        base = self._write_vdi("base.vdi", {0: b"a" * 1024, 3: b"d" * 1024})
+        child = self._write_vdi("child.vdi", {1: b"b" * 1024})
+        path = os.path.join(self._path, "stream.vdi")
+
+        with diskstream.FlatDisk([child, base]) as flat_disk:
+            expected = flat_disk.read(0, flat_disk.size)
+            reader = diskstream.ChunkReader(
+                diskstream.vdi_stream(flat_disk, self._BLOCK_SIZE))
+            with open(path, "wb") as disk_file:
+                for chunk in iter(lambda: reader.read(100), b""):
+                    disk_file.write(chunk)
+
+        image = diskstream.open_image(path)
+        self.addCleanup(image.close)
+        self.assertIsInstance(image, diskstream.VDIImage)
+        self.assertEqual((0, 1, diskstream.VDI_BLOCK_FREE, 2),
+                         image._block_map)
+        with diskstream.FlatDisk([path]) as flat_disk:
+            self.assertEqual(expected, flat_disk.read(0, flat_disk.size))
+
+    def test_vdi_stream_differencing(self):
+        base = self._write_vdi("base.vdi", {0: b"a" * 1024, 3: b"d" * 1024})
+        child = self._write_vdi("child.vdi", {1: b"b" * 1024, 3: None})
+        path = os.path.join(self._path, "stream.vdi")
+        parent_uuid = "0b0c5c5e-0f5e-4a5b-9a7c-1d2e3f405162"
+
+        with diskstream.FlatDisk([child, base]) as flat_disk:
+            with open(path, "wb") as disk_file:
+                for chunk in diskstream.vdi_stream(flat_disk,
+                                                   self._BLOCK_SIZE,
+                                                   parent_uuid):
+                    disk_file.write(chunk)
+
+        image = diskstream.open_image(path)
+        self.addCleanup(image.close)
+        self.assertEqual(diskstream.VDI_TYPE_DIFF, image.image_type)
+        self.assertEqual(parent_uuid, image.parent_uuid)
+        self.assertEqual((diskstream.VDI_BLOCK_FREE, 0,
+                          diskstream.VDI_BLOCK_FREE, 1), image._block_map)
+        with diskstream.FlatDisk([path, base]) as flat_disk:
+            self.assertEqual(b"a" * 1024 + b"b" * 1024 + b"\x00" * 2048,
+                             flat_disk.read(0, flat_disk.size))
+
+    def test_open_image_unsupported(self):
+        path = os.path.join(self._path, "disk.vmdk")
+        with open(path, "wb") as disk_file:
+            disk_file.write(b"KDMV" + b"\x00" * 1020)
+
+        self.assertRaises(vbox_exc.UnsupportedDiskImage,
+                          diskstream.open_image, path)
+        self.assertRaises(vbox_exc.UnsupportedDiskImage,
+                          diskstream.FlatDisk, [path])
+
+    def test_open_image_truncated(self):
+        path = self._write_vdi("base.vdi", {})
+        with open(path, "r+b") as disk_file:
+            disk_file.truncate(100)
+
+        self.assertRaises(vbox_exc.UnsupportedDiskImage,
+                          diskstream.open_image, path)
+
+    def test_compress(self):
+        data = b"abc" * 1000
+        chunks = list(diskstream.compress([data[:1500], data[1500:]]))
+
+        self.assertEqual(data, zlib.decompress(b"".join(chunks),
+                                               16 + zlib.MAX_WBITS))
+
+    def test_chunk_reader(self):
+        reader = diskstream.ChunkReader([b"abc", b"", b"defg"])
+
+        self.assertEqual(b"ab", reader.read(2))
+        self.assertEqual(b"cdef", reader.read(4))
+        self.assertEqual(b"g", reader.read())
+        self.assertEqual(b"", reader.read(10))
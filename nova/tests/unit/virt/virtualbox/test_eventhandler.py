@@ -0,0 +1,125 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from nova import test
+from nova.virt import event as virtevent
+from nova.virt.virtualbox import eventhandler
+from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import vminfo
+
+
+class InstanceEventHandlerTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(InstanceEventHandlerTestCase, self).setUp()
+        self._callback = mock.Mock()
+        self._handler = eventhandler.InstanceEventHandler(
+            state_change_callback=self._callback)
+
+    def _transitions(self):
+        return [(call[0][0].get_instance_uuid(), call[0][0].get_transition())
+                for call in self._callback.call_args_list]
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_vm_registry')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_vm_info_cache')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list_running_vms')
+    def test_poll_power_states(self, mock_running_vms, mock_show_vm_info,
+                               mock_cache, mock_vm_registry):
+        instance_uuids = {'uuid-2': 'instance-uuid-2'}
+        mock_vm_registry.return_value.instance_uuid.side_effect = (
+            lambda uuid: instance_uuids.get(uuid, uuid))
+        vms_info = {
+            'vm-1': {'VMState': 'running',
+                     'description': '{"instance_uuid": "uuid-1"}'},
+            'vm-2': {'VMState': 'paused', 'description': '{}'},
+            'vm-3': {'VMState': 'running', 'description': 'fake'},
+        }
+        mock_show_vm_info.side_effect = (
+            lambda instance, vm_name: vminfo.VMInfo(vms_info[vm_name]))
+        mock_running_vms.side_effect = [
+            [('vm-1', 'uuid-1'), ('nova-pool-1', 'uuid-5')],
+            [('vm-2', 'uuid-2'), ('vm-3', 'uuid-3')],
+            [('vm-1', 'uuid-1'), ('vm-2', 'uuid-2'), ('vm-3', 'uuid-3')],
+        ]
+
+        for _ in range(3):
+            self._handler._poll_power_states()
+
+        self.assertEqual([('instance-uuid-2',
+                           virtevent.EVENT_LIFECYCLE_PAUSED),
+                          ('uuid-1', virtevent.EVENT_LIFECYCLE_STOPPED),
+                          ('uuid-1', virtevent.EVENT_LIFECYCLE_STARTED)],
+                         self._transitions())
+        # Only the virtual machines which were started are queried.
+        self.assertEqual(['vm-1', 'vm-1', 'vm-2', 'vm-3'],
+                         sorted(call[1]['vm_name']
+                                for call in mock_show_vm_info.call_args_list))
+        mock_cache.return_value.invalidate.assert_has_calls(
+            [mock.call('vm-2'), mock.call('vm-3'), mock.call('vm-1'),
+             mock.call('vm-1')], any_order=True)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_vm_info_cache')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list_running_vms')
+    def test_poll_power_states_show_vm_info_fail(self, mock_running_vms,
+                                                 mock_show_vm_info,
+                                                 mock_cache):
+        mock_running_vms.return_value = [('vm-1', 'uuid-1')]
+        mock_show_vm_info.side_effect = [
+            vbox_exc.VBoxException(details='fake'),
+            vbox_exc.VBoxException(details='fake'),
+            vminfo.VMInfo({'VMState': 'running',
+                           'description': '{"instance_uuid": "uuid-1"}'}),
+        ]
+
+        for _ in range(3):
+            self._handler._poll_power_states()
+
+        self.assertEqual([('uuid-1', virtevent.EVENT_LIFECYCLE_STARTED)],
+                         self._transitions())
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list_running_vms')
+    def test_poll_power_states_fail(self, mock_running_vms):
+        mock_running_vms.side_effect = vbox_exc.VBoxException(details='fake')
+
+        self._handler._poll_power_states()
+
+        self.assertFalse(self._callback.called)
+
+    @mock.patch('nova.openstack.common.loopingcall.FixedIntervalLoopingCall')
+    def test_start_listener(self, mock_looping_call):
+        self.flags(power_state_event_polling_interval=5, group='virtualbox')
+
+        for _ in range(2):
+            self._handler.start_listener()
+
+        mock_looping_call.assert_called_once_with(
+            self._handler._poll_power_states)
+        mock_looping_call.return_value.start.assert_called_once_with(
+            interval=5)
+
+        self._handler.stop_listener()
+        mock_looping_call.return_value.stop.assert_called_once_with()
+
+    @mock.patch('nova.openstack.common.loopingcall.FixedIntervalLoopingCall')
+    def test_start_listener_disabled(self, mock_looping_call):
+        self.flags(power_state_event_polling_interval=0, group='virtualbox')
+
+        self._handler.start_listener()
+
+        self.assertFalse(mock_looping_call.called)
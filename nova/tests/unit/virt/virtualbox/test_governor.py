@@ -0,0 +1,77 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from nova import test
+from nova.virt.virtualbox import governor
+
+
+class ExecutionGovernorTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(ExecutionGovernorTestCase, self).setUp()
+        self._governor = governor.ExecutionGovernor(max_concurrent=2)
+
+    def test_slot(self):
+        with self._governor.slot():
+            with self._governor.slot():
+                self.assertEqual(2, self._governor.stats()["active"])
+                self.assertFalse(self._governor._slots.acquire(False))
+
+        stats = self._governor.stats()
+        self.assertEqual(0, stats["active"])
+        self.assertEqual(0, stats["waiting"])
+        self.assertEqual(1, stats["max_waiting"])
+        self.assertEqual(2, stats["acquired"])
+        self.assertTrue(self._governor._slots.acquire(False))
+
+    def test_slot_unlimited(self):
+        execution_governor = governor.ExecutionGovernor()
+
+        with execution_governor.slot():
+            self.assertIsNone(execution_governor._slots)
+            self.assertEqual(1, execution_governor.stats()["active"])
+
+    def test_slot_fail(self):
+        def _execute():
+            with self._governor.slot():
+                raise ValueError()
+
+        self.assertRaises(ValueError, _execute)
+        self.assertEqual(0, self._governor.stats()["active"])
+
+    def test_lane(self):
+        with self._governor.lane('fake-vm'):
+            with self._governor.lane('fake-other-vm'):
+                self.assertEqual(2, self._governor.stats()["lanes"])
+            lock, users = self._governor._lanes['fake-vm']
+            self.assertEqual(1, users)
+            self.assertFalse(lock.acquire(False))
+
+        self.assertEqual({}, self._governor._lanes)
+
+    def test_lane_no_name(self):
+        with self._governor.lane(None):
+            self.assertEqual({}, self._governor._lanes)
+
+    @mock.patch('random.uniform')
+    def test_backoff(self, mock_uniform):
+        mock_uniform.side_effect = lambda low, high: high
+
+        self.assertEqual(1, self._governor.backoff(0, 1))
+        self.assertEqual(8, self._governor.backoff(3, 1))
+        self.assertEqual(5, self._governor.backoff(3, 1, 5))
+        mock_uniform.assert_called_with(2.5, 5)
@@ -16,9 +16,14 @@
 import mock
 from oslo_config import cfg
 
+from nova import exception
 from nova import test
 from nova.tests.unit.virt.virtualbox import fake
+from nova.virt.virtualbox import cache
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import exception as vbox_exc
 from nova.virt.virtualbox import hostops
+from nova.virt.virtualbox import vmpool
 
 CONF = cfg.CONF
 
@@ -48,6 +53,42 @@ class HostOpsTestCase(test.NoDBTestCase):
 
         mock_disk_usage.assert_has_calls(calls)
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_vm_registry')
+    def test_get_vcpus_used(self, mock_vm_registry, mock_vm_info):
+        vm_registry = cache.VMRegistry()
+        vm_registry.reconcile(lambda: [
+            ('instance-00000001', 'uuid-1'),
+            ('instance-00000002', 'uuid-2'),
+            ('instance-00000003', 'uuid-3'),
+            (vmpool.POOL_PREFIX + 'uuid-4', 'uuid-4'),
+            ('instance-00000005', 'uuid-5'),
+        ])
+        vm_registry.set_cpus('uuid-1', 2)
+        mock_vm_registry.return_value = vm_registry
+        vm_info = {
+            'instance-00000002': {constants.VM_CPUS: 1},
+            'instance-00000003': exception.InstanceNotFound(
+                instance_id='uuid-3'),
+            'instance-00000005': vbox_exc.VBoxManageError(
+                method='showvminfo', reason='fake-error'),
+        }
+
+        def show_vm_info(instance, vm_name):
+            self.assertIsNone(instance)
+            if isinstance(vm_info[vm_name], Exception):
+                raise vm_info[vm_name]
+            return vm_info[vm_name]
+
+        mock_vm_info.side_effect = show_vm_info
+
+        self.assertEqual(3, hostops._get_vcpus_used())
+        self.assertEqual(3, mock_vm_info.call_count)
+        self.assertEqual(1, vm_registry.cpus('uuid-2'))
+        self.assertIsNone(vm_registry.cpus('uuid-3'))
+        self.assertIsNone(vm_registry.cpus('uuid-5'))
+
+    @mock.patch('nova.virt.virtualbox.hostops._get_vcpus_used')
     @mock.patch('oslo_serialization.jsonutils.dumps')
     @mock.patch('nova.virt.virtualbox.hostops._get_hypervisor_version')
     @mock.patch('nova.virt.virtualbox.hostops._get_local_hdd_info_gb')
@@ -55,22 +96,55 @@ class HostOpsTestCase(test.NoDBTestCase):
     @mock.patch('nova.virt.virtualbox.vmutils.get_host_info')
     def test_get_available_resource(self, mock_host_info, mock_cpu_info,
                                     mock_hdd_info, mock_version,
-                                    mock_json_utils):
+                                    mock_json_utils, mock_vcpus_used):
+        host_facts = hostops.HostFacts()
         mock_host_info.return_value = fake.fake_host_info()
         mock_version.return_value = mock.sentinel.version
         mock_cpu_info.return_value = mock.sentinel.cpu_info
         mock_json_utils.return_value = mock.sentinel.cpu_info
         mock_hdd_info.return_value = (fake.FAKE_TOTAL, fake.FAKE_FREE,
                                       fake.FAKE_USED)
+        mock_vcpus_used.return_value = fake.FAKE_VCPUS_USED
         expected = fake.fake_available_resources()
-        response = hostops.get_available_resource()
+        response = host_facts.get_available_resource()
         self.assertEqual(1, mock_host_info.call_count)
-        self.assertEqual(1, mock_cpu_info.call_count)
+        mock_cpu_info.assert_called_once_with(fake.fake_host_info())
         self.assertEqual(1, mock_hdd_info.call_count)
         mock_json_utils.assert_has_calls(mock.call(mock.sentinel.cpu_info))
         for key, value in expected.items():
             self.assertEqual(value, response[key])
 
+    @mock.patch('nova.virt.virtualbox.hostops._get_vcpus_used')
+    @mock.patch('nova.virt.virtualbox.hostops._get_hypervisor_version')
+    @mock.patch('nova.virt.virtualbox.hostops._get_local_hdd_info_gb')
+    @mock.patch('nova.virt.virtualbox.hostutils.get_cpus_info')
+    @mock.patch('nova.virt.virtualbox.vmutils.get_host_info')
+    def test_get_available_resource_cached(self, mock_host_info,
+                                           mock_cpu_info, mock_hdd_info,
+                                           mock_version, mock_vcpus_used):
+        host_facts = hostops.HostFacts()
+        host_info = fake.fake_host_info()
+        updated_host_info = dict(host_info)
+        updated_host_info[constants.HOST_MEMORY_AVAILABLE] = 1024
+        mock_host_info.side_effect = [host_info, updated_host_info]
+        mock_cpu_info.return_value = {}
+        mock_hdd_info.return_value = (fake.FAKE_TOTAL, fake.FAKE_FREE,
+                                      fake.FAKE_USED)
+        mock_vcpus_used.return_value = 0
+
+        host_facts.load()
+        first = host_facts.get_available_resource()
+        self.assertEqual(1, mock_host_info.call_count)
+        second = host_facts.get_available_resource()
+
+        self.assertEqual(2, mock_host_info.call_count)
+        mock_version.assert_called_once_with()
+        self.assertEqual(1, mock_cpu_info.call_count)
+        self.assertEqual(2, mock_hdd_info.call_count)
+        self.assertEqual(fake.FAKE_HOST_MEMORY_SIZE - 1024,
+                         second['memory_mb_used'])
+        self.assertEqual(first['cpu_info'], second['cpu_info'])
+
     @mock.patch('nova.virt.virtualbox.hostutils.get_local_ips')
     def test_get_host_ip_address(self, mock_local_ips):
         mock_local_ips.return_value = [mock.sentinel.ip]
@@ -31,13 +31,11 @@ class HostUtilsTestCase(test.NoDBTestCase):
     _FAKE_FREE = 400000
     _FAKE_USED = _FAKE_TOTAL - _FAKE_FREE
 
-    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list')
     @mock.patch('nova.virt.virtualbox.vmutils.get_host_info')
-    def test_get_cpus_info(self, mock_host_info, mock_list):
-        mock_host_info.return_value = fake.fake_host_info()
-        mock_list.return_value = "{cpu_desc_key}: {cpu_model}".format(
-            cpu_desc_key=constants.HOST_FIRST_CPU_DESCRIPTION,
-            cpu_model=self._FAKE_MODEL)
+    def test_get_cpus_info(self, mock_host_info):
+        host_info = fake.fake_host_info()
+        host_info[constants.HOST_FIRST_CPU_DESCRIPTION] = self._FAKE_MODEL
+        mock_host_info.return_value = host_info
         expected_topology = {
             'sockets': fake.FAKE_HOST_PROCESSOR_COUNT,
             'cores': fake.FAKE_HOST_PROCESSOR_CORE_COUNT,
@@ -46,10 +44,20 @@ class HostUtilsTestCase(test.NoDBTestCase):
         }
         cpu_info = hostutils.get_cpus_info()
 
+        mock_host_info.assert_called_once_with()
         self.assertEqual(self._FAKE_VENDOR, cpu_info['vendor'])
         self.assertEqual(self._FAKE_MODEL, cpu_info['model'])
         self.assertEqual(expected_topology, cpu_info['topology'])
 
+    @mock.patch('nova.virt.virtualbox.vmutils.get_host_info')
+    def test_get_cpus_info_from_host_info(self, mock_host_info):
+        cpu_info = hostutils.get_cpus_info(fake.fake_host_info())
+
+        self.assertFalse(mock_host_info.called)
+        self.assertIsNone(cpu_info['model'])
+        self.assertEqual(fake.FAKE_HOST_PROCESSOR_COUNT,
+                         cpu_info['topology']['sockets'])
+
     @mock.patch('os.statvfs')
     @mock.patch('platform.system')
     def test_disk_usage_linux(self, mock_system, mock_statvfs):
@@ -13,8 +13,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
+import zlib
+
+import fixtures
 import mock
+from oslo_utils import units
+import six
 
+from nova import exception
 from nova import test
 from nova.tests.unit import fake_instance
 from nova.virt.virtualbox import constants
@@ -42,69 +49,601 @@ class ImageCacheTestCase(test.NoDBTestCase):
         self._instance = fake_instance.fake_instance_obj(self._context,
                                                          **instance_values)
 
+    @mock.patch('os.rename')
     @mock.patch('nova.virt.virtualbox.vhdutils.check_disk_uuid')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.set_vhd_uuid')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.clone_hd')
-    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
     @mock.patch('nova.virt.images.fetch')
-    def test_fetch_image(self, mock_fetch, mock_disk_info, mock_clone_hd,
-                         mock_close_medium, mock_check_uuid):
+    def test_fetch_native_image(self, mock_fetch, mock_disk_info,
+                                mock_clone_hd, mock_close_medium,
+                                mock_set_uuid, mock_check_uuid, mock_rename):
         mock_disk_info.return_value = {
-            constants.VHD_IMAGE_TYPE: constants.DISK_FORMAT_VDI
+            constants.VHD_IMAGE_TYPE: constants.DISK_FORMAT_VMDK
         }
         disk_path = (self._FAKE_IMAGE_PATH + '.' +
-                     constants.DISK_FORMAT_VDI.lower())
+                     constants.DISK_FORMAT_VMDK.lower())
 
-        imagecache._fetch_image(self._context, self._instance,
-                                self._FAKE_IMAGE_PATH)
+        response = imagecache._fetch_native_image(
+            self._context, self._instance, self._FAKE_IMAGE_PATH)
 
+        self.assertEqual(disk_path, response)
         mock_disk_info.assert_called_once_with(self._FAKE_IMAGE_PATH)
         mock_fetch.assert_called_once_with(
             self._context, self._instance.image_ref, self._FAKE_IMAGE_PATH,
             self._instance.user_id, self._instance.project_id)
+        self.assertFalse(mock_clone_hd.called)
+        mock_close_medium.assert_called_once_with(
+            constants.MEDIUM_DISK, self._FAKE_IMAGE_PATH)
+        mock_rename.assert_called_once_with(self._FAKE_IMAGE_PATH, disk_path)
+        mock_set_uuid.assert_called_once_with(disk_path)
+        mock_check_uuid.assert_called_once_with(self._FAKE_IMAGE_PATH)
+
+    @mock.patch('nova.virt.virtualbox.vhdutils.check_disk_uuid')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.clone_hd')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
+    @mock.patch('nova.virt.images.fetch')
+    def test_fetch_native_image_convert(self, mock_fetch, mock_disk_info,
+                                        mock_clone_hd, mock_close_medium,
+                                        mock_check_uuid):
+        mock_disk_info.return_value = {constants.VHD_IMAGE_TYPE: 'QCOW'}
+        disk_path = (self._FAKE_IMAGE_PATH + '.' +
+                     constants.DEFAULT_DISK_FORMAT.lower())
+
+        response = imagecache._fetch_native_image(
+            self._context, self._instance, self._FAKE_IMAGE_PATH)
+
+        self.assertEqual(disk_path, response)
         mock_clone_hd.assert_called_once_with(
             self._FAKE_IMAGE_PATH, disk_path,
-            disk_format=constants.DISK_FORMAT_VDI)
+            disk_format=constants.DEFAULT_DISK_FORMAT)
         mock_close_medium.assert_called_once_with(
             constants.MEDIUM_DISK, self._FAKE_IMAGE_PATH, delete=True)
-        mock_check_uuid.assert_called_once_with(self._FAKE_IMAGE_PATH)
 
     @mock.patch('os.path.exists')
     @mock.patch('nova.virt.virtualbox.vhdutils.check_disk_uuid')
     @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.clone_hd')
-    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
     @mock.patch('nova.virt.images.fetch')
-    def test_fetch_image_fail(self, mock_fetch, mock_disk_info, mock_clone_hd,
-                              mock_close_medium, mock_delete_path,
-                              mock_check_uuid, mock_exists):
+    def test_fetch_native_image_fail(self, mock_fetch, mock_disk_info,
+                                     mock_clone_hd, mock_close_medium,
+                                     mock_delete_path, mock_check_uuid,
+                                     mock_exists):
         mock_exists.return_value = True
-        mock_disk_info.return_value = {
-            constants.VHD_IMAGE_TYPE: constants.DISK_FORMAT_VDI
-        }
+        mock_disk_info.return_value = {constants.VHD_IMAGE_TYPE: 'QCOW'}
         mock_clone_hd.side_effect = [vbox_exc.VBoxException("err")]
 
-        self.assertRaises(vbox_exc.VBoxException, imagecache._fetch_image,
+        self.assertRaises(vbox_exc.VBoxException,
+                          imagecache._fetch_native_image,
                           self._context, self._instance,
                           self._FAKE_IMAGE_PATH)
         self.assertEqual(2, mock_delete_path.call_count)
         mock_check_uuid.assert_called_once_with(self._FAKE_IMAGE_PATH)
 
+    @mock.patch('os.path.exists')
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
+    @mock.patch('nova.virt.virtualbox.vhdutils.check_disk_uuid')
+    @mock.patch('nova.virt.images.fetch')
+    def test_fetch_native_image_fail_cleanup(self, mock_fetch,
+                                             mock_check_uuid,
+                                             mock_close_medium,
+                                             mock_delete_path, mock_exists):
+        mock_exists.return_value = True
+        mock_check_uuid.side_effect = exception.NovaException("fake-error")
+        mock_close_medium.side_effect = vbox_exc.VBoxException("err")
+
+        exc = self.assertRaises(exception.NovaException,
+                                imagecache._fetch_native_image,
+                                self._context, self._instance,
+                                self._FAKE_IMAGE_PATH)
+
+        # The original error is raised even if the cleanup fails.
+        self.assertEqual("fake-error", six.text_type(exc))
+        mock_delete_path.assert_called_once_with(self._FAKE_IMAGE_PATH)
+
+    @mock.patch('nova.virt.virtualbox.imagecache._fetch_native_image')
+    @mock.patch('nova.virt.virtualbox.imagecache._fetch_qemu_image')
+    @mock.patch('nova.virt.virtualbox.imagecache._stream_raw_image')
+    @mock.patch('nova.virt.images.get_info')
+    def test_fetch_image(self, mock_get_info, mock_stream_raw,
+                         mock_fetch_qemu, mock_fetch_native):
+        mock_get_info.side_effect = [
+            {"disk_format": "raw", "size": 1024},
+            {"disk_format": "raw", "size": 0},
+            {"disk_format": "qcow2", "checksum": "fake-checksum"},
+            {"disk_format": "vdi", "checksum": "fake-checksum"},
+        ]
+        for _ in range(4):
+            imagecache._fetch_image(self._context, self._instance,
+                                    self._FAKE_IMAGE_PATH,
+                                    mock.sentinel.rate_limiter)
+
+        mock_stream_raw.assert_called_once_with(
+            self._context, self._instance, {"disk_format": "raw",
+                                            "size": 1024},
+            self._FAKE_IMAGE_PATH, mock.sentinel.rate_limiter)
+        # The raw images without size are converted by qemu-img.
+        mock_fetch_qemu.assert_has_calls([
+            mock.call(self._context, self._instance, self._FAKE_IMAGE_PATH,
+                      mock.sentinel.rate_limiter, None),
+            mock.call(self._context, self._instance, self._FAKE_IMAGE_PATH,
+                      mock.sentinel.rate_limiter, "fake-checksum")])
+        mock_fetch_native.assert_called_once_with(
+            self._context, self._instance, self._FAKE_IMAGE_PATH,
+            mock.sentinel.rate_limiter, checksum="fake-checksum")
+
+    def _test_stream_raw_image(self, checksum, rate_limiter=None):
+        image_info = {"size": 6, "checksum": checksum}
+        disk_path = (self._FAKE_IMAGE_PATH + '.' +
+                     constants.DEFAULT_DISK_FORMAT.lower())
+
+        def convert_from_raw(source, *args):
+            self.assertEqual(["abc", "def"], list(source))
+
+        with mock.patch.multiple(
+                'nova.virt.virtualbox.manage.VBoxManage',
+                convert_from_raw=mock.DEFAULT) as vbox_manage, \
+                mock.patch('nova.virt.images.IMAGE_API') as mock_image_api, \
+                mock.patch('os.rename') as mock_rename, \
+                mock.patch('os.unlink') as mock_unlink:
+            mock_image_api.download.return_value = iter(["abc", "def"])
+            vbox_manage["convert_from_raw"].side_effect = convert_from_raw
+            try:
+                response = imagecache._stream_raw_image(
+                    self._context, self._instance, image_info,
+                    self._FAKE_IMAGE_PATH, rate_limiter)
+            finally:
+                mock_image_api.download.assert_called_once_with(
+                    self._context, self._instance.image_ref)
+                vbox_manage["convert_from_raw"].assert_called_once_with(
+                    mock.ANY, self._FAKE_IMAGE_PATH, 6,
+                    constants.DEFAULT_DISK_FORMAT)
+
+            mock_rename.assert_called_once_with(self._FAKE_IMAGE_PATH,
+                                                disk_path)
+            self.assertFalse(mock_unlink.called)
+            return response
+
+    def test_stream_raw_image(self):
+        # md5("abcdef")
+        self.assertEqual(
+            self._FAKE_IMAGE_PATH + '.' +
+            constants.DEFAULT_DISK_FORMAT.lower(),
+            self._test_stream_raw_image("e80b5017098950fc58aad83c8c14978e"))
+
+    def test_stream_raw_image_rate_limit(self):
+        rate_limiter = mock.Mock()
+
+        self._test_stream_raw_image("e80b5017098950fc58aad83c8c14978e",
+                                    rate_limiter)
+
+        self.assertEqual([mock.call(3), mock.call(3)],
+                         rate_limiter.consume.call_args_list)
+
+    @mock.patch('os.unlink')
+    def test_stream_raw_image_checksum_mismatch(self, mock_unlink):
+        self.assertRaises(exception.ImageUnacceptable,
+                          self._test_stream_raw_image, "fake-checksum")
+
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch('os.rename')
+    @mock.patch('nova.virt.images.convert_image')
+    @mock.patch('nova.virt.images.qemu_img_info')
+    @mock.patch('nova.virt.images.fetch')
+    def test_fetch_qemu_image(self, mock_fetch, mock_img_info, mock_convert,
+                              mock_rename, mock_delete_path):
+        mock_img_info.return_value.backing_file = None
+        disk_path = (self._FAKE_IMAGE_PATH + '.' +
+                     constants.DEFAULT_DISK_FORMAT.lower())
+        part_path = self._FAKE_IMAGE_PATH + '.part'
+
+        response = imagecache._fetch_qemu_image(
+            self._context, self._instance, self._FAKE_IMAGE_PATH)
+
+        self.assertEqual(disk_path, response)
+        mock_fetch.assert_called_once_with(
+            self._context, self._instance.image_ref, self._FAKE_IMAGE_PATH,
+            self._instance.user_id, self._instance.project_id)
+        mock_convert.assert_called_once_with(
+            self._FAKE_IMAGE_PATH, part_path,
+            constants.DEFAULT_DISK_FORMAT.lower())
+        mock_rename.assert_called_once_with(part_path, disk_path)
+        mock_delete_path.assert_called_once_with(self._FAKE_IMAGE_PATH)
+
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch('nova.virt.images.convert_image')
+    @mock.patch('nova.virt.images.qemu_img_info')
+    @mock.patch('nova.virt.images.fetch')
+    def test_fetch_qemu_image_backing_file(self, mock_fetch, mock_img_info,
+                                          mock_convert, mock_delete_path):
+        mock_img_info.return_value.backing_file = mock.sentinel.backing_file
+
+        self.assertRaises(exception.ImageUnacceptable,
+                          imagecache._fetch_qemu_image, self._context,
+                          self._instance, self._FAKE_IMAGE_PATH)
+        self.assertFalse(mock_convert.called)
+        mock_delete_path.assert_called_once_with(self._FAKE_IMAGE_PATH)
+
+    @mock.patch('nova.virt.images.IMAGE_API')
+    @mock.patch('nova.virt.images.fetch')
+    def test_download_rate_limit(self, mock_fetch, mock_image_api):
+        rate_limiter = mock.Mock()
+        mock_image_api.download.return_value = iter(["abc", "de"])
+        image_path = os.path.join(self.useFixture(
+            fixtures.TempDir()).path, "image")
+
+        imagecache._download(self._context, self._instance, image_path,
+                             rate_limiter)
+
+        self.assertFalse(mock_fetch.called)
+        self.assertEqual([mock.call(3), mock.call(2)],
+                         rate_limiter.consume.call_args_list)
+        with open(image_path) as image_file:
+            self.assertEqual("abcde", image_file.read())
+
+    @mock.patch('nova.virt.images.IMAGE_API')
+    @mock.patch('nova.virt.images.fetch')
+    def test_download_compressed(self, mock_fetch, mock_image_api):
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                      zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data = compressor.compress(b"abcde" * 100) + compressor.flush()
+        mock_image_api.download.return_value = iter([data[:10], data[10:]])
+        image_path = os.path.join(self.useFixture(
+            fixtures.TempDir()).path, "image")
+
+        imagecache._download(self._context, self._instance, image_path,
+                             compression=constants.COMPRESSION_GZIP)
+
+        self.assertFalse(mock_fetch.called)
+        with open(image_path, "rb") as image_file:
+            self.assertEqual(b"abcde" * 100, image_file.read())
+
+    @mock.patch('nova.virt.images.IMAGE_API')
+    @mock.patch('nova.virt.images.fetch')
+    def test_download_checksum(self, mock_fetch, mock_image_api):
+        image_path = os.path.join(self.useFixture(
+            fixtures.TempDir()).path, "image")
+        mock_image_api.download.side_effect = lambda *args: iter(
+            ["abc", "def"])
+
+        # md5("abcdef")
+        imagecache._download(self._context, self._instance, image_path,
+                             checksum="e80b5017098950fc58aad83c8c14978e")
+        self.assertTrue(os.path.exists(image_path))
+
+        self.assertRaises(exception.ImageUnacceptable, imagecache._download,
+                          self._context, self._instance, image_path,
+                          checksum="fake-checksum")
+        # The image which does not match the checksum is removed.
+        self.assertFalse(os.path.exists(image_path))
+        self.assertFalse(mock_fetch.called)
+
+    @mock.patch('nova.virt.virtualbox.imagecache._fetch_native_image')
+    @mock.patch('nova.virt.images.get_info')
+    def test_fetch_image_compressed(self, mock_get_info, mock_fetch_native):
+        properties = {constants.IMAGE_PROPERTY_COMPRESSION:
+                      constants.COMPRESSION_GZIP}
+        mock_get_info.side_effect = [
+            {"disk_format": "vdi", "properties": properties},
+            {"disk_format": "raw", "size": 1024, "properties": properties},
+            {"disk_format": "vdi", "properties": {
+                constants.IMAGE_PROPERTY_COMPRESSION: "fake-compression"}},
+        ]
+
+        imagecache._fetch_image(self._context, self._instance,
+                                self._FAKE_IMAGE_PATH)
+        for _ in range(2):
+            self.assertRaises(exception.ImageUnacceptable,
+                              imagecache._fetch_image, self._context,
+                              self._instance, self._FAKE_IMAGE_PATH)
+
+        mock_fetch_native.assert_called_once_with(
+            self._context, self._instance, self._FAKE_IMAGE_PATH, None,
+            constants.COMPRESSION_GZIP, None)
+
+    @mock.patch('nova.virt.virtualbox.imagecache._fetch_differencing_image')
+    @mock.patch('nova.virt.images.get_info')
+    def test_fetch_image_differencing(self, mock_get_info,
+                                      mock_fetch_differencing):
+        mock_get_info.return_value = {"disk_format": "vdi", "properties": {
+            constants.IMAGE_PROPERTY_PARENT: mock.sentinel.parent_ref,
+            constants.IMAGE_PROPERTY_COMPRESSION: constants.COMPRESSION_GZIP,
+        }}
+
+        response = imagecache._fetch_image(
+            self._context, self._instance, self._FAKE_IMAGE_PATH,
+            mock.sentinel.rate_limiter)
+
+        self.assertEqual(mock_fetch_differencing.return_value, response)
+        mock_fetch_differencing.assert_called_once_with(
+            self._context, self._instance, self._FAKE_IMAGE_PATH,
+            mock.sentinel.parent_ref, mock.sentinel.rate_limiter,
+            constants.COMPRESSION_GZIP, None)
+
+    @mock.patch('os.rename')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.'
+                'set_disk_parent_uuid')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.set_vhd_uuid')
+    @mock.patch('nova.virt.virtualbox.imagecache._download')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
+    @mock.patch('nova.virt.virtualbox.imagecache.get_cached_image')
+    def test_fetch_differencing_image(self, mock_get_cached_image,
+                                      mock_get_disk, mock_download,
+                                      mock_set_uuid, mock_set_parent_uuid,
+                                      mock_rename):
+        mock_get_disk.return_value = {
+            constants.VHD_UUID: mock.sentinel.parent_uuid}
+        disk_path = (self._FAKE_IMAGE_PATH + '.' +
+                     constants.DISK_FORMAT_VDI.lower())
+
+        response = imagecache._fetch_differencing_image(
+            self._context, self._instance, self._FAKE_IMAGE_PATH,
+            'fake-parent-ref', mock.sentinel.rate_limiter,
+            mock.sentinel.compression)
+
+        self.assertEqual(disk_path, response)
+        parent = mock_get_cached_image.call_args[0][1]
+        self.assertEqual(('fake-parent-ref', 'fake_user_id',
+                          'fake_project_id'),
+                         (parent.image_ref, parent.user_id,
+                          parent.project_id))
+        mock_get_disk.assert_has_calls([
+            mock.call(mock_get_cached_image.return_value),
+            mock.call(disk_path)])
+        mock_download.assert_called_once_with(
+            self._context, self._instance, self._FAKE_IMAGE_PATH,
+            mock.sentinel.rate_limiter, mock.sentinel.compression, None)
+        mock_set_uuid.assert_called_once_with(self._FAKE_IMAGE_PATH)
+        mock_set_parent_uuid.assert_called_once_with(
+            self._FAKE_IMAGE_PATH, mock.sentinel.parent_uuid)
+        mock_rename.assert_called_once_with(self._FAKE_IMAGE_PATH, disk_path)
+
+    @mock.patch('os.utime')
     @mock.patch('os.path.exists')
     @mock.patch('os.path.join')
     @mock.patch('nova.utils.synchronized')
     @mock.patch('nova.virt.virtualbox.pathutils.create_path')
     def test_get_cached_image(self, mock_create_path, mock_synchronized,
-                              mock_join, mock_exists):
+                              mock_join, mock_exists, mock_utime):
         mock_join.return_value = self._FAKE_BASE_PATH
         mock_exists.side_effect = ([False] * len(constants.ALL_DISK_FORMATS) +
                                    [True])
-        imagecache.get_cached_image(self._context, self._instance)
+        imagecache.get_cached_image(self._context, self._instance,
+                                    mock.sentinel.rate_limiter)
         mock_synchronized.assert_called_once_with(self._FAKE_BASE_PATH)
         mock_synchronized().assert_called_once_with(imagecache._fetch_image)
+        mock_synchronized()().assert_called_once_with(
+            self._context, self._instance, self._FAKE_BASE_PATH,
+            mock.sentinel.rate_limiter)
         mock_synchronized.reset_mock()
 
         imagecache.get_cached_image(self._context, self._instance)
         self.assertEqual(0, mock_synchronized.call_count)
         self.assertEqual(2, mock_create_path.call_count)
+        mock_utime.assert_called_once_with(
+            self._FAKE_BASE_PATH + '.' +
+            constants.ALL_DISK_FORMATS[0].lower(), None)
+
+    @mock.patch('os.utime')
+    @mock.patch('os.path.exists')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.create_hd')
+    @mock.patch('nova.virt.virtualbox.pathutils.ephemeral_template_path')
+    def test_get_ephemeral_template(self, mock_template_path, mock_create_hd,
+                                    mock_exists, mock_utime):
+        mock_template_path.return_value = self._FAKE_BASE_PATH
+        mock_exists.side_effect = [False, False, True]
+
+        for _ in range(2):
+            response = imagecache.get_ephemeral_template(
+                10, constants.DISK_FORMAT_VDI)
+            self.assertEqual(self._FAKE_BASE_PATH, response)
+
+        mock_template_path.assert_called_with(10, constants.DISK_FORMAT_VDI)
+        mock_create_hd.assert_called_once_with(
+            filename=self._FAKE_BASE_PATH, size=10 * units.Ki,
+            disk_format=constants.DISK_FORMAT_VDI,
+            variant=constants.VARIANT_STANDARD)
+        mock_utime.assert_called_once_with(self._FAKE_BASE_PATH, None)
+
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch('os.path.exists')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.create_hd')
+    @mock.patch('nova.virt.virtualbox.pathutils.ephemeral_template_path')
+    def test_get_ephemeral_template_fail(self, mock_template_path,
+                                         mock_create_hd, mock_close_medium,
+                                         mock_exists, mock_delete_path):
+        mock_template_path.return_value = self._FAKE_BASE_PATH
+        mock_exists.side_effect = [False, False, True]
+        mock_create_hd.side_effect = vbox_exc.VBoxException(details='err')
+
+        self.assertRaises(vbox_exc.VBoxException,
+                          imagecache.get_ephemeral_template, 10)
+
+        mock_close_medium.assert_called_once_with(constants.MEDIUM_DISK,
+                                                  self._FAKE_BASE_PATH)
+        mock_delete_path.assert_called_once_with(self._FAKE_BASE_PATH)
+
+
+class ImageCacheManagerTestCase(test.NoDBTestCase):
+
+    _FAKE_BASE_DIR = 'fake-base-dir'
+
+    def setUp(self):
+        super(ImageCacheManagerTestCase, self).setUp()
+        self._context = 'fake-context'
+        self._manager = imagecache.ImageCacheManager()
+
+    @staticmethod
+    def _image(image_ref, size, last_used):
+        return {"image_ref": image_ref, "path": image_ref + ".vdi",
+                "size": size, "last_used": last_used}
+
+    @mock.patch('os.path.getmtime')
+    @mock.patch('os.path.getsize')
+    @mock.patch('os.path.isfile')
+    @mock.patch('os.listdir')
+    def test_list_base_images(self, mock_listdir, mock_isfile, mock_getsize,
+                              mock_getmtime):
+        mock_listdir.return_value = ['image.vdi', 'fetching', 'image.txt']
+        mock_isfile.return_value = True
+        mock_getsize.return_value = mock.sentinel.size
+        mock_getmtime.return_value = mock.sentinel.last_used
+
+        response = self._manager._list_base_images(self._FAKE_BASE_DIR)
+
+        self.assertEqual([{
+            "image_ref": "image",
+            "path": os.path.join(self._FAKE_BASE_DIR, "image.vdi"),
+            "size": mock.sentinel.size,
+            "last_used": mock.sentinel.last_used,
+        }], response["originals"])
+
+    @mock.patch('time.time')
+    @mock.patch.object(imagecache.ImageCacheManager, '_remove_base_image')
+    @mock.patch.object(imagecache.ImageCacheManager, '_list_base_images')
+    @mock.patch.object(imagecache.ImageCacheManager,
+                       '_list_running_instances')
+    def _test_age_and_verify(self, mock_running, mock_base_images,
+                             mock_remove, mock_time, max_size=0,
+                             keep_images=None, instances=(),
+                             extra_images=()):
+        self.flags(image_cache_max_size=max_size, group='virtualbox')
+        self.flags(remove_unused_original_minimum_age_seconds=100)
+        mock_time.return_value = 1000
+        mock_running.return_value = {
+            "used_images": {"used": (1, 0, ["fake-instance"]),
+                            "remote": (0, 1, ["fake-remote-instance"])}}
+        mock_base_images.return_value = {"originals": [
+            self._image("recent", 2 * units.Mi, 990),
+            self._image("used", 4 * units.Mi, 100),
+            self._image("remote", units.Mi, 950),
+            self._image("expired", units.Mi, 500),
+        ] + list(extra_images)}
+        mock_remove.return_value = True
+
+        self._manager._age_and_verify_cached_images(
+            self._context, instances, self._FAKE_BASE_DIR, keep_images)
+
+        return [mock_call[0][0]["image_ref"]
+                for mock_call in mock_remove.call_args_list]
+
+    def test_age_and_verify(self):
+        self.assertEqual(["expired"], self._test_age_and_verify())
+
+    def test_age_and_verify_max_size(self):
+        self.assertEqual(["expired", "remote"],
+                         self._test_age_and_verify(max_size=6))
+        self.assertEqual(["expired", "remote", "recent"],
+                         self._test_age_and_verify(max_size=4))
+
+    def test_age_and_verify_keep_images(self):
+        self.assertEqual(["remote"], self._test_age_and_verify(
+            max_size=4, keep_images=["expired", "recent"]))
+
+    def test_age_and_verify_ephemeral_templates(self):
+        self.flags(host='fake-host')
+        instances = [
+            fake_instance.fake_instance_obj(
+                self._context, host='fake-host', ephemeral_gb=10),
+            fake_instance.fake_instance_obj(
+                self._context, host='fake-other-host', ephemeral_gb=20),
+            fake_instance.fake_instance_obj(
+                self._context, host='fake-host', ephemeral_gb=0),
+        ]
+        extra_images = [self._image("ephemeral-10G", units.Mi, 100),
+                        self._image("ephemeral-20G", units.Mi, 200)]
+
+        self.assertEqual(["ephemeral-20G", "expired"],
+                         self._test_age_and_verify(
+                             instances=instances, extra_images=extra_images))
+
+    @mock.patch('os.path.getmtime')
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk_children')
+    @mock.patch('nova.virt.virtualbox.vhdutils.is_registered')
+    def test_remove_base_image(self, mock_registered, mock_children,
+                               mock_close_medium, mock_delete_path,
+                               mock_getmtime):
+        mock_getmtime.return_value = 0
+        image = self._image("fake-image", units.Mi, 0)
+        mock_registered.return_value = True
+        mock_children.side_effect = [[mock.sentinel.child], []]
+
+        self.assertFalse(self._manager._remove_base_image(image))
+        self.assertTrue(self._manager._remove_base_image(image))
+
+        mock_close_medium.assert_called_once_with(
+            constants.MEDIUM_DISK, image["path"], delete=True)
+        mock_delete_path.assert_called_once_with(image["path"])
+
+    @mock.patch('os.path.getmtime')
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk_children')
+    @mock.patch('nova.virt.virtualbox.vhdutils.is_registered')
+    def test_remove_base_image_unregistered(self, mock_registered,
+                                            mock_children, mock_close_medium,
+                                            mock_delete_path, mock_getmtime):
+        mock_getmtime.return_value = 0
+        image = self._image("fake-image", units.Mi, 0)
+        mock_registered.return_value = False
+
+        self.assertTrue(self._manager._remove_base_image(image))
+
+        self.assertFalse(mock_children.called)
+        self.assertFalse(mock_close_medium.called)
+        mock_delete_path.assert_called_once_with(image["path"])
+
+    @mock.patch('os.path.getmtime')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
+    @mock.patch('nova.virt.virtualbox.vhdutils.is_registered')
+    def test_remove_base_image_fail(self, mock_registered, mock_close_medium,
+                                    mock_getmtime):
+        mock_getmtime.return_value = 0
+        mock_registered.side_effect = [False, True]
+        mock_close_medium.side_effect = vbox_exc.VBoxException(details='err')
+
+        self.assertFalse(self._manager._remove_base_image(
+            self._image("fake-image", units.Mi, 0)))
+
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch.object(imagecache.ImageCacheManager, '_has_children')
+    def test_remove_base_image_used_after_scan(self, mock_has_children,
+                                               mock_delete_path):
+        base_dir = self.useFixture(fixtures.TempDir()).path
+        path = os.path.join(base_dir, "fake-image.vdi")
+        with open(path, "w") as image_file:
+            image_file.write("fake-image")
+        os.utime(path, (0, 0))
+        image = self._manager._list_base_images(base_dir)["originals"][0]
+
+        os.utime(path, None)
+        self.assertFalse(self._manager._remove_base_image(image))
+
+        os.remove(path)
+        self.assertFalse(self._manager._remove_base_image(image))
+
+        self.assertFalse(mock_has_children.called)
+        self.assertFalse(mock_delete_path.called)
+
+    @mock.patch('os.path.isdir')
+    @mock.patch.object(imagecache.ImageCacheManager,
+                       '_age_and_verify_cached_images')
+    def test_update(self, mock_age_and_verify, mock_isdir):
+        mock_isdir.side_effect = [False, True]
+
+        self._manager.update(self._context, mock.sentinel.instances)
+        self.assertFalse(mock_age_and_verify.called)
+
+        self._manager.update(self._context, mock.sentinel.instances,
+                             mock.sentinel.keep_images)
+        mock_age_and_verify.assert_called_once_with(
+            self._context, mock.sentinel.instances, mock.ANY,
+            mock.sentinel.keep_images)
@@ -0,0 +1,124 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from nova import test
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import instrumentation
+
+
+class InstrumentationTestCase(test.NoDBTestCase):
+
+    def test_error_class(self):
+        self.assertIsNone(instrumentation.error_class(None))
+        self.assertIsNone(instrumentation.error_class(
+            "0%...50%..." + constants.DONE))
+        self.assertEqual(constants.VBOX_E_FILE_ERROR,
+                         instrumentation.error_class(
+                             "VBoxManage: error: Details: code %s (0x80bb0004)"
+                             % constants.VBOX_E_FILE_ERROR))
+        self.assertEqual(instrumentation.OTHER_ERROR,
+                         instrumentation.error_class("VBoxManage: error"))
+
+    @mock.patch('nova.virt.virtualbox.instrumentation.time')
+    def test_operation_timer(self, mock_time):
+        mock_time.time.side_effect = [0, 1, 3, 4, 4.5, 10, 10]
+
+        with instrumentation.timed_operation("fake-operation") as timer:
+            with instrumentation.phase("fake-phase"):
+                pass
+            with instrumentation.phase("fake-phase"):
+                pass
+
+        self.assertEqual([("fake-phase", 2), ("fake-phase", 0.5)],
+                         timer.phases)
+        self.assertEqual({"fake-phase": 2.5, "total": 10},
+                         timer.breakdown())
+
+    def test_phase_no_operation(self):
+        with instrumentation.phase("fake-phase"):
+            pass
+
+        self.assertIsNone(getattr(instrumentation._LOCAL, "timer", None))
+
+    def test_use_timer(self):
+        timer = instrumentation.OperationTimer("fake-operation")
+
+        with instrumentation.use_timer(timer):
+            self.assertIs(timer, instrumentation.current_timer())
+            with instrumentation.phase("fake-phase"):
+                pass
+
+        self.assertIsNone(instrumentation.current_timer())
+        self.assertEqual(["fake-phase"],
+                         [name for name, _ in timer.phases])
+
+
+class CommandMetricsTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(CommandMetricsTestCase, self).setUp()
+        self._metrics = instrumentation.CommandMetrics()
+
+    def test_record(self):
+        self._metrics.record("showvminfo", 0.01, stdout="fake-output")
+        self._metrics.record("showvminfo", 200, retries=2,
+                             stderr=constants.VBOX_E_ACCESSDENIED)
+
+        stats = self._metrics.stats()["showvminfo"]
+        self.assertEqual(2, stats["count"])
+        self.assertEqual(2, stats["retries"])
+        self.assertEqual(200, stats["max_time"])
+        self.assertEqual(len("fake-output"), stats["stdout_bytes"])
+        self.assertEqual({constants.VBOX_E_ACCESSDENIED: 1}, stats["errors"])
+        self.assertEqual(1, stats["histogram"]["0.05"])
+        self.assertEqual(1, stats["histogram"]["+Inf"])
+
+        self._metrics.reset()
+        self.assertEqual({}, self._metrics.stats())
+
+    def test_summary(self):
+        self._metrics.record("list", 1)
+        self._metrics.record("list", 3, retries=1,
+                             stderr=constants.VBOX_E_ACCESSDENIED)
+
+        self.assertEqual({"vboxmanage_list_calls": 2,
+                          "vboxmanage_list_retries": 1,
+                          "vboxmanage_list_errors": 1,
+                          "vboxmanage_list_average_time": 2,
+                          "vboxmanage_list_max_time": 3},
+                         self._metrics.summary())
+
+    @mock.patch('nova.openstack.common.loopingcall.FixedIntervalLoopingCall')
+    def test_start(self, mock_looping_call):
+        metrics = instrumentation.CommandMetrics(log_interval=10)
+
+        for _ in range(2):
+            metrics.start()
+            metrics.record("list", 1)
+
+        mock_looping_call.assert_called_once_with(metrics.dump)
+        mock_looping_call.return_value.start.assert_called_once_with(
+            interval=10, initial_delay=10)
+
+        metrics.stop()
+        mock_looping_call.return_value.stop.assert_called_once_with()
+
+    @mock.patch('nova.openstack.common.loopingcall.FixedIntervalLoopingCall')
+    def test_start_disabled(self, mock_looping_call):
+        self._metrics.start()
+
+        self.assertFalse(mock_looping_call.called)
@@ -0,0 +1,386 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import socket
+
+import fixtures
+import mock
+
+from nova import exception
+from nova import test
+from nova.tests.unit import fake_instance
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import livemigrationops
+from nova.virt.virtualbox import manage
+from nova.virt.virtualbox import vminfo
+
+
+class TeleporterAllocatorTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(TeleporterAllocatorTestCase, self).setUp()
+        self._allocator = livemigrationops.TeleporterAllocator()
+        self._instances = [
+            fake_instance.fake_instance_obj('fake-context', name=name,
+                                            uuid=name)
+            for name in ('instance-1', 'instance-2', 'instance-3')]
+
+    def test_get_ports(self):
+        self.flags(teleporter_port='6005,6000-6002,invalid',
+                   group='virtualbox')
+
+        self.assertEqual([6000, 6001, 6002, 6005],
+                         livemigrationops._get_ports())
+
+    @mock.patch('nova.utils.generate_password')
+    @mock.patch.object(livemigrationops.TeleporterAllocator, '_is_free')
+    def test_allocate(self, mock_is_free, mock_generate_password):
+        self.flags(teleporter_port='6000-6002', group='virtualbox')
+        mock_is_free.side_effect = lambda port: port != 6000
+        mock_generate_password.return_value = mock.sentinel.password
+        instance1, instance2, instance3 = self._instances
+
+        self.assertEqual((6001, mock.sentinel.password),
+                         self._allocator.allocate(instance1))
+        self.assertEqual((6002, mock.sentinel.password),
+                         self._allocator.allocate(instance2))
+        self.assertRaises(vbox_exc.VBoxException,
+                          self._allocator.allocate, instance3)
+
+        self._allocator.release(instance1)
+        self.assertEqual((6001, mock.sentinel.password),
+                         self._allocator.allocate(instance3))
+
+    def test_is_free(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.bind(('', 0))
+        sock.listen(1)
+        port = sock.getsockname()[1]
+
+        self.assertFalse(self._allocator._is_free(port))
+        sock.close()
+        self.assertTrue(self._allocator._is_free(port))
+
+
+class LiveMigrationOperationsTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(LiveMigrationOperationsTestCase, self).setUp()
+        instance_values = {
+            'name': 'fake_name',
+            'uuid': 'fake_uuid',
+        }
+
+        self._context = 'fake-context'
+        self._instance = fake_instance.fake_instance_obj(self._context,
+                                                         **instance_values)
+        self._console_ops = mock.Mock()
+        self._liveops = livemigrationops.LiveMigrationOperations(
+            console_ops=self._console_ops)
+        self._liveops._allocator = mock.Mock()
+        self._liveops._allocator.allocate.return_value = (
+            6000, "fake-password")
+
+    def test_check_instance_shared_storage(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        self.flags(instances_path=path)
+
+        data = self._liveops.check_instance_shared_storage_local(
+            self._context, self._instance)
+
+        self.assertEqual(path, os.path.dirname(data["filename"]))
+        self.assertTrue(self._liveops.check_instance_shared_storage_remote(
+            self._context, data))
+        self._liveops.check_instance_shared_storage_cleanup(self._context,
+                                                            data)
+        self.assertFalse(self._liveops.check_instance_shared_storage_remote(
+            self._context, data))
+
+    def test_check_can_live_migrate_destination_block_migration(self):
+        self.assertRaises(exception.MigrationPreCheckError,
+                          self._liveops.check_can_live_migrate_destination,
+                          self._context, self._instance, {}, {},
+                          block_migration=True)
+
+    @mock.patch.object(livemigrationops.LiveMigrationOperations,
+                       'check_instance_shared_storage_remote')
+    def test_check_can_live_migrate_source(self, mock_check_remote):
+        mock_check_remote.return_value = True
+
+        response = self._liveops.check_can_live_migrate_source(
+            self._context, self._instance, {"filename": "fake-file"})
+
+        self.assertTrue(response["is_shared_instance_path"])
+        self.assertTrue(response["is_shared_block_storage"])
+
+        mock_check_remote.return_value = False
+        self.assertRaises(exception.InvalidSharedStorage,
+                          self._liveops.check_can_live_migrate_source,
+                          self._context, self._instance,
+                          {"filename": "fake-file"})
+
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
+    @mock.patch('nova.virt.virtualbox.imagecache.get_ephemeral_template')
+    @mock.patch('nova.virt.virtualbox.imagecache.get_cached_image')
+    def test_register_parent_disks(self, mock_get_cached_image,
+                                   mock_get_template, mock_get_disk):
+        self.flags(use_cow_images=True)
+        self._instance.ephemeral_gb = 1
+
+        self._liveops._register_parent_disks(
+            self._context, self._instance, mock.sentinel.root,
+            "ephemeral.vdi")
+
+        mock_get_template.assert_called_once_with(1, constants.DISK_FORMAT_VDI)
+        mock_get_disk.assert_has_calls([
+            mock.call(mock_get_cached_image.return_value),
+            mock.call(mock_get_template.return_value)])
+
+        mock_get_disk.reset_mock()
+        self.flags(use_cow_images=False)
+        self._liveops._register_parent_disks(
+            self._context, self._instance, mock.sentinel.root,
+            "ephemeral.vdi")
+        self.assertFalse(mock_get_disk.called)
+
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.storage_setup')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.create_instance')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch('nova.virt.virtualbox.pathutils.live_migration_dir')
+    @mock.patch.object(livemigrationops.LiveMigrationOperations,
+                       '_register_parent_disks')
+    @mock.patch('nova.virt.virtualbox.pathutils.lookup_ephemeral_vhd_path')
+    @mock.patch('nova.virt.virtualbox.pathutils.lookup_root_vhd_path')
+    def test_create_target_vm(self, mock_lookup_root, mock_lookup_ephemeral,
+                              mock_register_parents, mock_migration_dir,
+                              mock_delete_path, mock_execute,
+                              mock_create_instance, mock_storage_setup):
+        mock_migration_dir.return_value = 'fake-dir'
+        mock_execute.return_value = ("", "")
+        self._instance.system_metadata = {}
+
+        self._liveops._create_target_vm(
+            self._context, self._instance, mock.sentinel.network_info,
+            None, 6000, "fake-password")
+
+        mock_register_parents.assert_called_once_with(
+            self._context, self._instance, mock_lookup_root.return_value,
+            mock_lookup_ephemeral.return_value)
+        mock_migration_dir.assert_called_once_with(
+            action=constants.PATH_CREATE)
+        mock_delete_path.assert_called_once_with(
+            os.path.join('fake-dir', self._instance.name))
+        mock_create_instance.assert_called_once_with(
+            self._instance, mock.ANY, mock.sentinel.network_info,
+            overwrite=False, basefolder='fake-dir')
+        mock_execute.assert_called_once_with(
+            manage.VBoxManage.MODIFY_VM, self._instance.name,
+            constants.FIELD_TELEPORTER, constants.ON,
+            constants.FIELD_TELEPORTER_PORT, 6000,
+            constants.FIELD_TELEPORTER_PASSWORD, "fake-password")
+        mock_storage_setup.assert_called_once_with(
+            self._instance, mock_lookup_root.return_value,
+            mock_lookup_ephemeral.return_value, None)
+        self._console_ops.prepare_instance.assert_called_once_with(
+            self._instance)
+
+    @mock.patch('nova.virt.virtualbox.pathutils.lookup_root_vhd_path')
+    def test_create_target_vm_missing_root(self, mock_lookup_root):
+        mock_lookup_root.return_value = None
+
+        self.assertRaises(vbox_exc.VBoxException,
+                          self._liveops._create_target_vm,
+                          self._context, self._instance,
+                          mock.sentinel.network_info, None, 6000,
+                          "fake-password")
+
+    @mock.patch('nova.virt.virtualbox.hostops.get_host_ip_address')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.start_vm')
+    @mock.patch.object(livemigrationops.LiveMigrationOperations,
+                       '_create_target_vm')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
+    def test_pre_live_migration(self, mock_instance_exists,
+                                mock_create_target_vm, mock_start_vm,
+                                mock_get_ip):
+        mock_instance_exists.return_value = False
+        mock_get_ip.return_value = 'fake-ip'
+
+        response = self._liveops.pre_live_migration(
+            self._context, self._instance, mock.sentinel.block_device_info,
+            mock.sentinel.network_info, None)
+
+        self.assertEqual({"teleporter_host": 'fake-ip',
+                          "teleporter_port": 6000,
+                          "teleporter_password": "fake-password"}, response)
+        mock_create_target_vm.assert_called_once_with(
+            self._context, self._instance, mock.sentinel.network_info,
+            mock.sentinel.block_device_info, 6000, "fake-password")
+        mock_start_vm.assert_called_once_with(self._instance)
+        self.assertFalse(self._liveops._allocator.release.called)
+
+    @mock.patch.object(livemigrationops.LiveMigrationOperations,
+                       '_remove_vm')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.start_vm')
+    @mock.patch.object(livemigrationops.LiveMigrationOperations,
+                       '_create_target_vm')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
+    def test_pre_live_migration_fail(self, mock_instance_exists,
+                                     mock_create_target_vm, mock_start_vm,
+                                     mock_remove_vm):
+        mock_instance_exists.return_value = False
+        mock_start_vm.side_effect = vbox_exc.VBoxException('fake-error')
+
+        self.assertRaises(vbox_exc.VBoxException,
+                          self._liveops.pre_live_migration,
+                          self._context, self._instance, None,
+                          mock.sentinel.network_info, None)
+
+        self._liveops._allocator.release.assert_called_once_with(
+            self._instance)
+        mock_remove_vm.assert_called_once_with(self._instance)
+
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
+    def test_pre_live_migration_instance_exists(self, mock_instance_exists):
+        mock_instance_exists.return_value = True
+
+        self.assertRaises(exception.InstanceExists,
+                          self._liveops.pre_live_migration,
+                          self._context, self._instance, None,
+                          mock.sentinel.network_info, None)
+        self.assertFalse(self._liveops._allocator.allocate.called)
+
+    def _migrate_data(self):
+        return {"pre_live_migration_result": {
+            "teleporter_host": 'fake-ip',
+            "teleporter_port": 6000,
+            "teleporter_password": "fake-password"}}
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.teleport')
+    def test_live_migration(self, mock_teleport):
+        self.flags(teleporter_max_downtime=250, group='virtualbox')
+        migrate_data = self._migrate_data()
+        post_method, recover_method = mock.Mock(), mock.Mock()
+
+        with mock.patch.object(self._instance, 'save') as mock_save:
+            def teleport(instance, host, port, password, max_downtime,
+                         progress_callback):
+                progress_callback(40)
+                self.assertEqual(40, instance.progress)
+                mock_save.assert_called_once_with()
+
+            mock_teleport.side_effect = teleport
+            self._liveops.live_migration(
+                self._context, self._instance, 'fake-dest', post_method,
+                recover_method, migrate_data=migrate_data)
+
+        mock_teleport.assert_called_once_with(
+            self._instance, 'fake-ip', 6000, password="fake-password",
+            max_downtime=250, progress_callback=mock.ANY)
+        post_method.assert_called_once_with(
+            self._context, self._instance, 'fake-dest', False, migrate_data)
+        self.assertFalse(recover_method.called)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.teleport')
+    def test_live_migration_fail(self, mock_teleport):
+        mock_teleport.side_effect = vbox_exc.VBoxManageError(
+            method='controlvm', reason='fake-error')
+        migrate_data = self._migrate_data()
+        post_method, recover_method = mock.Mock(), mock.Mock()
+
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          self._liveops.live_migration,
+                          self._context, self._instance, 'fake-dest',
+                          post_method, recover_method,
+                          migrate_data=migrate_data)
+
+        recover_method.assert_called_once_with(
+            self._context, self._instance, 'fake-dest', False, migrate_data)
+        self.assertFalse(post_method.called)
+
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.unregister_vm')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.control_vm')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
+    def _test_remove_vm(self, mock_instance_exists, mock_vm_info,
+                        mock_control_vm, mock_unregister_vm,
+                        mock_delete_path, state, vm_dir):
+        self.flags(instances_path='/fake/instances')
+        mock_instance_exists.return_value = True
+        mock_vm_info.return_value = vminfo.VMInfo({
+            constants.VM_POWER_STATE: state,
+            constants.VM_CONFIG_FILE: os.path.join(
+                vm_dir, self._instance.name + '.vbox'),
+        })
+
+        self._liveops._remove_vm(self._instance)
+
+        mock_vm_info.assert_called_once_with(self._instance, refresh=True)
+        mock_unregister_vm.assert_called_once_with(self._instance,
+                                                   delete=False)
+        return mock_control_vm, mock_delete_path
+
+    def test_remove_vm_teleported(self):
+        mock_control_vm, mock_delete_path = self._test_remove_vm(
+            state=constants.STATE_TELEPORTED,
+            vm_dir=os.path.join('/fake/instances', self._instance.name))
+
+        self.assertFalse(mock_control_vm.called)
+        self.assertFalse(mock_delete_path.called)
+
+    def test_remove_vm_running(self):
+        mock_control_vm, mock_delete_path = self._test_remove_vm(
+            state='teleportingin',
+            vm_dir='/fake/instances/_live_migration/fake-host/fake_name')
+
+        mock_control_vm.assert_called_once_with(self._instance,
+                                                constants.STATE_POWER_OFF)
+        mock_delete_path.assert_called_once_with(
+            '/fake/instances/_live_migration/fake-host/fake_name')
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
+    def test_remove_vm_missing(self, mock_instance_exists, mock_vm_info):
+        mock_instance_exists.return_value = False
+
+        self._liveops._remove_vm(self._instance)
+
+        self.assertFalse(mock_vm_info.called)
+
+    @mock.patch.object(livemigrationops.LiveMigrationOperations,
+                       '_remove_vm')
+    def test_rollback_live_migration_at_destination(self, mock_remove_vm):
+        mock_remove_vm.side_effect = vbox_exc.VBoxException('fake-error')
+
+        self.assertRaises(
+            vbox_exc.VBoxException,
+            self._liveops.rollback_live_migration_at_destination,
+            self._context, self._instance, mock.sentinel.network_info,
+            None, destroy_disks=True)
+
+        mock_remove_vm.assert_called_once_with(self._instance)
+        self._liveops._allocator.release.assert_called_once_with(
+            self._instance)
+
+    def test_post_live_migration_at_destination(self):
+        self._liveops.post_live_migration_at_destination(
+            self._context, self._instance, mock.sentinel.network_info)
+
+        self._liveops._allocator.release.assert_called_once_with(
+            self._instance)
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
 import mock
 from oslo_concurrency import processutils
 
@@ -20,6 +21,7 @@ from nova import exception
 from nova import test
 from nova.tests.unit import fake_instance
 from nova.tests.unit.virt.virtualbox import fake
+from nova.virt.virtualbox import cache
 from nova.virt.virtualbox import constants
 from nova.virt.virtualbox import exception as vbox_exc
 from nova.virt.virtualbox import manage
@@ -44,6 +46,21 @@ class VBoxManageTestCase(test.NoDBTestCase):
         self._instance = fake_instance.fake_instance_obj(self._context,
                                                          **instance_values)
         self._vbox_manage = manage.VBoxManage()
+        self._vbox_manage.reset_vm_info_cache()
+        self.addCleanup(self._vbox_manage.reset_vm_info_cache)
+        self._vbox_manage.reset_governor()
+        self.addCleanup(self._vbox_manage.reset_governor)
+
+        patcher = mock.patch.object(manage.VBoxManage, '_vm_registry', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(manage.VBoxManage, '_medium_registry',
+                                    None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(manage.VBoxManage, '_metrics', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     @mock.patch('nova.utils.execute')
     def test_execute(self, mock_execute):
@@ -63,6 +80,59 @@ class VBoxManageTestCase(test.NoDBTestCase):
         self._vbox_manage._execute('command')
         self.assertEqual(self._RETRY_COUNT, mock_execute.call_count)
 
+    @mock.patch('time.sleep')
+    @mock.patch('nova.virt.virtualbox.governor.ExecutionGovernor.backoff')
+    @mock.patch('nova.utils.execute')
+    def test_execute_backoff(self, mock_execute, mock_backoff, mock_sleep):
+        self.flags(retry_interval=1, retry_max_interval=4,
+                   group="virtualbox")
+        mock_backoff.return_value = 0.5
+        mock_execute.side_effect = [
+            (None, constants.VBOX_E_INVALID_OBJECT_STATE),
+            (None, constants.VBOX_E_ACCESSDENIED)]
+        lanes = []
+        mock_sleep.side_effect = lambda delay: lanes.append(
+            self._vbox_manage.get_governor().stats()["lanes"])
+
+        self._vbox_manage._execute(manage.VBoxManage.MODIFY_VM,
+                                   self._instance.name)
+
+        mock_backoff.assert_has_calls([mock.call(0, 1, 4),
+                                       mock.call(1, 1, 4)])
+        mock_sleep.assert_called_with(0.5)
+        # The lane of the virtual machine is released while waiting.
+        self.assertEqual([0, 0], lanes)
+        stats = self._vbox_manage.get_governor().stats()
+        self.assertEqual(2, stats["acquired"])
+        self.assertEqual(0, stats["lanes"])
+
+        stats = self._vbox_manage.get_metrics().stats()
+        self.assertEqual(1, stats[manage.VBoxManage.MODIFY_VM]["retries"])
+        self.assertEqual(
+            {constants.VBOX_E_ACCESSDENIED: 1},
+            stats[manage.VBoxManage.MODIFY_VM]["errors"])
+
+    def test_get_governor(self):
+        self.flags(max_concurrent_commands=4, group="virtualbox")
+
+        execution_governor = self._vbox_manage.get_governor()
+
+        self.assertEqual(4, execution_governor.max_concurrent)
+        self.assertIs(execution_governor, self._vbox_manage.get_governor())
+
+    @mock.patch('nova.virt.virtualbox.backend.get_backend')
+    def test_get_backend(self, mock_get_backend):
+        self.addCleanup(manage.VBoxManage.reset_backend)
+        manage.VBoxManage.reset_backend()
+
+        for _ in range(2):
+            self.assertEqual(mock_get_backend.return_value,
+                             manage.VBoxManage.get_backend())
+        self.assertEqual(1, mock_get_backend.call_count)
+
+        manage.VBoxManage.reset_backend()
+        mock_get_backend.return_value.close.assert_called_once_with()
+
     def test_check_stderr(self):
         self.assertRaises(exception.InstanceNotFound,
                           self._vbox_manage._check_stderr,
@@ -119,10 +189,30 @@ class VBoxManageTestCase(test.NoDBTestCase):
         method = constants.ALL_START_VM[0]
         mock_execute.side_effect = [(stdout, None)]
 
-        self.assertIsNone(self._vbox_manage.start_vm(self._instance, method))
+        with mock.patch.object(manage.VBoxManage, '_started_vms', set()):
+            self.assertIsNone(self._vbox_manage.start_vm(self._instance,
+                                                         method))
+            self.assertEqual({self._instance.name},
+                             self._vbox_manage.pop_started_vms())
+            self.assertEqual(set(), self._vbox_manage.pop_started_vms())
         self.assertEqual(1, mock_execute.call_count)
         self.assertEqual(0, mock_check_stderr.call_count)
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_start_vm_not_tracked(self, mock_execute):
+        mock_execute.return_value = (None, None)
+        self.addCleanup(self._vbox_manage.track_started_vms, False)
+
+        self._vbox_manage.track_started_vms(False)
+        self._vbox_manage.start_vm(self._instance, constants.ALL_START_VM[0])
+        self.assertEqual(set(), self._vbox_manage.pop_started_vms())
+        self.assertIsNone(self._vbox_manage._started_vms)
+
+        self._vbox_manage.track_started_vms()
+        self._vbox_manage.start_vm(self._instance, constants.ALL_START_VM[0])
+        self.assertEqual({self._instance.name},
+                         self._vbox_manage.pop_started_vms())
+
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage._check_stderr')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
     def test_start_vm_fail(self, mock_execute, mock_check_stderr):
@@ -162,6 +252,110 @@ class VBoxManageTestCase(test.NoDBTestCase):
         mock_check_stderr.assert_called_once_with(
             self._FAKE_STDERR, self._instance, self._vbox_manage.MODIFY_VM)
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_deferred_modifications(self, mock_execute):
+        mock_execute.return_value = (None, None)
+
+        with self._vbox_manage.deferred_modifications(self._instance):
+            self._vbox_manage.modify_vm(self._instance,
+                                        constants.FIELD_MEMORY, 512)
+            with self._vbox_manage.deferred_modifications(self._instance):
+                self._vbox_manage.modify_network(
+                    self._instance, constants.FIELD_NIC, 1,
+                    constants.NIC_MODE_NAT)
+            self._vbox_manage.modify_vrde(self._instance,
+                                          constants.FIELD_VRDE_PORT, 3389)
+
+            self.assertEqual(0, mock_execute.call_count)
+            modifications = self._vbox_manage.pending_modifications(
+                self._instance)
+            self.assertEqual(constants.NIC_MODE_NAT,
+                             modifications.get('--nic1'))
+
+        mock_execute.assert_called_once_with(
+            self._vbox_manage.MODIFY_VM, self._instance.name,
+            constants.FIELD_MEMORY, 512, '--nic1', constants.NIC_MODE_NAT,
+            constants.FIELD_VRDE_PORT, 3389)
+        self.assertIsNone(
+            self._vbox_manage.pending_modifications(self._instance))
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_deferred_modifications_rename(self, mock_execute):
+        mock_execute.return_value = (None, None)
+        vm_registry = cache.VMRegistry()
+        vm_registry.reconcile(lambda: [('fake-pooled-vm', 'fake-vm-uuid')])
+        patcher = mock.patch.object(manage.VBoxManage, '_vm_registry',
+                                    vm_registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with self._vbox_manage.deferred_modifications(
+                self._instance, vm_name='fake-pooled-vm'):
+            self._vbox_manage.modify_vm(self._instance,
+                                        constants.FIELD_MEMORY, 512)
+            self._vbox_manage.modify_vm(self._instance,
+                                        constants.FIELD_CPUS, 2)
+
+        mock_execute.assert_called_once_with(
+            self._vbox_manage.MODIFY_VM, 'fake-pooled-vm',
+            constants.FIELD_NAME, self._instance.name,
+            constants.FIELD_MEMORY, 512, constants.FIELD_CPUS, 2)
+        self.assertIsNone(vm_registry.get('fake-pooled-vm'))
+        self.assertEqual('fake-vm-uuid',
+                         vm_registry.get(self._instance.name).uuid)
+        self.assertEqual(2, vm_registry.cpus('fake-vm-uuid'))
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_deferred_modifications_other_greenthread(self, mock_execute):
+        mock_execute.return_value = (None, None)
+
+        def _modify():
+            self.assertIsNone(
+                self._vbox_manage.pending_modifications(self._instance))
+            self._vbox_manage.modify_vm(self._instance,
+                                        constants.FIELD_CPUS, 2)
+
+        with self._vbox_manage.deferred_modifications(self._instance):
+            self._vbox_manage.modify_vm(self._instance,
+                                        constants.FIELD_MEMORY, 512)
+            eventlet.spawn(_modify).wait()
+            mock_execute.assert_called_once_with(
+                self._vbox_manage.MODIFY_VM, self._instance.name,
+                constants.FIELD_CPUS, 2)
+
+        mock_execute.assert_called_with(
+            self._vbox_manage.MODIFY_VM, self._instance.name,
+            constants.FIELD_MEMORY, 512)
+        self.assertEqual(2, mock_execute.call_count)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_deferred_modifications_discarded(self, mock_execute):
+        def _modify():
+            with self._vbox_manage.deferred_modifications(self._instance):
+                self._vbox_manage.modify_vm(self._instance,
+                                            constants.FIELD_MEMORY, 512)
+                raise vbox_exc.VBoxException(details='fake')
+
+        self.assertRaises(vbox_exc.VBoxException, _modify)
+        self.assertEqual(0, mock_execute.call_count)
+        self.assertIsNone(
+            self._vbox_manage.pending_modifications(self._instance))
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._check_stderr')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_deferred_modifications_fail(self, mock_execute,
+                                         mock_check_stderr):
+        mock_execute.return_value = (None, self._FAKE_STDERR)
+
+        def _modify():
+            with self._vbox_manage.deferred_modifications(self._instance):
+                self._vbox_manage.modify_vm(self._instance,
+                                            constants.FIELD_MEMORY, 512)
+
+        self.assertRaises(vbox_exc.VBoxManageError, _modify)
+        mock_check_stderr.assert_called_once_with(
+            self._FAKE_STDERR, self._instance, self._vbox_manage.MODIFY_VM)
+
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
     def test_modify_network(self, mock_execute):
         stdout = mock.sentinel.stdout
@@ -188,6 +382,53 @@ class VBoxManageTestCase(test.NoDBTestCase):
                           self._vbox_manage.modify_network,
                           *fake_input)
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_modify_teleporter(self, mock_execute):
+        mock_execute.return_value = (mock.sentinel.stdout, None)
+
+        self._vbox_manage.modify_teleporter(
+            self._instance, constants.FIELD_TELEPORTER_PORT, 6000)
+
+        mock_execute.assert_called_once_with(
+            self._vbox_manage.MODIFY_VM, self._instance.name,
+            constants.FIELD_TELEPORTER_PORT, 6000)
+        self.assertRaises(vbox_exc.VBoxValueNotAllowed,
+                          self._vbox_manage.modify_teleporter,
+                          self._instance, constants.FIELD_VRDE_PORT, 6000)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_backend')
+    def test_teleport(self, mock_get_backend):
+        execute_progress = mock_get_backend.return_value.execute_progress
+        execute_progress.return_value = ("", "0%...50%...100%")
+
+        self._vbox_manage.teleport(
+            self._instance, "fake-host", 6000, password="fake-password",
+            max_downtime=250, progress_callback=mock.sentinel.callback)
+
+        execute_progress.assert_called_once_with(
+            mock.sentinel.callback, self._vbox_manage.CONTROL_VM,
+            self._instance.name, constants.STATE_TELEPORT,
+            "--host", "fake-host", "--port", 6000,
+            "--password", "fake-password", "--maxdowntime", 250)
+        self.assertEqual(1, self._vbox_manage.get_metrics().stats()[
+            self._vbox_manage.CONTROL_VM]['count'])
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._check_stderr')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_backend')
+    def test_teleport_fail(self, mock_get_backend, mock_check_stderr):
+        execute_progress = mock_get_backend.return_value.execute_progress
+        execute_progress.return_value = ("", "0%...10%..." +
+                                         self._FAKE_STDERR)
+
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          self._vbox_manage.teleport,
+                          self._instance, "fake-host", 6000)
+        self.assertEqual(("--host", "fake-host", "--port", 6000),
+                         execute_progress.call_args[0][4:])
+        mock_check_stderr.assert_called_once_with(
+            execute_progress.return_value[1], self._instance,
+            self._vbox_manage.CONTROL_VM)
+
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
     def test_list(self, mock_execute):
         stdout, stderr = mock.sentinel.stdout, mock.sentinel.stderr
@@ -196,6 +437,51 @@ class VBoxManageTestCase(test.NoDBTestCase):
                           mock.sentinel.info)
         self.assertEqual(stdout, self._vbox_manage.list(mock.sentinel.info))
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list')
+    def test_list_running_vms(self, mock_list):
+        mock_list.return_value = (
+            '"vm-1" {uuid-1}\n'
+            'fake\n'
+            '"vm 2" {uuid-2}\n')
+
+        self.assertEqual([('vm-1', 'uuid-1'), ('vm 2', 'uuid-2')],
+                         self._vbox_manage.list_running_vms())
+        mock_list.assert_called_once_with(constants.RUNNINGVMS_INFO)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_setup_metrics(self, mock_execute):
+        mock_execute.side_effect = [(None, None), (None, self._FAKE_STDERR)]
+
+        self._vbox_manage.setup_metrics(10, 1, 'fake-vm',
+                                        ['CPU/Load', 'RAM/Usage'])
+        mock_execute.assert_called_once_with(
+            self._vbox_manage.METRICS, 'setup', '--period', 10,
+            '--samples', 1, 'fake-vm', 'CPU/Load,RAM/Usage')
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          self._vbox_manage.setup_metrics, 10, 1)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_query_metrics(self, mock_execute):
+        mock_execute.side_effect = [(mock.sentinel.stdout, None),
+                                    (None, self._FAKE_STDERR)]
+
+        self.assertEqual(mock.sentinel.stdout,
+                         self._vbox_manage.query_metrics())
+        mock_execute.assert_called_once_with(self._vbox_manage.METRICS,
+                                             'query', '*')
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          self._vbox_manage.query_metrics,
+                          metrics=['CPU/Load/User'])
+        mock_execute.assert_called_with(self._vbox_manage.METRICS,
+                                        'query', '*', 'CPU/Load/User')
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_list_long_format(self, mock_execute):
+        mock_execute.return_value = (mock.sentinel.stdout, None)
+        self._vbox_manage.list(mock.sentinel.info, long_format=True)
+        mock_execute.assert_called_once_with(self._vbox_manage.LIST, '--long',
+                                             mock.sentinel.info)
+
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
     def test_show_vm_info(self, mock_execute):
         mock_execute.side_effect = [
@@ -204,11 +490,85 @@ class VBoxManageTestCase(test.NoDBTestCase):
         ]
 
         for _ in range(3):
+            response = self._vbox_manage.show_vm_info(self._instance,
+                                                      refresh=True)
+            self.assertEqual({'a': 'b'}, response)
+
+        response = self._vbox_manage.show_vm_info(self._instance,
+                                                  refresh=True)
+        self.assertIsNone(response["none"])
+
+    @mock.patch('nova.utils.execute')
+    def test_show_vm_info_cache(self, mock_execute):
+        mock_execute.side_effect = [('"a"="b"', ''), ('', ''),
+                                    ('"a"="c"', '')]
+
+        for _ in range(2):
             response = self._vbox_manage.show_vm_info(self._instance)
             self.assertEqual({'a': 'b'}, response)
 
+        self._vbox_manage.modify_vm(self._instance, constants.FIELD_CPUS, 2)
         response = self._vbox_manage.show_vm_info(self._instance)
-        self.assertIsNone(response["none"])
+
+        self.assertEqual({'a': 'c'}, response)
+        self.assertEqual(3, mock_execute.call_count)
+        stats = self._vbox_manage.get_vm_info_cache().stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(2, stats['misses'])
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_show_vm_info_renamed(self, mock_execute):
+        mock_execute.return_value = ('"a"="b"', None)
+
+        for _ in range(2):
+            response = self._vbox_manage.show_vm_info(
+                self._instance, vm_name=mock.sentinel.vm_name)
+            self.assertEqual({'a': 'b'}, response)
+
+        mock_execute.assert_called_with(self._vbox_manage.SHOW_VM_INFO,
+                                        mock.sentinel.vm_name,
+                                        "--machinereadable")
+        self.assertEqual(2, mock_execute.call_count)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_show_vm_info_by_name(self, mock_execute):
+        mock_execute.side_effect = [
+            ('"a"="b"', None), ('"a"="b"', None),
+            (None, constants.VBOX_E_INVALID_VM_STATE)]
+
+        for _ in range(2):
+            self.assertEqual({'a': 'b'}, self._vbox_manage.show_vm_info(
+                None, vm_name=mock.sentinel.vm_name))
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          self._vbox_manage.show_vm_info, None,
+                          vm_name=mock.sentinel.vm_name)
+
+        mock_execute.assert_called_with(self._vbox_manage.SHOW_VM_INFO,
+                                        mock.sentinel.vm_name,
+                                        "--machinereadable")
+        self.assertEqual(3, mock_execute.call_count)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_show_vm_info_cache_disabled(self, mock_execute):
+        self.flags(vm_info_cache=False, group='virtualbox')
+        mock_execute.return_value = ('"a"="b"', None)
+
+        for _ in range(2):
+            self._vbox_manage.show_vm_info(self._instance)
+
+        self.assertEqual(2, mock_execute.call_count)
+
+    @mock.patch('nova.utils.execute')
+    @mock.patch.object(manage.VBoxManage, '_vm_info_cache')
+    def test_execute_invalidates_vm_info(self, mock_cache, mock_execute):
+        mock_execute.return_value = ('', '')
+
+        self._vbox_manage._execute(self._vbox_manage.LIST, 'vms')
+        self.assertFalse(mock_cache.invalidate.called)
+
+        self._vbox_manage._execute(self._vbox_manage.CONTROL_VM,
+                                   self._instance.name, 'pause')
+        mock_cache.invalidate.assert_called_once_with(self._instance.name)
 
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
     def test_show_vm_info_fail(self, mock_execute):
@@ -283,6 +643,22 @@ class VBoxManageTestCase(test.NoDBTestCase):
                                    variant=mock.sentinel.variant)
         mock_execute.assert_has_calls(calls)
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_backend')
+    def test_convert_from_raw(self, mock_get_backend):
+        execute_stream = mock_get_backend.return_value.execute_stream
+        execute_stream.side_effect = [("", ""), ("", self._FAKE_STDERR)]
+
+        self._vbox_manage.convert_from_raw(mock.sentinel.source,
+                                           mock.sentinel.path, 1024)
+        execute_stream.assert_called_once_with(
+            mock.sentinel.source, self._vbox_manage.CONVERT_FROM_RAW, "stdin",
+            mock.sentinel.path, 1024, "--format", constants.DISK_FORMAT_VDI)
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          self._vbox_manage.convert_from_raw,
+                          mock.sentinel.source, mock.sentinel.path, 1024)
+        self.assertEqual(2, self._vbox_manage.get_metrics().stats()[
+            self._vbox_manage.CONVERT_FROM_RAW]['count'])
+
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
     def test_clone_hd_fail(self, mock_execute):
         mock_execute.side_effect = [
@@ -305,6 +681,16 @@ class VBoxManageTestCase(test.NoDBTestCase):
                          self._vbox_manage.create_vm(fake.FAKE_VM_NAME))
         self.assertIsNone(self._vbox_manage.create_vm(fake.FAKE_VM_NAME))
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_create_vm_uuid(self, mock_execute):
+        mock_execute.return_value = ('UUID: %s' % fake.FAKE_VM_UUID, None)
+
+        self.assertEqual(fake.FAKE_VM_UUID, self._vbox_manage.create_vm(
+            fake.FAKE_VM_NAME, register=True, uuid=fake.FAKE_VM_UUID))
+        mock_execute.assert_called_once_with(
+            self._vbox_manage.CREATE_VM, '--name', fake.FAKE_VM_NAME,
+            '--register', '--uuid', fake.FAKE_VM_UUID)
+
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
     def test_create_vm_fail(self, mock_execute):
         stdout = mock.sentinel.stdout
@@ -383,6 +769,47 @@ class VBoxManageTestCase(test.NoDBTestCase):
                                                           delete=False))
         mock_execute.assert_has_calls(calls)
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_vm_registry(self, mock_execute):
+        mock_execute.side_effect = [
+            ('"%s" {fake-old-uuid}\n"<inaccessible>" {fake-uuid}' %
+             fake.FAKE_VM_NAME, None),
+            ('UUID: %s' % self._instance.uuid, None),
+            (None, None),
+        ]
+
+        vm_registry = self._vbox_manage.get_vm_registry()
+        self.assertEqual('fake-old-uuid',
+                         vm_registry.get(fake.FAKE_VM_NAME).uuid)
+        self.assertTrue(vm_registry.get('fake-uuid').inaccessible)
+
+        self._vbox_manage.create_vm(self._instance.name, register=True)
+        self.assertEqual(self._instance.uuid,
+                         vm_registry.get(self._instance.name).uuid)
+
+        self._vbox_manage.unregister_vm(self._instance)
+        self.assertIsNone(vm_registry.get(self._instance.name))
+
+        self.assertIs(vm_registry, self._vbox_manage.get_vm_registry())
+        self.assertEqual(3, mock_execute.call_count)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_medium_registry(self, mock_execute):
+        mock_execute.return_value = (None, None)
+        medium_registry = self._vbox_manage.get_medium_registry()
+        medium_registry.reconcile(lambda: {
+            'fake-uuid': {constants.VHD_PATH: 'fake-path'}})
+
+        self._vbox_manage.close_medium(constants.MEDIUM_DISK, 'fake-path')
+        self.assertFalse(medium_registry.registered('fake-uuid', dict))
+
+        self._vbox_manage.clone_hd(mock.sentinel.path, 'fake-new-path')
+        self.assertFalse(medium_registry._complete)
+
+        self._vbox_manage.unregister_vm(self._instance, delete=True)
+        self.assertTrue(medium_registry.outdated)
+        self.assertIs(medium_registry, self._vbox_manage.get_medium_registry())
+
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
     def test_unregister_vm_fail(self, mock_execute):
         mock_execute.side_effect = [
@@ -13,8 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
+
+import fixtures
 import mock
+from oslo_concurrency import processutils
+from oslo_utils import units
 
+from nova import exception
 from nova import test
 from nova.tests.unit import fake_instance
 from nova.virt.virtualbox import constants
@@ -69,7 +75,7 @@ class MigrationOperationsTestCase(test.NoDBTestCase):
 
         mock_delete.assert_called_once_with(mock.sentinel.disk)
 
-    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
     @mock.patch('nova.virt.virtualbox.vhdutils.check_disk_uuid')
     def test_check_disk(self, mock_check_uuid, mock_disk_info):
         mock_disk_info.return_value = {constants.VHD_PARENT_UUID: None}
@@ -79,30 +85,29 @@ class MigrationOperationsTestCase(test.NoDBTestCase):
         mock_check_uuid.assert_called_once_with(mock.sentinel.disk_file)
         mock_disk_info.assert_called_once_with(mock.sentinel.disk_file)
 
-    @mock.patch('nova.virt.virtualbox.vhdutils.get_hard_disks')
-    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.vhdutils.is_registered')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
     @mock.patch('nova.virt.virtualbox.vhdutils.check_disk_uuid')
     def test_check_disk_cow(self, mock_check_uuid, mock_disk_info,
-                            mock_get_hard_disks):
+                            mock_is_registered):
         mock_disk_info.return_value = {
             constants.VHD_PARENT_UUID: mock.sentinel.parent_uuid
         }
-        mock_get_hard_disks.return_value = [mock.sentinel.parent_uuid]
+        mock_is_registered.return_value = True
         self._migrationops._check_disk(mock.sentinel.disk_file,
                                        mock.sentinel.base_disk)
 
         mock_check_uuid.assert_called_once_with(mock.sentinel.disk_file)
         mock_disk_info.assert_called_once_with(mock.sentinel.disk_file)
-        mock_get_hard_disks.assert_called_once_with()
+        mock_is_registered.assert_called_once_with(mock.sentinel.parent_uuid)
 
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.set_disk_parent_uuid')
-    @mock.patch('nova.virt.virtualbox.vhdutils.get_hard_disks')
-    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.vhdutils.is_registered')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
     @mock.patch('nova.virt.virtualbox.vhdutils.check_disk_uuid')
     def test_check_disk_parent_missing(self, mock_check_uuid, mock_disk_info,
-                                       mock_get_hard_disks,
+                                       mock_is_registered,
                                        mock_set_parrent_uuid):
-        mock_get_hard_disks.return_value = []
         mock_disk_info.side_effect = [
             # No information available for disk file
             vbox_exc.VBoxException('error'),
@@ -117,6 +122,253 @@ class MigrationOperationsTestCase(test.NoDBTestCase):
             mock.call(mock.sentinel.disk_file),
             mock.call(mock.sentinel.base_disk)
         ])
-        mock_get_hard_disks.assert_called_once_with()
+        self.assertFalse(mock_is_registered.called)
         mock_set_parrent_uuid.assert_called_once_with(
             mock.sentinel.disk_file, mock.sentinel.base_disk_uuid)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.storage_attach')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_controllers')
+    def test_detach_storage(self, mock_get_controllers, mock_storage_attach,
+                            mock_close_medium):
+        mock_get_controllers.return_value = {
+            constants.DEFAULT_IDE_CNAME: {
+                (0, 0): {'path': 'ephemeral.vdi', 'uuid': 'uuid-1'},
+                (0, 1): {'path': None, 'uuid': None},
+            },
+            constants.DEFAULT_SATA_CNAME: {
+                (0, 0): {'path': 'root.vdi', 'uuid': 'uuid-2'},
+                (1, 0): {'path': 'iqn|target', 'uuid': 'uuid-3'},
+            },
+        }
+
+        disks = self._migrationops._detach_storage(self._instance)
+
+        self.assertEqual(['root.vdi', 'ephemeral.vdi'], disks)
+        self.assertEqual(3, mock_storage_attach.call_count)
+        mock_close_medium.assert_called_once_with(constants.MEDIUM_DISK,
+                                                  'iqn|target')
+
+    @mock.patch('nova.virt.virtualbox.imagecache.get_ephemeral_template')
+    @mock.patch('nova.virt.virtualbox.diskstream.open_image')
+    @mock.patch.object(migrationops.MigrationOperations, '_check_disk')
+    @mock.patch.object(migrationops.MigrationOperations,
+                       '_is_parent_missing')
+    def test_check_ephemeral_disk(self, mock_parent_missing, mock_check_disk,
+                                  mock_open_image, mock_get_template):
+        mock_parent_missing.return_value = True
+        mock_open_image.return_value.size = 2 * units.Gi
+
+        self._migrationops._check_ephemeral_disk('fake/ephemeral.vdi')
+
+        mock_open_image.return_value.close.assert_called_once_with()
+        mock_get_template.assert_called_once_with(2, constants.DISK_FORMAT_VDI)
+        mock_check_disk.assert_called_once_with(
+            'fake/ephemeral.vdi', mock_get_template.return_value)
+
+    def _write_file(self, path, data):
+        with open(path, 'wb') as disk_file:
+            disk_file.write(data)
+
+    def _read_file(self, path):
+        with open(path, 'rb') as disk_file:
+            return disk_file.read()
+
+    @mock.patch.object(migrationops.MigrationOperations, '_CHUNK_SIZE', 4)
+    def test_copy_disk(self):
+        path = self.useFixture(fixtures.TempDir()).path
+        source = os.path.join(path, 'source.vdi')
+        destination = os.path.join(path, 'destination.vdi')
+        data = b'abcd' + b'\x00' * 8 + b'efgh' + b'\x00' * 6
+        self._write_file(source, data)
+        # Note: A previous attempt copied the first chunk and a part of
+        # the second one.
+        self._write_file(destination + '.part', b'abcd\x00\xff')
+
+        self._migrationops._copy_disk(source, destination)
+
+        self.assertEqual(data, self._read_file(destination))
+        self.assertFalse(os.path.exists(destination + '.part'))
+
+    @mock.patch('os.rename')
+    @mock.patch('os.path.getsize')
+    @mock.patch.object(migrationops.MigrationOperations, '_copy_chunks')
+    def test_copy_disk_retry(self, mock_copy_chunks, mock_getsize,
+                             mock_rename):
+        self.flags(migration_copy_attempts=2, group='virtualbox')
+        mock_copy_chunks.side_effect = [IOError('fake-error'), None]
+
+        self._migrationops._copy_disk('source', 'destination')
+
+        mock_copy_chunks.assert_has_calls(
+            [mock.call('source', 'destination.part',
+                       mock_getsize.return_value)] * 2)
+        mock_rename.assert_called_once_with('destination.part',
+                                            'destination')
+
+    @mock.patch.object(migrationops.MigrationOperations, '_copy_chunks')
+    def test_copy_disk_fail(self, mock_copy_chunks):
+        self.flags(migration_copy_attempts=2, group='virtualbox')
+        mock_copy_chunks.side_effect = IOError('fake-error')
+
+        with mock.patch('os.path.getsize'):
+            self.assertRaises(IOError, self._migrationops._copy_disk,
+                              'source', 'destination')
+        self.assertEqual(2, mock_copy_chunks.call_count)
+
+    @mock.patch.object(migrationops.MigrationOperations, '_copy_disk')
+    def test_copy_disks_fail(self, mock_copy_disk):
+        errors = {'disk2': IOError('fake-error'),
+                  'disk3': IOError('other-error')}
+
+        def copy_disk(source, destination):
+            if source in errors:
+                raise errors[source]
+
+        mock_copy_disk.side_effect = copy_disk
+        transfers = [('disk1', 'dest1'), ('disk2', 'dest2'),
+                     ('disk3', 'dest3')]
+
+        response = self.assertRaises(IOError, self._migrationops._copy_disks,
+                                     transfers)
+
+        self.assertIs(errors['disk2'], response)
+        mock_copy_disk.assert_has_calls(
+            [mock.call(source, destination)
+             for source, destination in transfers], any_order=True)
+
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.destroy')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
+    @mock.patch('nova.virt.virtualbox.hostutils.get_ip')
+    @mock.patch('nova.virt.virtualbox.hostutils.get_local_ips')
+    def test_migrate_disk_files_remote(self, mock_local_ips, mock_get_ip,
+                                       mock_get_disk, mock_destroy):
+        # Note: Two instances paths are used as source and destination
+        # hosts.
+        path = self.useFixture(fixtures.TempDir()).path
+        self.flags(instances_path=os.path.join(path, 'source'))
+        self.flags(remote_instances_path=os.path.join(path, '%(host)s'),
+                   group='virtualbox')
+        mock_local_ips.return_value = ['10.0.0.1']
+        mock_get_ip.return_value = '10.0.0.1'
+        mock_get_disk.return_value = {
+            constants.VHD_IMAGE_TYPE: constants.DISK_FORMAT_VDI}
+        source_path = os.path.join(path, 'source', self._instance.name)
+        os.makedirs(source_path)
+        disks = []
+        for name, data in (('fake-root.vdi', b'root'),
+                           ('ephemeral.vdi', b'ephemeral')):
+            disks.append(os.path.join(source_path, name))
+            self._write_file(disks[-1], data)
+
+        self._migrationops._migrate_disk_files(self._instance, disks,
+                                               '10.0.0.2')
+
+        destination_path = os.path.join(path, '10.0.0.2',
+                                        self._instance.name)
+        self.assertEqual(['ephemeral.vdi', 'root.vdi'],
+                         sorted(os.listdir(destination_path)))
+        self.assertEqual(b'root', self._read_file(
+            os.path.join(destination_path, 'root.vdi')))
+        self.assertFalse(os.path.exists(source_path))
+        self.assertTrue(os.path.exists(source_path + '_revert'))
+        mock_destroy.assert_called_once_with(self._instance,
+                                             destroy_disks=False)
+
+    @mock.patch.object(migrationops.MigrationOperations, '_detach_storage')
+    @mock.patch.object(migrationops.MigrationOperations, '_is_same_host')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.power_off')
+    def test_migrate_disk_and_power_off_remote_path_missing(
+            self, mock_power_off, mock_same_host, mock_detach_storage):
+        mock_same_host.return_value = False
+        self._instance.root_gb = 1
+
+        self.assertRaises(exception.InstanceFaultRollback,
+                          self._migrationops.migrate_disk_and_power_off,
+                          self._context, self._instance, '10.0.0.2',
+                          {'root_gb': 1}, mock.sentinel.network_info)
+        self.assertFalse(mock_power_off.called)
+        self.assertFalse(mock_detach_storage.called)
+
+    @mock.patch.object(migrationops.MigrationOperations, '_detach_storage')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.power_off')
+    def test_migrate_disk_and_power_off_smaller_disk(self, mock_power_off,
+                                                     mock_detach_storage):
+        self._instance.root_gb = 2
+
+        self.assertRaises(exception.InstanceFaultRollback,
+                          self._migrationops.migrate_disk_and_power_off,
+                          self._context, self._instance, '10.0.0.2',
+                          {'root_gb': 1}, mock.sentinel.network_info)
+        self.assertFalse(mock_power_off.called)
+        self.assertFalse(mock_detach_storage.called)
+
+    @mock.patch('nova.utils.execute')
+    def test_link_disk_reflink(self, mock_execute):
+        self.assertTrue(self._migrationops._link_disk('disk', 'dest'))
+
+        mock_execute.assert_called_once_with('cp', '--reflink=always',
+                                             'disk', 'dest')
+
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch('nova.utils.execute')
+    def _test_link_disk_no_reflink(self, mock_execute, mock_delete_path,
+                                   reflink_error):
+        mock_execute.side_effect = reflink_error
+
+        self.assertFalse(self._migrationops._link_disk('disk', 'dest'))
+        mock_delete_path.assert_called_once_with('dest')
+
+    def test_link_disk_fallback_copy(self):
+        self._test_link_disk_no_reflink(
+            reflink_error=processutils.ProcessExecutionError)
+
+    def test_link_disk_missing_cp(self):
+        self._test_link_disk_no_reflink(
+            reflink_error=OSError(2, 'No such file or directory'))
+
+    def test_link_disk_modes(self):
+        opt = [opt for opt in migrationops.VIRTUAL_BOX
+               if opt.name == 'same_host_resize_disks'][0]
+        self.assertRaises(ValueError, opt.type, 'link')
+
+    @mock.patch('nova.utils.execute')
+    def test_link_disk_copy(self, mock_execute):
+        self.flags(same_host_resize_disks=constants.RESIZE_DISKS_COPY,
+                   group='virtualbox')
+
+        self.assertFalse(self._migrationops._link_disk('disk', 'dest'))
+        self.assertFalse(mock_execute.called)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.clone_hd')
+    @mock.patch.object(migrationops.MigrationOperations, '_link_disk')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
+    def test_migrate_disk_link(self, mock_get_disk, mock_link_disk,
+                               mock_clone_hd):
+        mock_get_disk.return_value = {
+            constants.VHD_IMAGE_TYPE: constants.DISK_FORMAT_VDI,
+            constants.VHD_PARENT_UUID: None}
+        mock_link_disk.return_value = True
+
+        self._migrationops._migrate_disk('path/disk.vdi', 'dest',
+                                         root_disk=True)
+
+        mock_link_disk.assert_called_once_with(
+            'path/disk.vdi', os.path.join('dest', 'root.vdi'))
+        self.assertFalse(mock_clone_hd.called)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.clone_hd')
+    @mock.patch.object(migrationops.MigrationOperations, '_link_disk')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
+    def test_migrate_disk_clone(self, mock_get_disk, mock_link_disk,
+                                mock_clone_hd):
+        mock_get_disk.return_value = {
+            constants.VHD_IMAGE_TYPE: constants.DISK_FORMAT_VDI,
+            constants.VHD_PARENT_UUID: None}
+        mock_link_disk.return_value = False
+
+        self._migrationops._migrate_disk('path/disk.vdi', 'dest')
+
+        mock_clone_hd.assert_called_once_with(
+            'path/disk.vdi', os.path.join('dest', 'disk.vdi'),
+            constants.DISK_FORMAT_VDI)
@@ -19,6 +19,8 @@ from nova import exception
 from nova import test
 from nova.tests.unit import fake_instance
 from nova.tests.unit.virt.virtualbox import fake
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import manage
 from nova.virt.virtualbox import networkutils
 
 
@@ -50,8 +52,42 @@ class NetworkUtilsTestCase(test.NoDBTestCase):
         for index in range(3, 8):
             self.assertFalse(response[index + 1])
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.pending_modifications')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_get_nic_status_deferred(self, mock_vm_info, mock_pending):
+        mock_vm_info.return_value = (fake.FakeVBoxManage.network_info(), None)
+        mock_pending.return_value = manage.DeferredModifications(
+            self._instance)
+        mock_pending.return_value.add('--nic4', constants.NIC_MODE_NULL)
+        response = networkutils.get_nic_status(self._instance)
+
+        for index in range(4):
+            self.assertTrue(response[index + 1])
+        for index in range(4, 8):
+            self.assertFalse(response[index + 1])
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.pending_modifications')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_get_nic_status_renamed(self, mock_execute, mock_pending):
+        mock_execute.return_value = (fake.FakeVBoxManage.network_info(), None)
+        mock_pending.return_value = manage.DeferredModifications(
+            self._instance, "fake-pooled-vm")
+
+        networkutils.get_nic_status(self._instance)
+
+        mock_execute.assert_called_once_with(
+            manage.VBoxManage.SHOW_VM_INFO, "fake-pooled-vm",
+            "--machinereadable")
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    def test_get_available_nic(self, mock_execute):
+        mock_execute.return_value = (fake.FakeVBoxManage.network_info(), None)
+        self.assertEqual(4, networkutils.get_available_nic(self._instance))
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.pending_modifications')
     @mock.patch('nova.virt.virtualbox.networkutils.get_nic_status')
-    def test_get_available_nic(self, mock_get_nic):
+    def test_get_available_nic_deferred(self, mock_get_nic, mock_pending):
+        mock_pending.return_value = mock.sentinel.modifications
         mock_get_nic.side_effect = [{1: False}, {1: True, 2: False},
                                     {1: True}]
 
@@ -113,6 +113,14 @@ class PathUtilsTestCase(test.NoDBTestCase):
 
         self.assertEqual(1, mock_join.call_count)
 
+    def test_vm_pool_dir(self):
+        self.flags(instances_path='/fake/instances', host='fake-host')
+
+        self.assertEqual('/fake/instances/_pool/fake-host',
+                         pathutils.vm_pool_dir())
+        self.assertEqual('/fake/instances/_live_migration/fake-host',
+                         pathutils.live_migration_dir())
+
     @mock.patch('os.path.join')
     @mock.patch('nova.virt.virtualbox.pathutils.base_disk_dir')
     def test_base_disk_path(self, mock_base_disk, mock_join):
@@ -121,6 +129,14 @@ class PathUtilsTestCase(test.NoDBTestCase):
         self.assertEqual(1, mock_base_disk.call_count)
         self.assertEqual(1, mock_join.call_count)
 
+    @mock.patch('os.path.join')
+    @mock.patch('nova.virt.virtualbox.pathutils.base_disk_dir')
+    def test_ephemeral_template_path(self, mock_base_disk, mock_join):
+        pathutils.ephemeral_template_path(10, 'VDI')
+
+        mock_join.assert_called_once_with(mock_base_disk(),
+                                          'ephemeral-10G.vdi')
+
     @mock.patch('os.path.join')
     @mock.patch('nova.virt.virtualbox.pathutils.instance_basepath')
     def test_root_disk_path(self, mock_instance_basepath, mock_join):
@@ -0,0 +1,184 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import textwrap
+
+import mock
+
+from nova import test
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import perfmetrics
+
+_QUERY_OUTPUT = textwrap.dedent(
+    """
+    Object          Metric               Values
+    --------------- -------------------- --------------------
+    host            CPU/Load/User        10.00%, 20.00%
+    host            CPU/Load/Kernel      5.00%
+    host            CPU/Load/Idle        75.00%
+    host            CPU/MHz              2600 MHz
+    instance-0001   CPU/Load/User        2.50%
+    instance-0001   RAM/Usage/Used       262144 kB
+    instance-0001   Net/Rate/Rx          1000 B/s
+    instance-0001   Guest/RAM/Usage/Total
+    """)
+
+
+class PerformanceCollectorTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(PerformanceCollectorTestCase, self).setUp()
+        self.flags(metrics_period=10, group='virtualbox')
+        self.flags(metrics_history=2, group='virtualbox')
+        self._collector = perfmetrics.PerformanceCollector()
+        self._collector._cpu_count = 2
+
+    def test_parse_query(self):
+        samples = perfmetrics.parse_query(_QUERY_OUTPUT)
+
+        self.assertEqual({'host', 'instance-0001'}, set(samples))
+        self.assertEqual(20.0,
+                         samples['host'][constants.METRIC_CPU_LOAD_USER])
+        self.assertEqual(2600.0, samples['host'][constants.METRIC_CPU_MHZ])
+        self.assertEqual({constants.METRIC_CPU_LOAD_USER: 2.5,
+                          constants.METRIC_RAM_USED: 262144.0,
+                          constants.METRIC_NET_RATE_RX: 1000.0},
+                         samples['instance-0001'])
+
+    @mock.patch('time.time')
+    def test_update(self, mock_time):
+        mock_time.return_value = 25
+        values = {constants.METRIC_CPU_LOAD_USER: 50.0,
+                  constants.METRIC_NET_RATE_RX: 100.0}
+
+        self._collector.update({'fake-vm': values}, 0)
+        self._collector.update({'fake-vm': values}, 5)
+        self._collector.update({'fake-vm': values}, 20)
+
+        self.assertEqual([5, 20], [sample.timestamp for sample in
+                                   self._collector.get_samples('fake-vm')])
+        self.assertEqual(values, self._collector.last_values('fake-vm'))
+        # The first sample covers a whole period and the counters are
+        # extrapolated up to the current time.
+        counters = self._collector.counters('fake-vm')
+        self.assertEqual(0.5 * 35 * 2 * 10 ** 9, counters['user'])
+        self.assertEqual(100.0 * 35, counters['rx'])
+
+        self._collector.update({}, 30)
+        self.assertEqual([], self._collector.get_samples('fake-vm'))
+        self.assertEqual({}, self._collector.counters('fake-vm'))
+
+    def test_memory_used(self):
+        self._collector.update({
+            'fake-guest-vm': {constants.METRIC_GUEST_RAM_TOTAL: 1024.0,
+                              constants.METRIC_GUEST_RAM_FREE: 256.0,
+                              constants.METRIC_RAM_USED: 2048.0},
+            'fake-vm': {constants.METRIC_RAM_USED: 2048.0},
+        }, 0)
+
+        self.assertEqual(768, self._collector.memory_used('fake-guest-vm'))
+        self.assertEqual(2048, self._collector.memory_used('fake-vm'))
+        self.assertIsNone(self._collector.memory_used('fake-other-vm'))
+
+    @mock.patch('time.time')
+    def test_host_cpu_stats(self, mock_time):
+        mock_time.return_value = 0
+        self.assertIsNone(self._collector.host_cpu_stats())
+
+        self._collector.update(perfmetrics.parse_query(_QUERY_OUTPUT), 0)
+        stats = self._collector.host_cpu_stats()
+
+        self.assertEqual({'user': 4 * 10 ** 9, 'kernel': 10 ** 9,
+                          'idle': 15 * 10 ** 9, 'iowait': 0,
+                          'frequency': 2600}, stats)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.pop_started_vms')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.query_metrics')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.setup_metrics')
+    def test_collect(self, mock_setup, mock_query, mock_started_vms):
+        mock_started_vms.return_value = {'instance-0001'}
+        mock_setup.side_effect = vbox_exc.VBoxException(details='fake')
+        mock_query.return_value = _QUERY_OUTPUT
+
+        self._collector.collect()
+
+        mock_setup.assert_called_once_with(10, 1, 'instance-0001',
+                                           constants.ALL_BASE_METRICS)
+        mock_query.assert_called_once_with(metrics=constants.ALL_METRICS)
+        self.assertEqual(1, len(self._collector.get_samples('host')))
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.pop_started_vms')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.query_metrics')
+    def test_collect_fail(self, mock_query, mock_started_vms):
+        mock_started_vms.return_value = set()
+        mock_query.side_effect = vbox_exc.VBoxException(details='fake')
+
+        self._collector.collect()
+
+        self.assertEqual([], self._collector.get_samples('host'))
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.track_started_vms')
+    @mock.patch('nova.openstack.common.loopingcall.FixedIntervalLoopingCall')
+    @mock.patch('nova.virt.virtualbox.hostops.get_vcpus')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.setup_metrics')
+    def test_start_stop(self, mock_setup, mock_vcpus, mock_looping_call,
+                        mock_track):
+        mock_vcpus.return_value = 8
+
+        self._collector.start()
+        self._collector.start()
+
+        mock_track.assert_called_once_with()
+        mock_setup.assert_called_once_with(
+            10, 1, metrics=constants.ALL_BASE_METRICS)
+        self.assertEqual(8, self._collector._cpu_count)
+        mock_looping_call.assert_called_once_with(self._collector.collect)
+        mock_looping_call.return_value.start.assert_called_once_with(
+            interval=10, initial_delay=10)
+
+        self._collector.stop()
+        mock_looping_call.return_value.stop.assert_called_once_with()
+        self.assertIsNone(self._collector._periodic_call)
+        mock_track.assert_called_with(False)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.track_started_vms')
+    @mock.patch('nova.openstack.common.loopingcall.FixedIntervalLoopingCall')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.setup_metrics')
+    def test_start_disabled(self, mock_setup, mock_looping_call, mock_track):
+        self.flags(metrics_period=0, group='virtualbox')
+        self._collector.start()
+        self.assertFalse(mock_track.called)
+
+        mock_setup.side_effect = vbox_exc.VBoxException(details='fake')
+        self.flags(metrics_period=10, group='virtualbox')
+        self._collector.start()
+
+        mock_setup.assert_called_once_with(
+            10, 1, metrics=constants.ALL_BASE_METRICS)
+        self.assertFalse(mock_looping_call.called)
+        self.assertEqual([mock.call(), mock.call(False)],
+                         mock_track.call_args_list)
+
+    @mock.patch.object(perfmetrics, '_COLLECTOR')
+    def test_get_host_cpu_stats(self, mock_collector):
+        mock_collector.host_cpu_stats.side_effect = [mock.sentinel.stats,
+                                                     None]
+
+        self.assertEqual(mock.sentinel.stats,
+                         perfmetrics.get_host_cpu_stats())
+        self.assertEqual({'kernel': 0, 'idle': 0, 'user': 0, 'iowait': 0,
+                          'frequency': 0},
+                         perfmetrics.get_host_cpu_stats())
@@ -0,0 +1,140 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_utils import units
+
+from nova import context as nova_context
+from nova import exception
+from nova import test
+from nova.tests.unit import fake_instance
+from nova.virt.virtualbox import prefetch
+
+
+class RateLimiterTestCase(test.NoDBTestCase):
+
+    @mock.patch('time.sleep')
+    @mock.patch('time.time')
+    def test_consume(self, mock_time, mock_sleep):
+        mock_time.return_value = 100
+        rate_limiter = prefetch.RateLimiter(10)
+
+        rate_limiter.consume(20)
+        self.assertFalse(mock_sleep.called)
+
+        rate_limiter.consume(10)
+        mock_sleep.assert_called_once_with(2)
+
+        mock_time.return_value = 110
+        mock_sleep.reset_mock()
+        rate_limiter.consume(10)
+        self.assertFalse(mock_sleep.called)
+
+
+class ImagePrefetcherTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(ImagePrefetcherTestCase, self).setUp()
+        self._context = nova_context.RequestContext('fake-user',
+                                                    'fake-project')
+        self._prefetcher = prefetch.ImagePrefetcher()
+
+    def _instance(self, index, image_ref):
+        return fake_instance.fake_instance_obj(
+            self._context, id=index, uuid='fake-uuid-%d' % index,
+            image_ref=image_ref)
+
+    @mock.patch('nova.objects.InstanceList.get_by_host')
+    @mock.patch('nova.objects.AggregateList.get_by_host')
+    def test_aggregate_instances(self, mock_aggregates, mock_instances):
+        self.flags(host='host1')
+        mock_aggregates.return_value = [mock.Mock(hosts=['host1', 'host2']),
+                                        mock.Mock(hosts=['host3'])]
+        mock_instances.side_effect = lambda context, host: [host]
+
+        instances = self._prefetcher._aggregate_instances(self._context)
+
+        self.assertEqual(['host1', 'host2', 'host3'], sorted(instances))
+        mock_aggregates.assert_called_once_with(self._context, 'host1')
+
+    @mock.patch.object(prefetch.ImagePrefetcher, '_aggregate_instances')
+    def test_popular_images(self, mock_aggregate_instances):
+        mock_aggregate_instances.return_value = [
+            self._instance(1, 'image-1'), self._instance(2, 'image-2'),
+            self._instance(3, 'image-2'), self._instance(4, ''),
+        ]
+        all_instances = [self._instance(1, 'image-1'),
+                         self._instance(5, 'image-3'),
+                         self._instance(6, 'image-3'),
+                         self._instance(7, 'image-3')]
+
+        self.assertEqual(['image-3', 'image-2'],
+                         self._prefetcher.popular_images(
+                             self._context, all_instances, count=2))
+        self.assertEqual([], self._prefetcher.popular_images(self._context))
+
+    @mock.patch.object(prefetch.ImagePrefetcher, 'popular_images')
+    def test_select_images(self, mock_popular_images):
+        self.flags(prefetch_images=['image-1', 'image-2'],
+                   group='virtualbox')
+        mock_popular_images.return_value = ['image-2', 'image-3']
+
+        self.assertEqual(['image-1', 'image-2', 'image-3'],
+                         self._prefetcher.select_images(
+                             self._context, mock.sentinel.instances))
+        mock_popular_images.assert_called_once_with(
+            self._context, mock.sentinel.instances)
+
+    @mock.patch.object(prefetch.ImagePrefetcher, 'popular_images')
+    def test_select_images_fail(self, mock_popular_images):
+        self.flags(prefetch_images=['image-1'], group='virtualbox')
+        mock_popular_images.side_effect = exception.NovaException
+
+        self.assertEqual(['image-1'],
+                         self._prefetcher.select_images(self._context))
+
+    @mock.patch('nova.virt.virtualbox.imagecache.get_cached_image')
+    def test_prefetch(self, mock_get_cached_image):
+        self.flags(prefetch_rate_limit=2, group='virtualbox')
+        error = exception.ImageNotFound(image_id='image-2')
+
+        def get_cached_image(context, request, rate_limiter):
+            self.assertEqual(self._context.user_id, request.user_id)
+            self.assertEqual(self._context.project_id, request.project_id)
+            self.assertEqual(2 * units.Mi, rate_limiter.rate)
+            if request.image_ref == 'image-2':
+                raise error
+            return request.image_ref + '.vdi'
+
+        mock_get_cached_image.side_effect = get_cached_image
+
+        response = self._prefetcher.prefetch(self._context,
+                                             ['image-1', 'image-2'])
+
+        self.assertEqual({'image-1': 'image-1.vdi', 'image-2': error},
+                         response)
+
+    @mock.patch('nova.utils.spawn_n')
+    @mock.patch.object(prefetch.ImagePrefetcher, 'prefetch')
+    def test_start(self, mock_prefetch, mock_spawn_n):
+        self.assertTrue(self._prefetcher.start(self._context, ['image-1']))
+        self.assertFalse(self._prefetcher.start(self._context, ['image-1']))
+        self.assertEqual(1, mock_spawn_n.call_count)
+
+        # Run the prefetch which was scheduled.
+        mock_spawn_n.call_args[0][0]()
+
+        mock_prefetch.assert_called_once_with(self._context, ['image-1'])
+        self.assertTrue(self._prefetcher.start(self._context, ['image-1']))
@@ -0,0 +1,172 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg
+
+from nova.compute import power_state
+from nova import exception
+from nova import test
+from nova.tests.unit import fake_instance
+from nova.tests.unit.virt.virtualbox import benchmark
+from nova.tests.unit.virt.virtualbox import simulator
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import manage
+from nova.virt.virtualbox import perfmetrics
+from nova.virt.virtualbox import vhdutils
+from nova.virt.virtualbox import vmutils
+
+CONF = cfg.CONF
+
+
+class SimulatedVBoxManageTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(SimulatedVBoxManageTestCase, self).setUp()
+        self._simulator = simulator.SimulatedVBoxManage()
+        self._instance = fake_instance.fake_instance_obj(
+            'fake-context', uuid='fake-uuid')
+        self._base = self._simulator.register_medium('/base.vdi',
+                                                     capacity=2048)
+
+        self.flags(retry_interval=0, group='virtualbox')
+        for attribute, value in (('_backend', self._simulator),
+                                 ('_vm_info_cache', None),
+                                 ('_vm_registry', None),
+                                 ('_medium_registry', None),
+                                 ('_governor', None),
+                                 ('_metrics', None),
+                                 ('_started_vms', set())):
+            patcher = mock.patch.object(manage.VBoxManage, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _create_vm(self):
+        manage.VBoxManage.create_vm(self._instance.name, basefolder='/vms',
+                                    register=True, uuid=self._instance.uuid)
+        vmutils.set_storage_controller(self._instance,
+                                       constants.SYSTEM_BUS_SATA)
+        manage.VBoxManage.create_hd('/vms/root.vdi', parent='/base.vdi')
+        manage.VBoxManage.storage_attach(
+            self._instance, constants.DEFAULT_SATA_CNAME, 0, 0,
+            constants.STORAGE_HDD, '/vms/root.vdi')
+
+    def test_vm_lifecycle(self):
+        self._create_vm()
+        manage.VBoxManage.modify_vm(self._instance, constants.FIELD_MEMORY,
+                                    512)
+        manage.VBoxManage.start_vm(self._instance)
+
+        vm_info = manage.VBoxManage.show_vm_info(self._instance)
+        self.assertEqual('512', vm_info[constants.VM_MEMORY])
+        self.assertEqual('/vms/root.vdi',
+                         vm_info[constants.DEFAULT_ROOT_ATTACH_POINT])
+        self.assertEqual({self._instance.name: power_state.RUNNING},
+                         vmutils.get_power_states())
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          manage.VBoxManage.start_vm, self._instance)
+
+        manage.VBoxManage.control_vm(self._instance,
+                                     constants.STATE_POWER_OFF)
+        manage.VBoxManage.unregister_vm(self._instance, delete=True)
+
+        self.assertEqual([], self._simulator.machines())
+        self.assertEqual(['/base.vdi'], self._simulator.media())
+        self.assertRaises(exception.InstanceNotFound,
+                          manage.VBoxManage.show_vm_info, self._instance)
+
+    def test_metrics(self):
+        self._create_vm()
+        manage.VBoxManage.start_vm(self._instance)
+        collector = perfmetrics.PerformanceCollector()
+
+        collector.collect()
+
+        self.assertEqual(set(), manage.VBoxManage.pop_started_vms())
+        self.assertEqual(1.0, collector.last_values(self._instance.name)[
+            constants.METRIC_CPU_LOAD_USER])
+        self.assertEqual(128 * 512,
+                         collector.memory_used(self._instance.name))
+        self.assertEqual(10.0, collector.last_values(
+            constants.METRICS_HOST)[constants.METRIC_CPU_LOAD_USER])
+
+    def test_disk_chain(self):
+        self._create_vm()
+        manage.VBoxManage.take_snapshot(self._instance, 'fake-snapshot')
+
+        chain = vhdutils.get_disk_chain(
+            vhdutils.get_controllers(self._instance)['SATA'][(0, 0)]['path'])
+        self.assertEqual(['/vms/root.vdi', '/base.vdi'],
+                         [disk[constants.VHD_PATH] for disk in chain[1:]])
+        self.assertEqual(2048 * 1024 * 1024,
+                         chain[0][constants.VHD_CAPACITY])
+
+        manage.VBoxManage.delete_snapshot(self._instance, 'fake-snapshot')
+        self.assertEqual(['/base.vdi', '/vms/root.vdi'],
+                         self._simulator.media())
+
+    def test_lock_errors(self):
+        self._create_vm()
+        self._simulator.lock_error_rate = 1
+
+        _, error = self._simulator.execute(
+            manage.VBoxManage.MODIFY_VM, self._instance.name, '--cpus', 2)
+        self.assertIn(constants.VBOX_E_INVALID_OBJECT_STATE, error)
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          manage.VBoxManage.storage_attach, self._instance,
+                          constants.DEFAULT_SATA_CNAME, 1, 0,
+                          constants.STORAGE_HDD, '/base.vdi')
+        self.assertEqual(
+            CONF.virtualbox.retry_count - 1,
+            manage.VBoxManage.get_metrics().stats()[
+                manage.VBoxManage.STORAGE_ATTACH]['retries'])
+
+    def test_convert_from_raw(self):
+        manage.VBoxManage.convert_from_raw(iter(["abc", "def"]),
+                                           '/converted.vdi', 6)
+        self.assertRaises(vbox_exc.VBoxManageError,
+                          manage.VBoxManage.convert_from_raw,
+                          iter(["abc"]), '/converted.vdi', 6)
+
+    @mock.patch('time.sleep')
+    def test_latency(self, mock_sleep):
+        self._simulator.latency = {manage.VBoxManage.LIST: 0.5}
+
+        self._simulator.execute(manage.VBoxManage.LIST, constants.VMS_INFO)
+
+        mock_sleep.assert_called_once_with(0.5)
+
+
+class BenchmarkTestCase(test.NoDBTestCase):
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(50, benchmark.percentile(values, 0.5))
+        self.assertEqual(99, benchmark.percentile(values, 0.99))
+        self.assertEqual(0.0, benchmark.percentile([], 0.5))
+
+    def test_run_benchmark(self):
+        backend = simulator.SimulatedVBoxManage()
+
+        report = benchmark.run_benchmark(builds=3, concurrency=2,
+                                         backend=backend)
+
+        for operation in benchmark.OPERATIONS:
+            self.assertEqual(3, report[operation]['count'])
+            self.assertEqual(0, report[operation]['errors'])
+        self.assertEqual([], backend.machines())
+        self.assertIn(manage.VBoxManage.CREATE_VM, report['commands'])
+        self.assertIn('spawn', benchmark.format_report(report))
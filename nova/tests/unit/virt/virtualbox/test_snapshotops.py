@@ -74,13 +74,13 @@ class SnapshotOperationsTestCase(test.NoDBTestCase):
     @mock.patch('os.path')
     @mock.patch('nova.virt.virtualbox.pathutils.export_dir')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.clone_hd')
-    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk_chain')
     @mock.patch('nova.virt.virtualbox.pathutils.get_root_disk_path')
-    def test_export_path(self, mock_root_disk, mock_disk_info, mock_clone_hd,
+    def test_export_path(self, mock_root_disk, mock_disk_chain, mock_clone_hd,
                          mock_export_dir, mock_os_path):
         mock_root_disk.return_value = mock.sentinel.current_disk
         mock_export_dir.return_value = mock.sentinel.export_dir
-        mock_disk_info.side_effect = [
+        mock_disk_chain.return_value = [
             # Information regarding the current disk
             {constants.VHD_PARENT_UUID: mock.sentinel.parent_uuid},
             {
@@ -96,20 +96,46 @@ class SnapshotOperationsTestCase(test.NoDBTestCase):
         self._snapshotops._export_disk(self._instance)
 
         mock_root_disk.assert_called_once_with(self._instance)
+        mock_disk_chain.assert_called_once_with(mock.sentinel.current_disk)
         self.assertEqual(2, mock_clone_hd.call_count)
 
+    @mock.patch('os.path')
+    @mock.patch('nova.virt.virtualbox.pathutils.export_dir')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.clone_hd')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk_chain')
+    @mock.patch('nova.virt.virtualbox.pathutils.get_root_disk_path')
+    def test_export_path_base_disk(self, mock_root_disk, mock_disk_chain,
+                                   mock_clone_hd, mock_export_dir,
+                                   mock_os_path):
+        mock_root_disk.return_value = mock.sentinel.current_disk
+        mock_export_dir.return_value = mock.sentinel.export_dir
+        mock_disk_chain.return_value = [
+            # Information regarding the current disk
+            {constants.VHD_PARENT_UUID: mock.sentinel.parent_uuid},
+            {
+                # Information regarding the root disk
+                constants.VHD_PATH: mock.sentinel.disk_path,
+                constants.VHD_PARENT_UUID: None,
+                constants.VHD_IMAGE_TYPE: mock.sentinel.image_type,
+            },
+        ]
+
+        self._snapshotops._export_disk(self._instance)
+
+        self.assertEqual(1, mock_clone_hd.call_count)
+
     @mock.patch('os.path')
     @mock.patch('nova.virt.virtualbox.pathutils.export_dir')
     @mock.patch('nova.virt.virtualbox.snapshotops.SnapshotOperations'
                 '._clenup_disk')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.clone_hd')
-    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk_chain')
     @mock.patch('nova.virt.virtualbox.pathutils.get_root_disk_path')
-    def test_export_path_fail(self, mock_root_disk, mock_disk_info,
+    def test_export_path_fail(self, mock_root_disk, mock_disk_chain,
                               mock_clone_hd, mock_clenup_disk,
                               mock_export_dir, mock_os_path):
         mock_root_disk.return_value = mock.sentinel.current_disk
-        mock_disk_info.side_effect = [
+        mock_disk_chain.return_value = [
             # Information regarding the current disk
             {constants.VHD_PARENT_UUID: mock.sentinel.parent_uuid},
             {
@@ -120,7 +146,7 @@ class SnapshotOperationsTestCase(test.NoDBTestCase):
             },
             # Information regarding the parrent disk of root disk
             {constants.VHD_PATH: mock.sentinel.base_path}
-        ] * 2
+        ]
 
         mock_clone_hd.side_effect = [
             vbox_exc.VBoxException("fake_error"),
@@ -142,15 +168,178 @@ class SnapshotOperationsTestCase(test.NoDBTestCase):
                           self._snapshotops._export_disk,
                           self._instance)
 
+    @mock.patch('nova.virt.virtualbox.diskstream.ChunkReader')
+    @mock.patch('nova.virt.virtualbox.diskstream.compress')
+    @mock.patch('nova.virt.virtualbox.diskstream.vdi_stream')
+    @mock.patch('nova.image.glance.get_remote_image_service')
+    def test_stream_glance_image(self, mock_get_remote_image_service,
+                                 mock_vdi_stream, mock_compress,
+                                 mock_chunk_reader):
+        self.flags(snapshot_compression=True, group='virtualbox')
+        glance_image_service = mock.MagicMock()
+        mock_get_remote_image_service.return_value = (glance_image_service,
+                                                      mock.sentinel.image_id)
+
+        self._snapshotops._stream_glance_image(
+            self._context, mock.sentinel.image_id, mock.sentinel.flat_disk)
+
+        mock_vdi_stream.assert_called_once_with(mock.sentinel.flat_disk,
+                                                parent_uuid=None)
+        mock_compress.assert_called_once_with(mock_vdi_stream.return_value)
+        mock_chunk_reader.assert_called_once_with(mock_compress.return_value)
+        image_metadata = fake.FakeInput.image_metadata()
+        image_metadata["properties"] = {
+            constants.IMAGE_PROPERTY_COMPRESSION: constants.COMPRESSION_GZIP}
+        glance_image_service.update.assert_called_once_with(
+            self._context, mock.sentinel.image_id, image_metadata,
+            mock_chunk_reader.return_value)
+
+    @mock.patch('nova.virt.virtualbox.diskstream.ChunkReader')
+    @mock.patch('nova.virt.virtualbox.diskstream.vdi_stream')
+    @mock.patch('nova.image.glance.get_remote_image_service')
+    def test_stream_glance_image_incremental(self,
+                                             mock_get_remote_image_service,
+                                             mock_vdi_stream,
+                                             mock_chunk_reader):
+        glance_image_service = mock.MagicMock()
+        mock_get_remote_image_service.return_value = (glance_image_service,
+                                                      mock.sentinel.image_id)
+
+        self._snapshotops._stream_glance_image(
+            self._context, mock.sentinel.image_id, mock.sentinel.flat_disk,
+            (mock.sentinel.parent_uuid, {"fake-property": "fake-value"}))
+
+        mock_vdi_stream.assert_called_once_with(
+            mock.sentinel.flat_disk, parent_uuid=mock.sentinel.parent_uuid)
+        image_metadata = fake.FakeInput.image_metadata()
+        image_metadata["properties"] = {"fake-property": "fake-value"}
+        glance_image_service.update.assert_called_once_with(
+            self._context, mock.sentinel.image_id, image_metadata,
+            mock_chunk_reader.return_value)
+
+    @mock.patch('nova.virt.images.get_info')
+    @mock.patch('nova.virt.virtualbox.pathutils.base_disk_path')
+    def _test_get_parent(self, mock_base_disk_path, mock_get_info,
+                         disk_chain=None, image_properties=None):
+        self.flags(incremental_snapshots=True, group='virtualbox')
+        mock_base_disk_path.return_value = '/fake/_base/fake-image'
+        mock_get_info.return_value = {"properties": image_properties or {}}
+        if disk_chain is None:
+            disk_chain = [
+                {constants.VHD_PATH: mock.sentinel.current_disk},
+                {constants.VHD_PATH: mock.sentinel.root_disk},
+                {constants.VHD_PATH: '/fake/_base/fake-image.vdi',
+                 constants.VHD_UUID: mock.sentinel.parent_uuid},
+            ]
+        return self._snapshotops._get_parent(self._context, self._instance,
+                                             disk_chain)
+
+    def test_get_parent(self):
+        self._instance.image_ref = 'fake-image'
+        parent = self._test_get_parent(image_properties={
+            constants.IMAGE_PROPERTY_CHAIN: "base-image"})
+
+        self.assertEqual(
+            (mock.sentinel.parent_uuid,
+             {constants.IMAGE_PROPERTY_PARENT: 'fake-image',
+              constants.IMAGE_PROPERTY_CHAIN: 'base-image,fake-image'}),
+            parent)
+
+    def test_get_parent_full_clone(self):
+        self.assertIsNone(self._test_get_parent(disk_chain=[
+            {constants.VHD_PATH: mock.sentinel.current_disk},
+            {constants.VHD_PATH: mock.sentinel.root_disk},
+        ]))
+
+    def test_get_parent_not_cached(self):
+        self.assertIsNone(self._test_get_parent(disk_chain=[
+            {constants.VHD_PATH: mock.sentinel.current_disk},
+            {constants.VHD_PATH: mock.sentinel.root_disk},
+            {constants.VHD_PATH: '/fake/other-disk.vdi'},
+        ]))
+
+    def test_get_parent_disabled(self):
+        self.assertIsNone(self._snapshotops._get_parent(
+            self._context, self._instance, mock.sentinel.disk_chain))
+
+    @mock.patch('nova.virt.virtualbox.snapshotops.SnapshotOperations.'
+                '_get_parent')
+    @mock.patch('nova.virt.virtualbox.diskstream.FlatDisk')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk_chain')
+    @mock.patch('nova.virt.virtualbox.pathutils.get_root_disk_path')
+    def test_open_flat_disk(self, mock_root_disk, mock_disk_chain,
+                            mock_flat_disk, mock_get_parent):
+        mock_disk_chain.return_value = [
+            {constants.VHD_PATH: mock.sentinel.current_disk},
+            {constants.VHD_PATH: mock.sentinel.root_disk},
+            {constants.VHD_PATH: mock.sentinel.base_disk},
+        ]
+
+        response = self._snapshotops._open_flat_disk(self._context,
+                                                     self._instance)
+
+        self.assertEqual((mock_flat_disk.return_value,
+                          mock_get_parent.return_value), response)
+        mock_flat_disk.assert_called_once_with([mock.sentinel.root_disk,
+                                                mock.sentinel.base_disk])
+        mock_get_parent.assert_called_once_with(
+            self._context, self._instance, mock_disk_chain.return_value)
+
+    @mock.patch('nova.virt.virtualbox.diskstream.FlatDisk')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk_chain')
+    @mock.patch('nova.virt.virtualbox.pathutils.get_root_disk_path')
+    def test_open_flat_disk_unsupported(self, mock_root_disk,
+                                       mock_disk_chain, mock_flat_disk):
+        mock_disk_chain.return_value = [
+            {constants.VHD_PATH: mock.sentinel.current_disk},
+            {constants.VHD_PATH: mock.sentinel.root_disk},
+        ]
+        mock_flat_disk.side_effect = vbox_exc.UnsupportedDiskImage(
+            path=mock.sentinel.root_disk, reason="n/a")
+
+        self.assertEqual((None, None), self._snapshotops._open_flat_disk(
+            self._context, self._instance))
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.take_snapshot')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.delete_snapshot')
+    @mock.patch('nova.virt.virtualbox.snapshotops.SnapshotOperations.'
+                '_stream_glance_image')
+    @mock.patch('nova.virt.virtualbox.snapshotops.SnapshotOperations.'
+                '_export_disk')
+    @mock.patch('nova.virt.virtualbox.snapshotops.SnapshotOperations.'
+                '_open_flat_disk')
+    def test_take_snapshot_stream(self, mock_open_flat_disk,
+                                  mock_export_disk, mock_stream_glance_image,
+                                  mock_delete_snapshot, mock_take_snapshot):
+        mock_update = mock.MagicMock()
+        flat_disk = mock.MagicMock()
+        mock_open_flat_disk.return_value = (flat_disk, mock.sentinel.parent)
+
+        self._snapshotops.take_snapshot(context=self._context,
+                                        instance=self._instance,
+                                        image_id=mock.sentinel.image_id,
+                                        update_task_state=mock_update)
+
+        self.assertFalse(mock_export_disk.called)
+        mock_stream_glance_image.assert_called_once_with(
+            self._context, mock.sentinel.image_id, flat_disk,
+            mock.sentinel.parent)
+        self.assertTrue(flat_disk.__exit__.called)
+        self.assertEqual(1, mock_delete_snapshot.call_count)
+
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.take_snapshot')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.delete_snapshot')
     @mock.patch('nova.virt.virtualbox.snapshotops.SnapshotOperations.'
                 '_save_glance_image')
     @mock.patch('nova.virt.virtualbox.snapshotops.SnapshotOperations.'
                 '_export_disk')
-    def test_take_snapshot(self, mock_export_disk, mock_save_glance_image,
-                           mock_delete_snapshot, mock_take_snapshot):
+    @mock.patch('nova.virt.virtualbox.snapshotops.SnapshotOperations.'
+                '_open_flat_disk')
+    def test_take_snapshot(self, mock_open_flat_disk, mock_export_disk,
+                           mock_save_glance_image, mock_delete_snapshot,
+                           mock_take_snapshot):
         mock_update = mock.MagicMock()
+        mock_open_flat_disk.return_value = (None, None)
         mock_export_disk.return_value = mock.sentinel.export_path
         mock_delete_snapshot.side_effect = [
             vbox_exc.VBoxManageError(method="delete_snapshot", reason="n/a")
@@ -163,6 +352,8 @@ class SnapshotOperationsTestCase(test.NoDBTestCase):
 
         self.assertEqual(1, mock_take_snapshot.call_count)
         mock_export_disk.assert_called_once_with(self._instance)
+        mock_save_glance_image.assert_called_once_with(
+            self._context, mock.sentinel.image_id, mock.sentinel.export_path)
         mock_update.has_calls(
             mock.call(task_state=task_states.IMAGE_PENDING_UPLOAD),
             mock.call(task_state=task_states.IMAGE_UPLOADING,
@@ -23,6 +23,7 @@ from nova.tests.unit.virt.virtualbox import fake
 from nova.virt.virtualbox import constants
 from nova.virt.virtualbox import exception as vbox_exception
 from nova.virt.virtualbox import vhdutils
+from nova.virt.virtualbox import vminfo
 
 
 class VHDUtilsTestCase(test.NoDBTestCase):
@@ -92,71 +93,70 @@ class VHDUtilsTestCase(test.NoDBTestCase):
                          vhdutils.get_controller_disks("SATA", instance_info))
 
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
-    @mock.patch('nova.virt.virtualbox.vhdutils.get_controller_disks')
-    def test_get_controllers(self, mock_controller_disks, mock_vm_info):
-        mock_controller_disks.return_value = mock.sentinel.disks
-        mock_vm_info.return_value = {
-            'storagecontrollername1': fake.FAKE_SYSTEM_BUS_IDE,
-            'storagecontrollername2': fake.FAKE_SYSTEM_BUS_SATA,
-            'storagecontrollername3': fake.FAKE_SYSTEM_BUS_SCSI,
+    def test_get_controllers(self, mock_vm_info):
+        mock_vm_info.return_value = vminfo.VMInfo({
+            'storagecontrollername0': fake.FAKE_SYSTEM_BUS_IDE,
+            'storagecontrollername1': fake.FAKE_SYSTEM_BUS_SATA,
+            '%s-0-0' % fake.FAKE_SYSTEM_BUS_SATA: mock.sentinel.path,
+            '%s-ImageUUID-0-0' % fake.FAKE_SYSTEM_BUS_SATA: mock.sentinel.uuid,
             'key': None
+        })
+        controllers = {
+            fake.FAKE_SYSTEM_BUS_IDE: {},
+            fake.FAKE_SYSTEM_BUS_SATA: {(0, 0): {"path": mock.sentinel.path,
+                                                 "uuid": mock.sentinel.uuid}},
         }
-        controllers = {fake.FAKE_SYSTEM_BUS_IDE: mock.sentinel.disks,
-                       fake.FAKE_SYSTEM_BUS_SATA: mock.sentinel.disks,
-                       fake.FAKE_SYSTEM_BUS_SCSI: mock.sentinel.disks}
         response = vhdutils.get_controllers(self._instance)
 
         mock_vm_info.assert_called_once_with(self._instance)
-        self.assertEqual(len(controllers), mock_controller_disks.call_count)
         self.assertEqual(controllers, response)
 
-    @mock.patch('nova.virt.virtualbox.vhdutils.get_controllers')
-    def test_get_available_attach_point(self, mock_get_controllers):
-        mock_get_controllers.return_value = {
-            mock.sentinel.controller: {
-                (0, 0): {"path": mock.sentinel.path,
-                         "uuid": mock.sentinel.uuid},
-                (1, 0): {"path": None,
-                         "uuid": None},
-            }
-        }
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    def test_get_available_attach_point(self, mock_vm_info):
+        mock_vm_info.return_value = vminfo.VMInfo({
+            'storagecontrollername0': 'SATA',
+            'SATA-0-0': mock.sentinel.path,
+            'SATA-ImageUUID-0-0': mock.sentinel.uuid,
+            'SATA-1-0': None,
+            'SATA-2-0': None,
+        })
 
         attach_point = vhdutils.get_available_attach_point(
-            self._instance, mock.sentinel.controller)
+            self._instance, 'SATA')
 
         self.assertEqual((1, 0), attach_point)
 
-    @mock.patch('nova.virt.virtualbox.vhdutils.get_controllers')
-    def test_get_available_attach_point_fail(self, mock_get_controllers):
-        mock_get_controllers.return_value = {
-            mock.sentinel.controller: {
-                (0, 0): {"path": mock.sentinel.path,
-                         "uuid": mock.sentinel.uuid},
-                (1, 0): {"path": mock.sentinel.path,
-                         "uuid": mock.sentinel.uuid}
-            }
-        }
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    def test_get_available_attach_point_fail(self, mock_vm_info):
+        mock_vm_info.return_value = vminfo.VMInfo({
+            'storagecontrollername0': 'SATA',
+            'SATA-0-0': mock.sentinel.path,
+            'SATA-ImageUUID-0-0': mock.sentinel.uuid,
+            'SATA-1-0': mock.sentinel.path,
+            'SATA-ImageUUID-1-0': mock.sentinel.alt_uuid,
+        })
 
         self.assertRaises(vbox_exception.VBoxException,
                           vhdutils.get_available_attach_point,
-                          self._instance, mock.sentinel.invalid)
+                          self._instance, 'IDE')
         self.assertRaises(vbox_exception.VBoxException,
                           vhdutils.get_available_attach_point,
-                          self._instance, mock.sentinel.controller)
+                          self._instance, 'SATA')
 
-    @mock.patch('nova.virt.virtualbox.vhdutils.get_controller_disks')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
-    def test_get_attach_point(self, mock_vm_info, mock_controller_disks):
-        mock_vm_info.return_value = mock.sentinel.instance_info
-        mock_controller_disks.return_value = {
-            (0, 0): {"path": mock.sentinel.path,
-                     "uuid": mock.sentinel.uuid}
-        }
+    def test_get_attach_point(self, mock_vm_info):
+        mock_vm_info.return_value = vminfo.VMInfo({
+            'storagecontrollername0': 'SATA',
+            'SATA-0-0': mock.sentinel.path,
+            'SATA-ImageUUID-0-0': mock.sentinel.uuid,
+        })
 
         self.assertEqual((0, 0), vhdutils.get_attach_point(
             self._instance, "SATA", mock.sentinel.uuid))
         self.assertIsNone(vhdutils.get_attach_point(
             self._instance, "SATA", mock.sentinel.alt_uuid))
+        self.assertIsNone(vhdutils.get_attach_point(
+            self._instance, "IDE", mock.sentinel.uuid))
 
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list')
     def test_get_hard_disks(self, mock_list_hdds):
@@ -168,6 +168,42 @@ class VHDUtilsTestCase(test.NoDBTestCase):
 
         self.assertEqual({"uuid_disk_1": {}, "uuid_disk_2": {}},
                          response)
+        mock_list_hdds.assert_called_once_with(constants.HDDS_INFO,
+                                               long_format=True)
+
+    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_hard_disks')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_medium_registry')
+    def test_get_disk(self, mock_registry, mock_get_hard_disks,
+                      mock_disk_info):
+        response = vhdutils.get_disk(mock.sentinel.disk)
+
+        mock_registry.return_value.reconcile.assert_called_once_with(
+            mock_get_hard_disks)
+        mock_registry.return_value.get.assert_called_once_with(
+            mock.sentinel.disk, mock_disk_info)
+        self.assertEqual(mock_registry.return_value.get.return_value,
+                         response)
+
+    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_medium_registry')
+    def test_get_disk_chain(self, mock_registry, mock_disk_info):
+        response = vhdutils.get_disk_chain(mock.sentinel.disk)
+
+        mock_registry.return_value.chain.assert_called_once_with(
+            mock.sentinel.disk, mock_disk_info)
+        self.assertEqual(mock_registry.return_value.chain.return_value,
+                         response)
+
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_hard_disks')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_medium_registry')
+    def test_is_registered(self, mock_registry, mock_get_hard_disks):
+        response = vhdutils.is_registered(mock.sentinel.disk)
+
+        mock_registry.return_value.registered.assert_called_once_with(
+            mock.sentinel.disk, mock_get_hard_disks)
+        self.assertEqual(mock_registry.return_value.registered.return_value,
+                         response)
 
     @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
     def test_get_image_type(self, mock_disk_info):
@@ -0,0 +1,96 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import textwrap
+
+from nova.compute import power_state
+from nova import test
+from nova.tests.unit.virt.virtualbox import fake
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import vminfo
+
+
+class VMInfoTestCase(test.NoDBTestCase):
+
+    _OUTPUT = textwrap.dedent("""
+        name="instance-00000001"
+        VMState="running"
+        memory=512
+        vrdeports="3389"
+        storagecontrollername0="IDE"
+        storagecontrollername1="SATA"
+        "IDE-0-0"="none"
+        "SATA-0-0"="/instances/root.vdi"
+        "SATA-ImageUUID-0-0"="root-uuid"
+        "SATA-1-0"="/instances/ephemeral.vdi"
+        "SATA-ImageUUID-1-0"="ephemeral-uuid"
+        "SATA-2-0"="none"
+        "SATA-3-0"="none"
+        SnapshotName-1="snapshot-1"
+        invalid line
+    """)
+
+    def setUp(self):
+        super(VMInfoTestCase, self).setUp()
+        self._vm_info = vminfo.VMInfo.parse(self._OUTPUT)
+
+    def test_parse(self):
+        self.assertEqual("instance-00000001", self._vm_info["name"])
+        self.assertEqual("512", self._vm_info.get(constants.VM_MEMORY))
+        self.assertIsNone(self._vm_info["IDE-0-0"])
+        self.assertNotIn("invalid line", self._vm_info)
+        self.assertEqual("running", self._vm_info.state)
+        self.assertEqual(power_state.RUNNING, self._vm_info.power_state)
+        self.assertEqual(3389, self._vm_info.vrde_port)
+
+    def test_mapping(self):
+        information = dict(self._vm_info)
+
+        self.assertEqual(information, self._vm_info)
+        self.assertEqual(len(information), len(self._vm_info))
+        self.assertIs(self._vm_info, self._vm_info.copy())
+        self.assertIs(self._vm_info, vminfo.VMInfo.wrap(self._vm_info))
+        self.assertEqual(self._vm_info, vminfo.VMInfo.wrap(information))
+        self.assertRaises(AttributeError, setattr, self._vm_info,
+                          "fake_attribute", None)
+
+    def test_controllers(self):
+        controllers = self._vm_info.controllers()
+
+        self.assertEqual({(0, 0): {"path": None, "uuid": None}},
+                         controllers["IDE"])
+        self.assertEqual({"path": "/instances/ephemeral.vdi",
+                          "uuid": "ephemeral-uuid"},
+                         controllers["SATA"][(1, 0)])
+        self.assertEqual(4, len(controllers["SATA"]))
+        self.assertEqual({}, self._vm_info.controller_disks("SCSI"))
+
+    def test_attach_points(self):
+        self.assertEqual((2, 0), self._vm_info.available_attach_point("SATA"))
+        self.assertEqual((0, 0), self._vm_info.available_attach_point("IDE"))
+        self.assertIsNone(self._vm_info.available_attach_point("SCSI"))
+        self.assertEqual((1, 0), self._vm_info.attach_point(
+            "SATA", "ephemeral-uuid"))
+        self.assertIsNone(self._vm_info.attach_point("IDE", "root-uuid"))
+
+    def test_nics(self):
+        vm_info = vminfo.VMInfo.parse(fake.FakeVBoxManage.network_info())
+
+        nic_status = vm_info.nic_status()
+        self.assertEqual(8, len(nic_status))
+        self.assertEqual([1, 2, 3], sorted(index for index in nic_status
+                                           if nic_status[index]))
+        self.assertEqual(4, vm_info.available_nic())
+        self.assertIsNone(self._vm_info.available_nic())
@@ -13,15 +13,21 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
 import mock
+from oslo_serialization import jsonutils
 from oslo_utils import units
 
 from nova import exception
 from nova import test
 from nova.tests.unit import fake_instance
+from nova.tests.unit.virt.virtualbox import fake
+from nova.virt.virtualbox import cache
 from nova.virt.virtualbox import constants
 from nova.virt.virtualbox import exception as vbox_exception
+from nova.virt.virtualbox import manage
 from nova.virt.virtualbox import vmops
+from nova.virt.virtualbox import vmpool
 
 
 class VBoxOperationTestCase(test.NoDBTestCase):
@@ -47,22 +53,28 @@ class VBoxOperationTestCase(test.NoDBTestCase):
                                                          **instance_values)
         self._vbox_ops = vmops.VBoxOperation()
 
+        patcher = mock.patch.object(manage.VBoxManage, '_vm_registry', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list')
     def test_inaccessible_vms(self, mock_list):
-        mock_list.side_effect = [
-            '"<inaccessible>" %(fake_uuid)s' % {
-                'fake_uuid': self._FAKE_VM_UUID},
-            'invalid-line']
+        mock_list.return_value = (
+            '"<inaccessible>" {%(fake_uuid)s}\n'
+            '"%(fake_vm)s" {fake-other-uuid}' % {
+                'fake_uuid': self._FAKE_VM_UUID,
+                'fake_vm': self._FAKE_VM_NAME})
 
         self.assertEqual([self._FAKE_VM_UUID],
                          self._vbox_ops._inaccessible_vms())
-        self.assertEqual([], self._vbox_ops._inaccessible_vms())
 
+    @mock.patch('nova.virt.virtualbox.vmpool.VMPool.init_host')
     @mock.patch('os.path.exists')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_vm_registry')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
     @mock.patch('nova.virt.virtualbox.vhdutils.get_hard_disks')
     def test_init_host(self, mock_get_hard_disks, mock_close_medium,
-                       mock_exists):
+                       mock_vm_registry, mock_exists, mock_pool_init_host):
         mock_exists.return_value = False
         mock_get_hard_disks.return_value = {
             mock.sentinel.uuid: {
@@ -72,19 +84,30 @@ class VBoxOperationTestCase(test.NoDBTestCase):
         }
         self._vbox_ops.init_host()
 
+        mock_vm_registry.assert_called_once_with(refresh=True)
         mock_close_medium.assert_called_once_with(constants.MEDIUM_DISK,
                                                   mock.sentinel.uuid)
+        mock_pool_init_host.assert_called_once_with()
 
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list')
     def test_list_vms(self, mock_list):
-        mock_list.side_effect = [
-            '"{fake_vm}" {{{fake_uuid}}}'.format(fake_vm=self._FAKE_VM_NAME,
-                                                 fake_uuid=self._FAKE_VM_UUID),
-            'invalid-line']
+        mock_list.return_value = (
+            '"{fake_vm}" {{{fake_uuid}}}\ninvalid-line'.format(
+                fake_vm=self._FAKE_VM_NAME, fake_uuid=self._FAKE_VM_UUID))
 
         self.assertEqual({self._FAKE_VM_NAME: self._FAKE_VM_UUID},
                          self._vbox_ops._list_vms())
-        self.assertEqual({}, self._vbox_ops._list_vms())
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list')
+    def test_list_vms_pooled(self, mock_list):
+        mock_list.return_value = (
+            '"{fake_vm}" {{{fake_uuid}}}\n"nova-pool-1" {{pool-uuid}}'.format(
+                fake_vm=self._FAKE_VM_NAME, fake_uuid=self._FAKE_VM_UUID))
+        manage.VBoxManage.get_vm_registry().set_instance_uuid(
+            self._FAKE_VM_UUID, mock.sentinel.instance_uuid)
+
+        self.assertEqual({self._FAKE_VM_NAME: mock.sentinel.instance_uuid},
+                         self._vbox_ops._list_vms())
 
     @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation._list_vms')
     def test_list_instances(self, mock_list_vms):
@@ -103,26 +126,119 @@ class VBoxOperationTestCase(test.NoDBTestCase):
     def test_instance_exists(self, mock_list):
         mock_list.side_effect = [
             '"fake_vm1" {fake_uuid1}\n"fake_vm2": {fake_uuid2}\n',
-            'invalid-line',
             '"{fake_vm}" {{{fake_uuid}}}'.format(fake_vm=self._instance.name,
                                                  fake_uuid=self._FAKE_VM_UUID)
         ]
         self.assertFalse(self._vbox_ops.instance_exists(self._instance))
-        self.assertFalse(self._vbox_ops.instance_exists(self._instance))
-        self.assertTrue(self._vbox_ops.instance_exists(self._instance))
+
+        # The virtual machines are listed only when the index is rebuilt.
+        manage.VBoxManage.get_vm_registry(refresh=True)
+        for _ in range(2):
+            self.assertTrue(self._vbox_ops.instance_exists(self._instance))
+        self.assertEqual(2, mock_list.call_count)
 
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
     def test_get_info(self, mock_vm_info):
         mock_vm_info.return_value = {
             constants.VM_POWER_STATE: constants.STATE_POWER_OFF,
-            constants.VM_CPUS: mock.sentinel.cpus,
-            constants.VM_MEMORY: mock.sentinel.memory
+            constants.VM_CPUS: '2',
+            constants.VM_MEMORY: '512'
         }
         response = self._vbox_ops.get_info(self._instance)
 
         mock_vm_info.assert_called_once_with(self._instance)
-        self.assertEqual(mock.sentinel.cpus, response.num_cpu)
-        self.assertEqual(mock.sentinel.memory, response.mem_kb)
+        self.assertEqual(2, response.num_cpu)
+        self.assertEqual(512 * units.Ki, response.max_mem_kb)
+        self.assertEqual(512 * units.Ki, response.mem_kb)
+        self.assertEqual(0, response.cpu_time_ns)
+
+    @mock.patch('nova.virt.virtualbox.perfmetrics.get_collector')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    def test_get_info_metrics(self, mock_vm_info, mock_get_collector):
+        mock_vm_info.return_value = {
+            constants.VM_POWER_STATE: 'running',
+            constants.VM_CPUS: '1',
+            constants.VM_MEMORY: '512'
+        }
+        collector = mock_get_collector.return_value
+        collector.memory_used.return_value = 1024
+        collector.counters.return_value = {'user': 30, 'kernel': 12}
+
+        response = self._vbox_ops.get_info(self._instance)
+
+        collector.memory_used.assert_called_once_with(self._instance.name)
+        collector.counters.assert_called_once_with(self._instance.name)
+        self.assertEqual(1024, response.mem_kb)
+        self.assertEqual(42, response.cpu_time_ns)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_metrics')
+    @mock.patch('nova.virt.virtualbox.perfmetrics.get_collector')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    def test_get_diagnostics(self, mock_vm_info, mock_get_collector,
+                             mock_get_metrics):
+        mock_vm_info.return_value = {constants.VM_MEMORY: '512'}
+        mock_get_metrics.return_value.summary.return_value = {
+            'vboxmanage_showvminfo_calls': 3}
+        collector = mock_get_collector.return_value
+        collector.last_values.return_value = {
+            constants.METRIC_NET_RATE_RX: 100.0,
+            constants.METRIC_DISK_USED: 2048.0,
+        }
+        collector.counters.return_value = {'user': 30, 'rx': 4096.0}
+        collector.memory_used.return_value = None
+
+        diagnostics = self._vbox_ops.get_diagnostics(self._instance)
+
+        self.assertEqual(30, diagnostics['cpu_time'])
+        self.assertEqual(512 * units.Ki, diagnostics['memory'])
+        self.assertEqual(0, diagnostics['memory_used'])
+        self.assertEqual(4096, diagnostics['net_rx'])
+        self.assertEqual(100.0, diagnostics['net_rx_rate'])
+        self.assertEqual(2048.0, diagnostics['disk_used_mb'])
+        self.assertEqual(3, diagnostics['vboxmanage_showvminfo_calls'])
+
+    @mock.patch('nova.virt.virtualbox.perfmetrics.get_collector')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    def test_get_instance_diagnostics(self, mock_vm_info,
+                                      mock_get_collector):
+        mock_vm_info.return_value = {
+            constants.VM_POWER_STATE: 'running',
+            constants.VM_MEMORY: '512',
+            constants.VM_MAC_ADDRESS % {'index': 1}: '080027ABCDEF',
+        }
+        collector = mock_get_collector.return_value
+        collector.counters.return_value = {'user': 30, 'kernel': 12,
+                                           'rx': 100.0, 'tx': 50.0}
+        collector.memory_used.return_value = 256 * units.Ki
+
+        diagnostics = self._vbox_ops.get_instance_diagnostics(
+            self._instance).serialize()
+
+        self.assertEqual('running', diagnostics['state'])
+        self.assertEqual('virtualbox', diagnostics['driver'])
+        self.assertEqual([{'time': 42}], diagnostics['cpu_details'])
+        self.assertEqual(1, len(diagnostics['nic_details']))
+        nic = diagnostics['nic_details'][0]
+        self.assertEqual('08:00:27:ab:cd:ef', nic['mac_address'])
+        self.assertEqual(100, nic['rx_octets'])
+        self.assertEqual(50, nic['tx_octets'])
+        self.assertEqual({'maximum': 512, 'used': 256},
+                         diagnostics['memory_details'])
+
+    @mock.patch('nova.virt.virtualbox.vmutils.get_power_states')
+    def test_get_power_states(self, mock_power_states):
+        missing_instance = mock.Mock()
+        missing_instance.name = 'fake-missing-name'
+        mock_power_states.return_value = {
+            self._instance.name: mock.sentinel.power_state,
+            'fake-other-name': mock.sentinel.other_power_state,
+        }
+
+        response = self._vbox_ops.get_power_states([self._instance,
+                                                    missing_instance])
+
+        self.assertEqual({self._instance.uuid: mock.sentinel.power_state},
+                         response)
 
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.control_vm')
     def test_pause(self, mock_control_vm):
@@ -146,7 +262,10 @@ class VBoxOperationTestCase(test.NoDBTestCase):
                                                 constants.STATE_SUSPEND)
 
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.start_vm')
-    def test_resume(self, mock_start_vm):
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    def test_resume(self, mock_vm_info, mock_start_vm):
+        mock_vm_info.return_value = {}
+
         self._vbox_ops.resume(self._instance)
 
         mock_start_vm.assert_called_once_with(self._instance)
@@ -181,11 +300,32 @@ class VBoxOperationTestCase(test.NoDBTestCase):
         self._vbox_ops.power_off(self._instance, timeout=1)
         self.assertEqual(2, mock_control_vm.call_count)
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.modify_teleporter')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.start_vm')
-    def test_power_on(self, mock_start_vm):
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    def test_power_on(self, mock_vm_info, mock_start_vm,
+                      mock_modify_teleporter):
+        mock_vm_info.return_value = {
+            constants.VM_TELEPORTER: constants.OFF}
+
         self._vbox_ops.power_on(self._instance)
 
         mock_start_vm.assert_called_once_with(self._instance)
+        self.assertFalse(mock_modify_teleporter.called)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.modify_teleporter')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.start_vm')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    def test_power_on_teleporter_enabled(self, mock_vm_info, mock_start_vm,
+                                         mock_modify_teleporter):
+        mock_vm_info.return_value = {
+            constants.VM_TELEPORTER: constants.ON}
+
+        self._vbox_ops.power_on(self._instance)
+
+        mock_modify_teleporter.assert_called_once_with(
+            self._instance, constants.FIELD_TELEPORTER, constants.OFF)
+        mock_start_vm.assert_called_once_with(self._instance)
 
     @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.power_on')
     @mock.patch('nova.virt.virtualbox.vmutils.soft_shutdown')
@@ -231,7 +371,7 @@ class VBoxOperationTestCase(test.NoDBTestCase):
     @mock.patch('nova.virt.virtualbox.vhdutils.get_image_type')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.create_hd')
     @mock.patch('nova.virt.virtualbox.pathutils.root_disk_path')
-    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
     @mock.patch('nova.virt.virtualbox.imagecache.get_cached_image')
     def test_create_root_disk(self, mock_get_cached_image, mock_disk_info,
                               mock_root_disk, mock_create_hd,
@@ -263,7 +403,7 @@ class VBoxOperationTestCase(test.NoDBTestCase):
     @mock.patch('nova.virt.virtualbox.vhdutils.get_image_type')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.clone_hd')
     @mock.patch('nova.virt.virtualbox.pathutils.root_disk_path')
-    @mock.patch('nova.virt.virtualbox.vhdutils.disk_info')
+    @mock.patch('nova.virt.virtualbox.vhdutils.get_disk')
     @mock.patch('nova.virt.virtualbox.imagecache.get_cached_image')
     def test_create_root_disk_cloned(self, mock_get_cached_image,
                                      mock_disk_info, mock_root_disk,
@@ -304,6 +444,7 @@ class VBoxOperationTestCase(test.NoDBTestCase):
     @mock.patch('nova.virt.virtualbox.pathutils.ephemeral_vhd_path')
     def test_create_ephemeral_disk(self, mock_ephemeral_vhd_path,
                                    mock_create_hd, mock_modify_hd):
+        self.flags(use_cow_images=False)
         mock_ephemeral_vhd_path.return_value = mock.sentinel.eph_vhd_path
         eph_vhd_path = self._vbox_ops.create_ephemeral_disk(self._instance)
 
@@ -327,12 +468,40 @@ class VBoxOperationTestCase(test.NoDBTestCase):
 
         self.assertEqual(mock.sentinel.eph_vhd_path, eph_vhd_path)
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.modify_hd')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.create_hd')
+    @mock.patch('nova.virt.virtualbox.imagecache.get_ephemeral_template')
+    @mock.patch('nova.virt.virtualbox.pathutils.ephemeral_vhd_path')
+    def test_create_ephemeral_disk_cow(self, mock_ephemeral_vhd_path,
+                                       mock_get_template, mock_create_hd,
+                                       mock_modify_hd):
+        self.flags(use_cow_images=True)
+        mock_ephemeral_vhd_path.return_value = mock.sentinel.eph_vhd_path
+        mock_get_template.return_value = mock.sentinel.template_path
+
+        eph_vhd_path = self._vbox_ops.create_ephemeral_disk(self._instance)
+
+        mock_get_template.assert_called_once_with(
+            self._instance.ephemeral_gb, constants.DEFAULT_DISK_FORMAT)
+        mock_create_hd.assert_called_once_with(
+            filename=mock.sentinel.eph_vhd_path,
+            disk_format=constants.DEFAULT_DISK_FORMAT,
+            variant=constants.VARIANT_STANDARD,
+            parent=mock.sentinel.template_path)
+        # The differencing disk is not immutable, so it is not reset
+        # when the virtual machine is started.
+        self.assertFalse(mock_modify_hd.called)
+        self.assertEqual(mock.sentinel.eph_vhd_path, eph_vhd_path)
+
     def test_create_ephemeral_disk_fail(self):
         self._instance.ephemeral_gb = 0
 
         self.assertIsNone(self._vbox_ops.create_ephemeral_disk(
             self._instance))
 
+    @mock.patch('nova.virt.virtualbox.vmpool.VMPool.take')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.modify_vm')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_storage_controllers')
     @mock.patch('os.path.dirname')
     @mock.patch('nova.virt.virtualbox.pathutils.instance_basepath')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.create_vm')
@@ -342,7 +511,9 @@ class VBoxOperationTestCase(test.NoDBTestCase):
     @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation._network_setup')
     def test_create_instance(self, mock_network, mock_os_type, mock_memory,
                              mock_cpus, mock_create_vm, mock_basepath,
-                             mock_dirname):
+                             mock_dirname, mock_set_controllers,
+                             mock_modify_vm, mock_take):
+        mock_take.return_value = None
         mock_basepath.return_value = mock.sentinel.path
         mock_dirname.return_value = mock.sentinel.dirname
         image_meta = {'properties': {'os_type': mock.sentinel.os_type}}
@@ -359,24 +530,136 @@ class VBoxOperationTestCase(test.NoDBTestCase):
         mock_cpus.assert_called_once_with(self._instance)
         mock_network.assert_called_once_with(self._instance,
                                              mock.sentinel.network_info)
-        self.assertEqual(1, mock_create_vm.call_count)
+        mock_create_vm.assert_called_once_with(
+            self._instance.name, basefolder=mock.sentinel.dirname,
+            register=True, uuid=self._instance.uuid)
+        mock_set_controllers.assert_called_once_with(self._instance)
+        mock_modify_vm.assert_called_once_with(
+            self._instance, constants.FIELD_DESCRIPTION,
+            jsonutils.dumps({"instance_uuid": self._instance.uuid}))
+
+    @mock.patch('nova.virt.virtualbox.vmpool.VMPool.take')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.modify_vm')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_storage_controllers')
+    @mock.patch('nova.virt.virtualbox.pathutils.instance_basepath')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.create_vm')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_cpus')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_memory')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_os_type')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation._network_setup')
+    def test_create_instance_basefolder(self, mock_network, mock_os_type,
+                                        mock_memory, mock_cpus,
+                                        mock_create_vm, mock_basepath,
+                                        mock_set_controllers, mock_modify_vm,
+                                        mock_take):
+        self._vbox_ops.create_instance(self._instance, {},
+                                       mock.sentinel.network_info,
+                                       overwrite=False,
+                                       basefolder=mock.sentinel.basefolder)
+
+        self.assertFalse(mock_take.called)
+        mock_basepath.assert_called_once_with(self._instance, action=None)
+        mock_create_vm.assert_called_once_with(
+            self._instance.name, basefolder=mock.sentinel.basefolder,
+            register=True, uuid=self._instance.uuid)
+        mock_set_controllers.assert_called_once_with(self._instance)
+
+    @mock.patch('nova.virt.virtualbox.vmpool.VMPool.discard')
+    @mock.patch('nova.virt.virtualbox.vmpool.VMPool.take')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.create_vm')
+    @mock.patch('nova.virt.virtualbox.pathutils.create_path')
+    @mock.patch('nova.virt.virtualbox.pathutils.instance_basepath')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_cpus')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_memory')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_os_type')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation._network_setup')
+    def test_create_instance_pooled(self, mock_network, mock_os_type,
+                                    mock_memory, mock_cpus, mock_basepath,
+                                    mock_create_path, mock_create_vm,
+                                    mock_execute, mock_take, mock_discard):
+        pooled_vm = vmpool.PooledVM("nova-pool-uuid", "pool-uuid")
+        mock_take.return_value = pooled_vm
+        mock_basepath.return_value = mock.sentinel.path
+        mock_execute.return_value = (None, None)
+        vm_registry = cache.VMRegistry()
+        vm_registry.reconcile(lambda: [(pooled_vm.name, pooled_vm.uuid)])
+        manage.VBoxManage._vm_registry = vm_registry
+
+        self._vbox_ops.create_instance(self._instance, {},
+                                       mock.sentinel.network_info)
+
+        self.assertFalse(mock_create_vm.called)
+        mock_create_path.assert_called_once_with(mock.sentinel.path)
+        mock_execute.assert_called_once_with(
+            manage.VBoxManage.MODIFY_VM, pooled_vm.name,
+            constants.FIELD_NAME, self._instance.name,
+            constants.FIELD_DESCRIPTION,
+            jsonutils.dumps({"instance_uuid": self._instance.uuid}))
+        self.assertEqual(pooled_vm.uuid,
+                         vm_registry.get(self._instance.name).uuid)
+        self.assertIsNone(vm_registry.get(pooled_vm.name))
+        self.assertEqual(self._instance.uuid,
+                         vm_registry.instance_uuid(pooled_vm.uuid))
+        self.assertFalse(mock_discard.called)
+
+        mock_execute.return_value = (None, "fake-error")
+        self.assertRaises(vbox_exception.VBoxManageError,
+                          self._vbox_ops.create_instance, self._instance, {},
+                          mock.sentinel.network_info)
+        mock_discard.assert_called_once_with(pooled_vm)
+
+    @mock.patch('nova.virt.virtualbox.vmpool.VMPool.take')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    @mock.patch('nova.virt.virtualbox.pathutils.create_path')
+    @mock.patch('nova.virt.virtualbox.pathutils.instance_basepath')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_cpus')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_memory')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_os_type')
+    def test_create_instance_pooled_network(self, mock_os_type, mock_memory,
+                                            mock_cpus, mock_basepath,
+                                            mock_create_path, mock_execute,
+                                            mock_take):
+        pooled_vm = vmpool.PooledVM("nova-pool-uuid", "pool-uuid")
+        mock_take.return_value = pooled_vm
+        mock_execute.side_effect = [
+            (fake.FakeVBoxManage.network_info(), None), (None, None)]
+        vm_registry = cache.VMRegistry()
+        vm_registry.reconcile(lambda: [(pooled_vm.name, pooled_vm.uuid)])
+        manage.VBoxManage._vm_registry = vm_registry
+
+        self._vbox_ops.create_instance(
+            self._instance, {}, [{'id': 'fake-vif-id',
+                                  'address': 'aa:bb:cc:dd:ee:ff'}])
+
+        # The free NICs are looked up on the pooled virtual machine,
+        # which is renamed by the single modifyvm command.
+        mock_execute.assert_has_calls([
+            mock.call(manage.VBoxManage.SHOW_VM_INFO, pooled_vm.name,
+                      "--machinereadable"),
+            mock.call(manage.VBoxManage.MODIFY_VM, pooled_vm.name,
+                      constants.FIELD_NAME, self._instance.name,
+                      constants.FIELD_DESCRIPTION, mock.ANY,
+                      constants.FIELD_NIC % {"index": 4},
+                      constants.DEFAULT_NIC_MODE,
+                      constants.FIELD_NIC_TYPE % {"index": 4},
+                      constants.DEFAULT_NIC_TYPE,
+                      constants.FILED_MAC_ADDRESS % {"index": 4},
+                      "AABBCCDDEEFF",
+                      constants.FIELD_CABLE_CONNECTED % {"index": 4},
+                      constants.ON,
+                      constants.FIELD_DESCRIPTION, mock.ANY)])
+        self.assertEqual(2, mock_execute.call_count)
 
     @mock.patch('nova.virt.virtualbox.volumeops.VolumeOperations'
                 '.attach_volumes')
     @mock.patch('nova.virt.virtualbox.volumeops.VolumeOperations'
                 '.attach_storage')
-    @mock.patch('nova.virt.virtualbox.vmutils.set_storage_controller')
-    def test_storage_setup(self, mock_set_controller, mock_attach_storage,
-                           mock_attach_volumes,):
+    def test_storage_setup(self, mock_attach_storage, mock_attach_volumes):
         self._vbox_ops.storage_setup(self._instance, mock.sentinel.root_disk,
                                      mock.sentinel.ephemeral,
                                      mock.sentinel.block_device_info)
 
-        mock_set_controller.assert_has_calls([
-            mock.call(self._instance, constants.SYSTEM_BUS_SATA),
-            mock.call(self._instance, constants.SYSTEM_BUS_SCSI)
-        ])
-
         mock_attach_storage.assert_has_calls([
             mock.call(instance=self._instance, port=0, device=0,
                       controller=constants.SYSTEM_BUS_SATA.upper(),
@@ -409,13 +692,30 @@ class VBoxOperationTestCase(test.NoDBTestCase):
 
         self._vbox_ops.destroy(self._instance)
         mock_exists.assert_called_once_with(self._instance)
-        mock_power_state.assert_called_once_with(self._instance)
+        mock_power_state.assert_called_once_with(self._instance,
+                                                 refresh=True)
         mock_control_vm.assert_called_once_with(self._instance,
                                                 constants.STATE_POWER_OFF)
         mock_unregister.assert_called_once_with(self._instance, delete=True)
         mock_basepath.assert_called_once_with(
             self._instance, action=constants.PATH_DELETE)
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_vm_registry')
+    @mock.patch('nova.virt.virtualbox.vmutils.get_power_state')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.unregister_vm')
+    def test_destroy_not_found(self, mock_unregister, mock_exists,
+                               mock_power_state, mock_vm_registry):
+        mock_exists.return_value = True
+        mock_power_state.side_effect = exception.InstanceNotFound(
+            instance_id=self._instance.uuid)
+
+        self._vbox_ops.destroy(self._instance)
+
+        mock_vm_registry.return_value.remove.assert_called_once_with(
+            self._instance.name)
+        self.assertFalse(mock_unregister.called)
+
     @mock.patch('nova.virt.virtualbox.vmutils.get_power_state')
     @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.unregister_vm')
@@ -429,8 +729,10 @@ class VBoxOperationTestCase(test.NoDBTestCase):
         self.assertRaises(vbox_exception.VBoxManageError,
                           self._vbox_ops.destroy, self._instance)
         mock_exists.assert_called_once_with(self._instance)
-        mock_power_state.assert_called_once_with(self._instance)
+        mock_power_state.assert_called_once_with(self._instance,
+                                                 refresh=True)
 
+    @mock.patch('nova.virt.virtualbox.pathutils.instance_basepath')
     @mock.patch('nova.virt.virtualbox.volumeutils.ebs_root_in_block_devices')
     @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.storage_setup')
     @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation'
@@ -441,7 +743,8 @@ class VBoxOperationTestCase(test.NoDBTestCase):
     @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
     def test_spawn(self, mock_instance_exists, mock_create_instance,
                    mock_create_root, mock_create_ephemeral,
-                   mock_storage_setup, mock_ebs_root_in_block):
+                   mock_storage_setup, mock_ebs_root_in_block,
+                   mock_basepath):
         mock_instance_exists.return_value = False
         mock_ebs_root_in_block.return_value = False
         mock_create_ephemeral.return_value = mock.sentinel.ephemeral
@@ -454,21 +757,75 @@ class VBoxOperationTestCase(test.NoDBTestCase):
                              mock.sentinel.network_info,
                              mock.sentinel.block_device_info)
 
+        mock_basepath.assert_called_once_with(
+            self._instance, action=constants.PATH_OVERWRITE)
         mock_create_instance.assert_called_once_with(
             self._instance, mock.sentinel.image_meta,
-            mock.sentinel.network_info)
+            mock.sentinel.network_info, overwrite=False)
         mock_create_ephemeral.assert_called_once_with(self._instance)
         mock_create_root.assert_called_once_with(self._context, self._instance)
         mock_storage_setup.assert_called_once_with(
             self._instance, mock.sentinel.root_disk, mock.sentinel.ephemeral,
             mock.sentinel.block_device_info)
 
+    @mock.patch('nova.virt.virtualbox.pathutils.instance_basepath')
+    @mock.patch('nova.virt.virtualbox.volumeutils.ebs_root_in_block_devices')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.storage_setup')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation'
+                '.create_ephemeral_disk')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation'
+                '.create_root_disk')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.create_instance')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
+    def test_spawn_concurrent(self, mock_instance_exists,
+                              mock_create_instance, mock_create_root,
+                              mock_create_ephemeral, mock_storage_setup,
+                              mock_ebs_root_in_block, mock_basepath):
+        mock_instance_exists.return_value = False
+        mock_ebs_root_in_block.return_value = False
+        download = eventlet.event.Event()
+        calls = []
+
+        def create_root_disk(context, instance):
+            # Note: The download finishes after the virtual machine
+            # was configured.
+            download.wait()
+            calls.append("create_root_disk")
+            return mock.sentinel.root_disk
+
+        def create_instance(*args, **kwargs):
+            calls.append("create_instance")
+            download.send()
+
+        mock_create_root.side_effect = create_root_disk
+        mock_create_instance.side_effect = create_instance
+
+        self._vbox_ops.spawn(self._context, self._instance,
+                             mock.sentinel.image_meta,
+                             mock.sentinel.injected_files,
+                             mock.sentinel.admin_password,
+                             mock.sentinel.network_info,
+                             mock.sentinel.block_device_info)
+
+        self.assertEqual(["create_instance", "create_root_disk"], calls)
+        mock_storage_setup.assert_called_once_with(
+            self._instance, mock.sentinel.root_disk,
+            mock_create_ephemeral.return_value,
+            mock.sentinel.block_device_info)
+
+    @mock.patch('nova.virt.virtualbox.pathutils.instance_basepath')
+    @mock.patch('nova.virt.virtualbox.volumeutils.ebs_root_in_block_devices')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation'
+                '.create_ephemeral_disk')
     @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.destroy')
     @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.create_instance')
     @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
     def test_spawn_fail(self, mock_instance_exists, mock_create_instance,
-                        mock_destroy):
+                        mock_destroy, mock_create_ephemeral,
+                        mock_ebs_root_in_block, mock_basepath):
         mock_instance_exists.side_effect = [True, False]
+        mock_ebs_root_in_block.return_value = True
+        mock_create_ephemeral.return_value = None
         mock_create_instance.side_effect = [
             vbox_exception.VBoxManageError(method="createvm", reason="n/a")
         ]
@@ -491,3 +848,44 @@ class VBoxOperationTestCase(test.NoDBTestCase):
                           mock.sentinel.network_info,
                           mock.sentinel.block_device_info)
         mock_destroy.assert_called_once_with(self._instance)
+
+    @mock.patch('os.path.exists')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.close_medium')
+    @mock.patch('nova.virt.virtualbox.pathutils.instance_basepath')
+    @mock.patch('nova.virt.virtualbox.volumeutils.ebs_root_in_block_devices')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.storage_setup')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation'
+                '.create_ephemeral_disk')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation'
+                '.create_root_disk')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.create_instance')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.destroy')
+    @mock.patch('nova.virt.virtualbox.vmops.VBoxOperation.instance_exists')
+    def test_spawn_branch_fail(self, mock_instance_exists, mock_destroy,
+                               mock_create_instance, mock_create_root,
+                               mock_create_ephemeral, mock_storage_setup,
+                               mock_ebs_root_in_block, mock_basepath,
+                               mock_close_medium, mock_exists):
+        mock_instance_exists.return_value = False
+        mock_ebs_root_in_block.return_value = False
+        mock_exists.return_value = True
+        mock_create_ephemeral.return_value = mock.sentinel.ephemeral
+        mock_create_root.side_effect = exception.ImageNotFound(
+            image_id='fake-image')
+
+        self.assertRaises(exception.ImageNotFound,
+                          self._vbox_ops.spawn,
+                          self._context, self._instance,
+                          mock.sentinel.image_meta,
+                          mock.sentinel.injected_files,
+                          mock.sentinel.admin_password,
+                          mock.sentinel.network_info,
+                          mock.sentinel.block_device_info)
+
+        self.assertTrue(mock_create_instance.called)
+        self.assertFalse(mock_storage_setup.called)
+        mock_destroy.assert_called_once_with(self._instance)
+        mock_close_medium.assert_called_once_with(
+            constants.MEDIUM_DISK, mock.sentinel.ephemeral, delete=True)
+        mock_basepath.assert_called_with(self._instance,
+                                         action=constants.PATH_DELETE)
@@ -0,0 +1,151 @@
+# Copyright 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import mock
+
+from nova import test
+from nova.virt.virtualbox import cache
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import vmpool
+
+
+class VMPoolTestCase(test.NoDBTestCase):
+
+    _FAKE_POOL_DIR = 'fake-pool-dir'
+
+    def setUp(self):
+        super(VMPoolTestCase, self).setUp()
+        self._pool = vmpool.VMPool()
+
+        patcher = mock.patch('nova.utils.spawn_n',
+                             side_effect=lambda func: func())
+        self._mock_spawn_n = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_is_pooled(self):
+        self.assertTrue(vmpool.is_pooled(vmpool.PooledVM.new().name))
+        self.assertFalse(vmpool.is_pooled('instance-00000001'))
+
+    @mock.patch('nova.virt.virtualbox.vmutils.set_storage_controllers')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.create_vm')
+    @mock.patch('nova.virt.virtualbox.pathutils.vm_pool_dir')
+    def test_create_vm(self, mock_pool_dir, mock_create_vm,
+                       mock_set_controllers):
+        mock_pool_dir.return_value = self._FAKE_POOL_DIR
+
+        pooled_vm = self._pool._create_vm()
+
+        mock_pool_dir.assert_called_once_with(action=constants.PATH_CREATE)
+        mock_create_vm.assert_called_once_with(
+            pooled_vm.name, register=True, uuid=pooled_vm.uuid,
+            basefolder=self._FAKE_POOL_DIR)
+        mock_set_controllers.assert_called_once_with(pooled_vm)
+        self.assertEqual(vmpool.POOL_PREFIX + pooled_vm.uuid, pooled_vm.name)
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.unregister_vm')
+    @mock.patch('nova.virt.virtualbox.vmutils.set_storage_controllers')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.create_vm')
+    @mock.patch('nova.virt.virtualbox.pathutils.vm_pool_dir')
+    def test_create_vm_fail(self, mock_pool_dir, mock_create_vm,
+                            mock_set_controllers, mock_unregister_vm):
+        mock_set_controllers.side_effect = vbox_exc.VBoxException(
+            details='fake-error')
+
+        self.assertRaises(vbox_exc.VBoxException, self._pool._create_vm)
+        mock_unregister_vm.assert_called_once_with(
+            mock_set_controllers.call_args[0][0], delete=True)
+
+    @mock.patch.object(vmpool.VMPool, '_create_vm')
+    def test_take(self, mock_create_vm):
+        self.flags(vm_pool_size=2, group='virtualbox')
+        mock_create_vm.side_effect = [mock.sentinel.vm1, mock.sentinel.vm2,
+                                      mock.sentinel.vm3]
+
+        self._pool.refill()
+        self.assertEqual(2, len(self._pool))
+
+        self.assertEqual(mock.sentinel.vm1, self._pool.take())
+        self.assertEqual(2, len(self._pool))
+        self.assertEqual(3, mock_create_vm.call_count)
+
+    @mock.patch.object(vmpool.VMPool, '_create_vm')
+    def test_take_empty(self, mock_create_vm):
+        self.assertIsNone(self._pool.take())
+        self.assertFalse(self._mock_spawn_n.called)
+
+    @mock.patch.object(vmpool.VMPool, '_create_vm')
+    def test_refill_fail(self, mock_create_vm):
+        self.flags(vm_pool_size=2, group='virtualbox')
+        mock_create_vm.side_effect = [
+            mock.sentinel.vm1, vbox_exc.VBoxException(details='fake-error')]
+
+        self._pool.refill()
+
+        self.assertEqual(1, len(self._pool))
+        self.assertFalse(self._pool._refilling)
+
+    def test_refill_in_progress(self):
+        self.flags(vm_pool_size=2, group='virtualbox')
+        self._pool._refilling = True
+
+        self._pool.refill()
+
+        self.assertFalse(self._mock_spawn_n.called)
+
+    @mock.patch('nova.virt.virtualbox.vmutils.get_description')
+    @mock.patch('nova.virt.virtualbox.pathutils.delete_path')
+    @mock.patch('os.listdir')
+    @mock.patch('os.path.isdir')
+    @mock.patch('nova.virt.virtualbox.pathutils.vm_pool_dir')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.get_vm_registry')
+    def test_init_host(self, mock_vm_registry, mock_pool_dir, mock_isdir,
+                       mock_listdir, mock_delete_path, mock_get_description):
+        vm_registry = cache.VMRegistry()
+        vm_registry.reconcile(lambda: [
+            ('nova-pool-uuid-1', 'uuid-1'),
+            ('instance-00000001', 'uuid-2'),
+            ('instance-00000002', 'instance-uuid-3'),
+        ])
+        mock_vm_registry.return_value = vm_registry
+        mock_pool_dir.return_value = self._FAKE_POOL_DIR
+        mock_isdir.return_value = True
+        mock_listdir.return_value = ['nova-pool-uuid-1', 'nova-pool-uuid-2',
+                                     'nova-pool-uuid-4', 'other']
+        mock_get_description.return_value = {'instance_uuid': 'instance-2'}
+
+        self._pool.init_host()
+
+        self.assertEqual(vmpool.PooledVM('nova-pool-uuid-1', 'uuid-1'),
+                         self._pool.take())
+        self.assertEqual('instance-2', vm_registry.instance_uuid('uuid-2'))
+        self.assertEqual('instance-uuid-3',
+                         vm_registry.instance_uuid('instance-uuid-3'))
+        mock_get_description.assert_called_once_with(
+            vmpool.PooledVM('instance-00000001', 'uuid-2'))
+        mock_delete_path.assert_called_once_with(
+            os.path.join(self._FAKE_POOL_DIR, 'nova-pool-uuid-4'))
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.unregister_vm')
+    def test_discard(self, mock_unregister_vm):
+        mock_unregister_vm.side_effect = vbox_exc.VBoxException(
+            details='fake-error')
+
+        self._pool.discard(mock.sentinel.pooled_vm)
+
+        mock_unregister_vm.assert_called_once_with(mock.sentinel.pooled_vm,
+                                                   delete=True)
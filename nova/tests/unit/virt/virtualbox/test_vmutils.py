@@ -15,13 +15,16 @@
 
 from eventlet import timeout as etimeout
 import mock
+from oslo_serialization import jsonutils
 
+from nova.compute import power_state
 from nova import exception
 from nova import test
 from nova.tests.unit import fake_instance
 from nova.tests.unit.virt.virtualbox import fake
 from nova.virt.virtualbox import constants
 from nova.virt.virtualbox import exception as vbox_exception
+from nova.virt.virtualbox import manage
 from nova.virt.virtualbox import vmutils
 
 
@@ -58,7 +61,7 @@ class VMUtilsTestCase(test.NoDBTestCase):
             self._instance, desired_power_state,
             constants.SHUTDOWN_RETRY_INTERVAL)
 
-        mock_get_power_state.assert_called_with(self._instance)
+        mock_get_power_state.assert_called_with(self._instance, refresh=True)
         self.assertTrue(response)
 
     @mock.patch('eventlet.timeout.with_timeout')
@@ -85,6 +88,8 @@ class VMUtilsTestCase(test.NoDBTestCase):
                          response[constants.HOST_MEMORY_AVAILABLE])
         self.assertEqual(fake.FAKE_HOST_MEMORY_SIZE,
                          response[constants.HOST_MEMORY_SIZE])
+        self.assertEqual(fake.FAKE_HOST_PROCESSOR_DESCRIPTION,
+                         response[constants.HOST_FIRST_CPU_DESCRIPTION])
 
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list')
     def test_get_host_info_default(self, mock_list):
@@ -111,6 +116,28 @@ class VMUtilsTestCase(test.NoDBTestCase):
         self.assertEqual('poweroff',
                          vmutils.get_power_state(self._instance))
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list')
+    def test_get_vms_states(self, mock_list):
+        mock_list.return_value = fake.FakeVBoxManage.list_vms_long()
+
+        self.assertEqual(
+            [(fake.FAKE_VM_NAME, fake.FAKE_VM_UUID, power_state.RUNNING),
+             ('fake-paused-vm', 'fake-paused-uuid', power_state.PAUSED),
+             ('fake-stuck-vm', None, power_state.NOSTATE)],
+            vmutils.get_vms_states())
+
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.list')
+    def test_get_power_states(self, mock_list):
+        mock_list.return_value = fake.FakeVBoxManage.list_vms_long()
+
+        response = vmutils.get_power_states()
+
+        mock_list.assert_called_once_with(constants.VMS_INFO,
+                                          long_format=True)
+        self.assertEqual({fake.FAKE_VM_NAME: power_state.RUNNING,
+                          'fake-paused-vm': power_state.PAUSED,
+                          'fake-stuck-vm': power_state.NOSTATE}, response)
+
     @mock.patch('nova.virt.virtualbox.vmutils.get_host_info')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.modify_vm')
     def test_set_cpus(self, mock_modify_vm, mock_host_info):
@@ -277,7 +304,7 @@ class VMUtilsTestCase(test.NoDBTestCase):
         mock_json_dumps.return_value = mock.sentinel.dumps
         mock_json_loads.return_value = {"test": mock.sentinel.loads}
         mock_show_vm_info.return_value = {
-            'current_description': mock.sentinel.description}
+            constants.VM_DESCRIPTION: mock.sentinel.description}
 
         vmutils.update_description(self._instance, description)
         mock_modify_vm.assert_called_once_with(
@@ -286,6 +313,24 @@ class VMUtilsTestCase(test.NoDBTestCase):
         mock_json_dumps.assert_called_once_with(description)
         mock_json_loads.assert_called_once_with(mock.sentinel.description)
 
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage._execute')
+    @mock.patch('nova.virt.virtualbox.manage.VBoxManage.show_vm_info')
+    def test_update_description_deferred(self, mock_show_vm_info,
+                                         mock_execute):
+        mock_execute.return_value = (None, None)
+        mock_show_vm_info.return_value = {}
+        with manage.VBoxManage.deferred_modifications(self._instance):
+            vmutils.update_description(self._instance, {"first": 1})
+            vmutils.update_description(self._instance, {"second": 2})
+            modifications = manage.VBoxManage.pending_modifications(
+                self._instance)
+            description = modifications.get(constants.FIELD_DESCRIPTION)
+
+        self.assertEqual({"first": 1, "second": 2},
+                         jsonutils.loads(description))
+        self.assertEqual(1, mock_show_vm_info.call_count)
+        self.assertEqual(1, mock_execute.call_count)
+
     @mock.patch('oslo_serialization.jsonutils.loads')
     @mock.patch('oslo_serialization.jsonutils.dumps')
     @mock.patch('nova.virt.virtualbox.manage.VBoxManage.modify_vm')
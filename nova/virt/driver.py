@@ -165,6 +165,24 @@ class ComputeDriver(object):
         # TODO(Vek): Need to pass context in for access to auth_token
         raise NotImplementedError()
 
+    def get_power_states(self, instances):
+        """Get the current power state for multiple instances at once.
+
+        :param instances: a list of nova.objects.instance.Instance objects
+
+        Returns a dictionary which has the instance UUID as key and the
+        power_state code as value. The instances unknown to the
+        virtualization layer are not included.
+
+        .. note::
+
+            This method is optional. It is used by the power states
+            synchronization in order to avoid a get_info call for each
+            instance when the driver can obtain all the states with
+            a single query.
+        """
+        raise NotImplementedError()
+
     def get_num_instances(self):
         """Return the total number of virtual machines.
 
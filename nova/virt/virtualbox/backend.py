@@ -0,0 +1,702 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Backends used by VBoxManage in order to communicate with VirtualBox.
+
+The CLI backend forks a new VBoxManage process for every command. The web
+service backend keeps a logged on session to a `vboxwebsrv` endpoint and
+a pool of persistent HTTP connections; the commands it does not know how
+to translate are delegated to the CLI backend.
+
+The web service backend serves `controlvm`, `startvm`, `modifyvm` and
+`storageattach`. The other commands, including `showvminfo` and `list`,
+still fork a VBoxManage process.
+"""
+
+import os
+import re
+import socket
+import subprocess
+import threading
+from xml.etree import ElementTree
+from xml.sax import saxutils
+
+from oslo_concurrency import processutils
+from oslo_config import cfg
+from oslo_log import log as logging
+from six.moves import http_client
+from six.moves import queue
+from six.moves.urllib import parse as urlparse
+
+from nova.i18n import _LW
+from nova import utils
+from nova.virt.virtualbox import constants
+
+LOG = logging.getLogger(__name__)
+VIRTUAL_BOX = [
+    cfg.StrOpt('backend',
+               default=constants.BACKEND_CLI,
+               choices=(constants.BACKEND_CLI, constants.BACKEND_WEBSRV),
+               help='The backend used in order to communicate with the '
+                    'VirtualBox (cli, websrv). The websrv backend handles '
+                    'the controlvm, startvm, modifyvm and storageattach '
+                    'commands; the other commands, including showvminfo '
+                    'and list, are still executed by VBoxManage.'),
+    cfg.StrOpt('websrv_url',
+               default='http://localhost:18083/',
+               help='The URL of the VirtualBox web service (vboxwebsrv).'),
+    cfg.StrOpt('websrv_username',
+               default='',
+               help='The user name used for the web service session.'),
+    cfg.StrOpt('websrv_password',
+               default='',
+               secret=True,
+               help='The password used for the web service session.'),
+    cfg.IntOpt('websrv_pool_size',
+               default=4,
+               help='The maximum number of persistent connections kept '
+                    'open to the VirtualBox web service.'),
+    cfg.IntOpt('websrv_timeout',
+               default=300,
+               help='Timeout for the web service requests, in seconds.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
+
+_SOAP_ENVELOPE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<SOAP-ENV:Envelope '
+    'xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:vbox="http://www.virtualbox.org/">'
+    '<SOAP-ENV:Body><vbox:%(method)s>%(params)s</vbox:%(method)s>'
+    '</SOAP-ENV:Body></SOAP-ENV:Envelope>')
+_SOAP_NS = '{http://schemas.xmlsoap.org/soap/envelope/}'
+
+# Note(alexandrucoman): The result codes are reported by the web service
+# as signed 32 bit integers.
+_RESULT_CODES = {
+    0x80BB0001: constants.VBOX_E_OBJECT_NOT_FOUND,
+    0x80BB0002: constants.VBOX_E_INVALID_VM_STATE,
+    0x80BB0004: constants.VBOX_E_FILE_ERROR,
+    0x80BB0007: constants.VBOX_E_INVALID_OBJECT_STATE,
+    0x80070005: constants.VBOX_E_ACCESSDENIED,
+    0x80070057: constants.NS_ERROR_INVALID_ARG,
+    0x80004005: constants.NS_ERROR_FAILURE,
+}
+
+_PROGRESS = re.compile(r"(\d+)%")
+_NIC_FIELD = re.compile(r"^--(?P<field>nic|nictype|cableconnected|"
+                        r"macaddress|bridgeadapter)(?P<index>\d+)$")
+
+_NIC_ATTACHMENTS = {
+    constants.NIC_MODE_NULL: "Null",
+    constants.NIC_MODE_NAT: "NAT",
+    constants.NIC_MODE_BRIDGED: "Bridged",
+    constants.NIC_MODE_INTNET: "Internal",
+    constants.NIC_MODE_HOSTONLY: "HostOnly",
+    constants.NIC_MODE_GENERIC: "Generic",
+}
+_NIC_TYPES = {
+    constants.NIC_TYPE_AM79C970A: "Am79C970A",
+    constants.NIC_TYPE_AM79C973: "Am79C973",
+    constants.NIC_TYPE_82540EM: "I82540EM",
+    constants.NIC_TYPE_82543GC: "I82543GC",
+    constants.NIC_TYPE_82545EM: "I82545EM",
+    constants.NIC_TYPE_VIRTIO: "Virtio",
+}
+_DEVICE_TYPES = {
+    constants.STORAGE_HDD: "HardDisk",
+    constants.STORAGE_DVD: "DVD",
+    constants.STORAGE_FDD: "Floppy",
+}
+
+
+def _text(value):
+    return str(value)
+
+
+def _integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        # Note: The error is reported by the fallback backend.
+        raise NotImplementedError()
+
+
+def _boolean(value):
+    if value == constants.ON:
+        return "true"
+    if value == constants.OFF:
+        return "false"
+    raise NotImplementedError()
+
+
+# The `modifyvm` fields supported by the web service backend:
+# field: (object, method, parameter, converter)
+_MODIFY_VM_FIELDS = {
+    constants.FIELD_CPUS: (None, "IMachine_setCPUCount", "CPUCount",
+                           _integer),
+    constants.FIELD_DESCRIPTION: (None, "IMachine_setDescription",
+                                  "description", _text),
+    constants.FIELD_MEMORY: (None, "IMachine_setMemorySize", "memorySize",
+                             _integer),
+    constants.FIELD_NAME: (None, "IMachine_setName", "name", _text),
+    constants.FIELD_OS_TYPE: (None, "IMachine_setOSTypeId", "OSTypeId",
+                              _text),
+    constants.FIELD_TELEPORTER: (None, "IMachine_setTeleporterEnabled",
+                                 "teleporterEnabled", _boolean),
+    constants.FIELD_TELEPORTER_ADDRESS: (
+        None, "IMachine_setTeleporterAddress", "teleporterAddress", _text),
+    constants.FIELD_TELEPORTER_PASSWORD: (
+        None, "IMachine_setTeleporterPassword", "teleporterPassword", _text),
+    constants.FIELD_TELEPORTER_PORT: (None, "IMachine_setTeleporterPort",
+                                      "teleporterPort", _integer),
+    constants.FIELD_VRDE_SERVER: ("vrde", "IVRDEServer_setEnabled",
+                                  "enabled", _boolean),
+    constants.FIELD_VRDE_MULTICON: ("vrde",
+                                    "IVRDEServer_setAllowMultiConnection",
+                                    "allowMultiConnection", _boolean),
+    constants.FIELD_VRDE_EXTPACK: ("vrde", "IVRDEServer_setVRDEExtPack",
+                                   "VRDEExtPack", _text),
+}
+_NIC_SETTERS = {
+    "nictype": ("INetworkAdapter_setAdapterType", "adapterType",
+                lambda value: _NIC_TYPES[value]),
+    "cableconnected": ("INetworkAdapter_setCableConnected",
+                       "cableConnected", _boolean),
+    "macaddress": ("INetworkAdapter_setMACAddress", "MACAddress", _text),
+    "bridgeadapter": ("INetworkAdapter_setBridgedInterface",
+                      "bridgedInterface", _text),
+}
+
+
+class WebServiceFault(Exception):
+
+    """The web service returned a SOAP fault."""
+
+    def __init__(self, message, result_code=None):
+        super(WebServiceFault, self).__init__(message)
+        self.message = message
+        self.result_code = result_code
+
+    def stderr(self):
+        """Format the fault like the VBoxManage error messages."""
+        error = "VBoxManage: error: %s" % self.message
+        if self.result_code is not None:
+            code = self.result_code & 0xFFFFFFFF
+            error += ("\nVBoxManage: error: Details: code %(name)s "
+                      "(0x%(code)x)" %
+                      {"name": _RESULT_CODES.get(code, "UNKNOWN"),
+                       "code": code})
+        return error
+
+
+class BaseBackend(object):
+
+    """Base class for the VBoxManage backends."""
+
+    def execute(self, command, *args):
+        """Execute the received command and returns stdout and stderr."""
+        raise NotImplementedError()
+
+    def execute_stream(self, source, command, *args):
+        """Execute the received command, write the chunks received from
+        `source` to its standard input and return stdout and stderr.
+        """
+        raise NotImplementedError()
+
+    def execute_progress(self, callback, command, *args):
+        """Execute the received command, call `callback` with the
+        percentage completed every time the progress is reported and
+        return stdout and stderr.
+        """
+        return self.execute(command, *args)
+
+    def close(self):
+        """Release all the resources used by the current backend."""
+        pass
+
+
+class CLIBackend(BaseBackend):
+
+    """Execute each command in a new VBoxManage process."""
+
+    def execute(self, command, *args):
+        try:
+            stdout, stderr = utils.execute(
+                CONF.virtualbox.vboxmanage_cmd, "--nologo",
+                command.lower(), *args)
+        except processutils.ProcessExecutionError as exc:
+            stdout, stderr = exc.stdout, exc.stderr
+        return (stdout, stderr)
+
+    def execute_stream(self, source, command, *args):
+        process = subprocess.Popen(
+            [CONF.virtualbox.vboxmanage_cmd, "--nologo", command.lower()] +
+            [str(argument) for argument in args],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, close_fds=True)
+        try:
+            for chunk in source:
+                process.stdin.write(chunk)
+        except IOError as exc:
+            # The process exited before reading the whole input, the
+            # reason will be available in stderr.
+            LOG.debug("Failed to write to VBoxManage %(command)s: "
+                      "%(reason)s", {"command": command, "reason": exc})
+
+        stdout, stderr = process.communicate()
+        if process.returncode and not stderr:
+            stderr = ("VBoxManage: error: The process exited with code %d" %
+                      process.returncode)
+        return (stdout, stderr)
+
+    def execute_progress(self, callback, command, *args):
+        # Note: VBoxManage reports the progress of the long running
+        # operations on stderr as "0%...10%...20%...".
+        process = subprocess.Popen(
+            [CONF.virtualbox.vboxmanage_cmd, "--nologo", command.lower()] +
+            [str(argument) for argument in args],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+
+        # Note: The standard output is read in parallel, otherwise
+        # a command which fills the pipe buffer would block while the
+        # progress is read from stderr.
+        output = []
+        reader = threading.Thread(
+            target=lambda: output.append(process.stdout.read()))
+        reader.daemon = True
+        reader.start()
+
+        stderr = ""
+        reported = 0
+        for chunk in iter(lambda: os.read(process.stderr.fileno(), 1024),
+                          b""):
+            stderr += chunk.decode("utf-8", "replace")
+            progress = _PROGRESS.findall(stderr)
+            if len(progress) > reported:
+                reported = len(progress)
+                callback(int(progress[-1]))
+
+        reader.join()
+        stdout = b"".join(output).decode("utf-8", "replace")
+        process.wait()
+        if process.returncode and constants.DONE not in stderr:
+            stderr += ("\nVBoxManage: error: The process exited with "
+                       "code %d" % process.returncode)
+        return (stdout, stderr)
+
+
+class WebServiceBackend(BaseBackend):
+
+    """Execute the commands using a persistent session to the VirtualBox
+    web service.
+
+    The commands which are not supported by the web service backend
+    are executed using the `fallback` backend.
+
+    .. note::
+        The `showvminfo` and `list` commands are executed using the
+        fallback backend because the web service requires a request
+        for every property of every virtual machine reported, which
+        costs more than the VBoxManage process. The `showvminfo` output
+        is cached by VBoxManage.
+    """
+
+    def __init__(self, fallback=None):
+        self._fallback = fallback or CLIBackend()
+        self._url = urlparse.urlparse(CONF.virtualbox.websrv_url)
+        self._connections = queue.Queue()
+        # Note: The semaphore limits the number of connections in use,
+        # so a slot is released even if the connection is broken.
+        self._slots = threading.Semaphore(
+            max(CONF.virtualbox.websrv_pool_size, 1))
+        self._session_lock = threading.Lock()
+        self._session = None
+        self._handlers = {
+            "--version": self._version,
+            "controlvm": self._control_vm,
+            "modifyvm": self._modify_vm,
+            "startvm": self._start_vm,
+            "storageattach": self._storage_attach,
+        }
+
+    def _new_connection(self):
+        connection_class = http_client.HTTPConnection
+        if self._url.scheme == 'https':
+            connection_class = http_client.HTTPSConnection
+        return connection_class(self._url.hostname, self._url.port,
+                                timeout=CONF.virtualbox.websrv_timeout)
+
+    def _get_connection(self):
+        self._slots.acquire()
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            return self._new_connection()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _put_connection(self, connection, broken=False):
+        try:
+            if broken:
+                connection.close()
+            else:
+                self._connections.put(connection)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _parse_response(body):
+        try:
+            root = ElementTree.fromstring(body)
+        except ElementTree.ParseError as exc:
+            raise WebServiceFault("Invalid response from the web service: "
+                                  "%s" % exc)
+
+        body = root.find(_SOAP_NS + 'Body')
+        if body is None:
+            raise WebServiceFault("Invalid response from the web service: "
+                                  "the SOAP body is missing")
+        fault = body.find(_SOAP_NS + 'Fault')
+        if fault is not None:
+            message = fault.findtext('faultstring') or ''
+            result_code = None
+            for element in fault.iter():
+                if element.tag.endswith('resultCode') and element.text:
+                    result_code = int(element.text)
+                    break
+            raise WebServiceFault(message.strip(), result_code)
+
+        values = []
+        for response in body:
+            for element in response:
+                if element.tag.endswith('returnval'):
+                    values.append(element.text or '')
+        return values
+
+    def _request(self, method, **params):
+        """Send a SOAP request to the web service and return the list of
+        values returned.
+        """
+        # Note(alexandrucoman): The web service does not require the
+        # parameters to be in the same order as in the WSDL, but the
+        # object reference is always sent first.
+        keys = sorted(params, key=lambda key: (key != "_this", key))
+        content = "".join("<%(key)s>%(value)s</%(key)s>" %
+                          {"key": key,
+                           "value": saxutils.escape(str(params[key]))}
+                          for key in keys)
+        request = _SOAP_ENVELOPE % {"method": method, "params": content}
+
+        connection = self._get_connection()
+        broken = True
+        try:
+            connection.request("POST", self._url.path or "/", request,
+                               {"Content-Type": "text/xml; charset=utf-8",
+                                "SOAPAction": '""'})
+            response = connection.getresponse()
+            body = response.read()
+            broken = response.will_close
+        finally:
+            self._put_connection(connection, broken)
+
+        return self._parse_response(body)
+
+    def _call(self, method, **params):
+        values = self._request(method, **params)
+        return values[0] if values else None
+
+    def _logon(self):
+        with self._session_lock:
+            if self._session is None:
+                LOG.debug("Logon to the VirtualBox web service: %s",
+                          CONF.virtualbox.websrv_url)
+                self._session = self._call(
+                    "IWebsessionManager_logon",
+                    username=CONF.virtualbox.websrv_username,
+                    password=CONF.virtualbox.websrv_password)
+            return self._session
+
+    def _wait_for_progress(self, progress):
+        self._call("IProgress_waitForCompletion", _this=progress, timeout=-1)
+        result_code = int(self._call("IProgress_getResultCode",
+                                     _this=progress))
+        if result_code:
+            error_info = self._call("IProgress_getErrorInfo", _this=progress)
+            message = self._call("IVirtualBoxErrorInfo_getText",
+                                 _this=error_info)
+            raise WebServiceFault(message, result_code)
+
+    def _find_machine(self, name):
+        try:
+            return self._call("IVirtualBox_findMachine",
+                              _this=self._logon(), nameOrId=name)
+        except WebServiceFault as exc:
+            if (exc.result_code or 0) & 0xFFFFFFFF == 0x80BB0001:
+                exc.message = "%s '%s'" % (
+                    constants.VBOX_E_INSTANCE_NOT_FOUND, name)
+            raise
+
+    def _version(self):
+        vbox = self._logon()
+        version = self._call("IVirtualBox_getVersion", _this=vbox)
+        revision = self._call("IVirtualBox_getRevision", _this=vbox)
+        return "%sr%s\n" % (version, revision)
+
+    def _with_session(self, name, lock_type, function):
+        machine = self._find_machine(name)
+        session = self._call("IWebsessionManager_getSessionObject",
+                             refIVirtualBox=self._logon())
+        if lock_type:
+            self._call("IMachine_lockMachine", _this=machine,
+                       session=session, lockType=lock_type)
+        try:
+            return function(machine, session)
+        finally:
+            try:
+                self._call("ISession_unlockMachine", _this=session)
+            except WebServiceFault as exc:
+                LOG.debug("Failed to unlock the machine %(name)s: %(exc)s",
+                          {"name": name, "exc": exc})
+
+    def _control_vm(self, name, state, *args):
+        methods = {
+            constants.STATE_PAUSE: ("IConsole_pause", False),
+            constants.STATE_RESUME: ("IConsole_resume", False),
+            constants.STATE_RESET: ("IConsole_reset", False),
+            constants.STATE_POWER_OFF: ("IConsole_powerDown", True),
+            constants.STATE_SUSPEND: ("IConsole_saveState", True),
+            constants.ACPI_POWER_BUTTON: ("IConsole_powerButton", False),
+            constants.ACPI_SLEEP_BUTTON: ("IConsole_sleepButton", False),
+        }
+        if args or state not in methods:
+            raise NotImplementedError()
+
+        method, has_progress = methods[state]
+
+        def _control(machine, session):
+            console = self._call("ISession_getConsole", _this=session)
+            progress = self._call(method, _this=console)
+            if has_progress:
+                self._wait_for_progress(progress)
+
+        self._with_session(name, "Shared", _control)
+        return ""
+
+    def _start_vm(self, name, *args):
+        if args and (len(args) != 2 or args[0] != "--type"):
+            raise NotImplementedError()
+        method = args[1] if args else constants.START_VM_HEADLESS
+
+        def _start(machine, session):
+            progress = self._call("IMachine_launchVMProcess", _this=machine,
+                                  session=session, type=method,
+                                  environment="")
+            self._wait_for_progress(progress)
+
+        self._with_session(name, None, _start)
+        return ('Waiting for VM "%(name)s" to power on...\n'
+                'VM "%(name)s" has been successfully started.\n' %
+                {"name": name})
+
+    @staticmethod
+    def _vm_change(field, value):
+        """Return the (object, method, parameters) required in order to
+        apply the received `modifyvm` change.
+
+        The object is None for the machine, "vrde" for the VRDE server
+        or the slot of a network adapter.
+        """
+        if field == constants.FIELD_VRDE_PORT:
+            return ("vrde", "IVRDEServer_setVRDEProperty",
+                    {"key": "TCP/Ports", "value": value})
+        if field == constants.FIELD_VRDE_PROPERTY:
+            key, separator, property_value = str(value).partition("=")
+            if not separator:
+                raise NotImplementedError()
+            return ("vrde", "IVRDEServer_setVRDEProperty",
+                    {"key": key, "value": property_value})
+        if field in _MODIFY_VM_FIELDS:
+            target, method, parameter, converter = _MODIFY_VM_FIELDS[field]
+            return (target, method, {parameter: converter(value)})
+
+        match = _NIC_FIELD.match(field)
+        if not match or int(match.group("index")) < 1:
+            raise NotImplementedError()
+        slot = int(match.group("index")) - 1
+        nic_field = match.group("field")
+        if nic_field == "nic":
+            if value == constants.NIC_MODE_NONE:
+                return (slot, "INetworkAdapter_setEnabled",
+                        {"enabled": "false"})
+            if value not in _NIC_ATTACHMENTS:
+                raise NotImplementedError()
+            return (slot, "INetworkAdapter_setAttachmentType",
+                    {"attachmentType": _NIC_ATTACHMENTS[value]})
+
+        method, parameter, converter = _NIC_SETTERS[nic_field]
+        try:
+            return (slot, method, {parameter: converter(value)})
+        except KeyError:
+            raise NotImplementedError()
+
+    def _modify_vm(self, name, *args):
+        if not args or len(args) % 2:
+            raise NotImplementedError()
+        # Note: All the changes are checked before locking the machine,
+        # the unsupported ones are applied by the fallback backend.
+        changes = [self._vm_change(field, value)
+                   for field, value in zip(args[::2], args[1::2])]
+
+        def _modify(machine, session):
+            mutable = self._call("ISession_getMachine", _this=session)
+            objects = {None: mutable}
+            for target, method, parameters in changes:
+                if target not in objects:
+                    if target == "vrde":
+                        objects[target] = self._call(
+                            "IMachine_getVRDEServer", _this=mutable)
+                    else:
+                        objects[target] = self._call(
+                            "IMachine_getNetworkAdapter", _this=mutable,
+                            slot=target)
+                if method == "INetworkAdapter_setAttachmentType":
+                    self._call("INetworkAdapter_setEnabled",
+                               _this=objects[target], enabled="true")
+                self._call(method, _this=objects[target], **parameters)
+            self._call("IMachine_saveSettings", _this=mutable)
+
+        self._with_session(name, "Write", _modify)
+        return ""
+
+    def _storage_attach(self, name, *args):
+        options = dict(zip(args[::2], args[1::2]))
+        required = ("--storagectl", "--port", "--device", "--type",
+                    "--medium")
+        if len(args) != 2 * len(required) or sorted(options) != sorted(
+                required):
+            raise NotImplementedError()
+
+        device_type = _DEVICE_TYPES.get(options["--type"])
+        medium = str(options["--medium"])
+        if device_type is None or (medium != constants.MEDIUM_NONE and
+                                   not os.path.isabs(medium)):
+            # Note: The special media (emptydrive, additions, host
+            # drives) are handled by the fallback backend.
+            raise NotImplementedError()
+        location = {"name": options["--storagectl"],
+                    "controllerPort": _integer(options["--port"]),
+                    "device": _integer(options["--device"])}
+
+        def _detach(mutable):
+            try:
+                self._call("IMachine_detachDevice", _this=mutable,
+                           **location)
+            except WebServiceFault as exc:
+                # Note: There is no medium attached to the received
+                # port and device.
+                if (exc.result_code or 0) & 0xFFFFFFFF != 0x80BB0001:
+                    raise
+
+        def _attach(machine, session):
+            mutable = self._call("ISession_getMachine", _this=session)
+            if medium == constants.MEDIUM_NONE:
+                self._call("IMachine_detachDevice", _this=mutable,
+                           **location)
+            else:
+                medium_ref = self._call(
+                    "IVirtualBox_openMedium", _this=self._logon(),
+                    location=medium, deviceType=device_type,
+                    accessMode=("ReadOnly" if device_type == "DVD"
+                                else "ReadWrite"),
+                    forceNewUuid="false")
+                _detach(mutable)
+                self._call("IMachine_attachDevice", _this=mutable,
+                           type=device_type, medium=medium_ref, **location)
+            self._call("IMachine_saveSettings", _this=mutable)
+
+        self._with_session(name, "Write", _attach)
+        return ""
+
+    def execute(self, command, *args):
+        handler = self._handlers.get(command.lower())
+        if handler is None:
+            return self._fallback.execute(command, *args)
+
+        try:
+            return (handler(*args), "")
+        except NotImplementedError:
+            return self._fallback.execute(command, *args)
+        except WebServiceFault as exc:
+            if exc.result_code is None and "session" in exc.message.lower():
+                # The session expired; it will be created again on the
+                # next request.
+                with self._session_lock:
+                    self._session = None
+            return ("", exc.stderr())
+        except (socket.error, http_client.HTTPException) as exc:
+            LOG.warning(_LW("The VirtualBox web service is not available: "
+                            "%(reason)s. Falling back to VBoxManage."),
+                        {"reason": exc})
+            with self._session_lock:
+                self._session = None
+            return self._fallback.execute(command, *args)
+
+    def execute_stream(self, source, command, *args):
+        # Note: The web service cannot receive the content of a file.
+        return self._fallback.execute_stream(source, command, *args)
+
+    def execute_progress(self, callback, command, *args):
+        return self._fallback.execute_progress(callback, command, *args)
+
+    def close(self):
+        with self._session_lock:
+            session, self._session = self._session, None
+        if session:
+            try:
+                self._call("IWebsessionManager_logoff", refIVirtualBox=session)
+            except (WebServiceFault, socket.error,
+                    http_client.HTTPException) as exc:
+                LOG.debug("Failed to logoff: %s", exc)
+
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+BACKENDS = {
+    constants.BACKEND_CLI: CLIBackend,
+    constants.BACKEND_WEBSRV: WebServiceBackend,
+}
+
+
+def get_backend():
+    """Return a new instance of the backend required by the config."""
+    backend_class = BACKENDS.get(CONF.virtualbox.backend)
+    if backend_class is None:
+        LOG.warning(_LW("Unknown backend %(backend)s, assuming %(default)s."),
+                    {"backend": CONF.virtualbox.backend,
+                     "default": constants.BACKEND_CLI})
+        backend_class = CLIBackend
+    return backend_class()
@@ -0,0 +1,369 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache for the information regarding the virtual machines.
+"""
+
+import collections
+import threading
+import time
+
+from nova.virt.virtualbox import constants
+
+VirtualMachine = collections.namedtuple('VirtualMachine',
+                                        ['name', 'uuid', 'inaccessible'])
+
+
+class VMInfoCache(object):
+
+    """Cache for the output of `showvminfo --machinereadable`.
+
+    The entries are kept by instance UUID and they are invalidated
+    every time a command which changes the virtual machine is executed.
+    Optionally, the entries can expire after `ttl` seconds.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = {}
+        self._names = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, timestamp):
+        return bool(self.ttl) and time.time() - timestamp > self.ttl
+
+    def token(self, instance):
+        """Return the token which should be used in order to store new
+        information for the received instance.
+        """
+        with self._lock:
+            return self._generations.get(instance.name, 0)
+
+    def lookup(self, instance):
+        """Return the cached information for the received instance and
+        a token which should be used in order to store new information.
+
+        If there is no valid information for the instance, None will be
+        returned instead.
+        """
+        with self._lock:
+            token = self._generations.get(instance.name, 0)
+            entry = self._entries.get(instance.uuid)
+            if entry and not self._expired(entry[1]):
+                self.hits += 1
+                return entry[0].copy(), token
+
+            self.misses += 1
+            return None, token
+
+    def store(self, instance, information, token):
+        """Store the information for the received instance.
+
+        The information is ignored if the virtual machine was changed
+        since the token was obtained.
+        """
+        with self._lock:
+            if self._generations.get(instance.name, 0) != token:
+                return
+            self._entries[instance.uuid] = (information.copy(), time.time())
+            self._names[instance.name] = instance.uuid
+
+    def invalidate(self, name):
+        """Remove the information for the virtual machine with the
+        received name or UUID.
+        """
+        with self._lock:
+            self.invalidations += 1
+            self._generations[name] = self._generations.get(name, 0) + 1
+            uuid = self._names.pop(name, name)
+            self._entries.pop(uuid, None)
+
+    def clear(self):
+        """Remove all the information from cache."""
+        with self._lock:
+            for name in self._names:
+                self._generations[name] = self._generations.get(name, 0) + 1
+            self._entries.clear()
+            self._names.clear()
+
+    def stats(self):
+        """Return the counters for the current cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+            }
+
+
+class VMRegistry(object):
+
+    """Index for the virtual machines registered with VirtualBox.
+
+    The virtual machines can be looked up by name or by UUID. The
+    registry is considered outdated `ttl` seconds after the last
+    reconcile.
+
+    The registry also keeps the UUID of the instance which uses
+    a virtual machine, when it differs from the UUID of the virtual
+    machine, and the number of virtual CPUs configured for the virtual
+    machines changed by this host.
+    """
+
+    INACCESSIBLE = "<inaccessible>"
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._by_name = {}
+        self._by_uuid = {}
+        self._instance_uuids = {}
+        self._cpus = {}
+        self._timestamp = None
+        self._lock = threading.Lock()
+
+    @property
+    def outdated(self):
+        """Whether the registry should be reconciled."""
+        if self._timestamp is None:
+            return True
+        return bool(self.ttl) and time.time() - self._timestamp > self.ttl
+
+    def _add(self, name, uuid):
+        inaccessible = name == self.INACCESSIBLE
+        virtual_machine = VirtualMachine(name, uuid, inaccessible)
+        self._by_uuid[uuid] = virtual_machine
+        if not inaccessible:
+            self._by_name[name] = virtual_machine
+
+    def reconcile(self, get_virtual_machines, force=False):
+        """Replace the content of the registry if it is outdated.
+
+        :param get_virtual_machines: callable which returns a list of
+                                     (name, uuid) tuples for all the
+                                     virtual machines registered with
+                                     VirtualBox
+        :param force:                reconcile the registry even if it
+                                     is not outdated
+
+        .. note::
+            The changes are blocked until the reconcile is done in order
+            to avoid losing them.
+        """
+        with self._lock:
+            if not (force or self.outdated):
+                return
+
+            virtual_machines = get_virtual_machines()
+            self._by_name.clear()
+            self._by_uuid.clear()
+            for name, uuid in virtual_machines:
+                self._add(name, uuid)
+            for uuid in list(self._instance_uuids):
+                if uuid not in self._by_uuid:
+                    del self._instance_uuids[uuid]
+            for uuid in list(self._cpus):
+                if uuid not in self._by_uuid:
+                    del self._cpus[uuid]
+            self._timestamp = time.time()
+
+    def add(self, name, uuid):
+        """Register a new virtual machine."""
+        with self._lock:
+            self._add(name, uuid)
+            self._cpus.pop(uuid, None)
+
+    def remove(self, name):
+        """Remove the virtual machine with the received name or UUID."""
+        with self._lock:
+            virtual_machine = (self._by_name.pop(name, None) or
+                               self._by_uuid.get(name))
+            if virtual_machine:
+                self._by_uuid.pop(virtual_machine.uuid, None)
+                self._by_name.pop(virtual_machine.name, None)
+                self._instance_uuids.pop(virtual_machine.uuid, None)
+                self._cpus.pop(virtual_machine.uuid, None)
+
+    def set_instance_uuid(self, uuid, instance_uuid):
+        """Record the UUID of the instance which uses the virtual
+        machine with the received UUID.
+        """
+        with self._lock:
+            self._instance_uuids[uuid] = instance_uuid
+
+    def instance_uuid(self, uuid):
+        """Return the UUID of the instance which uses the virtual
+        machine with the received UUID.
+        """
+        with self._lock:
+            return self._instance_uuids.get(uuid, uuid)
+
+    def set_cpus(self, uuid, cpus):
+        """Record the number of virtual CPUs configured for the virtual
+        machine with the received UUID.
+        """
+        with self._lock:
+            self._cpus[uuid] = cpus
+
+    def cpus(self, uuid):
+        """Return the number of virtual CPUs configured for the virtual
+        machine with the received UUID or None if it is unknown.
+        """
+        with self._lock:
+            return self._cpus.get(uuid)
+
+    def get(self, name):
+        """Return the virtual machine with the received name or UUID
+        or None if it is not registered.
+        """
+        with self._lock:
+            return self._by_name.get(name) or self._by_uuid.get(name)
+
+    def virtual_machines(self, inaccessible=False):
+        """Return the accessible virtual machines or only the
+        inaccessible ones if `inaccessible` is True.
+        """
+        with self._lock:
+            return [virtual_machine
+                    for virtual_machine in self._by_uuid.values()
+                    if virtual_machine.inaccessible == inaccessible]
+
+
+class MediumRegistry(object):
+
+    """Index for the virtual hard disks registered with VirtualBox.
+
+    The media can be looked up by UUID or by path. The differencing
+    disk chains are resolved in memory using the parent UUIDs.
+
+    The information regarding a medium is obtained using the callables
+    received by each method: `list_media` should return a dictionary
+    with the information for all the registered media, keyed by UUID,
+    and `show_medium` should return the information for a single medium.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._media = {}
+        self._aliases = {}
+        self._timestamp = None
+        self._complete = False
+        self._lock = threading.Lock()
+
+    @property
+    def outdated(self):
+        """Whether the registry should be reconciled."""
+        if self._timestamp is None:
+            return True
+        return bool(self.ttl) and time.time() - self._timestamp > self.ttl
+
+    def _add(self, uuid, information):
+        information = dict(information)
+        information[constants.VHD_UUID] = uuid
+        self._media[uuid] = information
+        path = information.get(constants.VHD_PATH)
+        if path:
+            self._aliases[path] = uuid
+
+    def _get(self, medium, show_medium=None):
+        uuid = self._aliases.get(medium, medium)
+        information = self._media.get(uuid)
+        if information is None and show_medium:
+            information = show_medium(medium)
+            uuid = information.get(constants.VHD_UUID)
+            if not uuid:
+                return information
+            self._add(uuid, information)
+            self._aliases[medium] = uuid
+            information = self._media[uuid]
+        return information
+
+    def reconcile(self, list_media, force=False):
+        """Replace the content of the registry if it is outdated."""
+        with self._lock:
+            if not (force or self.outdated):
+                return
+
+            media = list_media()
+            self._media.clear()
+            self._aliases.clear()
+            for uuid, information in media.items():
+                self._add(uuid, information)
+            self._timestamp = time.time()
+            self._complete = True
+
+    def invalidate(self, medium=None, created=False):
+        """Remove the information regarding the received medium.
+
+        :param medium:  the UUID or the path of the medium or None
+                        in order to invalidate the whole registry
+        :param created: whether the medium was just created
+        """
+        with self._lock:
+            if medium is None:
+                self._timestamp = None
+                return
+
+            if created:
+                # The list of the registered media is incomplete.
+                self._complete = False
+
+            uuid = self._aliases.pop(medium, medium)
+            information = self._media.pop(uuid, None)
+            if information:
+                self._aliases.pop(information.get(constants.VHD_PATH), None)
+
+    def get(self, medium, show_medium):
+        """Return the information regarding the received medium."""
+        with self._lock:
+            return dict(self._get(medium, show_medium))
+
+    def chain(self, medium, show_medium):
+        """Return the information for the received medium followed by
+        the information for all its ancestors, ending with the base
+        medium.
+        """
+        chain = []
+        with self._lock:
+            while medium:
+                information = self._get(medium, show_medium)
+                if information in chain:
+                    break
+                chain.append(information)
+                medium = information.get(constants.VHD_PARENT_UUID)
+            return [dict(item) for item in chain]
+
+    def registered(self, medium, list_media):
+        """Check if the received medium is registered."""
+        self.reconcile(list_media, force=not self._complete)
+        with self._lock:
+            return self._aliases.get(medium, medium) in self._media
+
+    def children(self, medium, list_media, show_medium):
+        """Return the information for the media which have the received
+        medium as parent.
+        """
+        self.reconcile(list_media, force=not self._complete)
+        with self._lock:
+            uuid = self._get(medium, show_medium).get(constants.VHD_UUID)
+            return [dict(information)
+                    for information in self._media.values()
+                    if uuid and
+                    information.get(constants.VHD_PARENT_UUID) == uuid]
@@ -30,6 +30,7 @@ from nova.virt.virtualbox import constants
 from nova.virt.virtualbox import exception as vbox_exc
 from nova.virt.virtualbox import hostutils
 from nova.virt.virtualbox import manage
+from nova.virt.virtualbox import vminfo
 
 REMOTE_DISPLAY = [
     cfg.BoolOpt(
@@ -163,10 +164,7 @@ class ConsoleOps(object):
         if not port:
             try:
                 instance_info = self._vbox_manage.show_vm_info(instance)
-                port = int(instance_info[constants.VM_VRDE_PORT])
-            except (ValueError, KeyError) as exc:
-                LOG.debug("Failed to get port for instance: %(reason)s",
-                          {"reason": exc}, instance=instance)
+                port = vminfo.VMInfo.wrap(instance_info).vrde_port
             except (exception.InstanceNotFound, vbox_exc.VBoxException) as exc:
                 LOG.debug("Failed to get information regarding "
                           "instance: %(reason)s",
@@ -251,17 +249,18 @@ class ConsoleOps(object):
                 i18n._LE("No available port was found."))
 
         self._ports['used'][instance.name] = port
-        self._vbox_manage.modify_vrde(instance=instance,
-                                      field=constants.FIELD_VRDE_SERVER,
-                                      value=constants.ON)
-        self._vbox_manage.modify_vrde(instance=instance,
-                                      field=constants.FIELD_VRDE_PORT,
-                                      value=port)
-
-        if self.vrde_module == constants.EXTPACK_VNC:
-            self._setup_vnc(instance)
-        elif self.vrde_module == constants.EXTPACK_RDP:
-            self._setup_rdp(instance)
+        with self._vbox_manage.deferred_modifications(instance):
+            self._vbox_manage.modify_vrde(instance=instance,
+                                          field=constants.FIELD_VRDE_SERVER,
+                                          value=constants.ON)
+            self._vbox_manage.modify_vrde(instance=instance,
+                                          field=constants.FIELD_VRDE_PORT,
+                                          value=port)
+
+            if self.vrde_module == constants.EXTPACK_VNC:
+                self._setup_vnc(instance)
+            elif self.vrde_module == constants.EXTPACK_RDP:
+                self._setup_rdp(instance)
 
     def prepare_instance(self, instance):
         """Modify the instance settings in order to properly work remote
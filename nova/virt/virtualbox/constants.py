@@ -30,6 +30,9 @@ VMS_INFO = 'vms'
 HOST_INFO = 'hostinfo'
 HDDS_INFO = 'hdds'
 
+BACKEND_CLI = 'cli'
+BACKEND_WEBSRV = 'websrv'
+
 ACPI_POWER_BUTTON = 'acpipowerbutton'
 ACPI_SLEEP_BUTTON = 'acpisleepbutton'
 
@@ -46,12 +49,31 @@ DISK_FORMAT_VDI = 'VDI'
 DISK_FORMAT_VHD = 'VHD'
 DISK_FORMAT_VMDK = 'VMDK'
 
+# The disk formats of the Glance images which have to be converted.
+IMAGE_FORMAT_RAW = 'raw'
+IMAGE_FORMAT_QCOW2 = 'qcow2'
+
+# How the disks are kept for reverting a resize on the same host.
+RESIZE_DISKS_COPY = 'copy'
+RESIZE_DISKS_REFLINK = 'reflink'
+
+# The image property which marks the compressed images.
+IMAGE_PROPERTY_COMPRESSION = 'vbox_compression'
+COMPRESSION_GZIP = 'gzip'
+
+# The image properties of the incremental snapshots: the image which
+# contains the parent disk and all the images of the disk chain,
+# starting with the base image.
+IMAGE_PROPERTY_PARENT = 'vbox_parent_image'
+IMAGE_PROPERTY_CHAIN = 'vbox_image_chain'
+
 EXTPACK_VNC = 'VNC'
 EXTPACK_RDP = 'Oracle VM VirtualBox Extension Pack'
 
 FIELD_CPUS = '--cpus'
 FIELD_DESCRIPTION = '--description'
 FIELD_MEMORY = '--memory'
+FIELD_NAME = '--name'
 FIELD_OS_TYPE = '--ostype'
 
 FIELD_NIC = "--nic%(index)s"
@@ -81,6 +103,11 @@ FIELD_VRDE_SERVER = '--vrde'
 FIELD_VRDE_VIDEO = '--vrdevideochannel'
 FIELD_VRDE_PROPERTY = '--vrdeproperty'
 
+FIELD_TELEPORTER = '--teleporter'
+FIELD_TELEPORTER_ADDRESS = '--teleporteraddress'
+FIELD_TELEPORTER_PASSWORD = '--teleporterpassword'
+FIELD_TELEPORTER_PORT = '--teleporterport'
+
 PROPERTY_VNC_PASSWORD = 'VNCPassword=%(password)s'
 
 HOST_MEMORY_AVAILABLE = 'Memory available'
@@ -126,6 +153,8 @@ STATE_RESUME = 'resume'
 STATE_SUSPEND = 'savestate'
 STATE_POWER_OFF = 'poweroff'
 STATE_SAVED = 'saved'
+STATE_TELEPORT = 'teleport'
+STATE_TELEPORTED = 'teleported'
 
 START_VM_GUI = 'gui'
 START_VM_HEADLESS = 'headless'
@@ -200,18 +229,58 @@ VBOX_E_INSTANCE_NOT_FOUND = 'Could not find a registered machine named'
 VM_POWER_STATE = 'VMState'
 VM_ACPI = 'acpi'
 VM_CPUS = 'cpus'
+VM_DESCRIPTION = 'description'
 VM_MEMORY = 'memory'
 VM_VRDE_PORT = 'vrdeports'
+VM_TELEPORTER = 'teleporterenabled'
+VM_CONFIG_FILE = 'CfgFile'
+VM_MAC_ADDRESS = 'macaddress%(index)s'
+
+# The performance metrics collected by VirtualBox
+METRIC_CPU_LOAD = 'CPU/Load'
+METRIC_CPU_LOAD_USER = 'CPU/Load/User'
+METRIC_CPU_LOAD_KERNEL = 'CPU/Load/Kernel'
+METRIC_CPU_LOAD_IDLE = 'CPU/Load/Idle'
+METRIC_CPU_MHZ = 'CPU/MHz'
+METRIC_RAM_USAGE = 'RAM/Usage'
+METRIC_RAM_USED = 'RAM/Usage/Used'
+METRIC_GUEST_RAM_USAGE = 'Guest/RAM/Usage'
+METRIC_GUEST_RAM_TOTAL = 'Guest/RAM/Usage/Total'
+METRIC_GUEST_RAM_FREE = 'Guest/RAM/Usage/Free'
+METRIC_NET_RATE = 'Net/Rate'
+METRIC_NET_RATE_RX = 'Net/Rate/Rx'
+METRIC_NET_RATE_TX = 'Net/Rate/Tx'
+METRIC_DISK_USAGE = 'Disk/Usage'
+METRIC_DISK_USED = 'Disk/Usage/Used'
+METRICS_HOST = 'host'
 
 POWER_STATE = {
     STATE_POWER_OFF: power_state.SHUTDOWN,
     'starting': power_state.RUNNING,
     'running': power_state.RUNNING,
     'paused': power_state.PAUSED,
+    'teleporting': power_state.RUNNING,
+    'teleportingin': power_state.RUNNING,
+    'teleportingpausedvm': power_state.PAUSED,
+    STATE_TELEPORTED: power_state.SHUTDOWN,
     'aborted': power_state.SUSPENDED,
     STATE_SAVED: power_state.SUSPENDED,
 }
 
+# The states reported by `list --long vms`
+LONG_POWER_STATE = {
+    'powered off': power_state.SHUTDOWN,
+    'starting': power_state.RUNNING,
+    'running': power_state.RUNNING,
+    'paused': power_state.PAUSED,
+    'teleporting': power_state.RUNNING,
+    'teleporting in': power_state.RUNNING,
+    'teleporting paused vm': power_state.PAUSED,
+    'teleported': power_state.SHUTDOWN,
+    'aborted': power_state.SUSPENDED,
+    'saved': power_state.SUSPENDED,
+}
+
 SHOW_HD_INFO_KEYS = {
     'UUID': VHD_UUID,
     'Parent UUID': VHD_PARENT_UUID,
@@ -236,6 +305,8 @@ ALL_VHD_TYPES = (VHD_TYPE_SHAREABLE, VHD_TYPE_MULTIATTACH, VHD_TYPE_READONLY,
 ALL_VM_FIELDS = (FIELD_CPUS, FIELD_DESCRIPTION, FIELD_MEMORY, FIELD_OS_TYPE)
 ALL_VRDE_FIELDS = (FIELD_VRDE_EXTPACK, FIELD_VRDE_MULTICON, FIELD_VRDE_PORT,
                    FIELD_VRDE_PROPERTY, FIELD_VRDE_SERVER, FIELD_VRDE_VIDEO)
+ALL_TELEPORTER_FIELDS = (FIELD_TELEPORTER, FIELD_TELEPORTER_ADDRESS,
+                         FIELD_TELEPORTER_PASSWORD, FIELD_TELEPORTER_PORT)
 ALL_NETWORK_FIELDS = (FIELD_NIC, FIELD_NIC_TYPE, FIELD_CABLE_CONNECTED,
                       FIELD_BRIDGE_ADAPTER, FILED_MAC_ADDRESS)
 ALL_STATES = (STATE_PAUSE, STATE_RESET, STATE_RESUME, STATE_SUSPEND,
@@ -245,6 +316,13 @@ ALL_START_VM = (START_VM_GUI, START_VM_HEADLESS, START_VM_SDL)
 ALL_VARIANTS = (VARIANT_ESX, VARIANT_FIXED, VARIANT_STANDARD,
                 VARIANT_STREAM, VARIANT_SPLIT2G)
 ALL_VBOX_PROPERTIES = (VBOX_MACHINE_FOLDER, VBOX_VRDE_EXTPACK)
+ALL_BASE_METRICS = (METRIC_CPU_LOAD, METRIC_CPU_MHZ, METRIC_RAM_USAGE,
+                    METRIC_GUEST_RAM_USAGE, METRIC_NET_RATE,
+                    METRIC_DISK_USAGE)
+ALL_METRICS = (METRIC_CPU_LOAD_USER, METRIC_CPU_LOAD_KERNEL,
+               METRIC_CPU_LOAD_IDLE, METRIC_CPU_MHZ, METRIC_RAM_USED,
+               METRIC_GUEST_RAM_TOTAL, METRIC_GUEST_RAM_FREE,
+               METRIC_NET_RATE_RX, METRIC_NET_RATE_TX, METRIC_DISK_USED)
 
 DEFAULT_IDE_CNAME = "IDE"
 DEFAULT_SATA_CNAME = "SATA"
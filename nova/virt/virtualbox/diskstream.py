@@ -0,0 +1,415 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Read the content of the VDI and VHD disk images without VBoxManage.
+
+The images from a differencing chain are merged while they are read,
+so the content of a disk can be streamed without creating a copy of it.
+"""
+
+import struct
+import uuid
+import zlib
+
+from oslo_utils import units
+
+from nova.i18n import _
+from nova.virt.virtualbox import exception as vbox_exc
+
+SECTOR_SIZE = 512
+
+VDI_PRE_HEADER = b"<<< Oracle VM VirtualBox Disk Image >>>\n"
+VDI_SIGNATURE = 0xbeda107f
+VDI_VERSION = 0x00010001
+VDI_HEADER_SIZE = 0x190
+VDI_TYPE_NORMAL = 1
+VDI_TYPE_DIFF = 4
+VDI_BLOCK_FREE = 0xffffffff
+VDI_BLOCK_ZERO = 0xfffffffe
+VDI_BLOCK_SIZE = units.Mi
+VDI_DATA_ALIGN = units.Mi
+
+# The pre-header and the header of a VDI image, version 1.1.
+_VDI_PRE_HEADER = struct.Struct("<64sII")
+_VDI_HEADER = struct.Struct("<III256sII16sIQIIII16s16s16s16s16s")
+
+VHD_COOKIE = b"conectix"
+VHD_FOOTER_SIZE = 512
+VHD_TYPE_FIXED = 2
+VHD_TYPE_DYNAMIC = 3
+VHD_TYPE_DIFFERENCING = 4
+VHD_BLOCK_FREE = 0xffffffff
+
+# The footer of a VHD image and the beginning of the dynamic disk
+# header, up to the block size.
+_VHD_FOOTER = struct.Struct(">8sIIQI4sI4sQQIII16sB427s")
+_VHD_DYNAMIC_HEADER = struct.Struct(">8sQQIII")
+
+
+def _align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def _zeros(length):
+    return bytes(bytearray(length))
+
+
+class DiskImage(object):
+
+    """A single disk image, without its parents."""
+
+    def __init__(self, path, disk_file):
+        self.path = path
+        self.size = 0
+        self._file = disk_file
+
+    def close(self):
+        self._file.close()
+
+    def _read_at(self, offset, length):
+        self._file.seek(offset)
+        data = self._file.read(length)
+        if len(data) != length:
+            raise vbox_exc.UnsupportedDiskImage(
+                path=self.path, reason=_("the image is truncated"))
+        return data
+
+    def _blocks(self, offset, length, block_size):
+        """Yield the index of every block from the received area
+        together with the part of the area which is in that block.
+        """
+        end = min(offset + length, self.size)
+        while offset < end:
+            index = offset // block_size
+            block_end = min((index + 1) * block_size, end)
+            yield index, offset, block_end - offset
+            offset = block_end
+
+    def is_allocated(self, offset, length):
+        """Check if any part of the received area is stored in this
+        image.
+        """
+        raise NotImplementedError()
+
+    def read(self, offset, length):
+        """Yield the offset and the content of every part of the
+        received area which is stored in this image.
+        """
+        raise NotImplementedError()
+
+
+class VDIImage(DiskImage):
+
+    """Dynamic, fixed or differencing VDI image."""
+
+    def __init__(self, path, disk_file):
+        super(VDIImage, self).__init__(path, disk_file)
+        header = _VDI_HEADER.unpack(self._read_at(_VDI_PRE_HEADER.size,
+                                                  _VDI_HEADER.size))
+        blocks_offset, self._data_offset = header[4:6]
+        self.size, self.block_size, self._block_extra = header[8:11]
+        block_count = header[11]
+        self.image_type = header[1]
+        self.parent_uuid = None
+        if self.image_type == VDI_TYPE_DIFF:
+            self.parent_uuid = str(uuid.UUID(bytes_le=header[15]))
+        self._block_map = struct.unpack(
+            "<%dI" % block_count,
+            self._read_at(blocks_offset, block_count * 4))
+
+    def is_allocated(self, offset, length):
+        return any(self._block_map[index] != VDI_BLOCK_FREE
+                   for index, _, _ in self._blocks(offset, length,
+                                                   self.block_size))
+
+    def read(self, offset, length):
+        for index, start, count in self._blocks(offset, length,
+                                                self.block_size):
+            entry = self._block_map[index]
+            if entry == VDI_BLOCK_FREE:
+                # Note: The content is stored in the parent image.
+                continue
+            if entry == VDI_BLOCK_ZERO:
+                yield start, _zeros(count)
+                continue
+
+            position = (self._data_offset +
+                        entry * (self.block_size + self._block_extra) +
+                        self._block_extra + start % self.block_size)
+            yield start, self._read_at(position, count)
+
+
+class VHDImage(DiskImage):
+
+    """Fixed, dynamic or differencing VHD image."""
+
+    def __init__(self, path, disk_file, footer):
+        super(VHDImage, self).__init__(path, disk_file)
+        footer = _VHD_FOOTER.unpack(footer)
+        data_offset, self.size, self._disk_type = (footer[3], footer[9],
+                                                   footer[11])
+        if self._disk_type == VHD_TYPE_FIXED:
+            return
+        if self._disk_type not in (VHD_TYPE_DYNAMIC, VHD_TYPE_DIFFERENCING):
+            raise vbox_exc.UnsupportedDiskImage(
+                path=path, reason=_("unknown VHD type %d") % self._disk_type)
+
+        header = _VHD_DYNAMIC_HEADER.unpack(
+            self._read_at(data_offset, _VHD_DYNAMIC_HEADER.size))
+        table_offset = header[2]
+        table_entries, self.block_size = header[4:6]
+        self._bat = struct.unpack(
+            ">%dI" % table_entries,
+            self._read_at(table_offset, table_entries * 4))
+        # Note: Every block starts with a bitmap which marks the sectors
+        # stored in the block, padded to a sector boundary.
+        self._bitmap_size = _align(
+            (self.block_size // SECTOR_SIZE + 7) // 8, SECTOR_SIZE)
+
+    def is_allocated(self, offset, length):
+        if self._disk_type == VHD_TYPE_FIXED:
+            return offset < self.size
+        return any(self._bat[index] != VHD_BLOCK_FREE
+                   for index, _, _ in self._blocks(offset, length,
+                                                   self.block_size))
+
+    @staticmethod
+    def _sector_runs(bitmap, start, count):
+        """Yield the ranges of the received part of a block which are
+        marked in the sector bitmap of the block.
+        """
+        bitmap = bytearray(bitmap)
+        first = start // SECTOR_SIZE
+        last = (start + count - 1) // SECTOR_SIZE
+        run_start = None
+        for sector in range(first, last + 2):
+            present = (sector <= last and
+                       bitmap[sector // 8] & (0x80 >> sector % 8))
+            if present and run_start is None:
+                run_start = sector
+            elif not present and run_start is not None:
+                run_offset = max(run_start * SECTOR_SIZE, start)
+                run_end = min(sector * SECTOR_SIZE, start + count)
+                yield run_offset, run_end - run_offset
+                run_start = None
+
+    def read(self, offset, length):
+        if self._disk_type == VHD_TYPE_FIXED:
+            length = min(length, self.size - offset)
+            if length > 0:
+                yield offset, self._read_at(offset, length)
+            return
+
+        for index, start, count in self._blocks(offset, length,
+                                                self.block_size):
+            entry = self._bat[index]
+            if entry == VHD_BLOCK_FREE:
+                continue
+
+            block_offset = entry * SECTOR_SIZE + self._bitmap_size
+            block_start = index * self.block_size
+            if self._disk_type == VHD_TYPE_DYNAMIC:
+                yield start, self._read_at(
+                    block_offset + start - block_start, count)
+                continue
+
+            # Note: The sectors of a differencing image which are not
+            # marked in the bitmap are stored in the parent image.
+            bitmap = self._read_at(entry * SECTOR_SIZE, self._bitmap_size)
+            for run_offset, run_length in self._sector_runs(
+                    bitmap, start - block_start, count):
+                yield (block_start + run_offset,
+                       self._read_at(block_offset + run_offset, run_length))
+
+
+def open_image(path):
+    """Open the received VDI or VHD image.
+
+    :raises UnsupportedDiskImage: if the format of the image is not
+                                  supported
+    """
+    disk_file = open(path, "rb")
+    try:
+        pre_header = disk_file.read(_VDI_PRE_HEADER.size)
+        if len(pre_header) == _VDI_PRE_HEADER.size:
+            signature, version = _VDI_PRE_HEADER.unpack(pre_header)[1:]
+            if signature == VDI_SIGNATURE:
+                if version >> 16 != VDI_VERSION >> 16:
+                    raise vbox_exc.UnsupportedDiskImage(
+                        path=path,
+                        reason=_("unknown VDI version %x") % version)
+                return VDIImage(path, disk_file)
+
+        disk_file.seek(0, 2)
+        if disk_file.tell() >= VHD_FOOTER_SIZE:
+            disk_file.seek(-VHD_FOOTER_SIZE, 2)
+            footer = disk_file.read(VHD_FOOTER_SIZE)
+            if footer.startswith(VHD_COOKIE):
+                return VHDImage(path, disk_file, footer)
+    except Exception:
+        disk_file.close()
+        raise
+
+    disk_file.close()
+    raise vbox_exc.UnsupportedDiskImage(
+        path=path, reason=_("the image is not a VDI or a VHD image"))
+
+
+class FlatDisk(object):
+
+    """The content of a disk merged with the content of its parents.
+
+    :param paths: the path of the disk followed by the paths of all
+                  its parents, ending with the base disk
+    """
+
+    def __init__(self, paths):
+        self._images = []
+        try:
+            for path in paths:
+                self._images.append(open_image(path))
+        except Exception:
+            self.close()
+            raise
+        self.size = self._images[0].size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for image in self._images:
+            image.close()
+
+    def is_allocated(self, offset, length, depth=None):
+        """Check if any part of the received area is stored in one of
+        the images.
+
+        :param depth: the number of images checked, starting with
+                      the disk; by default all the images are checked
+        """
+        return any(image.is_allocated(offset, length)
+                   for image in self._images[:depth])
+
+    def read(self, offset, length):
+        """Return the content of the received area."""
+        length = max(min(length, self.size - offset), 0)
+        data = bytearray(length)
+        # Note: The images are applied starting with the base image,
+        # so the content from a child overwrites the one from its parent.
+        for image in reversed(self._images):
+            for start, chunk in image.read(offset, length):
+                start -= offset
+                data[start:start + len(chunk)] = chunk
+        return bytes(data)
+
+
+def vdi_header(disk_size, block_size, block_count, allocated_count,
+               parent_uuid=None):
+    """Return the headers and the offset of the data blocks for
+    a dynamic VDI image or, if a parent UUID is received, for
+    a differencing VDI image.
+    """
+    image_type, linkage = VDI_TYPE_NORMAL, _zeros(16)
+    if parent_uuid:
+        image_type = VDI_TYPE_DIFF
+        linkage = uuid.UUID(parent_uuid).bytes_le
+
+    blocks_offset = _VDI_PRE_HEADER.size + VDI_HEADER_SIZE
+    blocks_offset = _align(blocks_offset, SECTOR_SIZE)
+    data_offset = _align(blocks_offset + block_count * 4, VDI_DATA_ALIGN)
+    geometry = struct.pack("<4I", 0, 0, 0, SECTOR_SIZE)
+    header = _VDI_PRE_HEADER.pack(VDI_PRE_HEADER, VDI_SIGNATURE,
+                                  VDI_VERSION)
+    header += _VDI_HEADER.pack(
+        VDI_HEADER_SIZE, image_type, 0, b"", blocks_offset, data_offset,
+        geometry, 0, disk_size, block_size, 0, block_count, allocated_count,
+        uuid.uuid4().bytes_le, uuid.uuid4().bytes_le, linkage, _zeros(16),
+        geometry)
+    return header, blocks_offset, data_offset
+
+
+def vdi_stream(flat_disk, block_size=VDI_BLOCK_SIZE, parent_uuid=None):
+    """Yield the content of the received disk as a dynamic VDI image.
+
+    Only the blocks which are stored in one of the images of the disk
+    are read and written to the stream. If a parent UUID is received,
+    the stream is a differencing image of that parent, which contains
+    only the blocks stored in the first image of the disk.
+    """
+    depth = 1 if parent_uuid else None
+    block_count = (flat_disk.size + block_size - 1) // block_size
+    allocated = [index for index in range(block_count)
+                 if flat_disk.is_allocated(index * block_size, block_size,
+                                           depth)]
+    block_map = [VDI_BLOCK_FREE] * block_count
+    for position, index in enumerate(allocated):
+        block_map[index] = position
+
+    header, blocks_offset, data_offset = vdi_header(
+        flat_disk.size, block_size, block_count, len(allocated),
+        parent_uuid)
+    yield header + _zeros(blocks_offset - len(header))
+    yield struct.pack("<%dI" % block_count, *block_map)
+    yield _zeros(data_offset - blocks_offset - block_count * 4)
+
+    for index in allocated:
+        data = flat_disk.read(index * block_size, block_size)
+        yield data + _zeros(block_size - len(data))
+
+
+def compress(chunks):
+    """Compress the received chunks using gzip."""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class ChunkReader(object):
+
+    """File-like object which returns the chunks received from
+    an iterator.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b""
+        self._offset = 0
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._offset >= len(self._chunk):
+                try:
+                    self._chunk = next(self._chunks)
+                except StopIteration:
+                    break
+                self._offset = 0
+                continue
+
+            end = len(self._chunk)
+            if size > 0:
+                end = min(end, self._offset + size)
+                size -= end - self._offset
+            parts.append(self._chunk[self._offset:end])
+            self._offset = end
+        return b"".join(parts)
@@ -20,8 +20,15 @@ import platform
 
 from nova.virt import driver
 from nova.virt.virtualbox import consoleops
+from nova.virt.virtualbox import eventhandler
 from nova.virt.virtualbox import hostops
+from nova.virt.virtualbox import imagecache
+from nova.virt.virtualbox import instrumentation
+from nova.virt.virtualbox import livemigrationops
+from nova.virt.virtualbox import manage
 from nova.virt.virtualbox import migrationops
+from nova.virt.virtualbox import perfmetrics
+from nova.virt.virtualbox import prefetch
 from nova.virt.virtualbox import snapshotops
 from nova.virt.virtualbox import vmops
 from nova.virt.virtualbox import volumeops
@@ -32,7 +39,13 @@ class VirtualBoxDriver(driver.ComputeDriver):
     def __init__(self, virtapi):
         super(VirtualBoxDriver, self).__init__(virtapi)
         self._console_ops = consoleops.ConsoleOps()
+        self._event_handler = eventhandler.InstanceEventHandler(
+            state_change_callback=self.emit_event)
+        self._image_cache_manager = imagecache.ImageCacheManager()
+        self._livemigrationops = livemigrationops.LiveMigrationOperations(
+            console_ops=self._console_ops)
         self._migrationops = migrationops.MigrationOperations()
+        self._prefetcher = prefetch.ImagePrefetcher()
         self._vbox_ops = vmops.VBoxOperation()
         self._snapshot_ops = snapshotops.SnapshotOperations()
         self._volume_ops = volumeops.VolumeOperations()
@@ -43,6 +56,10 @@ class VirtualBoxDriver(driver.ComputeDriver):
         """
         self._console_ops.setup_host()
         self._vbox_ops.init_host()
+        hostops.init_host()
+        perfmetrics.init_host()
+        manage.VBoxManage.get_metrics().start()
+        self._event_handler.start_listener()
 
     def get_available_resource(self, nodename):
         """Retrieve resource information.
@@ -102,6 +119,28 @@ class VirtualBoxDriver(driver.ComputeDriver):
         """
         return self._vbox_ops.get_info(instance)
 
+    def get_power_states(self, instances):
+        """Get the current power state for multiple instances at once.
+
+        Returns a dictionary which has the instance UUID as key and the
+        power_state code as value.
+        """
+        return self._vbox_ops.get_power_states(instances)
+
+    def get_diagnostics(self, instance):
+        """Return data about VM diagnostics."""
+        return self._vbox_ops.get_diagnostics(instance)
+
+    def get_instance_diagnostics(self, instance):
+        """Return data about VM diagnostics."""
+        return self._vbox_ops.get_instance_diagnostics(instance)
+
+    def get_host_cpu_stats(self):
+        """Return the CPU statistics of the host, which are used by the
+        ComputeDriverCPUMonitor.
+        """
+        return perfmetrics.get_host_cpu_stats()
+
     def spawn(self, context, instance, image_meta, injected_files,
               admin_password, network_info=None, block_device_info=None,
               flavor=None):
@@ -128,10 +167,16 @@ class VirtualBoxDriver(driver.ComputeDriver):
                                   attached to the instance.
         :param flavor: The flavor for the instance to be spawned.
         """
-        self._vbox_ops.spawn(context, instance, image_meta, injected_files,
-                             admin_password, network_info, block_device_info)
-        self._console_ops.prepare_instance(instance)
-        self._vbox_ops.power_on(instance)
+        with instrumentation.timed_operation("spawn", instance):
+            self._vbox_ops.spawn(context, instance, image_meta,
+                                 injected_files, admin_password,
+                                 network_info, block_device_info)
+            with instrumentation.phase("prepare_console"):
+                self._console_ops.prepare_instance(instance)
+            with instrumentation.phase("power_on"):
+                # Note: The virtual machine was just created, so its
+                # teleporter does not have to be checked.
+                manage.VBoxManage.start_vm(instance)
 
     def destroy(self, context, instance, network_info, block_device_info=None,
                 destroy_disks=True, migrate_data=None):
@@ -159,7 +204,10 @@ class VirtualBoxDriver(driver.ComputeDriver):
         """Clean up anything that is necessary for the driver gracefully stop,
         including ending remote sessions. This is optional.
         """
-        pass
+        self._event_handler.stop_listener()
+        perfmetrics.cleanup_host()
+        manage.VBoxManage.get_metrics().stop()
+        manage.VBoxManage.reset_backend()
 
     def pause(self, instance):
         """Pause the specified instance.
@@ -245,8 +293,9 @@ class VirtualBoxDriver(driver.ComputeDriver):
         :param image_id: Reference to a pre-created image that will
                          hold the snapshot.
         """
-        self._snapshot_ops.take_snapshot(context, instance,
-                                         image_id, update_task_state)
+        with instrumentation.timed_operation("snapshot", instance):
+            self._snapshot_ops.take_snapshot(context, instance,
+                                             image_id, update_task_state)
 
     def get_rdp_console(self, context, instance):
         """Get connection info for a rdp console.
@@ -305,10 +354,12 @@ class VirtualBoxDriver(driver.ComputeDriver):
         :param retry_interval: How often to signal guest while
                                waiting for it to shutdown
         """
-        self._console_ops.cleanup(instance)
-        return self._migrationops.migrate_disk_and_power_off(
-            context, instance, dest, flavor, network_info, block_device_info,
-            timeout, retry_interval)
+        with instrumentation.timed_operation("migrate_disk_and_power_off",
+                                             instance):
+            self._console_ops.cleanup(instance)
+            return self._migrationops.migrate_disk_and_power_off(
+                context, instance, dest, flavor, network_info,
+                block_device_info, timeout, retry_interval)
 
     def finish_migration(self, context, migration, instance, disk_info,
                          network_info, image_meta, resize_instance,
@@ -364,6 +415,193 @@ class VirtualBoxDriver(driver.ComputeDriver):
             self._console_ops.prepare_instance(instance)
             self._vbox_ops.power_on(instance)
 
+    def check_instance_shared_storage_local(self, context, instance):
+        """Check if instance files located on shared storage.
+
+        This runs check on the destination host, and then calls
+        back to the source host to check the results.
+
+        :param context: security context
+        :param instance: nova.objects.instance.Instance object
+        """
+        return self._livemigrationops.check_instance_shared_storage_local(
+            context, instance)
+
+    def check_instance_shared_storage_remote(self, context, data):
+        """Check if instance files located on shared storage.
+
+        :param context: security context
+        :param data: result of check_instance_shared_storage_local
+        """
+        return self._livemigrationops.check_instance_shared_storage_remote(
+            context, data)
+
+    def check_instance_shared_storage_cleanup(self, context, data):
+        """Do cleanup on host after check_instance_shared_storage calls
+
+        :param context: security context
+        :param data: result of check_instance_shared_storage_local
+        """
+        self._livemigrationops.check_instance_shared_storage_cleanup(
+            context, data)
+
+    def check_can_live_migrate_destination(self, context, instance,
+                                           src_compute_info, dst_compute_info,
+                                           block_migration=False,
+                                           disk_over_commit=False):
+        """Check if it is possible to execute live migration.
+
+        This runs checks on the destination host, and then calls
+        back to the source host to check the results.
+
+        :param context: security context
+        :param instance: nova.objects.instance.Instance object
+        :param block_migration: if true, prepare for block migration
+        :param disk_over_commit: if true, allow disk over commit
+        :returns: a dict containing migration info (hypervisor-dependent)
+        """
+        return self._livemigrationops.check_can_live_migrate_destination(
+            context, instance, src_compute_info, dst_compute_info,
+            block_migration, disk_over_commit)
+
+    def check_can_live_migrate_destination_cleanup(self, context,
+                                                   dest_check_data):
+        """Do required cleanup on dest host after check_can_live_migrate calls
+
+        :param context: security context
+        :param dest_check_data: result of check_can_live_migrate_destination
+        """
+        self._livemigrationops.check_can_live_migrate_destination_cleanup(
+            context, dest_check_data)
+
+    def check_can_live_migrate_source(self, context, instance,
+                                      dest_check_data, block_device_info=None):
+        """Check if it is possible to execute live migration.
+
+        :param context: security context
+        :param instance: nova.objects.instance.Instance object
+        :param dest_check_data: result of check_can_live_migrate_destination
+        :param block_device_info: result of _get_instance_block_device_info
+        :returns: a dict containing migration info (hypervisor-dependent)
+        """
+        return self._livemigrationops.check_can_live_migrate_source(
+            context, instance, dest_check_data, block_device_info)
+
+    def pre_live_migration(self, context, instance, block_device_info,
+                           network_info, disk_info, migrate_data=None):
+        """Prepare an instance for live migration
+
+        :param context: security context
+        :param instance: nova.objects.instance.Instance object
+        :param block_device_info: instance block device information
+        :param network_info: instance network information
+        :param disk_info: instance disk information
+        :param migrate_data: implementation specific data dict
+        """
+        with instrumentation.timed_operation("pre_live_migration",
+                                             instance):
+            return self._livemigrationops.pre_live_migration(
+                context, instance, block_device_info, network_info,
+                disk_info, migrate_data)
+
+    def live_migration(self, context, instance, dest,
+                       post_method, recover_method, block_migration=False,
+                       migrate_data=None):
+        """Live migration of an instance to another host.
+
+        :param context: security context
+        :param instance: nova.objects.instance.Instance object
+        :param dest: destination host
+        :param post_method: post operation method
+        :param recover_method: recovery method when any exception occurs
+        :param block_migration: if true, migrate VM disk
+        :param migrate_data: implementation specific params
+        """
+        with instrumentation.timed_operation("live_migration", instance):
+            self._livemigrationops.live_migration(
+                context, instance, dest, post_method, recover_method,
+                block_migration, migrate_data)
+
+    def rollback_live_migration_at_destination(self, context, instance,
+                                               network_info,
+                                               block_device_info,
+                                               destroy_disks=True,
+                                               migrate_data=None):
+        """Clean up destination node after a failed live migration.
+
+        :param context: security context
+        :param instance: instance object that was being migrated
+        :param network_info: instance network information
+        :param block_device_info: instance block device information
+        :param destroy_disks:
+            if true, destroy disks at destination during cleanup
+        :param migrate_data: implementation specific params
+        """
+        self._console_ops.cleanup(instance)
+        self._livemigrationops.rollback_live_migration_at_destination(
+            context, instance, network_info, block_device_info,
+            destroy_disks, migrate_data)
+
+    def post_live_migration(self, context, instance, block_device_info,
+                            migrate_data=None):
+        """Post operation of live migration at source host.
+
+        :param context: security context
+        :instance: instance object that was migrated
+        :block_device_info: instance block device information
+        :param migrate_data: if not None, it is a dict which has data
+        """
+        self._console_ops.cleanup(instance)
+        self._livemigrationops.post_live_migration(
+            context, instance, block_device_info, migrate_data)
+
+    def post_live_migration_at_source(self, context, instance, network_info):
+        """Unplug VIFs from networks at source.
+
+        :param context: security context
+        :param instance: instance object reference
+        :param network_info: instance network information
+        """
+        # Note: The network adapters were removed with the virtual
+        # machine by post_live_migration.
+        pass
+
+    def post_live_migration_at_destination(self, context, instance,
+                                           network_info,
+                                           block_migration=False,
+                                           block_device_info=None):
+        """Post operation of live migration at destination host.
+
+        :param context: security context
+        :param instance: instance object that is migrated
+        :param network_info: instance network information
+        :param block_migration: if true, post operation of block_migration.
+        """
+        self._livemigrationops.post_live_migration_at_destination(
+            context, instance, network_info, block_migration,
+            block_device_info)
+
+    def ensure_filtering_rules_for_instance(self, instance, network_info):
+        """Setting up filtering rules and waiting for its completion."""
+        # Note: The VirtualBox driver does not apply filtering rules.
+        pass
+
+    def unfilter_instance(self, instance, network_info):
+        """Stop filtering instance."""
+        pass
+
+    def manage_image_cache(self, context, all_instances):
+        """Manage the local cache of images.
+
+        The unused base images are removed and the images selected for
+        prefetching are fetched in the background.
+        """
+        image_ids = self._prefetcher.select_images(context, all_instances)
+        self._image_cache_manager.update(context, all_instances,
+                                         keep_images=image_ids)
+        if image_ids:
+            self._prefetcher.start(context, image_ids)
+
     def get_host_ip_addr(self):
         """Retrieves the IP address of the dom0
         """
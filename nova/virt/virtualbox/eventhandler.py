@@ -0,0 +1,179 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Watcher for the power state changes of the virtual machines.
+"""
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+
+from nova.compute import power_state
+from nova import exception
+from nova import i18n
+from nova.openstack.common import loopingcall
+from nova.virt import event as virtevent
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import manage
+from nova.virt.virtualbox import vmpool
+
+LOG = logging.getLogger(__name__)
+
+VIRTUAL_BOX = [
+    cfg.IntOpt('power_state_event_polling_interval',
+               default=10,
+               help='Interval between the checks for the virtual machines '
+                    'which were started or stopped, in seconds. If the '
+                    'value is 0, no lifecycle events will be emitted.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
+
+_TRANSITIONS = {
+    power_state.RUNNING: virtevent.EVENT_LIFECYCLE_STARTED,
+    power_state.PAUSED: virtevent.EVENT_LIFECYCLE_PAUSED,
+    power_state.SHUTDOWN: virtevent.EVENT_LIFECYCLE_STOPPED,
+    power_state.SUSPENDED: virtevent.EVENT_LIFECYCLE_STOPPED,
+}
+
+
+class InstanceEventHandler(object):
+
+    """Emit lifecycle events for the instances which were started or
+    stopped.
+
+    Every check lists only the running virtual machines and the
+    details are requested only for the virtual machines which were
+    started since the previous check. The virtual machines which are
+    not instances, like the pooled ones, are ignored.
+
+    .. note::
+        The paused virtual machines are also listed as running, so
+        pausing or resuming an instance does not emit events; those
+        changes are found by the periodic power state sync.
+    """
+
+    def __init__(self, state_change_callback=None):
+        self._callback = state_change_callback
+        self._running = None
+        self._periodic_call = None
+
+    @staticmethod
+    def _get_transition(previous_state, current_state):
+        if (current_state == power_state.RUNNING and
+                previous_state == power_state.PAUSED):
+            return virtevent.EVENT_LIFECYCLE_RESUMED
+        return _TRANSITIONS.get(current_state)
+
+    def _emit_event(self, instance_uuid, transition):
+        LOG.debug("Emitting lifecycle event %(transition)s for %(uuid)s",
+                  {"transition": transition, "uuid": instance_uuid})
+        if self._callback:
+            self._callback(virtevent.LifecycleEvent(instance_uuid,
+                                                    transition))
+
+    @staticmethod
+    def _instance_uuid(vm_uuid, vm_info):
+        """Return the UUID of the instance which uses the received
+        virtual machine or None if it is not an instance.
+
+        The description of the virtual machines created by the driver
+        is a JSON object.
+        """
+        try:
+            description = jsonutils.loads(
+                vm_info.get(constants.VM_DESCRIPTION) or "")
+        except ValueError:
+            return None
+        if not isinstance(description, dict):
+            return None
+
+        # Note: The virtual machines taken from the pool do not have
+        # the same UUID as the instance.
+        return (description.get("instance_uuid") or
+                manage.VBoxManage.get_vm_registry().instance_uuid(vm_uuid))
+
+    def _started_vm(self, vm_name, vm_uuid):
+        """Return the (name, instance UUID, power state) of a virtual
+        machine which was started or None if it cannot be queried.
+        """
+        try:
+            vm_info = manage.VBoxManage.show_vm_info(None, vm_name=vm_name)
+        except (exception.NovaException, vbox_exc.VBoxException) as exc:
+            LOG.debug("Failed to get the power state of %(name)s: "
+                      "%(reason)s", {"name": vm_name, "reason": exc})
+            return None
+        return (vm_name, self._instance_uuid(vm_uuid, vm_info),
+                vm_info.power_state)
+
+    def _poll_power_states(self):
+        try:
+            running_vms = manage.VBoxManage.list_running_vms()
+        except vbox_exc.VBoxException as exc:
+            LOG.warning(i18n._LW("Failed to get the running virtual "
+                                 "machines: %s"), exc)
+            return
+
+        running = {vm_uuid: vm_name for vm_name, vm_uuid in running_vms
+                   if not vmpool.is_pooled(vm_name)}
+        first_check = self._running is None
+        previous = self._running or {}
+        self._running = {}
+
+        for vm_uuid, vm_name in running.items():
+            if vm_uuid in previous:
+                self._running[vm_uuid] = previous[vm_uuid]
+                continue
+
+            started_vm = self._started_vm(vm_name, vm_uuid)
+            if started_vm is None:
+                continue
+            self._running[vm_uuid] = started_vm
+            if not first_check:
+                self._changed_state(started_vm, power_state.SHUTDOWN)
+
+        for vm_uuid, (vm_name, instance_uuid, _) in previous.items():
+            if vm_uuid not in running:
+                self._changed_state((vm_name, instance_uuid,
+                                     power_state.SHUTDOWN))
+
+    def _changed_state(self, virtual_machine, previous_state=None):
+        vm_name, instance_uuid, current_state = virtual_machine
+        # The cached information regarding the virtual machine
+        # is outdated.
+        manage.VBoxManage.get_vm_info_cache().invalidate(vm_name)
+        transition = self._get_transition(previous_state, current_state)
+        if instance_uuid and transition is not None:
+            self._emit_event(instance_uuid, transition)
+
+    def start_listener(self):
+        """Start watching the power state of the virtual machines."""
+        interval = CONF.virtualbox.power_state_event_polling_interval
+        if self._periodic_call or interval <= 0:
+            return
+
+        self._periodic_call = loopingcall.FixedIntervalLoopingCall(
+            self._poll_power_states)
+        self._periodic_call.start(interval=interval)
+
+    def stop_listener(self):
+        """Stop watching the power state of the virtual machines."""
+        if self._periodic_call:
+            self._periodic_call.stop()
+        self._periodic_call = None
+        self._running = None
@@ -42,3 +42,7 @@ class VBoxInvalidArgument(VBoxInvalid):
 class VBoxValueNotAllowed(VBoxInvalid):
     msg_fmt = i18n._("The value `%(value)s` for `%(argument)s` should be one "
                      "of the following: %(allowed_values)s in %(method)s.")
+
+
+class UnsupportedDiskImage(VBoxException):
+    msg_fmt = i18n._("The disk image %(path)s can not be read: %(reason)s")
@@ -0,0 +1,137 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Concurrency limits for the commands sent to VirtualBox.
+"""
+
+import contextlib
+import random
+import threading
+import time
+
+
+class ExecutionGovernor(object):
+
+    """Limit the number of VBoxManage commands executed at once.
+
+    Every command needs a slot in order to be executed. The commands
+    which change a virtual machine are also serialized using a lane
+    for each virtual machine, so they will not compete for the session
+    lock of the same machine.
+
+    :param max_concurrent: the maximum number of commands executed at
+                           once or 0 for no limit
+    """
+
+    def __init__(self, max_concurrent=0):
+        self.max_concurrent = max_concurrent
+        self._slots = None
+        if max_concurrent > 0:
+            self._slots = threading.Semaphore(max_concurrent)
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _enqueue(self):
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def _dequeue(self, wait_time):
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+            self.acquired += 1
+            self.total_wait += wait_time
+            self.max_wait = max(self.max_wait, wait_time)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Wait until a new command can be executed."""
+        self._enqueue()
+        start = time.time()
+        if self._slots:
+            self._slots.acquire()
+        self._dequeue(time.time() - start)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            if self._slots:
+                self._slots.release()
+
+    @contextlib.contextmanager
+    def lane(self, name):
+        """Serialize the commands for the virtual machine with
+        the received name.
+
+        If the name is None, the commands are not serialized.
+        """
+        if name is None:
+            yield
+            return
+
+        with self._lock:
+            lock, users = self._lanes.get(name, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._lanes[name] = (lock, users + 1)
+
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, users = self._lanes[name]
+                if users > 1:
+                    self._lanes[name] = (lock, users - 1)
+                else:
+                    del self._lanes[name]
+
+    @staticmethod
+    def backoff(attempt, interval, max_interval=None):
+        """Return the number of seconds to wait before the next attempt.
+
+        The delay grows exponentially with the number of attempts and
+        it is randomized in order to avoid the retries of concurrent
+        commands being executed at the same time.
+        """
+        delay = interval * (2 ** attempt)
+        if max_interval:
+            delay = min(delay, max_interval)
+        return random.uniform(delay / 2.0, delay)
+
+    def stats(self):
+        """Return the counters for the current governor."""
+        with self._lock:
+            return {
+                "active": self.active,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "acquired": self.acquired,
+                "total_wait": self.total_wait,
+                "max_wait": self.max_wait,
+                "average_wait": (self.total_wait / self.acquired
+                                 if self.acquired else 0.0),
+                "lanes": len(self._lanes),
+            }
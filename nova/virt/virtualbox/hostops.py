@@ -15,6 +15,7 @@
 
 import os
 import platform
+import threading
 
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -24,10 +25,13 @@ from oslo_utils import units
 from nova.compute import arch
 from nova.compute import hv_type
 from nova.compute import vm_mode
+from nova import exception
 from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import exception as vbox_exc
 from nova.virt.virtualbox import hostutils
 from nova.virt.virtualbox import manage
 from nova.virt.virtualbox import pathutils
+from nova.virt.virtualbox import vmpool
 from nova.virt.virtualbox import vmutils
 
 LOG = logging.getLogger(__name__)
@@ -54,6 +58,119 @@ def _get_local_hdd_info_gb():
     return (total_gb, free_gb, used_gb)
 
 
+def _get_vcpus_used():
+    """Return the number of virtual CPUs configured for the virtual
+    machines registered with VirtualBox, except the pooled ones.
+    """
+    vm_registry = manage.VBoxManage.get_vm_registry()
+    vcpus_used = 0
+    for virtual_machine in vm_registry.virtual_machines():
+        if vmpool.is_pooled(virtual_machine.name):
+            continue
+
+        cpus = vm_registry.cpus(virtual_machine.uuid)
+        if cpus is None:
+            try:
+                vm_info = manage.VBoxManage.show_vm_info(
+                    None, vm_name=virtual_machine.name)
+                cpus = int(vm_info.get(constants.VM_CPUS, 0))
+            except (exception.NovaException, vbox_exc.VBoxException,
+                    ValueError) as exc:
+                LOG.debug("Failed to get the number of virtual CPUs of "
+                          "%(name)s: %(reason)s",
+                          {"name": virtual_machine.name, "reason": exc})
+                continue
+            vm_registry.set_cpus(virtual_machine.uuid, cpus)
+        vcpus_used += cpus
+
+    return vcpus_used
+
+
+class HostFacts(object):
+
+    """The information regarding the host reported to the scheduler.
+
+    The facts which do not change while nova-compute is running, like
+    the VirtualBox version and the topology of the processors, are read
+    only once. The available memory, the disk usage and the number of
+    virtual CPUs used are refreshed every time the resources are
+    requested.
+    """
+
+    def __init__(self):
+        self._static = None
+        self._host_info = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        host_info = vmutils.get_host_info()
+        cpu_info = hostutils.get_cpus_info(host_info)
+        self._static = {
+            'vcpus': host_info[constants.HOST_PROCESSOR_COUNT],
+            'memory_mb': host_info[constants.HOST_MEMORY_SIZE],
+            'hypervisor_type': "vbox",
+            'hypervisor_version': _get_hypervisor_version(),
+            'hypervisor_hostname': platform.node(),
+            'cpu_info': jsonutils.dumps(cpu_info),
+            'supported_instances': jsonutils.dumps([
+                (arch.I686, hv_type.VBOX, vm_mode.HVM),
+                (arch.X86_64, hv_type.VBOX, vm_mode.HVM)]),
+            'numa_topology': None,
+        }
+        # Note: The information is used by the first request for the
+        # available resources instead of listing it again.
+        self._host_info = host_info
+
+    def load(self):
+        """Read the static facts regarding the host."""
+        with self._lock:
+            self._load()
+
+    def get(self, key):
+        """Return one of the static facts regarding the host."""
+        with self._lock:
+            if self._static is None:
+                self._load()
+            return self._static[key]
+
+    def get_available_resource(self):
+        """Return the static facts along with the current usage of
+        the host resources.
+        """
+        with self._lock:
+            if self._static is None:
+                self._load()
+            resources = dict(self._static)
+            host_info = self._host_info
+            self._host_info = None
+
+        if host_info is None:
+            host_info = vmutils.get_host_info()
+        local_gb, _, local_gb_used = _get_local_hdd_info_gb()
+
+        resources.update({
+            'memory_mb_used': (resources['memory_mb'] -
+                               host_info[constants.HOST_MEMORY_AVAILABLE]),
+            'local_gb': local_gb,
+            'local_gb_used': local_gb_used,
+            'vcpus_used': _get_vcpus_used(),
+        })
+        return resources
+
+
+_HOST_FACTS = HostFacts()
+
+
+def init_host():
+    """Read the static facts regarding the host."""
+    _HOST_FACTS.load()
+
+
+def get_vcpus():
+    """Return the number of processors of the host."""
+    return _HOST_FACTS.get('vcpus')
+
+
 def get_available_resource():
     """Retrieve resource info.
 
@@ -62,30 +179,7 @@ def get_available_resource():
 
     :returns: dictionary describing resources
     """
-
-    host_info = vmutils.get_host_info()
-    cpu_info = hostutils.get_cpus_info()
-    local_gb, _, local_gb_used = _get_local_hdd_info_gb()
-
-    resources = {
-        'vcpus': host_info[constants.HOST_PROCESSOR_COUNT],
-        'memory_mb': host_info[constants.HOST_MEMORY_SIZE],
-        'memory_mb_used': (host_info[constants.HOST_MEMORY_SIZE] -
-                           host_info[constants.HOST_MEMORY_AVAILABLE]),
-        'local_gb': local_gb,
-        'local_gb_used': local_gb_used,
-        'hypervisor_type': "vbox",
-        'hypervisor_version': _get_hypervisor_version(),
-        'hypervisor_hostname': platform.node(),
-        'vcpus_used': 0,
-        'cpu_info': jsonutils.dumps(cpu_info),
-        'supported_instances': jsonutils.dumps([
-            (arch.I686, hv_type.VBOX, vm_mode.HVM),
-            (arch.X86_64, hv_type.VBOX, vm_mode.HVM)]),
-        'numa_topology': None,
-    }
-
-    return resources
+    return _HOST_FACTS.get_available_resource()
 
 
 def get_host_ip_address():
@@ -24,21 +24,22 @@ import platform
 import socket
 
 from nova.virt.virtualbox import constants
-from nova.virt.virtualbox import manage
 from nova.virt.virtualbox import vmutils
 
 
-def get_cpus_info():
+def get_cpus_info(host_info=None):
     """Get the CPU information.
 
+    :param host_info: the information returned by vmutils.get_host_info
+                      or None in order to request it
     :returns: A dictionary containing the main properties
     of the central processor in the hypervisor.
     """
 
     cpu_info = {}
     topology = {}
-    host_info = vmutils.get_host_info()
-    all_infos = manage.VBoxManage.list(constants.HOST_INFO)
+    if host_info is None:
+        host_info = vmutils.get_host_info()
 
     topology['sockets'] = host_info[constants.HOST_PROCESSOR_COUNT]
     topology['cores'] = host_info[constants.HOST_PROCESSOR_CORE_COUNT]
@@ -50,11 +51,10 @@ def get_cpus_info():
     cpu_info['vendor'] = None
     cpu_info['features'] = []
 
-    for line in all_infos.splitlines():
-        if line.startswith(constants.HOST_FIRST_CPU_DESCRIPTION):
-            cpu_info['model'] = line.split(':')[1].strip()
-            cpu_info['vendor'] = cpu_info['model'].split()[0]
-            break
+    model = host_info.get(constants.HOST_FIRST_CPU_DESCRIPTION)
+    if model:
+        cpu_info['model'] = model
+        cpu_info['vendor'] = model.split()[0]
 
     return cpu_info
 
@@ -13,12 +13,26 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+"""
+Cache for the base images used by the VirtualBox driver.
+"""
+
+import collections
+import hashlib
 import os
+import time
+import zlib
 
+from oslo_config import cfg
+from oslo_log import log as logging
 from oslo_utils import excutils
+from oslo_utils import units
 
 from nova import exception
+from nova.i18n import _, _LI, _LW
+from nova.openstack.common import fileutils
 from nova import utils
+from nova.virt import imagecache
 from nova.virt import images
 from nova.virt.virtualbox import constants
 from nova.virt.virtualbox import exception as vbox_exc
@@ -26,45 +40,477 @@ from nova.virt.virtualbox import manage
 from nova.virt.virtualbox import pathutils
 from nova.virt.virtualbox import vhdutils
 
+LOG = logging.getLogger(__name__)
+VIRTUAL_BOX = [
+    cfg.IntOpt('image_cache_max_size',
+               default=0,
+               help='The maximum size of the cached base images, in MB. '
+                    'When the limit is exceeded, the least recently used '
+                    'base images which are not in use are removed. If the '
+                    'value is 0, the size of the cache is not limited.'),
+]
 
-def _fetch_image(context, instance, image_path):
-    disk_path = None
+CONF = cfg.CONF
+CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
+
+# The fields of the instance used by the image cache.
+ImageRequest = collections.namedtuple(
+    "ImageRequest", ["image_ref", "user_id", "project_id"])
+
+
+def _verify_checksum(image_ref, checksum, digest):
+    """Check the digest of the data received from Glance against
+    the checksum of the image.
+    """
+    if checksum and digest.hexdigest() != checksum:
+        raise exception.ImageUnacceptable(
+            image_id=image_ref,
+            reason=_("checksum mismatch: expected %(expected)s, "
+                     "got %(actual)s") %
+            {"expected": checksum, "actual": digest.hexdigest()})
+
+
+def _remove_disk(path):
+    """Unregister and remove a disk left by a failed fetch.
+
+    The errors are only logged, so they will not hide the error which
+    caused the fetch to fail.
+    """
+    try:
+        manage.VBoxManage.close_medium(constants.MEDIUM_DISK, path)
+    except vbox_exc.VBoxException as exc:
+        LOG.warning(_LW("Failed to unregister the disk %(path)s: "
+                        "%(reason)s"), {"path": path, "reason": exc})
     try:
-        images.fetch(context, instance.image_ref, image_path,
+        pathutils.delete_path(path)
+    except OSError as exc:
+        LOG.warning(_LW("Failed to remove the disk %(path)s: %(reason)s"),
+                    {"path": path, "reason": exc})
+
+
+def _download(context, instance, path, rate_limiter=None,
+              compression=None, checksum=None):
+    """Download the image used by the received instance.
+
+    If a rate limiter is received, the image is downloaded in chunks
+    and every chunk waits for the rate limiter. The compressed images
+    are decompressed while they are downloaded. If a checksum is
+    received, the data is verified against it.
+    """
+    if rate_limiter is None and compression is None and checksum is None:
+        images.fetch(context, instance.image_ref, path,
                      instance.user_id, instance.project_id)
+        return
+
+    decompressor = None
+    if compression == constants.COMPRESSION_GZIP:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    digest = hashlib.md5()
+
+    with fileutils.remove_path_on_error(path):
+        with open(path, "wb") as image_file:
+            for chunk in images.IMAGE_API.download(context,
+                                                   instance.image_ref):
+                if rate_limiter is not None:
+                    rate_limiter.consume(len(chunk))
+                digest.update(chunk)
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk)
+                image_file.write(chunk)
+            if decompressor is not None:
+                image_file.write(decompressor.flush())
+        _verify_checksum(instance.image_ref, checksum, digest)
+
+
+def _register_image(image_path, disk_path):
+    """Move the downloaded image to its final path and assign it
+    a new UUID, without copying its content.
+    """
+    # Note: The image was registered when its format was checked and
+    # VirtualBox keeps the path of the registered media.
+    manage.VBoxManage.close_medium(constants.MEDIUM_DISK, image_path)
+    os.rename(image_path, disk_path)
+    manage.VBoxManage.set_vhd_uuid(disk_path)
+
+
+def _convert_image(image_path, disk_path, disk_format):
+    """Copy the downloaded image to its final path using the received
+    disk format and remove the original.
+    """
+    manage.VBoxManage.clone_hd(image_path, disk_path,
+                               disk_format=disk_format)
+    manage.VBoxManage.close_medium(constants.MEDIUM_DISK, image_path,
+                                   delete=True)
+
+
+def _fetch_native_image(context, instance, image_path, rate_limiter=None,
+                        compression=None, checksum=None):
+    """Download an image which can be used by VirtualBox."""
+    disk_path = None
+    try:
+        _download(context, instance, image_path, rate_limiter, compression,
+                  checksum)
         # Avoid conflicts
         vhdutils.check_disk_uuid(image_path)
 
-        disk_info = vhdutils.disk_info(image_path)
+        disk_info = vhdutils.get_disk(image_path)
         disk_format = disk_info[constants.VHD_IMAGE_TYPE]
-        disk_path = image_path + "." + disk_format.lower()
-
-        manage.VBoxManage.clone_hd(image_path, disk_path,
-                                   disk_format=disk_format)
-        manage.VBoxManage.close_medium(constants.MEDIUM_DISK, image_path,
-                                       delete=True)
+        if disk_format in constants.ALL_DISK_FORMATS:
+            disk_path = image_path + "." + disk_format.lower()
+            _register_image(image_path, disk_path)
+        else:
+            disk_format = constants.DEFAULT_DISK_FORMAT
+            disk_path = image_path + "." + disk_format.lower()
+            _convert_image(image_path, disk_path, disk_format)
 
-    except (vbox_exc.VBoxException, exception.NovaException):
+    except (vbox_exc.VBoxException, exception.NovaException, OSError):
         with excutils.save_and_reraise_exception():
             for path in (image_path, disk_path):
                 if path and os.path.exists(path):
-                    manage.VBoxManage.close_medium(constants.MEDIUM_DISK,
-                                                   path)
-                    pathutils.delete_path(path)
+                    _remove_disk(path)
+
+    return disk_path
+
+
+def _stream_raw_image(context, instance, image_info, image_path,
+                      rate_limiter=None):
+    """Convert a raw image while it is downloaded, without storing
+    the raw image on disk.
+
+    The data received from Glance is verified against the checksum
+    of the image.
+    """
+    disk_format = constants.DEFAULT_DISK_FORMAT
+    disk_path = image_path + "." + disk_format.lower()
+    digest = hashlib.md5()
+
+    def chunks():
+        for chunk in images.IMAGE_API.download(context, instance.image_ref):
+            if rate_limiter is not None:
+                rate_limiter.consume(len(chunk))
+            digest.update(chunk)
+            yield chunk
+
+    # Note: The disk is moved to its final path only when it is complete,
+    # because the cached images are looked up without a lock.
+    with fileutils.remove_path_on_error(image_path):
+        manage.VBoxManage.convert_from_raw(chunks(), image_path,
+                                           image_info["size"], disk_format)
+        _verify_checksum(instance.image_ref, image_info.get("checksum"),
+                         digest)
+        os.rename(image_path, disk_path)
+
+    return disk_path
+
+
+def _fetch_qemu_image(context, instance, image_path, rate_limiter=None,
+                      checksum=None):
+    """Download an image which can not be used by VirtualBox and
+    convert it using qemu-img.
+    """
+    disk_format = constants.DEFAULT_DISK_FORMAT
+    disk_path = image_path + "." + disk_format.lower()
+    part_path = image_path + ".part"
+
+    try:
+        _download(context, instance, image_path, rate_limiter,
+                  checksum=checksum)
+        image_data = images.qemu_img_info(image_path)
+        if image_data.backing_file is not None:
+            raise exception.ImageUnacceptable(
+                image_id=instance.image_ref,
+                reason=_("fmt=%(fmt)s backed by: %(backing_file)s") %
+                {"fmt": image_data.file_format,
+                 "backing_file": image_data.backing_file})
+
+        with fileutils.remove_path_on_error(part_path):
+            images.convert_image(image_path, part_path, disk_format.lower())
+            os.rename(part_path, disk_path)
+    finally:
+        pathutils.delete_path(image_path)
+
+    return disk_path
+
+
+def _fetch_differencing_image(context, instance, image_path, parent_ref,
+                              rate_limiter=None, compression=None,
+                              checksum=None):
+    """Download an incremental snapshot, which contains only
+    a differencing disk, and link it to the cached image of its parent.
+
+    The parent image is fetched first, if it is not cached.
+    """
+    parent = ImageRequest(image_ref=parent_ref, user_id=instance.user_id,
+                          project_id=instance.project_id)
+    parent_path = get_cached_image(context, parent, rate_limiter)
+    parent_uuid = vhdutils.get_disk(parent_path)[constants.VHD_UUID]
+    disk_path = image_path + "." + constants.DISK_FORMAT_VDI.lower()
 
+    with fileutils.remove_path_on_error(image_path):
+        _download(context, instance, image_path, rate_limiter, compression,
+                  checksum)
+        # Note: The cached images get a new UUID on every host, so
+        # the differencing disk is linked to the local parent before it
+        # is registered.
+        manage.VBoxManage.set_vhd_uuid(image_path)
+        manage.VBoxManage.set_disk_parent_uuid(image_path, parent_uuid)
+        os.rename(image_path, disk_path)
+
+    # Note: Registering the disk keeps its parent in the cache while
+    # the disk is cached.
+    vhdutils.get_disk(disk_path)
     return disk_path
 
 
-def get_cached_image(context, instance):
+def _fetch_image(context, instance, image_path, rate_limiter=None):
+    """Download the image used by the received instance and convert it
+    to a format supported by VirtualBox, if it is required.
+
+    The cached image is kept by image ID, so every image is converted
+    only once. If a rate limiter is received, it is used for the data
+    downloaded from Glance.
+
+    .. note::
+        The data of a Glance image can not be changed once it was
+        uploaded, so the image ID identifies the content of the cached
+        image. The data is verified against the checksum of the image
+        when it is downloaded.
+    """
+    image_info = images.get_info(context, instance.image_ref)
+    image_format = image_info.get("disk_format")
+    checksum = image_info.get("checksum")
+    properties = image_info.get("properties", {})
+    compression = properties.get(constants.IMAGE_PROPERTY_COMPRESSION)
+    parent_ref = properties.get(constants.IMAGE_PROPERTY_PARENT)
+
+    if compression is not None:
+        # Note: Only the snapshots uploaded by the driver, which have
+        # a format used by VirtualBox, are compressed.
+        if (compression != constants.COMPRESSION_GZIP or image_format in
+                (constants.IMAGE_FORMAT_RAW, constants.IMAGE_FORMAT_QCOW2)):
+            raise exception.ImageUnacceptable(
+                image_id=instance.image_ref,
+                reason=_("unsupported %(compression)s compression for "
+                         "%(format)s images") %
+                {"compression": compression, "format": image_format})
+
+    if parent_ref:
+        return _fetch_differencing_image(context, instance, image_path,
+                                         parent_ref, rate_limiter,
+                                         compression, checksum)
+
+    if compression is not None:
+        return _fetch_native_image(context, instance, image_path,
+                                   rate_limiter, compression, checksum)
+
+    if image_format == constants.IMAGE_FORMAT_RAW and image_info.get("size"):
+        return _stream_raw_image(context, instance, image_info, image_path,
+                                 rate_limiter)
+
+    # Note: VirtualBox can not read the raw images, so the raw images
+    # with an unknown size, which can not be streamed, are converted
+    # by qemu-img.
+    if image_format in (constants.IMAGE_FORMAT_RAW,
+                        constants.IMAGE_FORMAT_QCOW2):
+        return _fetch_qemu_image(context, instance, image_path, rate_limiter,
+                                 checksum)
+
+    return _fetch_native_image(context, instance, image_path, rate_limiter,
+                               checksum=checksum)
+
+
+def get_cached_image(context, instance, rate_limiter=None):
     base_disk_path = pathutils.base_disk_path(instance)
 
     for disk_format in constants.ALL_DISK_FORMATS:
         test_path = base_disk_path + '.' + disk_format.lower()
         if os.path.exists(test_path):
+            _touch(test_path)
             return test_path
 
     sync = utils.synchronized(base_disk_path)
     synchronized_fetch_image = sync(_fetch_image)
-    disk_path = synchronized_fetch_image(context, instance, base_disk_path)
+    disk_path = synchronized_fetch_image(context, instance, base_disk_path,
+                                         rate_limiter)
 
     return disk_path
+
+
+def get_ephemeral_template(size, disk_format=constants.DEFAULT_DISK_FORMAT):
+    """Return the path of the blank disk used as parent for the
+    ephemeral disks of the received size, in GB.
+
+    The template is created the first time it is required. The templates
+    used by the instances from the current host are never removed by the
+    image cache manager; the other ones are removed like the base images.
+    """
+    template_path = pathutils.ephemeral_template_path(size, disk_format)
+    if os.path.exists(template_path):
+        _touch(template_path)
+        return template_path
+
+    @utils.synchronized(os.path.splitext(template_path)[0])
+    def create_template():
+        if os.path.exists(template_path):
+            return
+
+        LOG.debug("Creating the ephemeral disk template %(path)s",
+                  {"path": template_path})
+        try:
+            manage.VBoxManage.create_hd(filename=template_path,
+                                        size=size * units.Ki,
+                                        disk_format=disk_format,
+                                        variant=constants.VARIANT_STANDARD)
+        except vbox_exc.VBoxException:
+            with excutils.save_and_reraise_exception():
+                if os.path.exists(template_path):
+                    _remove_disk(template_path)
+
+    create_template()
+    return template_path
+
+
+def _touch(path):
+    """Mark the received base image as recently used."""
+    try:
+        os.utime(path, None)
+    except OSError as exc:
+        LOG.debug("Failed to update the access time for %(path)s: "
+                  "%(reason)s", {"path": path, "reason": exc})
+
+
+class ImageCacheManager(imagecache.ImageCacheManager):
+
+    """Remove the base images which are no longer used.
+
+    The modification time of a base image is updated every time it is
+    used, so the base images can be removed in least recently used
+    order. The base images and the ephemeral disk templates which are
+    used by the instances from the current host, which are kept in the
+    cache on purpose or which are the parent of a differencing disk are
+    never removed.
+    """
+
+    def _get_base(self):
+        return pathutils.base_disk_dir()
+
+    def _list_base_images(self, base_dir):
+        """Return the base images present in the received directory.
+
+        The files without a known disk format extension are images
+        which are still being fetched, so they are ignored.
+        """
+        originals = []
+        extensions = ['.' + disk_format.lower()
+                      for disk_format in constants.ALL_DISK_FORMATS]
+        for name in os.listdir(base_dir):
+            path = os.path.join(base_dir, name)
+            image_ref, extension = os.path.splitext(name)
+            if extension not in extensions or not os.path.isfile(path):
+                continue
+            originals.append({
+                "image_ref": image_ref,
+                "path": path,
+                "size": os.path.getsize(path),
+                "last_used": os.path.getmtime(path),
+            })
+        return {"unexplained_images": [], "originals": originals}
+
+    @staticmethod
+    def _ephemeral_templates(all_instances):
+        """Return the ephemeral disk templates used by the instances
+        from the current host.
+        """
+        return set(pathutils.ephemeral_template_name(instance.ephemeral_gb)
+                   for instance in all_instances
+                   if instance.host == CONF.host and instance.ephemeral_gb)
+
+    @staticmethod
+    def _has_children(path):
+        """Check if the base image is the parent of a differencing disk."""
+        # Note: Querying a medium which is not registered will register it.
+        if not vhdutils.is_registered(path):
+            return False
+        return bool(vhdutils.get_disk_children(path))
+
+    def _remove_base_image(self, image):
+        """Unregister the base image from VirtualBox and remove it."""
+        lock_name = os.path.splitext(image["path"])[0]
+
+        @utils.synchronized(lock_name)
+        def remove_base_image():
+            # Note: The base image can be used by a new instance between
+            # the scan of the cache and the removal, in which case the
+            # access time was updated by `get_cached_image`.
+            try:
+                last_used = os.path.getmtime(image["path"])
+            except OSError:
+                return False
+            if last_used != image["last_used"]:
+                LOG.debug("The base image %s was used after the scan of "
+                          "the cache, skipping its removal.", image["path"])
+                return False
+
+            if self._has_children(image["path"]):
+                return False
+
+            LOG.info(_LI("Removing base image %(path)s (%(size)d bytes)"),
+                     image)
+            if vhdutils.is_registered(image["path"]):
+                manage.VBoxManage.close_medium(constants.MEDIUM_DISK,
+                                               image["path"], delete=True)
+            pathutils.delete_path(image["path"])
+            return True
+
+        try:
+            return remove_base_image()
+        except (vbox_exc.VBoxException, OSError) as exc:
+            LOG.warning(_LW("Failed to remove the base image %(path)s: "
+                            "%(reason)s"),
+                        {"path": image["path"], "reason": exc})
+            return False
+
+    def _age_and_verify_cached_images(self, context, all_instances, base_dir,
+                                      keep_images=None):
+        running = self._list_running_instances(context, all_instances)
+        used_images = set(image_ref for image_ref, (local, _, _)
+                          in running["used_images"].items() if local)
+        used_images.update(self._ephemeral_templates(all_instances))
+        used_images.update(keep_images or [])
+
+        images_info = self._list_base_images(base_dir)["originals"]
+        cache_size = sum(image["size"] for image in images_info)
+        max_size = CONF.virtualbox.image_cache_max_size * units.Mi
+        max_age = CONF.remove_unused_original_minimum_age_seconds
+        now = time.time()
+
+        # Least recently used base images first.
+        for image in sorted(images_info, key=lambda image: image["last_used"]):
+            if image["image_ref"] in used_images:
+                continue
+
+            expired = (self.remove_unused_base_images and
+                       now - image["last_used"] > max_age)
+            over_budget = max_size > 0 and cache_size > max_size
+            if not (expired or over_budget):
+                continue
+
+            if self._remove_base_image(image):
+                cache_size -= image["size"]
+
+        if max_size > 0 and cache_size > max_size:
+            LOG.warning(_LW("The base images are using %(size)d bytes, which "
+                            "is over the limit of %(limit)d bytes, but all "
+                            "of them are in use."),
+                        {"size": cache_size, "limit": max_size})
+
+    def update(self, context, all_instances, keep_images=None):
+        """Remove the unused base images.
+
+        The images from `keep_images` are never removed.
+        """
+        base_dir = self._get_base()
+        if not os.path.isdir(base_dir):
+            return
+        self._age_and_verify_cached_images(context, all_instances, base_dir,
+                                           keep_images)
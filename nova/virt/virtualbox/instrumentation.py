@@ -0,0 +1,281 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Timing information for the VBoxManage commands and the driver operations.
+"""
+
+import bisect
+import contextlib
+import re
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+import six
+
+from nova.i18n import _LI
+from nova.openstack.common import loopingcall
+from nova.virt.virtualbox import constants
+
+LOG = logging.getLogger(__name__)
+VIRTUAL_BOX = [
+    cfg.IntOpt('command_stats_log_interval',
+               default=0,
+               help='Interval between the logs which contain the '
+                    'statistics for the VBoxManage commands, in seconds. '
+                    'The statistics are logged by a timer started with '
+                    'the compute service. If the value is 0, the '
+                    'statistics are not logged.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
+
+# The upper bounds of the latency histogram buckets, in seconds.
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+OTHER_ERROR = "other"
+
+_ERROR_CODE = re.compile(r'\b((?:VBOX_E|E|NS_ERROR)_[A-Z_]+)\b')
+_LOCAL = threading.local()
+
+
+def error_class(stderr):
+    """Return the class of the error reported by VBoxManage or None
+    if the command succeeded.
+    """
+    if not isinstance(stderr, six.string_types):
+        return None
+
+    match = _ERROR_CODE.search(stderr)
+    if match:
+        return match.group(1)
+
+    if constants.DONE in stderr or not stderr.strip():
+        # Only the progress of the command was reported.
+        return None
+
+    return OTHER_ERROR
+
+
+class CommandStats(object):
+
+    """Statistics for a single VBoxManage subcommand."""
+
+    def __init__(self):
+        self.count = 0
+        self.retries = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.stdout_bytes = 0
+        self.errors = {}
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def record(self, duration, retries=0, error=None, stdout_bytes=0):
+        self.count += 1
+        self.retries += retries
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.stdout_bytes += stdout_bytes
+        self.histogram[bisect.bisect_left(HISTOGRAM_BUCKETS, duration)] += 1
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def to_dict(self):
+        histogram = dict(zip([str(bucket) for bucket in HISTOGRAM_BUCKETS],
+                             self.histogram))
+        histogram["+Inf"] = self.histogram[-1]
+        return {
+            "count": self.count,
+            "retries": self.retries,
+            "total_time": self.total_time,
+            "max_time": self.max_time,
+            "average_time": (self.total_time / self.count
+                             if self.count else 0.0),
+            "stdout_bytes": self.stdout_bytes,
+            "errors": dict(self.errors),
+            "histogram": histogram,
+        }
+
+
+class CommandMetrics(object):
+
+    """Statistics for all the VBoxManage subcommands executed.
+
+    If `log_interval` is set, the statistics are logged every
+    `log_interval` seconds after :meth:`start` is called.
+    """
+
+    def __init__(self, log_interval=0):
+        self.log_interval = log_interval
+        self._commands = {}
+        self._periodic_call = None
+        self._lock = threading.Lock()
+
+    def record(self, command, duration, retries=0, stderr=None,
+               stdout=None):
+        """Record the result of a VBoxManage command."""
+        with self._lock:
+            command_stats = self._commands.setdefault(command,
+                                                      CommandStats())
+            stdout_bytes = (len(stdout)
+                            if isinstance(stdout, six.string_types) else 0)
+            command_stats.record(duration, retries, error_class(stderr),
+                                 stdout_bytes)
+
+    def stats(self):
+        """Return the statistics for every subcommand executed."""
+        with self._lock:
+            return {command: command_stats.to_dict()
+                    for command, command_stats in self._commands.items()}
+
+    def summary(self, prefix="vboxmanage"):
+        """Return the main statistics for every subcommand executed
+        as a flat dictionary, as used by the diagnostics.
+        """
+        summary = {}
+        for command, command_stats in self.stats().items():
+            key = "%s_%s_" % (prefix, command)
+            summary[key + "calls"] = command_stats["count"]
+            summary[key + "retries"] = command_stats["retries"]
+            summary[key + "errors"] = sum(command_stats["errors"].values())
+            summary[key + "average_time"] = command_stats["average_time"]
+            summary[key + "max_time"] = command_stats["max_time"]
+        return summary
+
+    def dump(self):
+        """Log the statistics for every subcommand executed."""
+        for command, command_stats in sorted(self.stats().items()):
+            LOG.info(_LI("VBoxManage %(command)s: %(count)d calls, "
+                         "%(average_time).3fs average, %(max_time).3fs max, "
+                         "%(retries)d retries, %(stdout_bytes)d stdout bytes, "
+                         "errors: %(errors)s"),
+                     dict(command_stats, command=command))
+
+    def reset(self):
+        """Drop all the statistics."""
+        with self._lock:
+            self._commands.clear()
+
+    def start(self):
+        """Start logging the statistics every `log_interval` seconds."""
+        if self._periodic_call or self.log_interval <= 0:
+            return
+
+        self._periodic_call = loopingcall.FixedIntervalLoopingCall(self.dump)
+        self._periodic_call.start(interval=self.log_interval,
+                                  initial_delay=self.log_interval)
+
+    def stop(self):
+        """Stop logging the statistics."""
+        if self._periodic_call:
+            self._periodic_call.stop()
+        self._periodic_call = None
+
+
+class OperationTimer(object):
+
+    """Time the phases of a driver operation."""
+
+    def __init__(self, operation, instance=None):
+        self.operation = operation
+        self.instance = instance
+        self.phases = []
+        self._start = time.time()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Record the time spent in the current context as a phase
+        of the operation.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.time() - start))
+
+    def breakdown(self):
+        """Return the time spent in each phase and the total time of
+        the operation.
+        """
+        breakdown = {}
+        for name, duration in self.phases:
+            breakdown[name] = breakdown.get(name, 0.0) + duration
+        breakdown["total"] = time.time() - self._start
+        return breakdown
+
+    def finish(self):
+        """Log the timing breakdown of the operation."""
+        breakdown = self.breakdown()
+        phases = ", ".join("%s: %.3fs" % (name, duration)
+                           for name, duration in self.phases)
+        LOG.info(_LI("%(operation)s took %(total).3fs (%(phases)s)"),
+                 {"operation": self.operation, "total": breakdown["total"],
+                  "phases": phases}, instance=self.instance)
+        return breakdown
+
+
+@contextlib.contextmanager
+def timed_operation(operation, instance=None):
+    """Yield an OperationTimer and log its breakdown when the context
+    is left.
+
+    The phases recorded with :func:`phase` in the current thread are
+    added to this timer.
+    """
+    timer = OperationTimer(operation, instance)
+    try:
+        with use_timer(timer):
+            yield timer
+    finally:
+        timer.finish()
+
+
+def current_timer():
+    """Return the timer of the operation timed in the current thread
+    or None if there is no such operation.
+    """
+    return getattr(_LOCAL, "timer", None)
+
+
+@contextlib.contextmanager
+def use_timer(timer):
+    """Record the phases from the current thread with the received
+    timer.
+
+    Used by the threads started by an operation in order to add their
+    phases to the timer of the operation.
+    """
+    previous_timer = current_timer()
+    _LOCAL.timer = timer
+    try:
+        yield
+    finally:
+        _LOCAL.timer = previous_timer
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Record the time spent in the current context as a phase of
+    the operation timed in the current thread, if there is one.
+    """
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+
+    with timer.phase(name):
+        yield
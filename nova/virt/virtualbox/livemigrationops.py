@@ -0,0 +1,358 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Management class for live migration operations.
+
+The instances are live migrated using VirtualBox teleporting: a virtual
+machine with the same settings and disks is started on the destination
+host with the teleporter enabled and the running virtual machine is
+teleported to it from the source host. The instance files have to be on
+storage shared by both hosts.
+"""
+
+import errno
+import os
+import socket
+import tempfile
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import excutils
+
+from nova import exception
+from nova.i18n import _, _LE
+from nova import utils
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import hostops
+from nova.virt.virtualbox import imagecache
+from nova.virt.virtualbox import manage
+from nova.virt.virtualbox import pathutils
+from nova.virt.virtualbox import vhdutils
+from nova.virt.virtualbox import vmops
+from nova.virt.virtualbox import volumeutils
+
+LOG = logging.getLogger(__name__)
+VIRTUAL_BOX = [
+    cfg.StrOpt('teleporter_port',
+               default='6000-6099',
+               help='A port or a range of ports the teleporters of the '
+                    'virtual machines live migrated to this host can '
+                    'listen on, for example 6000-6099. Every live '
+                    'migration uses its own port.'),
+    cfg.IntOpt('teleporter_max_downtime',
+               default=0,
+               help='The maximum time, in milliseconds, an instance can '
+                    'be paused at the end of the live migration. If the '
+                    'value is 0, the VirtualBox default is used.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
+CONF.import_opt('use_cow_images', 'nova.virt.driver')
+
+
+def _get_ports():
+    """Return the list of ports which can be used by the teleporters."""
+    ports = []
+    for group in CONF.virtualbox.teleporter_port.split(','):
+        start, _, stop = group.partition('-')
+        try:
+            ports.extend(range(int(start), int(stop or start) + 1))
+        except ValueError:
+            continue
+    return sorted(set(ports))
+
+
+class TeleporterAllocator(object):
+
+    """Allocate the port and the password of the teleporter for every
+    instance live migrated to this host.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._used = {}
+
+    @staticmethod
+    def _is_free(port):
+        """Check if no other process is listening on the received port."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind(('', port))
+        except socket.error as exc:
+            if exc.errno != errno.EADDRINUSE:
+                raise
+            return False
+        finally:
+            sock.close()
+        return True
+
+    def allocate(self, instance):
+        """Return a (port, password) tuple for the teleporter of the
+        received instance.
+        """
+        with self._lock:
+            for port in _get_ports():
+                if port in self._used.values() or not self._is_free(port):
+                    continue
+                self._used[instance.uuid] = port
+                return port, utils.generate_password()
+
+        raise vbox_exc.VBoxException(
+            _("No port is available for the teleporter of %s") %
+            instance.name)
+
+    def release(self, instance):
+        """Release the port allocated for the received instance."""
+        with self._lock:
+            self._used.pop(instance.uuid, None)
+
+
+class LiveMigrationOperations(object):
+
+    """Management class for live migration operations."""
+
+    # Note: The allocator is shared by all the instances of this class.
+    _allocator = TeleporterAllocator()
+
+    def __init__(self, console_ops=None):
+        self._console_ops = console_ops
+        self._vbox_manage = manage.VBoxManage()
+        self._vbox_ops = vmops.VBoxOperation()
+
+    def check_instance_shared_storage_local(self, context, instance):
+        """Create a file in the instances path of the destination host
+        which is looked for by the source host.
+        """
+        handle, path = tempfile.mkstemp(
+            dir=pathutils.instance_dir(action=constants.PATH_CREATE))
+        os.close(handle)
+        LOG.debug("Creating the file %(path)s in order to check if the "
+                  "instances path is shared", {"path": path},
+                  instance=instance)
+        return {"filename": path}
+
+    def check_instance_shared_storage_remote(self, context, data):
+        return os.path.exists(data["filename"])
+
+    def check_instance_shared_storage_cleanup(self, context, data):
+        pathutils.delete_path(data["filename"])
+
+    def check_can_live_migrate_destination(self, context, instance,
+                                           src_compute_info, dst_compute_info,
+                                           block_migration=False,
+                                           disk_over_commit=False):
+        """Check if the instance can be live migrated to this host.
+
+        The disks are not copied by the teleporter, so the block
+        migration is not supported.
+        """
+        if block_migration:
+            raise exception.MigrationPreCheckError(
+                reason=_("Block migration is not supported by the "
+                         "VirtualBox driver"))
+        return self.check_instance_shared_storage_local(context, instance)
+
+    def check_can_live_migrate_destination_cleanup(self, context,
+                                                   dest_check_data):
+        self.check_instance_shared_storage_cleanup(context, dest_check_data)
+
+    def check_can_live_migrate_source(self, context, instance,
+                                      dest_check_data, block_device_info=None):
+        """Check if the instances path is shared with the destination
+        host.
+        """
+        if not self.check_instance_shared_storage_remote(context,
+                                                         dest_check_data):
+            raise exception.InvalidSharedStorage(
+                path=pathutils.instance_dir(),
+                reason=_("The instances path has to be shared with "
+                         "the destination host"))
+
+        dest_check_data["is_shared_instance_path"] = True
+        dest_check_data["is_shared_block_storage"] = True
+        return dest_check_data
+
+    def _register_parent_disks(self, context, instance, root_path,
+                               ephemeral_path):
+        """Register the parents of the differencing disks with this
+        host, in order to attach the disks.
+
+        .. note::
+            The disks are used by the source host, so their header can
+            not be changed.
+        """
+        if not CONF.use_cow_images:
+            return
+
+        if root_path:
+            vhdutils.get_disk(imagecache.get_cached_image(context, instance))
+        if ephemeral_path:
+            disk_format = os.path.splitext(ephemeral_path)[1][1:].upper()
+            vhdutils.get_disk(imagecache.get_ephemeral_template(
+                instance.ephemeral_gb, disk_format))
+
+    def _remove_vm(self, instance):
+        """Unregister the virtual machine of the instance and remove its
+        folder, without removing the disks shared with the other host.
+        """
+        if not self._vbox_ops.instance_exists(instance):
+            return
+
+        vm_info = self._vbox_manage.show_vm_info(instance, refresh=True)
+        if vm_info.state not in (constants.STATE_POWER_OFF,
+                                 constants.STATE_SAVED,
+                                 constants.STATE_TELEPORTED):
+            self._vbox_manage.control_vm(instance, constants.STATE_POWER_OFF)
+        self._vbox_manage.unregister_vm(instance, delete=False)
+
+        config_file = vm_info.get(constants.VM_CONFIG_FILE)
+        if config_file:
+            vm_dir = os.path.dirname(config_file)
+            if (os.path.normpath(vm_dir) !=
+                    pathutils.instance_basepath(instance)):
+                pathutils.delete_path(vm_dir)
+
+    def _create_target_vm(self, context, instance, network_info,
+                          block_device_info, port, password):
+        if volumeutils.ebs_root_in_block_devices(block_device_info):
+            root_path = None
+        else:
+            root_path = pathutils.lookup_root_vhd_path(instance)
+            if not root_path:
+                raise vbox_exc.VBoxException(
+                    _("Cannot find boot VHD file for instance: %s") %
+                    instance.name)
+        ephemeral_path = pathutils.lookup_ephemeral_vhd_path(instance)
+        self._register_parent_disks(context, instance, root_path,
+                                    ephemeral_path)
+
+        # Note: The folder of the instance already contains the settings
+        # of the virtual machine from the source host, so the virtual
+        # machine is created in a folder which belongs to this host.
+        basefolder = pathutils.live_migration_dir(action=constants.PATH_CREATE)
+        pathutils.delete_path(os.path.join(basefolder, instance.name))
+
+        image_meta = utils.get_image_from_system_metadata(
+            instance.system_metadata)
+        with self._vbox_manage.deferred_modifications(instance):
+            self._vbox_ops.create_instance(instance, image_meta,
+                                           network_info, overwrite=False,
+                                           basefolder=basefolder)
+            self._vbox_manage.modify_teleporter(
+                instance, constants.FIELD_TELEPORTER, constants.ON)
+            self._vbox_manage.modify_teleporter(
+                instance, constants.FIELD_TELEPORTER_PORT, port)
+            self._vbox_manage.modify_teleporter(
+                instance, constants.FIELD_TELEPORTER_PASSWORD, password)
+
+        self._vbox_ops.storage_setup(instance, root_path, ephemeral_path,
+                                     block_device_info)
+        if self._console_ops:
+            self._console_ops.prepare_instance(instance)
+
+    def pre_live_migration(self, context, instance, block_device_info,
+                           network_info, disk_info, migrate_data=None):
+        """Create the virtual machine of the instance and start it
+        in order to wait for the teleport from the source host.
+
+        Return the information required by the source host in order to
+        connect to the teleporter.
+        """
+        LOG.debug("Preparing the instance for live migration",
+                  instance=instance)
+        if self._vbox_ops.instance_exists(instance):
+            raise exception.InstanceExists(name=instance.name)
+
+        port, password = self._allocator.allocate(instance)
+        try:
+            self._create_target_vm(context, instance, network_info,
+                                   block_device_info, port, password)
+            self._vbox_manage.start_vm(instance)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._allocator.release(instance)
+                try:
+                    self._remove_vm(instance)
+                except Exception:
+                    LOG.exception(_LE("Failed to remove the virtual "
+                                      "machine prepared for live "
+                                      "migration"), instance=instance)
+
+        return {"teleporter_host": hostops.get_host_ip_address(),
+                "teleporter_port": port,
+                "teleporter_password": password}
+
+    def _report_progress(self, instance):
+        def report(progress):
+            LOG.debug("Live migration progress: %(progress)d%%",
+                      {"progress": progress}, instance=instance)
+            instance.progress = progress
+            instance.save()
+        return report
+
+    def live_migration(self, context, instance, dest, post_method,
+                       recover_method, block_migration=False,
+                       migrate_data=None):
+        """Teleport the virtual machine of the instance to the virtual
+        machine prepared on the destination host.
+        """
+        LOG.debug("Live migration of the instance to %(dest)s",
+                  {"dest": dest}, instance=instance)
+        target = (migrate_data or {}).get("pre_live_migration_result", {})
+        try:
+            self._vbox_manage.teleport(
+                instance, target["teleporter_host"],
+                target["teleporter_port"],
+                password=target.get("teleporter_password"),
+                max_downtime=CONF.virtualbox.teleporter_max_downtime,
+                progress_callback=self._report_progress(instance))
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                LOG.exception(_LE("Live migration failed"),
+                              instance=instance)
+                recover_method(context, instance, dest, block_migration,
+                               migrate_data)
+
+        post_method(context, instance, dest, block_migration, migrate_data)
+
+    def post_live_migration(self, context, instance, block_device_info,
+                            migrate_data=None):
+        """Remove the virtual machine left on the source host."""
+        self._remove_vm(instance)
+
+    def post_live_migration_at_destination(self, context, instance,
+                                           network_info,
+                                           block_migration=False,
+                                           block_device_info=None):
+        self._allocator.release(instance)
+
+    def rollback_live_migration_at_destination(self, context, instance,
+                                               network_info,
+                                               block_device_info,
+                                               destroy_disks=True,
+                                               migrate_data=None):
+        """Remove the virtual machine prepared for the live migration.
+
+        The disks are always kept, because they are used by the virtual
+        machine on the source host.
+        """
+        try:
+            self._remove_vm(instance)
+        finally:
+            self._allocator.release(instance)
@@ -17,18 +17,24 @@
 A connection to VirtualBox via VBoxManage.
 """
 
+import contextlib
 import os
+import re
 import time
 
+import eventlet
 from oslo_config import cfg
-from oslo_concurrency import processutils
 from oslo_log import log as logging
 
 from nova import exception
 from nova.i18n import _LW
-from nova import utils
+from nova.virt.virtualbox import backend
+from nova.virt.virtualbox import cache
 from nova.virt.virtualbox import constants
 from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import governor
+from nova.virt.virtualbox import instrumentation
+from nova.virt.virtualbox import vminfo
 
 LOG = logging.getLogger(__name__)
 VIRTUAL_BOX = [
@@ -37,16 +43,93 @@ VIRTUAL_BOX = [
                help='The number of times to retry to execute command.'),
     cfg.IntOpt('retry_interval',
                default=1,
-               help='Interval between execute attempts, in seconds.'),
+               help='Interval between execute attempts, in seconds. The '
+                    'interval is doubled after every failed attempt.'),
+    cfg.IntOpt('retry_max_interval',
+               default=16,
+               help='The maximum interval between execute attempts, '
+                    'in seconds.'),
+    cfg.IntOpt('max_concurrent_commands',
+               default=8,
+               help='The maximum number of VBoxManage commands executed '
+                    'at once. If the value is 0, the number of commands '
+                    'is not limited.'),
     cfg.StrOpt('vboxmanage_cmd',
                default="VBoxManage",
                help='Path of VBoxManage executable which is used to '
                     'comunicate with the VirtualBox.'),
+    cfg.BoolOpt('vm_info_cache',
+                default=True,
+                help='Keep the information regarding the virtual machines '
+                     'until a command which changes them is executed.'),
+    cfg.IntOpt('vm_info_cache_ttl',
+               default=5,
+               help='Number of seconds after which the cached information '
+                    'regarding a virtual machine expires. If the value is '
+                    '0, the information expires only when the virtual '
+                    'machine is changed.'),
+    cfg.IntOpt('vm_registry_reconcile_interval',
+               default=60,
+               help='Number of seconds after which the index of the '
+                    'virtual machines registered with VirtualBox is '
+                    'rebuilt. If the value is 0, the index is built only '
+                    'once and then updated by the driver.'),
+    cfg.IntOpt('medium_registry_reconcile_interval',
+               default=60,
+               help='Number of seconds after which the index of the '
+                    'virtual hard disks registered with VirtualBox is '
+                    'rebuilt. If the value is 0, the index is built only '
+                    'once and then updated by the driver.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
 
+# Line format: "instance_name" {instance_uuid}
+_LIST_VMS_LINE = re.compile(r'^"(?P<name>.*)"\s+\{?(?P<uuid>[^{}\s]+)\}?$')
+
+
+class DeferredModifications(object):
+
+    """Settings changes for a virtual machine which are waiting to be
+    applied using a single `modifyvm` command.
+
+    The `vm_name` is the current name of the virtual machine, which
+    differs from the name of the instance until the pending rename
+    is applied.
+    """
+
+    def __init__(self, instance, vm_name=None):
+        self.instance = instance
+        self.vm_name = vm_name or instance.name
+        self._fields = []
+
+    def __len__(self):
+        return len(self._fields)
+
+    def add(self, field, *values):
+        """Register a new change for the current virtual machine."""
+        self._fields.append((field, values))
+
+    def get(self, field, default=None):
+        """Return the last value requested for the received field."""
+        for current_field, values in reversed(self._fields):
+            if current_field == field:
+                return values[0] if len(values) == 1 else values
+        return default
+
+    def fields(self):
+        """Return a list with all the fields changed."""
+        return [field for field, _ in self._fields]
+
+    def arguments(self):
+        """Return the arguments required by the `modifyvm` command."""
+        arguments = []
+        for field, values in self._fields:
+            arguments.append(field)
+            arguments.extend(values)
+        return arguments
+
 
 class VBoxManage(object):
 
@@ -54,9 +137,11 @@ class VBoxManage(object):
     CONTROL_VM = "controlvm"
     CLONE_HD = "clonehd"
     CLOSE_MEDIUM = "closemedium"
+    CONVERT_FROM_RAW = "convertfromraw"
     CREATE_HD = "createhd"
     CREATE_VM = "createvm"
     LIST = "list"
+    METRICS = "metrics"
     MODIFY_HD = "modifyhd"
     MODIFY_VM = "modifyvm"
     SET_PROPERTY = "setproperty"
@@ -69,32 +154,225 @@ class VBoxManage(object):
     UNREGISTER_VM = "unregistervm"
     VERSION = "--version"
 
+    # Commands which change the state or the settings of the virtual
+    # machine received as first argument.
+    VM_COMMANDS = (CONTROL_VM, MODIFY_VM, SNAPSHOT, START_VM, STORAGE_ATTACH,
+                   STORAGE_CTL, UNREGISTER_VM)
+
+    _backend = None
+    _deferred = {}
+    _started_vms = None
+    _vm_info_cache = None
+    _vm_registry = None
+    _medium_registry = None
+    _governor = None
+    _metrics = None
+
+    @classmethod
+    def get_backend(cls):
+        """Return the backend used in order to execute the commands."""
+        if cls._backend is None:
+            cls._backend = backend.get_backend()
+        return cls._backend
+
+    @classmethod
+    def reset_backend(cls):
+        """Release the current backend.
+
+        A new backend will be created using the current config on the
+        next command.
+        """
+        current_backend, cls._backend = cls._backend, None
+        if current_backend:
+            current_backend.close()
+
+    @classmethod
+    def get_vm_info_cache(cls):
+        """Return the cache used for the information regarding the
+        virtual machines.
+        """
+        if cls._vm_info_cache is None:
+            cls._vm_info_cache = cache.VMInfoCache(
+                ttl=CONF.virtualbox.vm_info_cache_ttl)
+        return cls._vm_info_cache
+
+    @classmethod
+    def reset_vm_info_cache(cls):
+        """Drop all the information regarding the virtual machines."""
+        cls._vm_info_cache = None
+
+    @classmethod
+    def _list_vms(cls, information=constants.VMS_INFO):
+        """Return a list of (name, uuid) tuples for all the virtual
+        machines registered with VirtualBox.
+        """
+        virtual_machines = []
+        for line in cls.list(information).splitlines():
+            match = _LIST_VMS_LINE.match(line.strip())
+            if match:
+                virtual_machines.append((match.group("name"),
+                                         match.group("uuid")))
+        return virtual_machines
+
+    @classmethod
+    def list_running_vms(cls):
+        """Return a list of (name, uuid) tuples for the virtual machines
+        which are running, including the paused ones.
+        """
+        return cls._list_vms(constants.RUNNINGVMS_INFO)
+
+    @classmethod
+    def get_vm_registry(cls, refresh=False):
+        """Return the index of the virtual machines registered with
+        VirtualBox.
+
+        The index is rebuilt if it is outdated or if refresh is True.
+        """
+        if cls._vm_registry is None:
+            cls._vm_registry = cache.VMRegistry(
+                ttl=CONF.virtualbox.vm_registry_reconcile_interval)
+
+        cls._vm_registry.reconcile(cls._list_vms, force=refresh)
+        return cls._vm_registry
+
+    @classmethod
+    def get_medium_registry(cls):
+        """Return the index of the virtual hard disks registered with
+        VirtualBox.
+        """
+        if cls._medium_registry is None:
+            cls._medium_registry = cache.MediumRegistry(
+                ttl=CONF.virtualbox.medium_registry_reconcile_interval)
+        return cls._medium_registry
+
+    @classmethod
+    def _invalidate_medium(cls, medium=None, created=False):
+        """Drop the information regarding the received medium."""
+        if cls._medium_registry:
+            cls._medium_registry.invalidate(medium, created=created)
+
+    @classmethod
+    def get_governor(cls):
+        """Return the governor which limits the number of commands
+        executed at once.
+        """
+        if cls._governor is None:
+            cls._governor = governor.ExecutionGovernor(
+                max_concurrent=CONF.virtualbox.max_concurrent_commands)
+        return cls._governor
+
+    @classmethod
+    def reset_governor(cls):
+        """Drop the current governor.
+
+        A new governor will be created using the current config on the
+        next command.
+        """
+        cls._governor = None
+
+    @classmethod
+    def get_metrics(cls):
+        """Return the statistics for the commands executed."""
+        if cls._metrics is None:
+            cls._metrics = instrumentation.CommandMetrics(
+                log_interval=CONF.virtualbox.command_stats_log_interval)
+        return cls._metrics
+
     @classmethod
     def _execute(cls, command, *args):
         """Execute the received command and returns stdout and stderr."""
         LOG.debug("Execute: VBoxManage --nologo %(command)s %(args)s",
                   {"command": command, "args": args})
 
-        for _ in range(CONF.virtualbox.retry_count):
-            try:
-                stdout, stderr = utils.execute(
-                    CONF.virtualbox.vboxmanage_cmd, "--nologo",
-                    command.lower(), *args)
-            except processutils.ProcessExecutionError as exc:
-                stdout, stderr = exc.stdout, exc.stderr
-
-            if (constants.VBOX_E_ACCESSDENIED in stderr or
-                    constants.VBOX_E_INVALID_OBJECT_STATE in stderr):
-                LOG.warning(_LW("Something went wrong, trying again."))
-                time.sleep(CONF.virtualbox.retry_interval)
-                continue
+        execution_governor = cls.get_governor()
+        vm_name = args[0] if command in cls.VM_COMMANDS and args else None
+        stdout = stderr = None
+        attempt = 0
+        start = time.time()
+        try:
+            for attempt in range(CONF.virtualbox.retry_count):
+                # Note: The lane is released between the attempts, so the
+                # other commands for the same virtual machine do not wait
+                # for the backoff.
+                with execution_governor.lane(vm_name):
+                    with execution_governor.slot():
+                        stdout, stderr = cls.get_backend().execute(command,
+                                                                   *args)
+
+                if (constants.VBOX_E_ACCESSDENIED in stderr or
+                        constants.VBOX_E_INVALID_OBJECT_STATE in stderr):
+                    delay = execution_governor.backoff(
+                        attempt, CONF.virtualbox.retry_interval,
+                        CONF.virtualbox.retry_max_interval)
+                    LOG.warning(_LW("Something went wrong, trying again "
+                                    "in %.2f seconds."), delay)
+                    time.sleep(delay)
+                    continue
 
-            break
-        else:
-            LOG.warning(_LW("Failed to process command."))
+                break
+            else:
+                LOG.warning(_LW("Failed to process command."))
+        finally:
+            cls.get_metrics().record(command, time.time() - start,
+                                     retries=attempt, stderr=stderr,
+                                     stdout=stdout)
+            if command in cls.VM_COMMANDS and args:
+                # Note: The command can change the virtual machine even
+                # if it fails.
+                cls.get_vm_info_cache().invalidate(args[0])
 
         return (stdout, stderr)
 
+    @classmethod
+    def _execute_stream(cls, source, command, *args):
+        """Execute the received command using the chunks received from
+        `source` as standard input and return stdout and stderr.
+
+        .. note::
+            The command is not retried because the source can be
+            consumed only once.
+        """
+        LOG.debug("Execute: VBoxManage --nologo %(command)s %(args)s "
+                  "(streamed input)", {"command": command, "args": args})
+
+        stdout = stderr = None
+        start = time.time()
+        try:
+            with cls.get_governor().slot():
+                stdout, stderr = cls.get_backend().execute_stream(
+                    source, command, *args)
+        finally:
+            cls.get_metrics().record(command, time.time() - start,
+                                     stderr=stderr, stdout=stdout)
+        return (stdout, stderr)
+
+    @classmethod
+    def _execute_progress(cls, callback, command, *args):
+        """Execute the received long running command, report its
+        progress to `callback` and return stdout and stderr.
+
+        .. note::
+            The command is not retried and it does not take a slot or
+            a lane from the governor, because it can run for minutes.
+            The other commands for the same virtual machine which find
+            its session locked are retried by :meth:`_execute`.
+        """
+        LOG.debug("Execute: VBoxManage --nologo %(command)s %(args)s "
+                  "(with progress)", {"command": command, "args": args})
+
+        vm_name = args[0] if command in cls.VM_COMMANDS and args else None
+        stdout = stderr = None
+        start = time.time()
+        try:
+            stdout, stderr = cls.get_backend().execute_progress(
+                callback, command, *args)
+        finally:
+            cls.get_metrics().record(command, time.time() - start,
+                                     stderr=stderr, stdout=stdout)
+            if vm_name:
+                cls.get_vm_info_cache().invalidate(vm_name)
+        return (stdout, stderr)
+
     @classmethod
     def _check_stderr(cls, stderr, instance=None, method=None):
         # TODO(alexandrucoman): Check for another common exceptions
@@ -107,6 +385,117 @@ class VBoxManage(object):
                 attr=None, instance_uuid=instance.uuid,
                 state=instance.power_state, method=method)
 
+    @classmethod
+    def _modify_vm(cls, instance, method, field, *values):
+        """Change a setting for the received virtual machine or register
+        the change if the modifications are deferred.
+        """
+        modifications = cls._deferred.get(cls._deferred_key(instance))
+        if modifications is not None:
+            modifications.add(field, *values)
+            return
+
+        _, error = cls._execute(cls.MODIFY_VM, instance.name, field, *values)
+        if error:
+            cls._check_stderr(error, instance, method)
+            raise vbox_exc.VBoxManageError(method=method, reason=error)
+
+        if field == constants.FIELD_CPUS:
+            cls._changed_cpus(instance.name, values[0])
+
+    @staticmethod
+    def _deferred_key(instance):
+        """Return the key of the changes deferred for the received
+        instance by the current greenthread.
+
+        .. note::
+            The changes requested by other greenthreads for the same
+            instance are not collected.
+        """
+        return (id(eventlet.getcurrent()), instance.uuid)
+
+    @classmethod
+    @contextlib.contextmanager
+    def deferred_modifications(cls, instance, vm_name=None):
+        """Collect all the changes requested by modify_vm, modify_network
+        and modify_vrde for the received instance and apply them using
+        a single `modifyvm` command when the context is left.
+
+        If an exception is raised within the context, the changes
+        collected are discarded.
+
+        If `vm_name` is received, the changes are applied to the virtual
+        machine with that name, which is renamed to the name of the
+        instance by the same command.
+
+        .. note::
+            In case of nested calls, the changes are applied only when
+            the outermost context is left. Only the changes requested
+            by the current greenthread are deferred.
+        """
+        key = cls._deferred_key(instance)
+        modifications = cls._deferred.get(key)
+        if modifications is not None:
+            yield modifications
+            return
+
+        modifications = DeferredModifications(instance, vm_name)
+        if vm_name:
+            modifications.add(constants.FIELD_NAME, instance.name)
+        cls._deferred[key] = modifications
+        try:
+            yield modifications
+        finally:
+            cls._deferred.pop(key, None)
+
+        if not modifications:
+            return
+
+        _, error = cls._execute(cls.MODIFY_VM, vm_name or instance.name,
+                                *modifications.arguments())
+        if error:
+            cls._check_stderr(error, instance, cls.MODIFY_VM)
+            raise vbox_exc.VBoxManageError(method=cls.MODIFY_VM, reason=error)
+
+        if vm_name:
+            cls._renamed_vm(vm_name, instance.name)
+
+        cpus = modifications.get(constants.FIELD_CPUS)
+        if cpus is not None:
+            cls._changed_cpus(instance.name, cpus)
+
+    @classmethod
+    def _changed_cpus(cls, vm_name, cpus):
+        """Record the number of virtual CPUs configured for the received
+        virtual machine.
+        """
+        if not cls._vm_registry:
+            return
+
+        virtual_machine = cls._vm_registry.get(vm_name)
+        if virtual_machine:
+            cls._vm_registry.set_cpus(virtual_machine.uuid, int(cpus))
+
+    @classmethod
+    def _renamed_vm(cls, old_name, new_name):
+        """Update the indexes after a virtual machine was renamed."""
+        if cls._vm_info_cache:
+            cls._vm_info_cache.invalidate(old_name)
+        if not cls._vm_registry:
+            return
+
+        virtual_machine = cls._vm_registry.get(old_name)
+        cls._vm_registry.remove(old_name)
+        if virtual_machine:
+            cls._vm_registry.add(new_name, virtual_machine.uuid)
+
+    @classmethod
+    def pending_modifications(cls, instance):
+        """Return the changes deferred for the received instance or None
+        if the modifications are not deferred by the current greenthread.
+        """
+        return cls._deferred.get(cls._deferred_key(instance))
+
     @classmethod
     def _storageattach(cls, instance, controller, port, device, drive_type,
                        medium, *args):
@@ -210,6 +599,63 @@ class VBoxManage(object):
                 raise vbox_exc.VBoxManageError(method="startvm", reason=error)
             break
 
+        if cls._started_vms is not None:
+            cls._started_vms.add(instance.name)
+
+    @classmethod
+    def track_started_vms(cls, enabled=True):
+        """Start or stop recording the names of the virtual machines
+        started, which are returned by `pop_started_vms`.
+        """
+        cls._started_vms = set() if enabled else None
+
+    @classmethod
+    def pop_started_vms(cls):
+        """Return the names of the virtual machines started since
+        the last call.
+        """
+        started_vms = cls._started_vms
+        if started_vms is None:
+            return set()
+        cls._started_vms = set()
+        return started_vms
+
+    @classmethod
+    def setup_metrics(cls, period, samples, objects="*", metrics=None):
+        """Configure the collection of the performance metrics.
+
+        :param period:  the interval between the samples, in seconds
+        :param samples: the number of samples kept by VirtualBox
+        :param objects: `host`, the name of a virtual machine or `*`
+                        for all of them
+        :param metrics: a list with the base metrics which should be
+                        collected or None for all of them
+        """
+        command = [cls.METRICS, "setup", "--period", period,
+                   "--samples", samples, objects]
+        if metrics:
+            command.append(",".join(metrics))
+
+        _, error = cls._execute(*command)
+        if error:
+            raise vbox_exc.VBoxManageError(method="metrics setup",
+                                           reason=error)
+
+    @classmethod
+    def query_metrics(cls, objects="*", metrics=None):
+        """Return the last samples collected for the received metrics
+        of the received objects, as reported by `metrics query`.
+        """
+        command = [cls.METRICS, "query", objects]
+        if metrics:
+            command.append(",".join(metrics))
+
+        output, error = cls._execute(*command)
+        if error:
+            raise vbox_exc.VBoxManageError(method="metrics query",
+                                           reason=error)
+        return output
+
     @classmethod
     def modify_hd(cls, filename, field, value=None):
         """Change the characteristics of a disk image after it has
@@ -235,6 +681,7 @@ class VBoxManage(object):
             command.append(value)
 
         _, error = cls._execute(*command)
+        cls._invalidate_medium(filename)
         if error and constants.DONE not in error:
             raise vbox_exc.VBoxManageError(method=cls.MODIFY_HD, reason=error)
 
@@ -260,10 +707,7 @@ class VBoxManage(object):
                 argument="field", value=field, method=cls.MODIFY_VM,
                 allowed_values=constants.ALL_VM_FIELDS)
 
-        _, error = cls._execute(cls.MODIFY_VM, instance.name, field, *args)
-        if error:
-            cls._check_stderr(error, instance, cls.MODIFY_VM)
-            raise vbox_exc.VBoxManageError(method=cls.MODIFY_VM, reason=error)
+        cls._modify_vm(instance, cls.MODIFY_VM, field, *args)
 
     @classmethod
     def modify_network(cls, instance, field, index, value):
@@ -288,12 +732,8 @@ class VBoxManage(object):
                 argument="field", value=field, method="modify_network",
                 allowed_values=constants.ALL_NETWORK_FIELDS)
 
-        _, error = cls._execute(cls.MODIFY_VM, instance.name,
-                                field % {"index": index}, value)
-        if error:
-            cls._check_stderr(error, instance, "modify_network")
-            raise vbox_exc.VBoxManageError(method="modify_network",
-                                           reason=error)
+        cls._modify_vm(instance, "modify_network",
+                       field % {"index": index}, value)
 
     @classmethod
     def modify_vrde(cls, instance, field, value):
@@ -315,17 +755,66 @@ class VBoxManage(object):
                 argument="field", value=field, method="modify_vrde",
                 allowed_values=constants.ALL_VRDE_FIELDS)
 
-        _, error = cls._execute(cls.MODIFY_VM, instance.name, field, value)
-        if error:
-            cls._check_stderr(error, instance, "modify_vrde")
-            raise vbox_exc.VBoxManageError(method="modify_vrde",
+        cls._modify_vm(instance, "modify_vrde", field, value)
+
+    @classmethod
+    def modify_teleporter(cls, instance, field, value):
+        """Change the teleporting settings for a registered virtual
+        machine.
+
+        The following fields are available with VBoxManage
+        modify_teleporter:
+            :FIELD_TELEPORTER:          enables or disables the teleporter;
+                                        when enabled, the virtual machine
+                                        waits for a teleport request when
+                                        it is started
+            :FIELD_TELEPORTER_ADDRESS:  the address the teleporter listens on
+            :FIELD_TELEPORTER_PASSWORD: the password required by the
+                                        teleporter
+            :FIELD_TELEPORTER_PORT:     the port the teleporter listens on
+        """
+        if field not in constants.ALL_TELEPORTER_FIELDS:
+            raise vbox_exc.VBoxValueNotAllowed(
+                argument="field", value=field, method="modify_teleporter",
+                allowed_values=constants.ALL_TELEPORTER_FIELDS)
+
+        cls._modify_vm(instance, "modify_teleporter", field, value)
+
+    @classmethod
+    def teleport(cls, instance, host, port, password=None,
+                 max_downtime=None, progress_callback=None):
+        """Move a running virtual machine to the virtual machine which
+        waits for it on the received host and port.
+
+        :param progress_callback: called with the percentage completed
+                                  every time VBoxManage reports the
+                                  progress
+        :param max_downtime:      the maximum time, in milliseconds, the
+                                  virtual machine can be paused for the
+                                  final transfer
+        """
+        args = [instance.name, constants.STATE_TELEPORT,
+                "--host", host, "--port", port]
+        if password:
+            args.extend(("--password", password))
+        if max_downtime:
+            args.extend(("--maxdowntime", max_downtime))
+
+        _, error = cls._execute_progress(progress_callback or (lambda _: None),
+                                         cls.CONTROL_VM, *args)
+        if error and constants.DONE not in error:
+            cls._check_stderr(error, instance, cls.CONTROL_VM)
+            raise vbox_exc.VBoxManageError(method=cls.CONTROL_VM,
                                            reason=error)
 
     @classmethod
-    def list(cls, information):
+    def list(cls, information, long_format=False):
         """Gives relevant information about host and information
         about VirtualBox's current settings.
 
+        If long_format is True, more detailed information will be
+        displayed (if it is available).
+
         The following information are available with VBoxManage list:
             :HOST_INFO:         information about the host system
             :OSTYPES_INFO:      lists all guest operating systems
@@ -335,35 +824,55 @@ class VBoxManage(object):
             :RUNNINGVMS_INFO:   lists all currently running virtual
                                 machines by their unique identifiers
         """
-        output, error = cls._execute(cls.LIST, information)
+        command = [cls.LIST, information]
+        if long_format:
+            command.insert(1, "--long")
+
+        output, error = cls._execute(*command)
         if error:
             raise vbox_exc.VBoxManageError(method=cls.LIST, reason=error)
         return output
 
     @classmethod
-    def show_vm_info(cls, instance):
-        """Show the configuration of a particular VM."""
-        information = {}
-        output, error = cls._execute(cls.SHOW_VM_INFO, instance.name,
+    def show_vm_info(cls, instance, refresh=False, vm_name=None):
+        """Show the configuration of a particular VM.
+
+        :param instance:    nova.objects.instance.Instance or None if
+                            the virtual machine is identified only by
+                            `vm_name`
+        :param refresh:     ignore the information from cache
+        :param vm_name:     the current name of the virtual machine, if
+                            it was not renamed to the name of the
+                            instance yet
+        :return:            nova.virt.virtualbox.vminfo.VMInfo
+        """
+        vm_name = vm_name or instance.name
+        # Note: The information of a virtual machine which is waiting
+        # to be renamed or which is not known as an instance is not
+        # cached.
+        use_cache = (instance is not None and
+                     CONF.virtualbox.vm_info_cache and
+                     vm_name == instance.name)
+        vm_info_cache = cls.get_vm_info_cache()
+        if use_cache and refresh:
+            token = vm_info_cache.token(instance)
+        elif use_cache:
+            information, token = vm_info_cache.lookup(instance)
+            if information is not None:
+                return information
+
+        output, error = cls._execute(cls.SHOW_VM_INFO, vm_name,
                                      "--machinereadable")
         if error:
-            cls._check_stderr(error, instance, cls.SHOW_VM_INFO)
+            if instance is not None:
+                cls._check_stderr(error, instance, cls.SHOW_VM_INFO)
             raise vbox_exc.VBoxManageError(method=cls.SHOW_VM_INFO,
                                            reason=error)
 
-        for line in output.splitlines():
-            line = line.strip()
-            if not line:
-                continue
+        information = vminfo.VMInfo.parse(output)
 
-            key, separator, value = line.partition("=")
-            value = value.strip(' "')
-            key = key.strip(' "')
-            if separator != "=":
-                LOG.warning("Could not parse the following line: %s", line)
-                continue
-
-            information[key] = value if value != "none" else None
+        if use_cache:
+            vm_info_cache.store(instance, information, token)
 
         return information
 
@@ -419,6 +928,7 @@ class VBoxManage(object):
             command.extend(["--diffparent", parent])
 
         output, error = cls._execute(*command)
+        cls._invalidate_medium(filename, created=True)
 
         if error and constants.DONE not in error:
             if constants.VBOX_E_FILE_ERROR in error:
@@ -464,6 +974,7 @@ class VBoxManage(object):
             command.append("--existing")
 
         _, error = cls._execute(*command)
+        cls._invalidate_medium(new_vdh_path, created=True)
         if error and constants.DONE not in error:
             if constants.VBOX_E_FILE_ERROR in error:
                 LOG.debug("Fail to clone hd: %(error)s", {"error": error})
@@ -472,7 +983,26 @@ class VBoxManage(object):
             raise vbox_exc.VBoxManageError(method=cls.CLONE_HD, reason=error)
 
     @classmethod
-    def create_vm(cls, name, basefolder=None, register=False):
+    def convert_from_raw(cls, source, filename, size,
+                         disk_format=constants.DISK_FORMAT_VDI):
+        """Create a new virtual hard disk image from the content of
+        a raw disk image, without storing the raw image on disk.
+
+        :param source:      iterable with the chunks of the raw image
+        :param filename:    the file name for the hard disk image
+        :param size:        the size of the raw image, in bytes
+        :param disk_format: file format for the output file
+        """
+        _, error = cls._execute_stream(source, cls.CONVERT_FROM_RAW, "stdin",
+                                       filename, size, "--format",
+                                       disk_format)
+        cls._invalidate_medium(filename, created=True)
+        if error and constants.DONE not in error:
+            raise vbox_exc.VBoxManageError(method=cls.CONVERT_FROM_RAW,
+                                           reason=error)
+
+    @classmethod
+    def create_vm(cls, name, basefolder=None, register=False, uuid=None):
         """Creates a new XML virtual machine definition file.
 
         :param name:          the name of the virtual machine
@@ -480,6 +1010,8 @@ class VBoxManage(object):
         :param register:      import a virtual machine definition in
                               an XML file into VirtualBox
         :type register:       bool
+        :param uuid:          the UUID for the virtual machine (if it is
+                              not provided, a new one will be generated)
 
         :return:              UUID for the disk image created
 
@@ -497,6 +1029,9 @@ class VBoxManage(object):
         if register:
             command.extend(["--register"])
 
+        if uuid:
+            command.extend(["--uuid", uuid])
+
         output, error = cls._execute(*command)
         if error:
             if constants.VBOX_E_FILE_ERROR in error:
@@ -515,6 +1050,9 @@ class VBoxManage(object):
             # TODO(alexandrucoman): Fail to get UUID (Something went wrong)
             return
 
+        if register and cls._vm_registry:
+            cls._vm_registry.add(name, vm_uuid)
+
         return vm_uuid
 
     @classmethod
@@ -625,10 +1163,21 @@ class VBoxManage(object):
 
         _, error = cls._execute(*command)
         if error and constants.DONE not in error:
+            if (constants.VBOX_E_INSTANCE_NOT_FOUND in error and
+                    cls._vm_registry):
+                cls._vm_registry.remove(instance.name)
             cls._check_stderr(error, instance, cls.UNREGISTER_VM)
             raise vbox_exc.VBoxManageError(method=cls.UNREGISTER_VM,
                                            reason=error)
 
+        if cls._vm_registry:
+            cls._vm_registry.remove(instance.name)
+
+        if delete:
+            # The virtual hard disks used only by this virtual machine
+            # were removed.
+            cls._invalidate_medium()
+
     @classmethod
     def take_snapshot(cls, instance, name, description=None, live=None):
         """Take a snapshot of the current state of the virtual machine.
@@ -673,6 +1222,7 @@ class VBoxManage(object):
         This way, multiple copies of a container can be registered.
         """
         _, error = cls._execute('internalcommands', 'sethduuid', disk)
+        cls._invalidate_medium(disk)
         if error:
             raise vbox_exc.VBoxManageError(method="sethduuid",
                                            reason=error)
@@ -682,6 +1232,7 @@ class VBoxManage(object):
         """Assigns a new parent UUID to the given image file."""
         _, error = cls._execute('internalcommands', 'sethdparentuuid',
                                 disk_file, parent_uuid)
+        cls._invalidate_medium(disk_file)
         if error:
             raise vbox_exc.VBoxManageError(method="sethdparentuuid",
                                            reason=error)
@@ -693,6 +1244,8 @@ class VBoxManage(object):
         if delete:
             command.append("--delete")
         _, error = cls._execute(*command)
+        if medium == constants.MEDIUM_DISK:
+            cls._invalidate_medium(path)
         if error and constants.DONE not in error:
             raise vbox_exc.VBoxManageError(method=cls.CLOSE_MEDIUM,
                                            reason=error)
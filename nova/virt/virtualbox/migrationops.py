@@ -19,17 +19,26 @@ Management class for migration / resize operations.
 
 import os
 import shutil
+import sys
 
+import eventlet
+from eventlet import tpool
+from oslo_concurrency import processutils
+from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
 from oslo_utils import units
+import six
 
 from nova import exception
 from nova import i18n
+from nova import utils
 from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import diskstream
 from nova.virt.virtualbox import exception as vbox_exc
 from nova.virt.virtualbox import hostutils
 from nova.virt.virtualbox import imagecache
+from nova.virt.virtualbox import instrumentation
 from nova.virt.virtualbox import manage
 from nova.virt.virtualbox import pathutils
 from nova.virt.virtualbox import vhdutils
@@ -37,6 +46,32 @@ from nova.virt.virtualbox import vmops
 from nova.virt.virtualbox import volumeutils
 
 LOG = logging.getLogger(__name__)
+VIRTUAL_BOX = [
+    cfg.StrOpt('remote_instances_path',
+               help='The path where the instances path of the other compute '
+                    'hosts is mounted, used to migrate the instances to '
+                    'another host. The %(host)s field is replaced with the '
+                    'address of the destination host, for example '
+                    '/mnt/nova/%(host)s. If it is not set, the instances '
+                    'can be resized only on the same host.'),
+    cfg.IntOpt('migration_copy_attempts',
+               default=3,
+               help='The number of attempts made to copy a disk to '
+                    'another host. Every attempt resumes the copy from '
+                    'the last complete chunk.'),
+    cfg.StrOpt('same_host_resize_disks',
+               default=constants.RESIZE_DISKS_REFLINK,
+               choices=(constants.RESIZE_DISKS_COPY,
+                        constants.RESIZE_DISKS_REFLINK),
+               help='How the disks are copied when an instance is resized '
+                    'on the same host (copy, reflink). The reflink '
+                    'copies share the data with the original disks, on '
+                    'the file systems which support them, and fall back '
+                    'to full copies.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
 
 
 class MigrationOperations(object):
@@ -44,6 +79,9 @@ class MigrationOperations(object):
     """Management class for migration operations."""
 
     _SUFFIX = "_copy"
+    _PARTIAL_SUFFIX = ".part"
+    _CHUNK_SIZE = 4 * units.Mi
+    _ROOT_ATTACH_POINT = (constants.DEFAULT_SATA_CNAME, (0, 0))
 
     def __init__(self):
         self._vbox_manage = manage.VBoxManage()
@@ -55,8 +93,9 @@ class MigrationOperations(object):
         Return a list with all disks detached.
         """
         disks = []
-        for controller in vhdutils.get_controllers(instance):
-            for attach_point, disk in controller.items():
+        controllers = vhdutils.get_controllers(instance)
+        for controller, controller_disks in controllers.items():
+            for attach_point, disk in sorted(controller_disks.items()):
                 if not disk['path']:
                     continue
 
@@ -81,8 +120,10 @@ class MigrationOperations(object):
                               {"path": disk["path"]})
                     self._vbox_manage.close_medium(constants.MEDIUM_DISK,
                                                    disk["path"])
+                elif (controller, attach_point) == self._ROOT_ATTACH_POINT:
+                    disks.insert(0, disk["path"])
                 else:
-                    disks.append(disk)
+                    disks.append(disk["path"])
 
         return disks
 
@@ -97,22 +138,45 @@ class MigrationOperations(object):
                 LOG.debug("Remove file: %(path)s", {"path": disk_path})
                 pathutils.delete_path(disk_path)
 
-    def _check_disk(self, disk_file, base_disk):
+    @staticmethod
+    def _is_parent_missing(disk_file):
+        """Check if the received disk is a differencing disk whose parent
+        is not registered on this host.
+        """
         try:
             vhdutils.check_disk_uuid(disk_file)
-            disk_info = vhdutils.disk_info(disk_file)
+            disk_info = vhdutils.get_disk(disk_file)
             parent_uuid = disk_info[constants.VHD_PARENT_UUID]
             if not parent_uuid:
-                return
+                return False
         except vbox_exc.VBoxException:
             parent_uuid = None
 
-        registered_hdds = vhdutils.get_hard_disks()
-        if parent_uuid not in registered_hdds:
-            parent_info = vhdutils.disk_info(base_disk)
+        return not parent_uuid or not vhdutils.is_registered(parent_uuid)
+
+    def _check_disk(self, disk_file, base_disk):
+        if self._is_parent_missing(disk_file):
+            parent_info = vhdutils.get_disk(base_disk)
             self._vbox_manage.set_disk_parent_uuid(
                 disk_file, parent_info[constants.VHD_UUID])
 
+    def _check_ephemeral_disk(self, disk_file):
+        """Link a differencing ephemeral disk copied from another host
+        to the local blank template with the same size.
+        """
+        if not self._is_parent_missing(disk_file):
+            return
+
+        image = diskstream.open_image(disk_file)
+        try:
+            size = image.size
+        finally:
+            image.close()
+        disk_format = os.path.splitext(disk_file)[1][1:].upper()
+        template_path = imagecache.get_ephemeral_template(
+            size // units.Gi, disk_format)
+        self._check_disk(disk_file, template_path)
+
     def _cleanup_failed_disk_migration(self, instance_path,
                                        revert_path, dest_path):
         if dest_path and os.path.exists(dest_path):
@@ -127,8 +191,33 @@ class MigrationOperations(object):
         revert_path = pathutils.revert_dir(instance)
         os.rename(revert_path, instance_basepath)
 
+    @staticmethod
+    def _link_disk(disk_file, dest_file):
+        """Create a copy-on-write copy of the disk which shares the
+        data with the original disk, without reading it.
+
+        Return False if the copy has to be made in full.
+        """
+        mode = CONF.virtualbox.same_host_resize_disks
+        if mode == constants.RESIZE_DISKS_COPY:
+            return False
+
+        # Note: The reflink copies share the data blocks until they are
+        # modified, so the original disk is kept for revert. Hard links
+        # or renames cannot be used, because the disk kept for revert
+        # would be changed by the resized instance.
+        try:
+            utils.execute('cp', '--reflink=always', disk_file, dest_file)
+            return True
+        except (processutils.ProcessExecutionError, OSError) as exc:
+            # Note: OSError is raised if `cp` is not available.
+            LOG.debug("Failed to create a reflink copy of %(disk)s: "
+                      "%(reason)s", {"disk": disk_file, "reason": exc})
+            pathutils.delete_path(dest_file)
+        return False
+
     def _migrate_disk(self, disk_file, destination, root_disk=False):
-        disk_info = vhdutils.disk_info(disk_file)
+        disk_info = vhdutils.get_disk(disk_file)
         disk_format = disk_info[constants.VHD_IMAGE_TYPE]
 
         if root_disk:
@@ -138,18 +227,120 @@ class MigrationOperations(object):
             dest_file = os.path.join(destination,
                                      os.path.basename(disk_file))
 
+        if self._link_disk(disk_file, dest_file):
+            # Note: The copy keeps the UUID of the original disk, which
+            # is checked by finish_migration.
+            return
+
         if not disk_info[constants.VHD_PARENT_UUID]:
             self._vbox_manage.clone_hd(disk_file, dest_file, disk_format)
         else:
             shutil.copy(disk_file, dest_file)
 
-    def _migrate_disk_files(self, instance, disk_files, destination):
+    def _copy_chunks(self, source, partial_path, size):
+        offset = 0
+        if os.path.exists(partial_path):
+            # Note: The chunks before the last one written by a previous
+            # attempt are complete. The chunks which contain only zeros
+            # are skipped, so a shorter file only repeats some of them.
+            offset = min(os.path.getsize(partial_path), size)
+            offset -= offset % self._CHUNK_SIZE
+            LOG.debug("Resuming the copy of %(source)s from %(offset)d",
+                      {"source": source, "offset": offset})
+
+        with open(source, "rb") as source_file, \
+                open(partial_path, "r+b" if offset else "wb") as dest_file:
+            source_file.seek(offset)
+            dest_file.truncate(offset)
+            dest_file.seek(offset)
+            while True:
+                chunk = source_file.read(self._CHUNK_SIZE)
+                if not chunk:
+                    break
+                if chunk.count(b"\x00") == len(chunk):
+                    dest_file.seek(len(chunk), os.SEEK_CUR)
+                else:
+                    dest_file.write(chunk)
+                offset += len(chunk)
+            dest_file.truncate(offset)
+
+    def _copy_disk(self, source, destination):
+        """Copy a disk file in chunks, leaving holes in the destination
+        for the chunks which contain only zeros.
+
+        The data is written to a partial file which is renamed when
+        the copy is complete. A failed attempt is resumed from the last
+        complete chunk.
+        """
+        partial_path = destination + self._PARTIAL_SUFFIX
+        size = os.path.getsize(source)
+        attempts = max(CONF.virtualbox.migration_copy_attempts, 1)
+        for attempt in range(1, attempts + 1):
+            try:
+                self._copy_chunks(source, partial_path, size)
+                break
+            except EnvironmentError as exc:
+                if attempt == attempts:
+                    raise
+                LOG.warning(i18n._LW("Failed to copy %(source)s, attempt "
+                                     "%(attempt)d of %(attempts)d: "
+                                     "%(reason)s"),
+                            {"source": source, "attempt": attempt,
+                             "attempts": attempts, "reason": exc})
+        os.rename(partial_path, destination)
+
+    def _copy_disks(self, transfers):
+        """Copy the received (source, destination) pairs in parallel.
+
+        The file operations block, so every copy runs in a native thread.
+        The first error is raised after all the copies end.
+        """
+        threads = [eventlet.spawn(tpool.execute, self._copy_disk,
+                                  source, destination)
+                   for source, destination in transfers]
+        exc_info = None
+        for thread in threads:
+            try:
+                thread.wait()
+            except EnvironmentError as exc:
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+                else:
+                    LOG.error(i18n._LE("Failed to copy a disk: %s"), exc)
+        if exc_info is not None:
+            six.reraise(*exc_info)
+
+    def _remote_disk_transfers(self, disk_files, destination_path):
+        root_disk = disk_files[0]
+        disk_format = vhdutils.get_disk(root_disk)[constants.VHD_IMAGE_TYPE]
+        transfers = [(root_disk, os.path.join(
+            destination_path, "root." + disk_format.lower()))]
+        for disk_file in disk_files[1:]:
+            transfers.append((disk_file, os.path.join(
+                destination_path, os.path.basename(disk_file))))
+        return transfers
+
+    @staticmethod
+    def _is_same_host(destination):
         local_ips = hostutils.get_local_ips()
         local_ips.append(hostutils.get_ip())
-        same_host = destination in local_ips
         LOG.debug("Destination `%(dest)s` %(local_ips)s",
                   {"dest": destination, "local_ips": local_ips})
+        return destination in local_ips
+
+    @staticmethod
+    def _remote_instance_basepath(instance, destination):
+        """Return the folder of the received instance on the destination
+        host, through the mounted instances path of that host.
+        """
+        remote_instances_path = CONF.virtualbox.remote_instances_path
+        if not remote_instances_path:
+            return None
+        return os.path.join(remote_instances_path % {"host": destination},
+                            instance.name)
 
+    def _migrate_disk_files(self, instance, disk_files, destination):
+        same_host = self._is_same_host(destination)
         instance_basepath = pathutils.instance_basepath(instance)
         revert_path = pathutils.revert_dir(
             instance, action=constants.PATH_OVERWRITE)
@@ -159,9 +350,8 @@ class MigrationOperations(object):
                 "%(path)s%(suffix)s" %
                 {"path": instance_basepath, "suffix": self._SUFFIX})
         else:
-            LOG.warning(
-                i18n._LW("Only resize on the same host is supported!"))
-            raise NotImplementedError()
+            destination_path = self._remote_instance_basepath(instance,
+                                                              destination)
 
         # Delete the destination path if already exists
         pathutils.delete_path(destination_path)
@@ -170,9 +360,14 @@ class MigrationOperations(object):
         pathutils.create_path(destination_path)
 
         try:
-            self._migrate_disk(disk_files[0], destination_path, root_disk=True)
-            for disk_file in disk_files[1:]:
-                self._migrate_disk(disk_file, destination_path)
+            if same_host:
+                self._migrate_disk(disk_files[0], destination_path,
+                                   root_disk=True)
+                for disk_file in disk_files[1:]:
+                    self._migrate_disk(disk_file, destination_path)
+            else:
+                self._copy_disks(self._remote_disk_transfers(
+                    disk_files, destination_path))
 
             # Remove the instance from the Hypervisor
             self._vbox_ops.destroy(instance, destroy_disks=False)
@@ -181,7 +376,7 @@ class MigrationOperations(object):
             os.rename(instance_basepath, revert_path)
             if same_host:
                 os.rename(destination_path, instance_basepath)
-        except (OSError, vbox_exc.VBoxException):
+        except (EnvironmentError, vbox_exc.VBoxException):
             with excutils.save_and_reraise_exception():
                 try:
                     self._cleanup_failed_disk_migration(
@@ -208,10 +403,8 @@ class MigrationOperations(object):
         """
         LOG.debug("`Migrate disk and power off` method called.",
                   instance=instance)
-        # Power off the instance
-        self._vbox_ops.power_off(instance, timeout, retry_interval)
-
-        # Check if resize is posible
+        # Note: The checks are done before powering off the instance,
+        # which keeps running if the migration is not possible.
         if flavor['root_gb'] < instance['root_gb']:
             raise exception.InstanceFaultRollback(
                 i18n._("Cannot resize the root disk to a smaller size. "
@@ -220,10 +413,23 @@ class MigrationOperations(object):
                 {'current_size': instance['root_gb'],
                  'new_size': flavor['root_gb']})
 
+        if (not self._is_same_host(dest) and
+                not self._remote_instance_basepath(instance, dest)):
+            raise exception.InstanceFaultRollback(
+                i18n._("Cannot migrate the instance to %(dest)s, because "
+                       "the remote_instances_path option is not set") %
+                {'dest': dest})
+
+        # Power off the instance
+        with instrumentation.phase("power_off"):
+            self._vbox_ops.power_off(instance, timeout, retry_interval)
+
         # Migrate the disks
-        disks = self._detach_storage(instance)
+        with instrumentation.phase("detach_storage"):
+            disks = self._detach_storage(instance)
         if disks:
-            self._migrate_disk_files(instance, disks, dest)
+            with instrumentation.phase("migrate_disk_files"):
+                self._migrate_disk_files(instance, disks, dest)
 
     def finish_revert_migration(self, context, instance, network_info,
                                 block_device_info=None):
@@ -267,7 +473,11 @@ class MigrationOperations(object):
             self._check_disk(root_path, base_disk_path)
 
         ephemeral_path = pathutils.lookup_ephemeral_vhd_path(instance)
-        if not ephemeral_path:
+        if ephemeral_path:
+            # Note: The differencing ephemeral disks are copied with the
+            # UUID of the original disk.
+            self._check_ephemeral_disk(ephemeral_path)
+        else:
             ephemeral_path = self._vbox_ops.create_ephemeral_disk(instance)
 
         if resize_instance:
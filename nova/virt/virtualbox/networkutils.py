@@ -20,6 +20,7 @@ Utility class for network related operations.
 from nova import exception
 from nova.virt.virtualbox import constants
 from nova.virt.virtualbox import manage
+from nova.virt.virtualbox import vminfo
 
 
 def mac_address(address):
@@ -33,22 +34,29 @@ def mac_address(address):
 
 def get_nic_status(instance):
     """Get status for all the available NIC for received instance."""
-    nic_status = {}
-    instance_info = manage.VBoxManage.show_vm_info(instance)
-    for key, value in instance_info.items():
-        if key.startswith('nic'):
-            try:
-                index = int(key.replace('nic', ''))
-            except ValueError:
-                continue
-            nic_status[index] = False if value is None else True
+    modifications = manage.VBoxManage.pending_modifications(instance)
+    vm_name = modifications.vm_name if modifications is not None else None
+    instance_info = manage.VBoxManage.show_vm_info(instance, vm_name=vm_name)
+    nic_status = vminfo.VMInfo.wrap(instance_info).nic_status()
+
+    # Take into consideration the NICs which are waiting to be created
+    if modifications:
+        for index in nic_status:
+            field = constants.FIELD_NIC % {"index": index}
+            if field in modifications.fields():
+                nic_status[index] = (modifications.get(field) !=
+                                     constants.NIC_MODE_NONE)
     return nic_status
 
 
 def get_available_nic(instance):
     """Return the index of the first disabled nic."""
+    if manage.VBoxManage.pending_modifications(instance) is None:
+        instance_info = manage.VBoxManage.show_vm_info(instance)
+        return vminfo.VMInfo.wrap(instance_info).available_nic()
+
     nic_status = get_nic_status(instance)
-    for key, value in nic_status.items():
+    for key, value in sorted(nic_status.items()):
         if not value:
             return key
     return None
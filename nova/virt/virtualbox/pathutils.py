@@ -31,6 +31,7 @@ from nova.virt.virtualbox import manage
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
 CONF.import_opt('instances_path', 'nova.compute.manager')
+CONF.import_opt('host', 'nova.netconf')
 
 
 def create_path(path):
@@ -104,11 +105,51 @@ def base_disk_dir(action=None):
     return os.path.join(CONF.instances_path, '_base')
 
 
+@_action
+def vm_pool_dir(action=None):
+    """Return the path for the folders of the pooled virtual machines.
+
+    Every host has its own pool folder, because the instances path can
+    be shared by multiple hosts.
+    """
+    return os.path.join(CONF.instances_path, '_pool', CONF.host)
+
+
+@_action
+def live_migration_dir(action=None):
+    """Return the path for the folders of the virtual machines created
+    by this host for the instances which are live migrated to it.
+
+    The folder of the instance is used by the virtual machine on the
+    source host, which can not be overwritten.
+    """
+    return os.path.join(CONF.instances_path, '_live_migration', CONF.host)
+
+
 def base_disk_path(instance):
     return os.path.join(base_disk_dir(action=constants.PATH_CREATE),
                         instance.image_ref)
 
 
+def ephemeral_template_name(size):
+    """Return the name, without extension, of the blank disk template
+    used by the ephemeral disks of the received size, in GB.
+    """
+    return 'ephemeral-%dG' % size
+
+
+def ephemeral_template_path(size, disk_format):
+    """Return the path for the blank disk template used by the ephemeral
+    disks of the received size.
+
+    :param size:      the size of the template, in GB
+    :disk_format:     one disk format from ALL_DISK_FORMAT container
+    """
+    return os.path.join(base_disk_dir(action=constants.PATH_CREATE),
+                        '%s.%s' % (ephemeral_template_name(size),
+                                   disk_format.lower()))
+
+
 @_action
 def export_dir(instance, action=None):
     """Return the export path for received instance."""
@@ -0,0 +1,317 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Collector for the performance metrics of the host and of the virtual
+machines.
+
+VirtualBox samples the metrics periodically and a single
+`metrics query` returns the last sample of every metric for the host
+and for all the running virtual machines. The samples are kept in
+a ring buffer for every object.
+"""
+
+import collections
+import re
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import units
+
+from nova.i18n import _LW
+from nova.openstack.common import loopingcall
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import hostops
+from nova.virt.virtualbox import manage
+
+LOG = logging.getLogger(__name__)
+
+VIRTUAL_BOX = [
+    cfg.IntOpt('metrics_period',
+               default=10,
+               help='Interval between the samples of the performance '
+                    'metrics collected for the host and for the virtual '
+                    'machines, in seconds. If the value is 0, the '
+                    'metrics are not collected.'),
+    cfg.IntOpt('metrics_history',
+               default=30,
+               help='The number of samples of the performance metrics '
+                    'kept in memory for the host and for every virtual '
+                    'machine.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
+
+_QUERY_LINE = re.compile(r"^(?P<object>\S+)\s+(?P<metric>\S+)\s+"
+                         r"(?P<values>.+)$")
+_VALUE = re.compile(r"^(?P<value>-?\d+(\.\d+)?)")
+
+# The counters integrated from the processor load, in nanoseconds.
+_CPU_COUNTERS = {
+    constants.METRIC_CPU_LOAD_USER: "user",
+    constants.METRIC_CPU_LOAD_KERNEL: "kernel",
+    constants.METRIC_CPU_LOAD_IDLE: "idle",
+}
+# The counters integrated from the network rates, in bytes.
+_RATE_COUNTERS = {
+    constants.METRIC_NET_RATE_RX: "rx",
+    constants.METRIC_NET_RATE_TX: "tx",
+}
+
+Sample = collections.namedtuple("Sample", ["timestamp", "values"])
+
+
+def parse_query(output):
+    """Return the last value of every metric reported by the
+    `metrics query` command, keyed by the name of the object.
+
+    The values are expressed in the unit used by VirtualBox for the
+    metric: percents, kB, MB, B/s or MHz.
+    """
+    samples = {}
+    in_header = True
+    for line in output.splitlines():
+        line = line.strip()
+        if in_header:
+            in_header = not line.startswith("---")
+            continue
+
+        match = _QUERY_LINE.match(line)
+        if not match:
+            continue
+        value = _VALUE.match(match.group("values").split(",")[-1].strip())
+        if not value:
+            continue
+        samples.setdefault(match.group("object"), {})[
+            match.group("metric")] = float(value.group("value"))
+
+    return samples
+
+
+class PerformanceCollector(object):
+
+    """Collect the performance metrics for the host and for all the
+    virtual machines using a single `metrics query` per period.
+
+    The load of the processors and the network rates are also
+    integrated over time, in order to provide the cumulative counters
+    required by the diagnostics and by the compute monitors.
+    """
+
+    def __init__(self):
+        self._samples = {}
+        self._counters = {}
+        self._cpu_count = 1
+        self._periodic_call = None
+        self._lock = threading.Lock()
+
+    def _integrate(self, counters, values, elapsed):
+        for metric, counter in _CPU_COUNTERS.items():
+            if metric in values:
+                # Note: The load is reported as a percentage of the
+                # capacity of all the processors of the host.
+                counters[counter] = (counters.get(counter, 0) +
+                                     values[metric] / 100 * elapsed *
+                                     self._cpu_count * units.G)
+        for metric, counter in _RATE_COUNTERS.items():
+            if metric in values:
+                counters[counter] = (counters.get(counter, 0) +
+                                     values[metric] * elapsed)
+
+    def update(self, samples, timestamp):
+        """Add the samples received for every object to the history.
+
+        The history of the objects without samples, like the virtual
+        machines which are not running anymore, is dropped.
+        """
+        with self._lock:
+            for name in list(self._samples):
+                if name not in samples:
+                    del self._samples[name]
+                    self._counters.pop(name, None)
+
+            for name, values in samples.items():
+                history = self._samples.get(name)
+                if history:
+                    elapsed = timestamp - history[-1].timestamp
+                else:
+                    history = self._samples[name] = collections.deque(
+                        maxlen=max(CONF.virtualbox.metrics_history, 1))
+                    elapsed = CONF.virtualbox.metrics_period
+
+                self._integrate(self._counters.setdefault(name, {}),
+                                values, max(elapsed, 0))
+                history.append(Sample(timestamp, values))
+
+    def _setup_started_vms(self):
+        """Set up the metrics of the virtual machines started since the
+        last collection.
+        """
+        for vm_name in manage.VBoxManage.pop_started_vms():
+            try:
+                manage.VBoxManage.setup_metrics(
+                    CONF.virtualbox.metrics_period, 1, vm_name,
+                    constants.ALL_BASE_METRICS)
+            except vbox_exc.VBoxException as exc:
+                LOG.debug("Failed to set up the metrics of %(name)s: "
+                          "%(reason)s", {"name": vm_name, "reason": exc})
+
+    def collect(self):
+        """Query the last samples of the metrics for all the objects."""
+        self._setup_started_vms()
+        try:
+            output = manage.VBoxManage.query_metrics(
+                metrics=constants.ALL_METRICS)
+        except vbox_exc.VBoxException as exc:
+            LOG.warning(_LW("Failed to query the performance metrics: %s"),
+                        exc)
+            return
+
+        self.update(parse_query(output), time.time())
+
+    def start(self):
+        """Set up the metrics and start collecting them."""
+        period = CONF.virtualbox.metrics_period
+        if self._periodic_call or period <= 0:
+            return
+
+        # Note: The metrics of the virtual machines started after this
+        # point are set up by every collection.
+        manage.VBoxManage.track_started_vms()
+        try:
+            manage.VBoxManage.setup_metrics(
+                period, 1, metrics=constants.ALL_BASE_METRICS)
+        except vbox_exc.VBoxException as exc:
+            LOG.warning(_LW("Failed to set up the performance metrics: %s"),
+                        exc)
+            manage.VBoxManage.track_started_vms(False)
+            return
+
+        self._cpu_count = hostops.get_vcpus() or 1
+        self._periodic_call = loopingcall.FixedIntervalLoopingCall(
+            self.collect)
+        self._periodic_call.start(interval=period, initial_delay=period)
+
+    def stop(self):
+        """Stop collecting the metrics and drop the samples."""
+        if self._periodic_call:
+            self._periodic_call.stop()
+        self._periodic_call = None
+        manage.VBoxManage.track_started_vms(False)
+        with self._lock:
+            self._samples.clear()
+            self._counters.clear()
+
+    def get_samples(self, name):
+        """Return the samples kept for the received object, the oldest
+        first.
+        """
+        with self._lock:
+            return list(self._samples.get(name, ()))
+
+    def last_values(self, name):
+        """Return the last value of every metric of the received object
+        or an empty dictionary if there are no samples.
+        """
+        with self._lock:
+            history = self._samples.get(name)
+            return dict(history[-1].values) if history else {}
+
+    def counters(self, name):
+        """Return the cumulative counters of the received object or an
+        empty dictionary if there are no samples.
+
+        The counters are extrapolated from the last sample up to the
+        current time.
+        """
+        with self._lock:
+            history = self._samples.get(name)
+            if not history:
+                return {}
+            counters = dict(self._counters[name])
+            last = history[-1]
+
+        self._integrate(counters, last.values,
+                        max(time.time() - last.timestamp, 0))
+        return counters
+
+    def memory_used(self, name):
+        """Return the memory used by the received virtual machine in kB
+        or None if it is unknown.
+
+        The memory reported by the guest is preferred over the memory
+        used by the process of the virtual machine.
+        """
+        values = self.last_values(name)
+        guest_total = values.get(constants.METRIC_GUEST_RAM_TOTAL)
+        if guest_total:
+            return int(guest_total -
+                       values.get(constants.METRIC_GUEST_RAM_FREE, 0))
+        if constants.METRIC_RAM_USED in values:
+            return int(values[constants.METRIC_RAM_USED])
+        return None
+
+    def host_cpu_stats(self):
+        """Return the cumulative CPU times of the host, in nanoseconds,
+        or None if there are no samples.
+        """
+        counters = self.counters(constants.METRICS_HOST)
+        if not counters:
+            return None
+
+        values = self.last_values(constants.METRICS_HOST)
+        return {
+            "kernel": int(counters.get("kernel", 0)),
+            "idle": int(counters.get("idle", 0)),
+            "user": int(counters.get("user", 0)),
+            "iowait": 0,
+            "frequency": int(values.get(constants.METRIC_CPU_MHZ, 0)),
+        }
+
+
+_COLLECTOR = PerformanceCollector()
+
+
+def get_collector():
+    """Return the collector used for the performance metrics."""
+    return _COLLECTOR
+
+
+def init_host():
+    """Start collecting the performance metrics."""
+    _COLLECTOR.start()
+
+
+def cleanup_host():
+    """Stop collecting the performance metrics."""
+    _COLLECTOR.stop()
+
+
+def get_host_cpu_stats():
+    """Return the CPU statistics of the host, as required by the compute
+    monitors.
+
+    The statistics are available only when the metrics are collected.
+    Until the first sample, all the counters are 0.
+    """
+    stats = _COLLECTOR.host_cpu_stats()
+    if stats is None:
+        return {"kernel": 0, "idle": 0, "user": 0, "iowait": 0,
+                "frequency": 0}
+    return stats
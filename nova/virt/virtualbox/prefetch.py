@@ -0,0 +1,197 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Prefetch the base images which are likely to be used on the current host.
+"""
+
+import collections
+import threading
+import time
+
+import eventlet
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import units
+
+from nova import exception
+from nova.i18n import _LI, _LW
+from nova import objects
+from nova import utils
+from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import imagecache
+
+LOG = logging.getLogger(__name__)
+VIRTUAL_BOX = [
+    cfg.ListOpt('prefetch_images',
+                default=[],
+                help='The IDs of the images which are always kept in the '
+                     'image cache of the host.'),
+    cfg.IntOpt('prefetch_popular_images',
+               default=0,
+               help='The number of images used by the most instances from '
+                    'the aggregates of the host which are prefetched in '
+                    'the image cache. If the value is 0, only the images '
+                    'from prefetch_images are prefetched.'),
+    cfg.IntOpt('prefetch_concurrency',
+               default=2,
+               help='The maximum number of images fetched at once.'),
+    cfg.IntOpt('prefetch_rate_limit',
+               default=0,
+               help='The maximum rate used for fetching images, in MB per '
+                    'second, shared by all the fetches. If the value is 0, '
+                    'the rate is not limited.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
+CONF.import_opt('host', 'nova.netconf')
+
+
+class RateLimiter(object):
+
+    """Limit the rate of the data processed by multiple consumers."""
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._next_time = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Wait until the received amount of bytes can be processed."""
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_time)
+            self._next_time = start + amount / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class ImagePrefetcher(object):
+
+    """Fetch the selected images in the image cache of the host."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+
+    @staticmethod
+    def _aggregate_instances(context):
+        """Return the instances from the hosts which share an aggregate
+        with the current host.
+        """
+        hosts = set([CONF.host])
+        for aggregate in objects.AggregateList.get_by_host(context,
+                                                           CONF.host):
+            hosts.update(aggregate.hosts)
+
+        instances = []
+        for host in hosts:
+            instances.extend(objects.InstanceList.get_by_host(context, host))
+        return instances
+
+    def popular_images(self, context, all_instances=None, count=None):
+        """Return the IDs of the images used by the most instances from
+        the aggregates of the current host.
+        """
+        count = (CONF.virtualbox.prefetch_popular_images
+                 if count is None else count)
+        if count <= 0:
+            return []
+
+        instances = {}
+        for instance in self._aggregate_instances(context):
+            instances[instance.uuid] = instance
+        for instance in all_instances or []:
+            instances[instance.uuid] = instance
+
+        usage = collections.Counter(instance.image_ref
+                                    for instance in instances.values()
+                                    if instance.image_ref)
+        return [image_ref for image_ref, _ in usage.most_common(count)]
+
+    def select_images(self, context, all_instances=None):
+        """Return the IDs of the images which should be present in
+        the image cache.
+        """
+        image_ids = list(CONF.virtualbox.prefetch_images)
+        try:
+            popular_images = self.popular_images(context, all_instances)
+        except exception.NovaException as exc:
+            LOG.warning(_LW("Failed to find the popular images: %s"), exc)
+            popular_images = []
+
+        for image_id in popular_images:
+            if image_id not in image_ids:
+                image_ids.append(image_id)
+        return image_ids
+
+    @staticmethod
+    def _prefetch_image(context, image_id, rate_limiter):
+        request = imagecache.ImageRequest(image_ref=image_id,
+                                          user_id=context.user_id,
+                                          project_id=context.project_id)
+        try:
+            path = imagecache.get_cached_image(context, request,
+                                               rate_limiter=rate_limiter)
+        except (vbox_exc.VBoxException, exception.NovaException,
+                EnvironmentError) as exc:
+            LOG.warning(_LW("Failed to prefetch the image %(image)s: "
+                            "%(reason)s"), {"image": image_id, "reason": exc})
+            return image_id, exc
+        return image_id, path
+
+    def prefetch(self, context, image_ids):
+        """Fetch the received images which are not already cached.
+
+        Return the path of the cached image or the error raised while
+        fetching it, keyed by image ID.
+        """
+        rate_limiter = None
+        if CONF.virtualbox.prefetch_rate_limit > 0:
+            rate_limiter = RateLimiter(
+                CONF.virtualbox.prefetch_rate_limit * units.Mi)
+
+        pool = eventlet.GreenPool(max(CONF.virtualbox.prefetch_concurrency, 1))
+        results = dict(pool.imap(
+            lambda image_id: self._prefetch_image(context, image_id,
+                                                  rate_limiter),
+            image_ids))
+        LOG.info(_LI("Prefetched %(fetched)d of %(count)d images"),
+                 {"fetched": len([result for result in results.values()
+                                  if not isinstance(result, Exception)]),
+                  "count": len(image_ids)})
+        return results
+
+    def start(self, context, image_ids):
+        """Prefetch the received images in the background.
+
+        Return False if the previous prefetch is still running.
+        """
+        with self._lock:
+            if self._running:
+                LOG.debug("The previous prefetch is still running.")
+                return False
+            self._running = True
+
+        def prefetch():
+            try:
+                self.prefetch(context, image_ids)
+            finally:
+                with self._lock:
+                    self._running = False
+
+        utils.spawn_n(prefetch)
+        return True
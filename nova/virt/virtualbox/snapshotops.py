@@ -19,19 +19,41 @@ Management class for operations related to snapshots.
 import os
 import time
 
+from oslo_config import cfg
 from oslo_utils import excutils
 from oslo_log import log as logging
 
 from nova.compute import task_states
+from nova import exception as nova_exc
 from nova import i18n
 from nova.image import glance
+from nova.virt import images
 from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import diskstream
 from nova.virt.virtualbox import exception
+from nova.virt.virtualbox import instrumentation
 from nova.virt.virtualbox import manage
 from nova.virt.virtualbox import pathutils
 from nova.virt.virtualbox import vhdutils
 
 LOG = logging.getLogger(__name__)
+VIRTUAL_BOX = [
+    cfg.BoolOpt('snapshot_compression',
+                default=False,
+                help='Compress the snapshot images with gzip while they '
+                     'are uploaded to Glance. The compressed images are '
+                     'decompressed by the image cache of the driver.'),
+    cfg.BoolOpt('incremental_snapshots',
+                default=False,
+                help='Upload only the differencing disk of the instance '
+                     'when its root disk was created from a cached image. '
+                     'The image of the instance is recorded as the parent '
+                     'of the snapshot and the image cache rebuilds the '
+                     'disk chain from the cached parents.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
 
 
 class SnapshotOperations(object):
@@ -69,15 +91,103 @@ class SnapshotOperations(object):
             glance_image_service.update(context, image_id, image_metadata,
                                         file_handle)
 
-    def _export_disk(self, instance):
+    def _stream_glance_image(self, context, image_id, flat_disk,
+                             parent=None):
+        """Upload the content of the received disk to Glance as
+        a dynamic VDI image, without exporting it to a local file.
+
+        If the parent of an incremental snapshot is received, only
+        the blocks of the root disk are uploaded, as a differencing
+        image.
+        """
+        LOG.debug("Streaming the root disk to Glance image %(image_id)s",
+                  {'image_id': image_id})
+        (glance_image_service,
+         image_id) = glance.get_remote_image_service(context, image_id)
+        image_metadata = {"is_public": False,
+                          "disk_format": constants.DISK_FORMAT_VDI.lower(),
+                          "container_format": "bare",
+                          "properties": {}}
+
+        parent_uuid = None
+        if parent is not None:
+            parent_uuid, properties = parent
+            image_metadata["properties"].update(properties)
+
+        chunks = diskstream.vdi_stream(flat_disk, parent_uuid=parent_uuid)
+        if CONF.virtualbox.snapshot_compression:
+            chunks = diskstream.compress(chunks)
+            image_metadata["properties"][
+                constants.IMAGE_PROPERTY_COMPRESSION] = (
+                    constants.COMPRESSION_GZIP)
+
+        glance_image_service.update(context, image_id, image_metadata,
+                                    diskstream.ChunkReader(chunks))
+
+    def _get_disk_chain(self, instance):
         LOG.debug("Trying to get the root virtual hard driver.")
         current_disk = pathutils.get_root_disk_path(instance)
         if not current_disk:
             raise exception.VBoxException("Cannot get the root disk.")
 
-        disk_info = vhdutils.disk_info(current_disk)
-        root_disk_uuid = disk_info[constants.VHD_PARENT_UUID]
-        root_disk = vhdutils.disk_info(root_disk_uuid)
+        # The current disk is a differencing disk of the root disk
+        return vhdutils.get_disk_chain(current_disk)
+
+    @staticmethod
+    def _get_parent(context, instance, disk_chain):
+        """Return the UUID of the parent disk and the image properties
+        of an incremental snapshot, or None if the snapshot has to
+        contain the whole disk.
+        """
+        if not CONF.virtualbox.incremental_snapshots or len(disk_chain) < 3:
+            return None
+
+        # Note: The root disk has to be a differencing disk of the cached
+        # image used by the instance.
+        parent_disk = disk_chain[2]
+        parent_path = os.path.splitext(parent_disk[constants.VHD_PATH])[0]
+        if (not instance.image_ref or
+                parent_path != pathutils.base_disk_path(instance)):
+            return None
+
+        try:
+            image_info = images.get_info(context, instance.image_ref)
+        except nova_exc.NovaException as exc:
+            LOG.warning(i18n._LW("Failed to get the parent image %(image)s "
+                                 "of the incremental snapshot: %(reason)s"),
+                        {"image": instance.image_ref, "reason": exc})
+            return None
+
+        chain = image_info.get("properties", {}).get(
+            constants.IMAGE_PROPERTY_CHAIN)
+        chain = chain.split(",") if chain else []
+        chain.append(instance.image_ref)
+        properties = {constants.IMAGE_PROPERTY_PARENT: instance.image_ref,
+                      constants.IMAGE_PROPERTY_CHAIN: ",".join(chain)}
+        return parent_disk[constants.VHD_UUID], properties
+
+    def _open_flat_disk(self, context, instance):
+        """Return the content of the root disk from the snapshot and
+        the parent of the snapshot, if it is incremental.
+
+        The content is None if the disk images can not be read
+        directly.
+        """
+        disk_chain = self._get_disk_chain(instance)
+        parent = self._get_parent(context, instance, disk_chain)
+        try:
+            flat_disk = diskstream.FlatDisk(
+                [disk[constants.VHD_PATH] for disk in disk_chain[1:]])
+        except exception.UnsupportedDiskImage as exc:
+            LOG.debug("The root disk will be exported before the upload: "
+                      "%(reason)s", {"reason": exc})
+            return None, None
+
+        return flat_disk, parent
+
+    def _export_disk(self, instance):
+        disk_chain = self._get_disk_chain(instance)
+        root_disk = disk_chain[1]
 
         # The root virtual disk is a base disk
         root_disk_path = root_disk[constants.VHD_PATH]
@@ -87,11 +197,10 @@ class SnapshotOperations(object):
 
         LOG.debug("Trying to export the virtual disk to %(export_path)s.",
                   {"export_path": export_path})
-        existing = constants.VHD_PARENT_UUID in root_disk
+        existing = len(disk_chain) > 2
         if existing:
             # The root virtual disk is linked to another disk
-            base_info = vhdutils.disk_info(
-                root_disk[constants.VHD_PARENT_UUID])
+            base_info = disk_chain[2]
             base_disk_path = base_info[constants.VHD_PATH]
             try:
                 LOG.debug("Cloning base disk for the root disk.")
@@ -128,14 +237,29 @@ class SnapshotOperations(object):
         snapshot_name = "Snapshot-%(timestamp)s" % {"timestamp": time.time()}
         LOG.debug("Creating snapshot %(name)s for instance %(instance)s",
                   {'instance': instance.name, 'name': snapshot_name})
-        self._vbox_manage.take_snapshot(instance, snapshot_name, live=True)
+        with instrumentation.phase("take_snapshot"):
+            self._vbox_manage.take_snapshot(instance, snapshot_name,
+                                            live=True)
         update_task_state(task_state=task_states.IMAGE_PENDING_UPLOAD)
         export_path = None
         try:
-            export_path = self._export_disk(instance)
+            # Note: The content of the root disk is read from the disk
+            # chain while it is uploaded. The disk is exported only if
+            # one of the images has a format which can not be read.
+            flat_disk, parent = self._open_flat_disk(context, instance)
+            if flat_disk is None:
+                with instrumentation.phase("export_disk"):
+                    export_path = self._export_disk(instance)
+
             update_task_state(task_state=task_states.IMAGE_UPLOADING,
                               expected_state=task_states.IMAGE_PENDING_UPLOAD)
-            self._save_glance_image(context, image_id, export_path)
+            with instrumentation.phase("upload_image"):
+                if flat_disk is None:
+                    self._save_glance_image(context, image_id, export_path)
+                else:
+                    with flat_disk:
+                        self._stream_glance_image(context, image_id,
+                                                  flat_disk, parent)
             LOG.debug("Snapshot image %(image_id)s updated for VM "
                       "%(instance_name)s",
                       {'image_id': image_id, 'instance_name': instance.name})
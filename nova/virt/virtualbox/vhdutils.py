@@ -18,8 +18,6 @@ Helper methods for operations related to the management of virtual
 hard disks and their settings.
 """
 
-import re
-
 from oslo_log import log as logging
 
 from nova import exception
@@ -27,6 +25,7 @@ from nova.i18n import _LE
 from nova.virt.virtualbox import constants
 from nova.virt.virtualbox import exception as vbox_exc
 from nova.virt.virtualbox import manage
+from nova.virt.virtualbox import vminfo
 
 
 SYMBOLS = {
@@ -99,21 +98,8 @@ def get_controller_disks(controller_name, instance_info):
     """Get all the available information regarding disks attached to
     the received strorage controller.
     """
-    disks = {}
-    regexp = re.compile(r'%s(?P<uuid>-ImageUUID)*-(?P<port>\d+)-'
-                        '(?P<device>\d+)' % controller_name)
-    for key, value in instance_info.items():
-        info = regexp.search(key)
-        if not info:
-            continue
-
-        port = int(info.group("port"))
-        device = int(info.group("device"))
-        device_map = disks.setdefault((port, device),
-                                      {"path": None, "uuid": None})
-        device_map["uuid" if info.group("uuid") else "path"] = value
-
-    return disks
+    instance_info = vminfo.VMInfo.wrap(instance_info)
+    return instance_info.controller_disks(controller_name)
 
 
 def get_controllers(instance):
@@ -121,37 +107,27 @@ def get_controllers(instance):
     from show_vm_info for the received instance.
     """
     instance_info = manage.VBoxManage.show_vm_info(instance)
-    controllers = {}
-
-    for key in instance_info:
-        if key.startswith('storagecontrollername'):
-            controller_name = instance_info[key]
-            controllers[controller_name] = get_controller_disks(
-                controller_name, instance_info)
-    return controllers
+    return vminfo.VMInfo.wrap(instance_info).controllers()
 
 
 def get_available_attach_point(instance, controller_name):
-    storage_info = get_controllers(instance)
-    controller = storage_info.get(controller_name)
-    if not controller:
+    instance_info = vminfo.VMInfo.wrap(
+        manage.VBoxManage.show_vm_info(instance))
+    if not instance_info.controller_disks(controller_name):
         details = _LE("Controller %(controller)s do not exists!")
         raise vbox_exc.VBoxException(details % {"controller": controller_name})
 
-    for attach_point, disk in controller.items():
-        if not disk["uuid"]:
-            return attach_point
-
-    raise vbox_exc.VBoxException(_LE("Exceeded the maximum number of slots"))
+    attach_point = instance_info.available_attach_point(controller_name)
+    if attach_point is None:
+        raise vbox_exc.VBoxException(
+            _LE("Exceeded the maximum number of slots"))
+    return attach_point
 
 
 def get_attach_point(instance, controller_name, disk_uuid):
     instance_info = manage.VBoxManage.show_vm_info(instance)
-    controller = get_controller_disks(controller_name, instance_info)
-    for attach_point in controller:
-        if disk_uuid == controller[attach_point]["uuid"]:
-            return attach_point
-    return None
+    return vminfo.VMInfo.wrap(instance_info).attach_point(controller_name,
+                                                          disk_uuid)
 
 
 def get_hard_disks():
@@ -159,7 +135,7 @@ def get_hard_disks():
     hypervisor, including all their settings, the unique identifiers (UUIDs)
     associated with them by VirtualBox and all files associated with them.
     """
-    output = manage.VBoxManage.list(constants.HDDS_INFO)
+    output = manage.VBoxManage.list(constants.HDDS_INFO, long_format=True)
     current_vhd = {}
     hdds_map = {}
     for line in output.splitlines():
@@ -170,9 +146,56 @@ def get_hard_disks():
             current_vhd = {}
             continue
         _process_vhd_field(line, current_vhd)
+
+    hdd_uuid = current_vhd.pop(constants.VHD_UUID, None)
+    if hdd_uuid:
+        hdds_map[hdd_uuid] = current_vhd
     return hdds_map
 
 
+def get_medium_registry():
+    """Return the index of the virtual hard disks registered with
+    VirtualBox, rebuilding it if it is outdated.
+    """
+    medium_registry = manage.VBoxManage.get_medium_registry()
+    medium_registry.reconcile(get_hard_disks)
+    return medium_registry
+
+
+def get_disk(hard_disk):
+    """Return the information regarding a virtual hard disk from
+    the index of the registered hard disks.
+
+    The dictionary has the same format as the one returned by
+    disk_info, but the VHD_CHILD_UUIDS and VHD_USED_BY fields can be
+    missing or outdated.
+    """
+    return get_medium_registry().get(hard_disk, disk_info)
+
+
+def get_disk_chain(hard_disk):
+    """Return the information regarding a virtual hard disk followed
+    by the information regarding all its parents, ending with
+    the base disk.
+    """
+    return get_medium_registry().chain(hard_disk, disk_info)
+
+
+def get_disk_children(hard_disk):
+    """Return the information regarding all the differencing disks
+    which have the received virtual hard disk as parent.
+    """
+    return get_medium_registry().children(hard_disk, get_hard_disks,
+                                          disk_info)
+
+
+def is_registered(hard_disk):
+    """Check if the received virtual hard disk is registered with
+    VirtualBox.
+    """
+    return get_medium_registry().registered(hard_disk, get_hard_disks)
+
+
 def get_image_type(disk_path):
     """Get image disk type from the virtual hard disk information."""
     try:
@@ -0,0 +1,251 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Parser for the output of `showvminfo --machinereadable`.
+"""
+
+import collections
+import re
+
+from oslo_log import log as logging
+import six
+
+from nova.i18n import _LW
+from nova.virt.virtualbox import constants
+
+LOG = logging.getLogger(__name__)
+
+CONTROLLER_NAME = "storagecontrollername"
+
+_ATTACHMENT = re.compile(r'^(?P<controller>.+?)(?P<uuid>-ImageUUID)?'
+                         r'-(?P<port>\d+)-(?P<device>\d+)$')
+_NIC = re.compile(r'^nic(?P<index>\d+)$')
+
+
+def _iter_lines(output):
+    """Yield the lines from the received output without splitting
+    the whole output at once.
+    """
+    start, length = 0, len(output)
+    while start < length:
+        end = output.find("\n", start)
+        if end == -1:
+            end = length
+        yield output[start:end]
+        start = end + 1
+
+
+def _normalize(key, value):
+    key = key.strip(' "')
+    if isinstance(value, six.string_types):
+        value = value.strip(' "')
+        if value == "none":
+            value = None
+    return key, value
+
+
+class VMInfo(object):
+
+    """The information regarding a virtual machine.
+
+    The object can be used as a read-only dictionary with the fields
+    reported by `showvminfo`. The storage controllers, the disks
+    attached to them, the network adapters, the VRDE port and the
+    power state are indexed while the fields are parsed.
+    """
+
+    __slots__ = ("_fields", "_controllers", "_disks", "_media", "_free_points",
+                 "_nics", "_free_nic", "state", "power_state", "vrde_port")
+
+    def __init__(self, fields=None):
+        self._fields = {}
+        self._controllers = []
+        self._disks = {}
+        self._media = {}
+        self._free_points = {}
+        self._nics = []
+        self._free_nic = None
+        self.state = None
+        self.power_state = None
+        self.vrde_port = None
+
+        attachments = {}
+        nics = {}
+        for key, value in (fields or {}).items():
+            self._index(key, value, attachments, nics)
+        self._finish(attachments, nics)
+
+    @classmethod
+    def parse(cls, output):
+        """Return a VMInfo object for the output of the `showvminfo`
+        command in machine readable format.
+        """
+        vm_info = cls()
+        attachments = {}
+        nics = {}
+        for line in _iter_lines(output or ""):
+            line = line.strip()
+            if not line:
+                continue
+
+            key, separator, value = line.partition("=")
+            if separator != "=":
+                LOG.warning(_LW("Could not parse the following line: %s"),
+                            line)
+                continue
+            vm_info._index(key, value, attachments, nics)
+
+        vm_info._finish(attachments, nics)
+        return vm_info
+
+    @classmethod
+    def wrap(cls, information):
+        """Return the received information as a VMInfo object."""
+        if isinstance(information, cls):
+            return information
+        return cls(information)
+
+    def _index(self, key, value, attachments, nics):
+        key, value = _normalize(key, value)
+        self._fields[key] = value
+
+        if key.startswith(CONTROLLER_NAME):
+            self._controllers.append(value)
+            return
+
+        match = _NIC.match(key)
+        if match:
+            nics[int(match.group("index"))] = value is not None
+            return
+
+        match = _ATTACHMENT.match(key)
+        if match:
+            attach_point = (int(match.group("port")),
+                            int(match.group("device")))
+            disk = attachments.setdefault(
+                (match.group("controller"), attach_point),
+                {"path": None, "uuid": None})
+            disk["uuid" if match.group("uuid") else "path"] = value
+
+    def _finish(self, attachments, nics):
+        for (controller, attach_point), disk in attachments.items():
+            self._disks.setdefault(controller, {})[attach_point] = disk
+            if disk["uuid"]:
+                self._media[disk["uuid"]] = (controller, attach_point)
+            elif (controller not in self._free_points or
+                    attach_point < self._free_points[controller]):
+                self._free_points[controller] = attach_point
+
+        if nics:
+            self._nics = [None] * (max(nics) + 1)
+            for index, enabled in nics.items():
+                self._nics[index] = enabled
+                if not enabled and (self._free_nic is None or
+                                    index < self._free_nic):
+                    self._free_nic = index
+
+        self.state = self._fields.get(constants.VM_POWER_STATE)
+        self.power_state = constants.POWER_STATE.get(self.state)
+        try:
+            self.vrde_port = int(self._fields[constants.VM_VRDE_PORT])
+        except (KeyError, TypeError, ValueError):
+            self.vrde_port = None
+
+    # Storage
+
+    def controllers(self):
+        """Return the disks attached to each storage controller."""
+        return {name: self.controller_disks(name)
+                for name in self._controllers}
+
+    def controller_disks(self, controller):
+        """Return the disks attached to the received storage controller,
+        keyed by (port, device).
+        """
+        return {attach_point: dict(disk) for attach_point, disk
+                in self._disks.get(controller, {}).items()}
+
+    def available_attach_point(self, controller):
+        """Return the first (port, device) without a disk attached from
+        the received storage controller or None if all of them are used.
+        """
+        return self._free_points.get(controller)
+
+    def attach_point(self, controller, disk_uuid):
+        """Return the (port, device) where the received disk is
+        attached or None.
+        """
+        location = self._media.get(disk_uuid)
+        if location and location[0] == controller:
+            return location[1]
+        return None
+
+    # Network
+
+    def nic_status(self):
+        """Return whether each network adapter is enabled, keyed by
+        the index of the adapter.
+        """
+        return {index: enabled for index, enabled in enumerate(self._nics)
+                if enabled is not None}
+
+    def available_nic(self):
+        """Return the index of the first disabled network adapter."""
+        return self._free_nic
+
+    # Mapping
+
+    def __getitem__(self, key):
+        return self._fields[key]
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if isinstance(other, VMInfo):
+            other = other._fields
+        return self._fields == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "VMInfo(%r)" % self._fields
+
+    def get(self, key, default=None):
+        return self._fields.get(key, default)
+
+    def keys(self):
+        return self._fields.keys()
+
+    def values(self):
+        return self._fields.values()
+
+    def items(self):
+        return self._fields.items()
+
+    def copy(self):
+        # Note: The object is read-only, so it can be shared.
+        return self
+
+
+collections.Mapping.register(VMInfo)
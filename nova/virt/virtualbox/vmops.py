@@ -18,22 +18,32 @@ Management class for basic VM operations.
 """
 
 import os
+import platform
+import sys
 
+import eventlet
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 from oslo_utils import excutils
 from oslo_utils import units
+import six
 
+from nova.compute import power_state
 from nova import exception
 from nova import i18n
+from nova.virt import diagnostics
 from nova.virt import hardware
 from nova.virt.virtualbox import constants
 from nova.virt.virtualbox import exception as vbox_exc
 from nova.virt.virtualbox import imagecache
+from nova.virt.virtualbox import instrumentation
 from nova.virt.virtualbox import manage
 from nova.virt.virtualbox import networkutils
 from nova.virt.virtualbox import pathutils
+from nova.virt.virtualbox import perfmetrics
 from nova.virt.virtualbox import vhdutils
+from nova.virt.virtualbox import vmpool
 from nova.virt.virtualbox import vmutils
 from nova.virt.virtualbox import volumeops
 from nova.virt.virtualbox import volumeutils
@@ -48,6 +58,9 @@ class VBoxOperation(object):
 
     """Management class for virtual machines operations."""
 
+    # Note: The pool is shared by all the instances of this class.
+    _vm_pool = vmpool.VMPool()
+
     def __init__(self):
         self._vbox_manage = manage.VBoxManage()
         self._volume = volumeops.VolumeOperations()
@@ -56,25 +69,19 @@ class VBoxOperation(object):
         """Get the UUID for each virtual machine which is in inaccessible
         state.
         """
-        list_vms = self._vbox_manage.list(constants.VMS_INFO)
-        instance_list = []
-
-        for virtual_machine in list_vms.splitlines():
-            # Line format: "instance_name" {instance_uuid}
-            try:
-                name, uuid = virtual_machine.split()
-            except ValueError:
-                continue
-            if name.strip('"') == "<inaccessible>":
-                instance_list.append(uuid.strip(' {}'))
-
-        return instance_list
+        vm_registry = self._vbox_manage.get_vm_registry()
+        return [virtual_machine.uuid for virtual_machine in
+                vm_registry.virtual_machines(inaccessible=True)]
 
     def init_host(self):
         """Initialize anything that is necessary for the driver to function,
         including catching up with currently running VM's on the given host.
         """
 
+        # Build the index of the virtual machines registered with
+        # VirtualBox.
+        self._vbox_manage.get_vm_registry(refresh=True)
+
         # Update the Hypervisor internal database.
         # Remove all the inaccessible virtual hard disk which
         # not exist anymore.
@@ -92,28 +99,21 @@ class VBoxOperation(object):
                          {"disk": disk})
                 manage.VBoxManage.close_medium(constants.MEDIUM_DISK, uuid)
 
+        self._vm_pool.init_host()
+
         # TODO(alexandrucoman): Check the inaccessible vms and try to
         # repair them.
 
     def _list_vms(self):
-        """Process information from list vms.
-
-        Return a dictionary which has `instance uuid` as key and
-        `instance name` as value for all virtual machines currently
-        registered with VirtualBox.
+        """Return a dictionary which has `instance name` as key and
+        `instance uuid` as value for all virtual machines currently
+        registered with VirtualBox, except the pooled ones.
         """
-        virtual_machines = {}
-        list_vms = self._vbox_manage.list(constants.VMS_INFO)
-
-        for virtual_machine in list_vms.splitlines():
-            # Line format: "instance_name" {instance_uuid}
-            try:
-                name, uuid = virtual_machine.split()
-            except ValueError:
-                continue
-            virtual_machines[name.strip('"')] = uuid.strip('{}')
-
-        return virtual_machines
+        vm_registry = self._vbox_manage.get_vm_registry()
+        return {virtual_machine.name:
+                vm_registry.instance_uuid(virtual_machine.uuid)
+                for virtual_machine in vm_registry.virtual_machines()
+                if not vmpool.is_pooled(virtual_machine.name)}
 
     def list_instances(self):
         """Return the names of all the instances known to the virtualization
@@ -129,34 +129,103 @@ class VBoxOperation(object):
 
     def instance_exists(self, instance):
         """Check existence of an instance on the host."""
-        list_vms = self._vbox_manage.list(constants.VMS_INFO)
+        vm_registry = self._vbox_manage.get_vm_registry()
+        return vm_registry.get(instance.name) is not None
 
-        for virtual_machine in list_vms.splitlines():
-            # Line format: "instance_name" {instance_uuid}
-            try:
-                vm_name, _ = virtual_machine.split()
-            except ValueError:
-                continue
-
-            if instance.name == vm_name.strip(' "'):
-                return True
-
-        return False
+    @staticmethod
+    def _get_cpu_time(counters):
+        """Return the CPU time used by the virtual machine, in
+        nanoseconds.
+        """
+        return int(counters.get("user", 0) + counters.get("kernel", 0))
 
     def get_info(self, instance):
-        """Get the current status of an instance, by name."""
+        """Get the current status of an instance, by name.
+
+        The memory used and the CPU time are taken from the performance
+        metrics, when they are collected.
+        """
         vm_info = self._vbox_manage.show_vm_info(instance)
+        collector = perfmetrics.get_collector()
 
         state = vm_info.get(constants.VM_POWER_STATE)
-        cpu_count = vm_info.get(constants.VM_CPUS, 0)
-        memory = vm_info.get(constants.VM_MEMORY, 0)
+        cpu_count = int(vm_info.get(constants.VM_CPUS, 0))
+        max_memory = int(vm_info.get(constants.VM_MEMORY, 0)) * units.Ki
+        memory = collector.memory_used(instance.name)
 
         state = constants.POWER_STATE.get(state, 0)
-        return hardware.InstanceInfo(state=state,
-                                     max_mem_kb=memory,
-                                     mem_kb=memory,
-                                     num_cpu=cpu_count,
-                                     cpu_time_ns=0)
+        return hardware.InstanceInfo(
+            state=state,
+            max_mem_kb=max_memory,
+            mem_kb=max_memory if memory is None else memory,
+            num_cpu=cpu_count,
+            cpu_time_ns=self._get_cpu_time(
+                collector.counters(instance.name)))
+
+    def get_diagnostics(self, instance):
+        """Return data about VM diagnostics.
+
+        The statistics for the VBoxManage commands executed on the
+        host are also included, as `vboxmanage_<command>_<stat>`.
+        """
+        vm_info = self._vbox_manage.show_vm_info(instance)
+        collector = perfmetrics.get_collector()
+        values = collector.last_values(instance.name)
+        counters = collector.counters(instance.name)
+
+        diags = {
+            "cpu_time": self._get_cpu_time(counters),
+            "cpu_load_user": values.get(constants.METRIC_CPU_LOAD_USER, 0),
+            "cpu_load_kernel": values.get(constants.METRIC_CPU_LOAD_KERNEL,
+                                          0),
+            "memory": int(vm_info.get(constants.VM_MEMORY, 0)) * units.Ki,
+            "memory_used": collector.memory_used(instance.name) or 0,
+            "net_rx": int(counters.get("rx", 0)),
+            "net_tx": int(counters.get("tx", 0)),
+            "net_rx_rate": values.get(constants.METRIC_NET_RATE_RX, 0),
+            "net_tx_rate": values.get(constants.METRIC_NET_RATE_TX, 0),
+            "disk_used_mb": values.get(constants.METRIC_DISK_USED, 0),
+        }
+        diags.update(self._vbox_manage.get_metrics().summary())
+        return diags
+
+    def get_instance_diagnostics(self, instance):
+        """Return data about VM diagnostics.
+
+        VirtualBox reports the rates for all the network adapters of
+        a virtual machine together and does not report the disk I/O,
+        so a single NIC and no disks are included.
+        """
+        vm_info = self._vbox_manage.show_vm_info(instance)
+        collector = perfmetrics.get_collector()
+        counters = collector.counters(instance.name)
+
+        state = constants.POWER_STATE.get(
+            vm_info.get(constants.VM_POWER_STATE), power_state.NOSTATE)
+        diags = diagnostics.Diagnostics(
+            state=power_state.STATE_MAP[state], driver="virtualbox",
+            hypervisor_os=platform.system().lower())
+        diags.add_cpu(time=self._get_cpu_time(counters))
+
+        mac_address = vm_info.get(constants.VM_MAC_ADDRESS % {"index": 1})
+        if mac_address:
+            diags.add_nic(
+                mac_address=":".join(mac_address[index:index + 2]
+                                     for index in range(0, 12, 2)).lower(),
+                rx_octets=int(counters.get("rx", 0)),
+                tx_octets=int(counters.get("tx", 0)))
+
+        diags.memory_details.maximum = int(vm_info.get(constants.VM_MEMORY,
+                                                       0))
+        diags.memory_details.used = (
+            collector.memory_used(instance.name) or 0) // units.Ki
+        return diags
+
+    def get_power_states(self, instances):
+        """Get the current power state for the received instances."""
+        power_states = vmutils.get_power_states()
+        return {instance.uuid: power_states[instance.name]
+                for instance in instances if instance.name in power_states}
 
     def pause(self, instance):
         """Put a virtual machine on hold, without changing its state
@@ -177,6 +246,17 @@ class VBoxOperation(object):
         LOG.debug("Suspend instance", instance=instance)
         self._vbox_manage.control_vm(instance, constants.STATE_SUSPEND)
 
+    def _disable_teleporter(self, instance):
+        """Disable the teleporter of a virtual machine which was
+        live migrated to this host, otherwise it would wait for another
+        teleport when it is started.
+        """
+        vm_info = self._vbox_manage.show_vm_info(instance)
+        if vm_info.get(constants.VM_TELEPORTER) == constants.ON:
+            LOG.debug("Disabling the teleporter", instance=instance)
+            self._vbox_manage.modify_teleporter(
+                instance, constants.FIELD_TELEPORTER, constants.OFF)
+
     def resume(self, instance, context=None, network_info=None,
                block_device_info=None):
         """Resume the specified instance.
@@ -189,6 +269,7 @@ class VBoxOperation(object):
         """
         # TODO(alexandrucoman): Process the information from the unused
         #                       arguments.
+        self._disable_teleporter(instance)
         self._vbox_manage.start_vm(instance)
 
     def power_off(self, instance, timeout=0, retry_interval=0):
@@ -224,6 +305,7 @@ class VBoxOperation(object):
         """
         # TODO(alexandrucoman): Process the information from the unused
         #                       arguments.
+        self._disable_teleporter(instance)
         self._vbox_manage.start_vm(instance)
 
     def reboot(self, instance, context=None, network_info=None,
@@ -261,6 +343,25 @@ class VBoxOperation(object):
 
         eph_vhd_format = constants.DEFAULT_DISK_FORMAT
         eph_vhd_path = pathutils.ephemeral_vhd_path(instance, eph_vhd_format)
+        if CONF.use_cow_images:
+            # Note: A differencing disk of a blank template shared by all
+            # the ephemeral disks with the same size is created instead
+            # of a new disk. Unlike the immutable disk created below, the
+            # differencing disk is not reset when the virtual machine is
+            # started, so the data written on the ephemeral disk is kept
+            # between reboots, as it is by the other drivers.
+            template_path = imagecache.get_ephemeral_template(
+                instance.ephemeral_gb, eph_vhd_format)
+            LOG.debug("Creating differencing ephemeral disk. Parent: "
+                      "%(parent)s, Target: %(target)s",
+                      {'parent': template_path, 'target': eph_vhd_path},
+                      instance=instance)
+            self._vbox_manage.create_hd(filename=eph_vhd_path,
+                                        disk_format=eph_vhd_format,
+                                        variant=constants.VARIANT_STANDARD,
+                                        parent=template_path)
+            return eph_vhd_path
+
         self._vbox_manage.create_hd(filename=eph_vhd_path,
                                     size=eph_vhd_size / units.Mi,
                                     disk_format=eph_vhd_format,
@@ -279,7 +380,7 @@ class VBoxOperation(object):
 
     def create_root_disk(self, context, instance):
         base_vhd_path = imagecache.get_cached_image(context, instance)
-        base_info = vhdutils.disk_info(base_vhd_path)
+        base_info = vhdutils.get_disk(base_vhd_path)
         root_vhd_path = pathutils.root_disk_path(
             instance, disk_format=base_info[constants.VHD_IMAGE_TYPE])
 
@@ -322,26 +423,57 @@ class VBoxOperation(object):
         return root_vhd_path
 
     def create_instance(self, instance, image_meta, network_info,
-                        overwrite=True):
+                        overwrite=True, basefolder=None):
+        """Create and configure the virtual machine of the instance.
+
+        If `basefolder` is received, a new virtual machine is created in
+        it instead of taking one from the pool.
+        """
         image_properties = image_meta.get("properties", {})
         action = constants.PATH_DELETE if overwrite else None
 
         basepath = pathutils.instance_basepath(instance, action=action)
-        self._vbox_manage.create_vm(
-            instance.name, basefolder=os.path.dirname(basepath),
-            register=True)
+        pooled_vm = None if basefolder else self._vm_pool.take()
+        if pooled_vm:
+            LOG.debug("Using the pooled virtual machine %(name)s",
+                      {"name": pooled_vm.name}, instance=instance)
+            pathutils.create_path(basepath)
+        else:
+            # Note: The virtual machine has the same UUID as the instance
+            # in order to identify the instance for the lifecycle events.
+            self._vbox_manage.create_vm(
+                instance.name,
+                basefolder=basefolder or os.path.dirname(basepath),
+                register=True, uuid=instance.uuid)
+            vmutils.set_storage_controllers(instance)
+
+        # Note(alexandrucoman): All the settings are applied using
+        # a single modifyvm command. The pooled virtual machine is
+        # renamed by the same command.
+        try:
+            with self._vbox_manage.deferred_modifications(
+                    instance, vm_name=pooled_vm.name if pooled_vm else None):
+                self._vbox_manage.modify_vm(
+                    instance, constants.FIELD_DESCRIPTION,
+                    jsonutils.dumps({"instance_uuid": instance.uuid}))
+                vmutils.set_os_type(instance,
+                                    image_properties.get('os_type', None))
+                vmutils.set_memory(instance)
+                vmutils.set_cpus(instance)
+                self._network_setup(instance, network_info)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                if pooled_vm:
+                    self._vm_pool.discard(pooled_vm)
 
-        vmutils.set_os_type(instance, image_properties.get('os_type', None))
-        vmutils.set_memory(instance)
-        vmutils.set_cpus(instance)
-        self._network_setup(instance, network_info)
+        if pooled_vm:
+            self._vbox_manage.get_vm_registry().set_instance_uuid(
+                pooled_vm.uuid, instance.uuid)
 
     def storage_setup(self, instance, root_path, ephemeral_path,
                       block_device_info):
-        for system_bus in (constants.SYSTEM_BUS_SATA,
-                           constants.SYSTEM_BUS_SCSI):
-            vmutils.set_storage_controller(instance, system_bus)
-
+        # Note: The storage controllers are created with the virtual
+        # machine.
         port = 0
         for disk_path in (root_path, ephemeral_path):
             if disk_path:
@@ -359,14 +491,23 @@ class VBoxOperation(object):
                 block_device_info=None, destroy_disks=True,
                 migrate_data=None):
         """Destroy the specified instance from the Hypervisor."""
-        LOG.info(i18n._("Got request to destroy instance"), instance=instance)
+        LOG.info(i18n._LI("Got request to destroy instance"),
+                 instance=instance)
         if not self.instance_exists(instance):
-            LOG.warning(i18n._("Instance do not exists."), instance=instance)
+            LOG.warning(i18n._LW("Instance do not exists."), instance=instance)
+            return
+
+        try:
+            current_state = vmutils.get_power_state(instance, refresh=True)
+        except exception.InstanceNotFound:
+            # The virtual machine was removed by someone else.
+            LOG.warning(i18n._LW("Instance do not exists."),
+                        instance=instance)
+            self._vbox_manage.get_vm_registry().remove(instance.name)
             return
 
-        power_state = vmutils.get_power_state(instance)
-        if power_state not in (constants.STATE_POWER_OFF,
-                               constants.STATE_SAVED):
+        if current_state not in (constants.STATE_POWER_OFF,
+                                 constants.STATE_SAVED):
             self._vbox_manage.control_vm(instance, constants.STATE_POWER_OFF)
 
         try:
@@ -376,9 +517,65 @@ class VBoxOperation(object):
                     instance, action=constants.PATH_DELETE)
         except vbox_exc.VBoxException:
             with excutils.save_and_reraise_exception():
-                LOG.exception(i18n._('Failed to destroy instance: %s'),
+                LOG.exception(i18n._LE('Failed to destroy instance: %s'),
                               instance.name)
 
+    @staticmethod
+    def _start_branch(name, function, *args, **kwargs):
+        """Run the received function in a green thread, timed as a phase
+        of the current operation.
+        """
+        timer = instrumentation.current_timer()
+
+        def run():
+            with instrumentation.use_timer(timer):
+                with instrumentation.phase(name):
+                    return function(*args, **kwargs)
+
+        return eventlet.spawn(run)
+
+    @staticmethod
+    def _join_branches(branches, instance):
+        """Wait for all the received branches to finish.
+
+        Return the result of each branch which succeeded and the
+        information for the first exception raised by a branch.
+        """
+        results = {}
+        exc_info = None
+        for name, branch in branches:
+            try:
+                results[name] = branch.wait()
+            except Exception:
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+                else:
+                    LOG.exception(i18n._LE("The %(branch)s spawn branch "
+                                           "failed"), {"branch": name},
+                                  instance=instance)
+        return results, exc_info
+
+    def _cleanup_failed_spawn(self, instance, disk_paths):
+        """Remove the virtual machine and the disks created for
+        an instance which failed to spawn.
+        """
+        try:
+            self.destroy(instance)
+            # Note: The disks which were not attached are not removed
+            # with the virtual machine.
+            for disk_path in disk_paths:
+                if disk_path and os.path.exists(disk_path):
+                    try:
+                        self._vbox_manage.close_medium(
+                            constants.MEDIUM_DISK, disk_path, delete=True)
+                    except vbox_exc.VBoxException:
+                        pathutils.delete_path(disk_path)
+            pathutils.instance_basepath(instance,
+                                        action=constants.PATH_DELETE)
+        except Exception:
+            LOG.exception(i18n._LE("Failed to clean up the instance which "
+                                   "failed to spawn"), instance=instance)
+
     def spawn(self, context, instance, image_meta, injected_files,
               admin_password, network_info, block_device_info):
         """Create a new VM on the virtualization platform.
@@ -386,24 +583,47 @@ class VBoxOperation(object):
         Once this successfully completes, the instance should be
         running (power_state.RUNNING).
         """
-        LOG.info(i18n._("Got request to spawn instance"), instance=instance)
+        LOG.info(i18n._LI("Got request to spawn instance"), instance=instance)
         if self.instance_exists(instance):
             raise exception.InstanceExists(name=instance.name)
 
-        try:
-            self.create_instance(instance, image_meta, network_info)
-
-            root_path = None
-            if not volumeutils.ebs_root_in_block_devices(block_device_info):
-                root_path = self.create_root_disk(context, instance)
-            ephemeral_path = self.create_ephemeral_disk(instance)
+        # Note: The instance folder is prepared before starting the
+        # branches because all of them create files in it.
+        pathutils.instance_basepath(instance,
+                                    action=constants.PATH_OVERWRITE)
+
+        # Note(alexandrucoman): The virtual machine and the disks do not
+        # depend on each other, so they are created concurrently and
+        # the base image is downloaded while the virtual machine is
+        # configured. They are joined before attaching the storage.
+        branches = [
+            ("create_instance", self._start_branch(
+                "create_instance", self.create_instance, instance,
+                image_meta, network_info, overwrite=False)),
+            ("ephemeral_path", self._start_branch(
+                "create_ephemeral_disk", self.create_ephemeral_disk,
+                instance)),
+        ]
+        if not volumeutils.ebs_root_in_block_devices(block_device_info):
+            branches.append(("root_path", self._start_branch(
+                "create_root_disk", self.create_root_disk, context,
+                instance)))
+
+        results, exc_info = self._join_branches(branches, instance)
+        disk_paths = [results.get("root_path"), results.get("ephemeral_path")]
+        if exc_info:
+            self._cleanup_failed_spawn(instance, disk_paths)
+            six.reraise(*exc_info)
 
-            self.storage_setup(instance, root_path, ephemeral_path,
-                               block_device_info)
+        try:
+            with instrumentation.phase("storage_setup"):
+                self.storage_setup(instance, results.get("root_path"),
+                                   results.get("ephemeral_path"),
+                                   block_device_info)
             # TODO(alexandrucoman): Create the config drive
-        except vbox_exc.VBoxException:
+        except Exception:
             with excutils.save_and_reraise_exception():
-                self.destroy(instance)
+                self._cleanup_failed_spawn(instance, disk_paths)
 
-        LOG.info(i18n._("The instance was successfully spawned!"),
+        LOG.info(i18n._LI("The instance was successfully spawned!"),
                  instance=instance)
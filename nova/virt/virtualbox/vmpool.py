@@ -0,0 +1,206 @@
+# Copyright (c) 2015 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Pool of generic virtual machines which are ready to be used by new
+instances.
+"""
+
+import collections
+import os
+import threading
+import uuid
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import excutils
+
+from nova.i18n import _LI, _LW
+from nova import utils
+from nova.virt.virtualbox import constants
+from nova.virt.virtualbox import exception as vbox_exc
+from nova.virt.virtualbox import manage
+from nova.virt.virtualbox import pathutils
+from nova.virt.virtualbox import vmutils
+
+LOG = logging.getLogger(__name__)
+VIRTUAL_BOX = [
+    cfg.IntOpt('vm_pool_size',
+               default=0,
+               help='The number of generic virtual machines, with the '
+                    'storage controllers already created, which are kept '
+                    'ready to be used by new instances. If the value is 0, '
+                    'the virtual machines are created when the instances '
+                    'are spawned.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(VIRTUAL_BOX, 'virtualbox')
+
+POOL_PREFIX = "nova-pool-"
+
+
+def is_pooled(vm_name):
+    """Check if the virtual machine with the received name is waiting
+    in the pool.
+    """
+    return vm_name.startswith(POOL_PREFIX)
+
+
+class PooledVM(collections.namedtuple("PooledVM", ["name", "uuid"])):
+
+    """A virtual machine from the pool.
+
+    It has the attributes of the instance used by VBoxManage.
+    """
+
+    __slots__ = ()
+    power_state = None
+
+    @classmethod
+    def new(cls):
+        vm_uuid = str(uuid.uuid4())
+        return cls(POOL_PREFIX + vm_uuid, vm_uuid)
+
+
+class VMPool(object):
+
+    """Generic virtual machines which have the storage controllers
+    already created.
+
+    A virtual machine taken from the pool is renamed and configured for
+    the instance using a single `modifyvm` command. Its UUID can not be
+    changed, so the UUID of the instance is kept in the description of
+    the virtual machine and in the virtual machine registry.
+
+    The folder of every pooled virtual machine is created in
+    `pathutils.vm_pool_dir()` and it is named after the original name of
+    the virtual machine, which contains its UUID.
+    """
+
+    def __init__(self):
+        self._vms = collections.deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+
+    def __len__(self):
+        return len(self._vms)
+
+    @staticmethod
+    def _pool_uuids():
+        """Return the UUIDs of the virtual machines created by the pool
+        which still have a folder.
+        """
+        pool_dir = pathutils.vm_pool_dir()
+        if not os.path.isdir(pool_dir):
+            return set()
+        return set(name[len(POOL_PREFIX):] for name in os.listdir(pool_dir)
+                   if is_pooled(name))
+
+    def init_host(self):
+        """Adopt the pooled virtual machines and restore the UUIDs of the
+        instances which use a virtual machine taken from the pool.
+        """
+        vm_registry = manage.VBoxManage.get_vm_registry()
+        pool_uuids = self._pool_uuids()
+        for vm_uuid in pool_uuids:
+            virtual_machine = vm_registry.get(vm_uuid)
+            if virtual_machine is None:
+                # Note: The virtual machine was unregistered without
+                # removing its files.
+                pathutils.delete_path(os.path.join(
+                    pathutils.vm_pool_dir(), POOL_PREFIX + vm_uuid))
+                continue
+
+            pooled_vm = PooledVM(virtual_machine.name, virtual_machine.uuid)
+            if is_pooled(virtual_machine.name):
+                with self._lock:
+                    self._vms.append(pooled_vm)
+                continue
+
+            try:
+                description = vmutils.get_description(pooled_vm)
+            except vbox_exc.VBoxException as exc:
+                LOG.warning(_LW("Failed to get the description of "
+                                "%(name)s: %(reason)s"),
+                            {"name": virtual_machine.name, "reason": exc})
+                continue
+
+            instance_uuid = description.get("instance_uuid")
+            if instance_uuid:
+                vm_registry.set_instance_uuid(virtual_machine.uuid,
+                                              instance_uuid)
+
+        self.refill()
+
+    def _create_vm(self):
+        pooled_vm = PooledVM.new()
+        manage.VBoxManage.create_vm(
+            pooled_vm.name, register=True, uuid=pooled_vm.uuid,
+            basefolder=pathutils.vm_pool_dir(action=constants.PATH_CREATE))
+        try:
+            vmutils.set_storage_controllers(pooled_vm)
+        except vbox_exc.VBoxException:
+            with excutils.save_and_reraise_exception():
+                self.discard(pooled_vm)
+        return pooled_vm
+
+    def _refill(self):
+        created = 0
+        try:
+            while len(self._vms) < CONF.virtualbox.vm_pool_size:
+                pooled_vm = self._create_vm()
+                with self._lock:
+                    self._vms.append(pooled_vm)
+                created += 1
+        except (vbox_exc.VBoxException, EnvironmentError) as exc:
+            LOG.warning(_LW("Failed to refill the virtual machine pool: "
+                            "%s"), exc)
+        finally:
+            with self._lock:
+                self._refilling = False
+
+        if created:
+            LOG.info(_LI("Added %(count)d virtual machines to the pool"),
+                     {"count": created})
+
+    def refill(self):
+        """Create the missing virtual machines in the background."""
+        with self._lock:
+            if (self._refilling or
+                    len(self._vms) >= CONF.virtualbox.vm_pool_size):
+                return
+            self._refilling = True
+
+        utils.spawn_n(self._refill)
+
+    def take(self):
+        """Return a virtual machine from the pool or None if the pool
+        is empty.
+        """
+        with self._lock:
+            pooled_vm = self._vms.popleft() if self._vms else None
+        self.refill()
+        return pooled_vm
+
+    @staticmethod
+    def discard(pooled_vm):
+        """Remove a virtual machine which was taken from the pool."""
+        try:
+            manage.VBoxManage.unregister_vm(pooled_vm, delete=True)
+        except vbox_exc.VBoxException as exc:
+            LOG.warning(_LW("Failed to remove the pooled virtual machine "
+                            "%(name)s: %(reason)s"),
+                        {"name": pooled_vm.name, "reason": exc})
@@ -55,7 +55,7 @@ def wait_for_power_state(instance, power_state, time_limit):
     """
 
     def _check_power_state(instance):
-        current_state = get_power_state(instance)
+        current_state = get_power_state(instance, refresh=True)
         LOG.debug("Wait for soft shutdown: (%s, %s)", current_state,
                   power_state)
         if current_state == power_state:
@@ -86,6 +86,7 @@ def get_host_info():
         :HOST_PROCESSOR_CORE_COUNT:     (int) Processor core count
         :HOST_MEMORY_AVAILABLE:         (int) Available memory in MB
         :HOST_MEMORY_SIZE:              (int) Memory size in MB
+        :HOST_FIRST_CPU_DESCRIPTION:    (str) Model of the first processor
     """
     output = manage.VBoxManage.list(constants.HOST_INFO)
     information = {}
@@ -109,6 +110,9 @@ def get_host_info():
             except ValueError:
                 information[key] = 0
 
+        elif key == constants.HOST_FIRST_CPU_DESCRIPTION:
+            information[key] = value.strip()
+
     return information
 
 
@@ -130,16 +134,60 @@ def get_os_types():
     return os_types
 
 
-def get_power_state(instance):
+def get_power_state(instance, refresh=False):
     """Return the power state of the received instance.
 
     :param instance: nova.objects.instance.Instance
+    :param refresh:  ignore the information from cache
     :return: nova.compute.power_state
     """
-    instance_info = manage.VBoxManage.show_vm_info(instance)
+    instance_info = manage.VBoxManage.show_vm_info(instance, refresh=refresh)
     return instance_info.get(constants.VM_POWER_STATE)
 
 
+def get_vms_states():
+    """Return the name, the UUID and the power state for each virtual
+    machine registered with VirtualBox using a single `list --long vms`
+    command.
+
+    :return: a list of (name, uuid, nova.compute.power_state) tuples
+    """
+    vms_states = []
+    vm_name = vm_uuid = None
+    output = manage.VBoxManage.list(constants.VMS_INFO, long_format=True)
+    for line in output.splitlines():
+        key, separator, value = line.partition(":")
+        if not separator:
+            continue
+
+        key, value = key.strip(), value.strip()
+        if key == "Name":
+            # Note: The shared folders are also listed with `Name:`,
+            # but always after the state of the virtual machine.
+            vm_name, vm_uuid = value, None
+        elif key == "UUID" and vm_name and not vm_uuid:
+            vm_uuid = value
+        elif key == "State" and vm_name:
+            # Line format: State: running (since 2015-05-12T10:15:22.123)
+            state = value.split("(")[0].strip()
+            vms_states.append((vm_name, vm_uuid,
+                               constants.LONG_POWER_STATE.get(state, 0)))
+            vm_name = vm_uuid = None
+
+    return vms_states
+
+
+def get_power_states():
+    """Return the power state for each virtual machine registered with
+    VirtualBox.
+
+    :return: a dictionary which has the virtual machine name as key
+             and nova.compute.power_state as value
+    """
+    return {vm_name: power_state
+            for vm_name, _, power_state in get_vms_states()}
+
+
 def set_cpus(instance):
     """Set the number of virtual CPUs for the virtual machine.
 
@@ -212,16 +260,48 @@ def set_storage_controller(instance, system_bus, controller=None,
                                          controller)
 
 
+def set_storage_controllers(instance):
+    """Attach the storage controllers used by the driver: SATA for the
+    disks and SCSI for the volumes.
+
+    :param instance:    nova.objects.instance.Instance
+    """
+    for system_bus in (constants.SYSTEM_BUS_SATA,
+                       constants.SYSTEM_BUS_SCSI):
+        set_storage_controller(instance, system_bus)
+
+
+def get_description(instance):
+    """Return the information stored in the description of the
+    received instance.
+    """
+    instance_info = manage.VBoxManage.show_vm_info(instance)
+    description = instance_info.get(constants.VM_DESCRIPTION)
+    if not description:
+        return {}
+
+    try:
+        return jsonutils.loads(description)
+    except ValueError:
+        return {}
+
+
 def update_description(instance, description):
     """Update description for received instance."""
-    instance_info = manage.VBoxManage.show_vm_info(instance)
-    current_description = instance_info.get('current_description', {})
+    modifications = manage.VBoxManage.pending_modifications(instance)
+    if modifications and constants.FIELD_DESCRIPTION in modifications.fields():
+        current_description = modifications.get(constants.FIELD_DESCRIPTION)
+    else:
+        vm_name = (modifications.vm_name if modifications is not None
+                   else None)
+        instance_info = manage.VBoxManage.show_vm_info(instance,
+                                                       vm_name=vm_name)
+        current_description = instance_info.get(constants.VM_DESCRIPTION)
 
-    if current_description:
-        try:
-            current_description = jsonutils.loads(current_description)
-        except ValueError:
-            current_description = {}
+    try:
+        current_description = jsonutils.loads(current_description or "{}")
+    except ValueError:
+        current_description = {}
 
     current_description.update(description)
 
@@ -268,7 +348,8 @@ def soft_shutdown(instance, timeout=0, retry_interval=0):
                 manage.VBoxManage.control_vm(instance,
                                              constants.ACPI_POWER_BUTTON)
             except nova_exception.InstanceInvalidState:
-                if get_power_state(instance) == desired_power_state:
+                if (get_power_state(instance, refresh=True) ==
+                        desired_power_state):
                     LOG.info(i18n._LI("Soft shutdown succeeded."),
                              instance=instance)
                     return True